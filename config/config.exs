@@ -3,6 +3,10 @@ import Config
 config :diwa_agent,
   ecto_repos: [DiwaAgent.Repo],
   vector_type: Pgvector.Ecto.Vector,
+  # Embeddings go through the batching/caching pipeline; the provider does
+  # the actual work (DiwaAgent.AI.Embeddings.Local is an offline option).
+  embedding_module: DiwaAgent.AI.EmbeddingPipeline,
+  embedding_provider: DiwaAgent.AI.Embeddings,
   engine_adapter: DiwaAgent.Engine.Simple,
   enable_analysis: true,
 
@@ -15,14 +19,59 @@ config :diwa_agent,
   cloud_api_url: "https://api.diwa.one",
 
   # Feature flags
-  # Disable to prevent slow startup on escript
+  # Migrations run only when schema_migrations is behind the shipped files
   auto_migrate: true,
   create_default_org: true,
+  # Start non-essential workers on first use (DiwaAgent.Lazy)
+  fast_start: true,
 
   # Edition control - Community Edition licensing (Apache 2.0)
   # Enterprise features (Patents D1, D2, D3, SINAG) are in diwa-cloud (BSL 1.1)
   enterprise_features: false
 
+# Set report: true (or DIWA_STARTUP_REPORT=1) to print boot phase timings to
+# stderr on the first initialize; deferred workers (cloud sync) start
+# deferred_start_ms after boot in fast-start mode.
+config :diwa_agent, DiwaAgent.Startup, report: false, deferred_start_ms: 2_000
+
+# Maximum number of tools/call requests executed concurrently by the MCP
+# server; up to max_pending further calls are queued until a slot frees up,
+# beyond that they are rejected as busy. Up to max_parked_polls long polls
+# (poll_delegated_tasks with wait_ms) run without taking one of those slots.
+config :diwa_agent, DiwaAgent.Server, max_in_flight: 8, max_pending: 64, max_parked_polls: 2
+
+config :diwa_agent, DiwaAgent.AI.EmbeddingPipeline,
+  batch_size: 32,
+  max_wait_ms: 10,
+  max_queue: 1_000,
+  max_concurrency: 2,
+  max_retries: 3,
+  backoff_ms: 200
+
+config :diwa_agent, DiwaAgent.AI.EmbeddingCache, max_entries: 10_000
+
+# Session-start reads (handoff, blockers, tasks, plan, health); entries are
+# invalidated on write and expire after ttl_ms.
+config :diwa_agent, DiwaAgent.Storage.HotCache, ttl_ms: 60_000, max_entries: 5_000
+
+# Cloud sync: queued writes are coalesced per record and uploaded in batches
+# of chunk_size, max_concurrency requests at a time. Failed entries retry
+# after retry_base_ms * 2^attempts (capped at retry_max_ms).
+config :diwa_agent, DiwaAgent.Cloud.SyncWorker,
+  batch_size: 200,
+  chunk_size: 50,
+  max_concurrency: 4,
+  min_interval_ms: 500,
+  max_interval_ms: 30_000
+
+config :diwa_agent, DiwaAgent.Cloud.SyncQueue, retry_base_ms: 1_000, retry_max_ms: 300_000
+
+# Per-tool latency histograms; set prometheus_file to a path to have a
+# Prometheus text dump rewritten every dump_interval_ms.
+config :diwa_agent, DiwaAgent.Telemetry.Metrics,
+  prometheus_file: nil,
+  dump_interval_ms: 15_000
+
 config :diwa_agent, DiwaAgent.Repo,
   adapter: Ecto.Adapters.SQLite3,
   migration_primary_key: [name: :id, type: :binary_id],
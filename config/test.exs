@@ -13,3 +13,6 @@ config :diwa_agent,
   vector_repo_module: DiwaAgent.Test.FakeVectorRepo,
   embedding_module: DiwaAgent.Test.FakeEmbeddings,
   consensus_module: DiwaAgent.Consensus.ClusterMock
+
+# Retry failed sync entries on the next poll
+config :diwa_agent, DiwaAgent.Cloud.SyncQueue, retry_base_ms: 0
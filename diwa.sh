@@ -14,5 +14,11 @@ cd "$(dirname "$0")"
 export DIWA_DISABLE_WEB=true
 export MIX_QUIET=1
 
+# 3. `./diwa.sh daemon` serves all clients from one node on a Unix socket
+#    (see scripts/diwa_shim.py); anything else runs a per-client stdio server.
+if [ "$1" = "daemon" ]; then
+  export DIWA_TRANSPORT=socket
+fi
+
 # Run with Mix output suppressed
 exec mix run --no-start --no-deps-check --no-compile --no-halt scripts/launch_mcp.exs
@@ -0,0 +1,139 @@
+defmodule DiwaAgent.AI.EmbeddingCache do
+  @moduledoc """
+  Shared LRU cache of embeddings keyed by provider and content hash.
+
+  Used by `DiwaAgent.AI.EmbeddingPipeline` for both memory writes and search
+  queries, so identical text is embedded once. Reads and writes go straight
+  to public ETS tables from the calling process; this GenServer only owns
+  the tables.
+
+  Recency is tracked in a second `ordered_set` keyed by a monotonic tick.
+  Entries whose tick no longer matches the main table are stale and are
+  skipped during eviction.
+  """
+
+  use GenServer
+
+  alias DiwaAgent.Storage.ContentHash
+
+  @table :diwa_embedding_cache
+  @lru :diwa_embedding_cache_lru
+  @default_max_entries 10_000
+
+  def start_link(opts \\ []) do
+    GenServer.start_link(__MODULE__, opts, name: __MODULE__)
+  end
+
+  @doc """
+  Cache key for `text` embedded by `provider`: the same normalised content
+  hash used for memory fingerprints.
+  """
+  def key(provider, text), do: {provider, ContentHash.hash(text)}
+
+  @doc """
+  Look up a cached vector, marking it as recently used.
+  """
+  def get(key) do
+    case safe_lookup(key) do
+      [{^key, vector, old_tick}] ->
+        tick = next_tick()
+        :ets.update_element(@table, key, {3, tick})
+        :ets.insert(@lru, {tick, key})
+        :ets.delete(@lru, old_tick)
+        {:ok, vector}
+
+      _ ->
+        :miss
+    end
+  end
+
+  @doc """
+  Store a vector, evicting least-recently-used entries beyond capacity.
+  """
+  def put(key, vector) do
+    if :ets.whereis(@table) != :undefined do
+      tick = next_tick()
+
+      case :ets.lookup(@table, key) do
+        [{^key, _vector, old_tick}] -> :ets.delete(@lru, old_tick)
+        [] -> :ok
+      end
+
+      :ets.insert(@table, {key, vector, tick})
+      :ets.insert(@lru, {tick, key})
+      evict(max_entries())
+    end
+
+    :ok
+  end
+
+  @doc """
+  Current number of cached vectors.
+  """
+  def size do
+    case :ets.whereis(@table) do
+      :undefined -> 0
+      _ -> :ets.info(@table, :size)
+    end
+  end
+
+  @doc """
+  Drop every cached vector.
+  """
+  def clear do
+    if :ets.whereis(@table) != :undefined do
+      :ets.delete_all_objects(@table)
+      :ets.delete_all_objects(@lru)
+    end
+
+    :ok
+  end
+
+  # Server Callbacks
+
+  @impl true
+  def init(_opts) do
+    :ets.new(@table, [:named_table, :set, :public, read_concurrency: true])
+    :ets.new(@lru, [:named_table, :ordered_set, :public])
+    {:ok, %{}}
+  end
+
+  # Private Functions
+
+  defp evict(max) do
+    if :ets.info(@table, :size) > max do
+      case :ets.first(@lru) do
+        :"$end_of_table" ->
+          :ok
+
+        tick ->
+          case :ets.take(@lru, tick) do
+            [{^tick, key}] ->
+              # Only evict if this tick is still the entry's latest access
+              :ets.select_delete(@table, [{{key, :_, tick}, [], [true]}])
+
+            [] ->
+              :ok
+          end
+
+          evict(max)
+      end
+    else
+      :ok
+    end
+  end
+
+  defp safe_lookup(key) do
+    :ets.lookup(@table, key)
+  rescue
+    ArgumentError -> []
+  end
+
+  defp next_tick, do: :erlang.unique_integer([:monotonic])
+
+  defp max_entries do
+    :diwa_agent
+    |> Application.get_env(__MODULE__, [])
+    |> Keyword.get(:max_entries, @default_max_entries)
+  end
+end
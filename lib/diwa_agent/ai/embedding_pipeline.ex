@@ -0,0 +1,405 @@
+defmodule DiwaAgent.AI.EmbeddingPipeline do
+  @moduledoc """
+  Batched, cached front-end for the configured embedding provider.
+
+  Drop-in replacement for the `:embedding_module` contract
+  (`generate_embedding/1`), plus a batch call and an asynchronous
+  `enqueue/2` used by memory writes:
+
+    * texts are looked up in `DiwaAgent.AI.EmbeddingCache` first;
+    * misses wait in a bounded queue (`:max_queue`). When it is full,
+      `generate_embedding/1` callers get `{:error, :queue_full}` instead of
+      growing the mailbox, while `enqueue/2` callers (memory writes) are
+      held until a batch makes room, so bulk writes slow down to the
+      provider's pace instead of losing embeddings;
+    * the queue is drained in micro-batches of up to `:batch_size` texts,
+      flushed early after `:max_wait_ms`, with at most `:max_concurrency`
+      batches in flight. Providers exporting `generate_embeddings/1` get one
+      call per batch;
+    * failed batches are retried with exponential backoff (`:max_retries`,
+      `:backoff_ms`);
+    * `[:diwa_agent, :embedding, :queue]` and `[:diwa_agent, :embedding, :batch]`
+      telemetry events report queue depth and batch size/duration.
+
+  The provider comes from `config :diwa_agent, :embedding_provider`
+  (default `DiwaAgent.AI.Embeddings`). Tuning lives under
+  `config :diwa_agent, DiwaAgent.AI.EmbeddingPipeline`.
+  """
+
+  use GenServer
+  require Logger
+
+  alias DiwaAgent.AI.EmbeddingCache
+
+  @defaults [
+    batch_size: 32,
+    max_wait_ms: 10,
+    max_queue: 1_000,
+    max_concurrency: 2,
+    max_retries: 3,
+    backoff_ms: 200,
+    call_timeout: 60_000
+  ]
+
+  # Errors that retrying cannot fix
+  @permanent_errors [:not_implemented, :invalid_input]
+
+  # Client API
+
+  def start_link(opts \\ []) do
+    GenServer.start_link(__MODULE__, opts, name: __MODULE__)
+  end
+
+  @doc """
+  Embed one text, waiting for the batch it joins.
+  """
+  def generate_embedding(text) do
+    key = EmbeddingCache.key(provider(), text)
+
+    case EmbeddingCache.get(key) do
+      {:ok, vector} ->
+        DiwaAgent.Telemetry.execute([:diwa_agent, :embedding, :cache], %{hit: 1, miss: 0})
+        {:ok, vector}
+
+      :miss ->
+        DiwaAgent.Telemetry.execute([:diwa_agent, :embedding, :cache], %{hit: 0, miss: 1})
+
+        case Process.whereis(__MODULE__) do
+          nil -> embed_direct(key, text)
+          pid -> GenServer.call(pid, {:embed, key, text}, config(:call_timeout))
+        end
+    end
+  end
+
+  @doc """
+  Embed many texts; returns vectors in input order or the first error.
+  """
+  def generate_embeddings(texts) when is_list(texts) do
+    texts
+    |> Task.async_stream(&generate_embedding/1,
+      max_concurrency: max(length(texts), 1),
+      timeout: config(:call_timeout)
+    )
+    |> Enum.reduce_while({:ok, []}, fn
+      {:ok, {:ok, vector}}, {:ok, acc} -> {:cont, {:ok, [vector | acc]}}
+      {:ok, {:error, reason}}, _ -> {:halt, {:error, reason}}
+      {:exit, reason}, _ -> {:halt, {:error, reason}}
+    end)
+    |> case do
+      {:ok, vectors} -> {:ok, Enum.reverse(vectors)}
+      error -> error
+    end
+  end
+
+  @doc """
+  Queue `text` for embedding without waiting for the embedding. `on_result`
+  is called with `{:ok, vector}` or `{:error, reason}` from a pipeline task.
+
+  When the queue is full the caller waits until a batch makes room. After
+  `:call_timeout` it gets `{:error, :timeout}`; the text stays in line and
+  is still embedded.
+  """
+  def enqueue(text, on_result) when is_function(on_result, 1) do
+    key = EmbeddingCache.key(provider(), text)
+
+    case EmbeddingCache.get(key) do
+      {:ok, vector} ->
+        on_result.({:ok, vector})
+        :ok
+
+      :miss ->
+        case Process.whereis(__MODULE__) do
+          nil -> on_result.(embed_direct(key, text))
+          pid -> call_enqueue(pid, {:enqueue, key, text, on_result})
+        end
+    end
+  end
+
+  defp call_enqueue(pid, request) do
+    GenServer.call(pid, request, config(:call_timeout))
+  catch
+    :exit, {:timeout, _} -> {:error, :timeout}
+  end
+
+  @doc """
+  Current queue depth and number of batches in flight.
+  """
+  def stats do
+    GenServer.call(__MODULE__, :stats)
+  end
+
+  # Server Callbacks
+
+  @impl true
+  def init(opts) do
+    settings = Keyword.merge(@defaults, Application.get_env(:diwa_agent, __MODULE__, []))
+    settings = Keyword.merge(settings, opts)
+
+    {:ok,
+     %{
+       settings: Map.new(settings),
+       queue: :queue.new(),
+       queue_len: 0,
+       # enqueue/2 callers held while the queue is full: {from, item}
+       blocked: :queue.new(),
+       in_flight: %{},
+       timer: nil
+     }}
+  end
+
+  @impl true
+  def handle_call({:embed, key, text}, from, state) do
+    push(state, {key, text, {:reply, from}})
+  end
+
+  def handle_call({:enqueue, key, text, on_result}, from, state) do
+    item = {key, text, {:callback, on_result}}
+
+    case push(state, item) do
+      {:noreply, state} ->
+        {:reply, :ok, state}
+
+      {:reply, {:error, :queue_full}, state} ->
+        {:noreply, %{state | blocked: :queue.in({from, item}, state.blocked)}}
+    end
+  end
+
+  def handle_call(:stats, _from, state) do
+    stats = %{
+      queue_depth: state.queue_len,
+      batches_in_flight: map_size(state.in_flight),
+      blocked: :queue.len(state.blocked)
+    }
+
+    {:reply, stats, state}
+  end
+
+  @impl true
+  def handle_info(:flush, state) do
+    {:noreply, dispatch(%{state | timer: nil}, true)}
+  end
+
+  # Batch task finished (its waiters were answered from the task itself)
+  def handle_info({ref, _result}, state) when is_reference(ref) do
+    Process.demonitor(ref, [:flush])
+    {:noreply, dispatch(%{state | in_flight: Map.delete(state.in_flight, ref)}, false)}
+  end
+
+  def handle_info({:DOWN, ref, :process, _pid, reason}, state) do
+    case Map.pop(state.in_flight, ref) do
+      {nil, _} ->
+        {:noreply, state}
+
+      {batch, in_flight} ->
+        Logger.error("[DiwaAgent.EmbeddingPipeline] Batch crashed: #{inspect(reason)}")
+        Enum.each(batch, fn {_key, _text, waiter} -> respond(waiter, {:error, :batch_failed}) end)
+        {:noreply, dispatch(%{state | in_flight: in_flight}, false)}
+    end
+  end
+
+  def handle_info(_msg, state), do: {:noreply, state}
+
+  # Queueing
+
+  defp push(%{queue_len: len, settings: %{max_queue: max}} = state, _item) when len >= max do
+    {:reply, {:error, :queue_full}, state}
+  end
+
+  defp push(state, item) do
+    state = %{state | queue: :queue.in(item, state.queue), queue_len: state.queue_len + 1}
+
+    DiwaAgent.Telemetry.execute([:diwa_agent, :embedding, :queue], %{depth: state.queue_len})
+
+    state =
+      cond do
+        state.queue_len >= state.settings.batch_size -> dispatch(state, false)
+        state.timer == nil -> %{state | timer: schedule_flush(state)}
+        true -> state
+      end
+
+    {:noreply, state}
+  end
+
+  # Start batches while there is capacity; partial batches only when `force`
+  # (linger timer fired) or when a full batch cannot be formed.
+  defp dispatch(state, force) do
+    cond do
+      state.queue_len == 0 ->
+        state
+
+      map_size(state.in_flight) >= state.settings.max_concurrency ->
+        state
+
+      state.queue_len < state.settings.batch_size and not force ->
+        if state.timer == nil, do: %{state | timer: schedule_flush(state)}, else: state
+
+      true ->
+        {batch, queue, taken} = take(state.queue, state.settings.batch_size)
+        task = start_batch(batch, state.settings)
+
+        %{
+          state
+          | queue: queue,
+            queue_len: state.queue_len - taken,
+            in_flight: Map.put(state.in_flight, task.ref, batch)
+        }
+        |> admit()
+        |> dispatch(force)
+    end
+  end
+
+  # Move held enqueue/2 callers into the room a batch just made
+  defp admit(%{queue_len: len, settings: %{max_queue: max}} = state) when len >= max, do: state
+
+  defp admit(state) do
+    case :queue.out(state.blocked) do
+      {{:value, {from, item}}, blocked} ->
+        GenServer.reply(from, :ok)
+
+        admit(%{
+          state
+          | blocked: blocked,
+            queue: :queue.in(item, state.queue),
+            queue_len: state.queue_len + 1
+        })
+
+      {:empty, _} ->
+        state
+    end
+  end
+
+  defp take(queue, n), do: take(queue, n, [], 0)
+
+  defp take(queue, 0, acc, taken), do: {Enum.reverse(acc), queue, taken}
+
+  defp take(queue, n, acc, taken) do
+    case :queue.out(queue) do
+      {{:value, item}, rest} -> take(rest, n - 1, [item | acc], taken + 1)
+      {:empty, _} -> {Enum.reverse(acc), queue, taken}
+    end
+  end
+
+  defp schedule_flush(state), do: Process.send_after(self(), :flush, state.settings.max_wait_ms)
+
+  # Batch execution (runs in a task)
+
+  defp start_batch(batch, settings) do
+    fun = fn -> run_batch(batch, settings) end
+
+    case Process.whereis(DiwaAgent.TaskSupervisor) do
+      nil -> Task.async(fun)
+      _ -> Task.Supervisor.async_nolink(DiwaAgent.TaskSupervisor, fun)
+    end
+  end
+
+  defp run_batch(batch, settings) do
+    # Identical texts in one batch are embedded once
+    unique = batch |> Enum.uniq_by(fn {key, _, _} -> key end)
+    texts = Enum.map(unique, fn {_, text, _} -> text end)
+    started = System.monotonic_time()
+
+    result = with_retries(fn -> call_provider(texts) end, settings, 0)
+
+    DiwaAgent.Telemetry.execute(
+      [:diwa_agent, :embedding, :batch],
+      %{size: length(texts), duration: System.monotonic_time() - started},
+      %{provider: provider(), status: elem(result, 0)}
+    )
+
+    results =
+      case result do
+        {:ok, vectors} ->
+          unique
+          |> Enum.zip(vectors)
+          |> Map.new(fn {{key, _, _}, vector} ->
+            EmbeddingCache.put(key, vector)
+            {key, {:ok, vector}}
+          end)
+
+        {:error, reason} ->
+          Map.new(unique, fn {key, _, _} -> {key, {:error, reason}} end)
+      end
+
+    Enum.each(batch, fn {key, _text, waiter} -> respond(waiter, Map.fetch!(results, key)) end)
+    :done
+  end
+
+  defp with_retries(fun, settings, attempt) do
+    case fun.() do
+      {:ok, _} = ok ->
+        ok
+
+      {:error, reason} when reason in @permanent_errors ->
+        {:error, reason}
+
+      {:error, reason} when attempt < settings.max_retries ->
+        delay = settings.backoff_ms * Integer.pow(2, attempt)
+
+        Logger.warning(
+          "[DiwaAgent.EmbeddingPipeline] Provider error #{inspect(reason)}, retrying in #{delay}ms"
+        )
+
+        Process.sleep(delay)
+        with_retries(fun, settings, attempt + 1)
+
+      {:error, reason} ->
+        {:error, reason}
+    end
+  end
+
+  defp call_provider(texts) do
+    mod = provider()
+    Code.ensure_loaded(mod)
+
+    if function_exported?(mod, :generate_embeddings, 1) do
+      case mod.generate_embeddings(texts) do
+        {:ok, vectors} when length(vectors) == length(texts) -> {:ok, vectors}
+        {:ok, _} -> {:error, :provider_result_mismatch}
+        error -> error
+      end
+    else
+      Enum.reduce_while(texts, {:ok, []}, fn text, {:ok, acc} ->
+        case mod.generate_embedding(text) do
+          {:ok, vector} -> {:cont, {:ok, [vector | acc]}}
+          error -> {:halt, error}
+        end
+      end)
+      |> case do
+        {:ok, vectors} -> {:ok, Enum.reverse(vectors)}
+        error -> error
+      end
+    end
+  rescue
+    e -> {:error, e}
+  end
+
+  defp respond({:reply, from}, result), do: GenServer.reply(from, result)
+
+  defp respond({:callback, fun}, result) do
+    fun.(result)
+  rescue
+    e -> Logger.error("[DiwaAgent.EmbeddingPipeline] Callback failed: #{inspect(e)}")
+  end
+
+  # Used when the pipeline process is not running (scripts, --no-start)
+  defp embed_direct(key, text) do
+    case call_provider([text]) do
+      {:ok, [vector]} ->
+        EmbeddingCache.put(key, vector)
+        {:ok, vector}
+
+      error ->
+        error
+    end
+  end
+
+  defp provider do
+    Application.get_env(:diwa_agent, :embedding_provider, DiwaAgent.AI.Embeddings)
+  end
+
+  defp config(key) do
+    :diwa_agent
+    |> Application.get_env(__MODULE__, [])
+    |> Keyword.get(key, @defaults[key])
+  end
+end
@@ -0,0 +1,58 @@
+defmodule DiwaAgent.AI.Embeddings.Local do
+  @moduledoc """
+  Deterministic, dependency-free embedding provider based on feature hashing.
+
+  Each lower-cased word and word bigram is hashed into one of 256
+  signed buckets and the result is L2-normalised. Texts that share
+  vocabulary get high cosine similarity, which is enough for tests and for
+  offline installs without an LLM provider. It is not a semantic model.
+  """
+
+  @dimensions 256
+
+  @doc """
+  Embed a single text.
+  """
+  def generate_embedding(text) when is_binary(text) do
+    {:ok, embed(text)}
+  end
+
+  def generate_embedding(_), do: {:error, :invalid_input}
+
+  @doc """
+  Embed a batch of texts in one call.
+  """
+  def generate_embeddings(texts) when is_list(texts) do
+    if Enum.all?(texts, &is_binary/1),
+      do: {:ok, Enum.map(texts, &embed/1)},
+      else: {:error, :invalid_input}
+  end
+
+  @doc """
+  Vector dimensionality produced by this provider.
+  """
+  def dimensions, do: @dimensions
+
+  defp embed(text) do
+    words =
+      ~r/[\p{L}\p{N}_]+/u
+      |> Regex.scan(String.downcase(text))
+      |> List.flatten()
+
+    bigrams = Enum.zip_with(words, Enum.drop(words, 1), &(&1 <> " " <> &2))
+
+    buckets =
+      Enum.reduce(words ++ bigrams, %{}, fn feature, acc ->
+        bucket = :erlang.phash2(feature, @dimensions)
+        sign = if :erlang.phash2({:sign, feature}, 2) == 0, do: 1.0, else: -1.0
+        Map.update(acc, bucket, sign, &(&1 + sign))
+      end)
+
+    norm = :math.sqrt(Enum.reduce(buckets, 0.0, fn {_, v}, acc -> acc + v * v end))
+
+    for i <- 0..(@dimensions - 1) do
+      value = Map.get(buckets, i, 0.0)
+      if norm == 0.0, do: 0.0, else: value / norm
+    end
+  end
+end
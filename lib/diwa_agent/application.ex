@@ -5,83 +5,105 @@ defmodule DiwaAgent.Application do
   Starts the supervision tree with:
   - DiwaAgent.Repo (SQLite database)
   - DiwaAgent.Server (MCP stdio server)
+
+  With `config :diwa_agent, fast_start: true` the workers that are not needed
+  for the first request are started on demand by `DiwaAgent.Lazy`, and boot
+  phases are recorded by `DiwaAgent.Startup`.
   """
 
   use Application
   require Logger
 
+  # Not needed to answer the first request: started on first use (or, for
+  # background workers, shortly after boot) in fast-start mode
+  @lazy_children [
+    DiwaAgent.Registry.Server,
+    DiwaAgent.Delegation.Broker,
+    DiwaAgent.Workflow.ArtifactQueue
+  ]
+  @deferred_children [DiwaAgent.Cloud.SyncWorker, DiwaAgent.ContextBridge.LifecycleScheduler]
+
   @impl true
   def start(_type, _args) do
+    fast_start = DiwaAgent.Lazy.fast_start?()
+    DiwaAgent.Startup.mark(:application_start)
+
     children =
       [
+        # Metrics aggregator (attaches telemetry handlers before anything emits)
+        DiwaAgent.Telemetry.Metrics,
+
         # Database
         DiwaAgent.Repo,
 
+        # Pending migrations only; skipped when schema_migrations is current
+        if Application.get_env(:diwa_agent, :auto_migrate, false) do
+          DiwaAgent.Startup.Migrator
+        end,
+
         # Task Supervisor for async tasks
         {Task.Supervisor, name: DiwaAgent.TaskSupervisor},
 
-        # Agent and Shortcut Registries
-        DiwaAgent.Registry.Server,
-        DiwaAgent.Shortcuts.Registry,
-        DiwaAgent.Delegation.Broker,
+        # Embedding cache and batching pipeline
+        DiwaAgent.AI.EmbeddingCache,
+        DiwaAgent.AI.EmbeddingPipeline,
 
-        # Cloud Synchronization Worker
-        DiwaAgent.Cloud.SyncWorker,
+        # Read-through cache for session-start context data
+        DiwaAgent.Storage.HotCache,
 
-        # TALA Buffer (Transactional Accumulation & Lazy Apply)
-        DiwaAgent.Tala.Buffer,
+        # Write-behind memory access counts
+        DiwaAgent.ContextBridge.AccessTracker,
 
-        # Handoff Artifact Queue
-        DiwaAgent.Workflow.ArtifactQueue,
+        # Local ANN index for semantic search without pgvector
+        DiwaAgent.Storage.VectorIndex,
 
-        # MCP Server (Must start before Transport to handle initial messages)
-        DiwaAgent.Server,
+        # Cached workspace tree for list_directory, read_file and search_code
+        DiwaAgent.CodeBrowser.FileIndex,
 
-        # Transport (Stdio)
-        # Only start if not disabled via env var (e.g. when running in Diwa Cloud)
-        if System.get_env("DIWA_DISABLE_TRANSPORT") != "true" do
-          {DiwaAgent.Transport.Stdio, []}
-        else
-          nil
-        end
-      ]
-      |> Enum.reject(&is_nil(&1))
+        # Shortcut Registry
+        DiwaAgent.Shortcuts.Registry,
 
-    opts = [strategy: :one_for_one, name: DiwaAgent.Supervisor]
+        # TALA Buffer (Transactional Accumulation & Lazy Apply)
+        DiwaAgent.Tala.Buffer,
 
-    # Run migrations if configured
-    if Application.get_env(:diwa_agent, :auto_migrate, false) do
-      migrate()
-    end
+        # Agent Registry, Delegation Broker, Handoff Artifact Queue, Cloud
+        # Synchronization Worker and Lifecycle Scheduler (lazy in fast-start mode)
+        DiwaAgent.Lazy
+      ] ++
+        if(fast_start, do: [], else: @lazy_children ++ @deferred_children) ++
+        [
+          # MCP Server (Must start before Transport to handle initial messages)
+          DiwaAgent.Server,
+
+          # Transport: Stdio, or the shared daemon socket
+          # Only start if not disabled via env var (e.g. when running in Diwa Cloud)
+          transport()
+        ]
+
+    children = Enum.reject(children, &is_nil(&1))
+    opts = [strategy: :one_for_one, name: DiwaAgent.Supervisor]
 
     # Create default organization if configured
     if Application.get_env(:diwa_agent, :create_default_org, false) do
       create_default_org()
     end
 
-    Supervisor.start_link(children, opts)
+    result =
+      DiwaAgent.Startup.measure(:supervision_tree, fn -> Supervisor.start_link(children, opts) end)
+
+    if fast_start do
+      DiwaAgent.Lazy.start_deferred(@deferred_children, DiwaAgent.Startup.deferred_start_ms())
+    end
+
+    DiwaAgent.Startup.mark(:ready)
+    result
   end
 
-  defp migrate do
-    # Run migrations on startup (for escript/release mode)
-    # Suppress all output to prevent stdout pollution in MCP protocol
-    # and ensure any residual logs go to stderr
-    Logger.configure(level: :warning)
-    Logger.configure_backend(:console, device: :standard_error)
-
-    try do
-      # Note: with_repo/2 takes an optional logger option since Ecto 3.9
-      # but if not available we rely on Logger.configure_backend
-      {:ok, _, _} =
-        Ecto.Migrator.with_repo(DiwaAgent.Repo, fn repo ->
-          # Log via Logger
-          Ecto.Migrator.run(repo, :up, all: true, log: :debug)
-        end)
-    rescue
-      e ->
-        # Log to stderr only
-        Logger.error("[DiwaAgent] Migration failed: #{Exception.message(e)}")
-        :ok
+  defp transport do
+    cond do
+      System.get_env("DIWA_DISABLE_TRANSPORT") == "true" -> nil
+      System.get_env("DIWA_TRANSPORT") == "socket" -> {DiwaAgent.Transport.Socket, []}
+      true -> {DiwaAgent.Transport.Stdio, []}
     end
   end
 
@@ -6,6 +6,14 @@ defmodule DiwaAgent.Cloud.Client do
   @callback sync_context(map()) :: :ok | {:error, term()}
   @callback sync_memory(map()) :: :ok | {:error, term()}
 
+  @doc """
+  Upload several queue entries (`%{id: queue_id, type: type, payload: map}`)
+  in one request. Returns the entries that failed as `{queue_id, reason}`.
+  """
+  @callback sync_batch([map()]) :: {:ok, [{term(), term()}]} | {:error, term()}
+
+  @optional_callbacks sync_batch: 1
+
   @doc """
   Sync a context with Diwa Cloud.
   """
@@ -17,6 +25,40 @@ defmodule DiwaAgent.Cloud.Client do
     impl().sync_memory(memory)
   end
 
+  @doc """
+  Sync a batch of queue entries, one request per entry when the client
+  has no batch endpoint.
+  """
+  def sync_batch(entries) do
+    impl = impl()
+
+    if Code.ensure_loaded?(impl) and function_exported?(impl, :sync_batch, 1) do
+      impl.sync_batch(entries)
+    else
+      sync_each(impl, entries)
+    end
+  end
+
+  @doc false
+  def sync_each(impl, entries) do
+    failed =
+      Enum.flat_map(entries, fn entry ->
+        result =
+          case entry.type do
+            "context" -> impl.sync_context(entry.payload)
+            "memory" -> impl.sync_memory(entry.payload)
+            other -> {:error, {:unknown_type, other}}
+          end
+
+        case result do
+          :ok -> []
+          {:error, reason} -> [{entry.id, reason}]
+        end
+      end)
+
+    {:ok, failed}
+  end
+
   defp impl do
     Application.get_env(:diwa_agent, :cloud_client, DiwaAgent.Cloud.Client.Http)
   end
@@ -87,8 +129,43 @@ defmodule DiwaAgent.Cloud.Client.Http do
     end
   end
 
-  defp post(url, body) do
-    Req.post(url, json: body, headers: auth_headers())
+  @doc """
+  Sync a batch of queue entries with one gzip-compressed request to
+  `/sync/batch`. The server answers with the refs it rejected:
+  `{"failed": [{"ref": queue_id, "error": reason}]}`.
+  """
+  def sync_batch(entries) do
+    url = "#{base_url()}/sync/batch"
+
+    body = %{
+      items: Enum.map(entries, &%{ref: &1.id, type: &1.type, payload: &1.payload})
+    }
+
+    case post(url, body, compress_body: true) do
+      {:ok, %{status: status, body: body}} when status in 200..299 ->
+        failed =
+          for %{"ref" => ref} = item <- (is_map(body) && body["failed"]) || [],
+              do: {ref, item["error"] || :rejected}
+
+        {:ok, failed}
+
+      {:ok, %{status: status}} when status in [404, 405] ->
+        # Server predates the batch endpoint
+        DiwaAgent.Cloud.Client.sync_each(__MODULE__, entries)
+
+      {:ok, %{status: status, body: body}} ->
+        Logger.warning("[CloudClient] Batch sync failed (#{status}): #{inspect(body)}")
+        {:error, :sync_failed}
+
+      {:error, reason} ->
+        Logger.error("[CloudClient] Batch sync error: #{inspect(reason)}")
+        {:error, reason}
+    end
+  end
+
+  # Retries are scheduled by SyncQueue, not by the HTTP client
+  defp post(url, body, opts \\ []) do
+    Req.post(url, [json: body, headers: auth_headers(), retry: false] ++ opts)
   end
 
   defp auth_headers do
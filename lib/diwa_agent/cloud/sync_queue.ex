@@ -1,6 +1,11 @@
 defmodule DiwaAgent.Cloud.SyncQueue do
   @moduledoc """
   Durable queue for synchronization tasks.
+
+  Entries move `pending -> sending -> completed`; a failed upload goes to
+  `failed` and is retried after an exponential backoff (`scheduled_at`)
+  until it has been attempted 10 times. Entries replaced by a newer write to
+  the same record before they were uploaded end up `superseded`.
   """
   use Ecto.Schema
   import Ecto.Changeset
@@ -8,6 +13,7 @@ defmodule DiwaAgent.Cloud.SyncQueue do
   alias DiwaAgent.Repo
 
   @primary_key {:id, :binary_id, autogenerate: true}
+  @max_attempts 10
 
   schema "sync_queue" do
     field(:type, :string)
@@ -27,7 +33,35 @@ defmodule DiwaAgent.Cloud.SyncQueue do
     |> validate_required([:type, :payload])
   end
 
+  @doc """
+  Queue `payload` for upload. A pending entry for the same `(type, id)` is
+  overwritten with the newer payload instead of adding a row, so repeated
+  writes to one record are uploaded once.
+
+  The overwrite is conditional on the entry still being pending: if
+  `claim_batch/1` took it in the meantime, the payload goes into a new row
+  instead of one already being uploaded with the old payload.
+
+  Failed entries for the record waiting on their backoff are superseded, so
+  a retry can never upload an older payload over this one.
+  """
   def enqueue(type, payload, priority \\ 0) do
+    id = payload_id(payload)
+    supersede_failed(type, id)
+
+    result =
+      with %__MODULE__{} = entry <- pending_entry(type, id),
+           {1, [updated]} <- overwrite_pending(entry, payload, priority) do
+        {:ok, updated}
+      else
+        _ -> insert_entry(type, payload, priority)
+      end
+
+    DiwaAgent.Cloud.SyncWorker.notify()
+    result
+  end
+
+  defp insert_entry(type, payload, priority) do
     %__MODULE__{}
     |> changeset(%{
       type: type,
@@ -38,27 +72,188 @@ defmodule DiwaAgent.Cloud.SyncQueue do
     |> Repo.insert()
   end
 
+  defp overwrite_pending(entry, payload, priority) do
+    from(q in __MODULE__, where: q.id == ^entry.id and q.status == "pending", select: q)
+    |> Repo.update_all(
+      set: [
+        payload: payload,
+        priority: max(entry.priority, priority),
+        updated_at: DateTime.utc_now()
+      ]
+    )
+  end
+
+  defp pending_entry(_type, nil), do: nil
+
+  defp pending_entry(type, id) do
+    from(q in __MODULE__,
+      where: q.status == "pending",
+      order_by: [desc: q.inserted_at],
+      limit: 1
+    )
+    |> for_record(type, id)
+    |> Repo.one()
+  end
+
+  defp supersede_failed(_type, nil), do: {0, nil}
+
+  defp supersede_failed(type, id) do
+    from(q in __MODULE__, where: q.status == "failed")
+    |> for_record(type, id)
+    |> Repo.update_all(set: [status: "superseded"])
+  end
+
+  # An upload that was in flight while the record was written again
+  defp newer_entry?(%__MODULE__{} = item) do
+    case payload_id(item.payload) do
+      nil ->
+        false
+
+      id ->
+        from(q in __MODULE__,
+          where: q.id != ^item.id and q.inserted_at > ^item.inserted_at,
+          where: q.status != "superseded"
+        )
+        |> for_record(item.type, id)
+        |> Repo.exists?()
+    end
+  end
+
+  defp for_record(query, type, id) do
+    adapter = Application.get_env(:diwa_agent, DiwaAgent.Repo)[:adapter]
+    id = to_string(id)
+    query = from(q in query, where: q.type == ^type)
+
+    if adapter == Ecto.Adapters.Postgres do
+      from(q in query, where: fragment("?->>'id' = ?", q.payload, ^id))
+    else
+      from(q in query, where: fragment("json_extract(?, '$.id') = ?", q.payload, ^id))
+    end
+  end
+
   def next_batch(batch_size \\ 10) do
+    Repo.all(due_query(batch_size))
+  end
+
+  @doc """
+  Take up to `batch_size` due entries and mark them `"sending"`, so that
+  `enqueue/3` no longer coalesces into them while they are in flight.
+  """
+  def claim_batch(batch_size) do
+    {:ok, items} =
+      Repo.transaction(fn ->
+        items = Repo.all(due_query(batch_size))
+        ids = Enum.map(items, & &1.id)
+        from(q in __MODULE__, where: q.id in ^ids) |> Repo.update_all(set: [status: "sending"])
+        items
+      end)
+
+    items
+  end
+
+  @doc """
+  Return claimed entries to the queue, e.g. after the worker restarted
+  mid-batch.
+  """
+  def release_claimed do
+    from(q in __MODULE__, where: q.status == "sending")
+    |> Repo.update_all(set: [status: "pending"])
+  end
+
+  @doc """
+  Keep only the newest entry per `(type, id)`; older ones are returned as
+  superseded.
+  """
+  def coalesce(items) do
+    newest =
+      items
+      |> Enum.group_by(&{&1.type, payload_id(&1.payload) || &1.id})
+      |> MapSet.new(fn {_key, entries} -> Enum.max_by(entries, & &1.inserted_at, DateTime).id end)
+
+    Enum.split_with(items, &MapSet.member?(newest, &1.id))
+  end
+
+  defp due_query(batch_size) do
     now = DateTime.utc_now()
 
-    query =
-      from(q in __MODULE__,
-        where: q.status == "pending" or (q.status == "failed" and q.attempts < 10),
-        where: q.scheduled_at <= ^now,
-        order_by: [desc: q.priority, asc: q.inserted_at],
-        limit: ^batch_size
-      )
+    from(q in __MODULE__,
+      where: q.status == "pending" or (q.status == "failed" and q.attempts < @max_attempts),
+      where: q.scheduled_at <= ^now,
+      order_by: [desc: q.priority, asc: q.inserted_at],
+      limit: ^batch_size
+    )
+  end
 
-    Repo.all(query)
+  defp payload_id(payload), do: payload[:id] || payload["id"]
+
+  @doc """
+  Number of items still waiting to be synced (pending or retryable).
+  """
+  def depth do
+    from(q in __MODULE__,
+      where: q.status in ["pending", "sending"] or
+          (q.status == "failed" and q.attempts < @max_attempts)
+    )
+    |> Repo.aggregate(:count)
   end
 
-  def mark_completed(id) do
-    from(q in __MODULE__, where: q.id == ^id)
+  def mark_completed(id), do: mark_completed_many([id])
+
+  def mark_completed_many([]), do: {0, nil}
+
+  def mark_completed_many(ids) do
+    from(q in __MODULE__, where: q.id in ^ids)
     |> Repo.update_all(set: [status: "completed", attempts: 1])
   end
 
+  @doc """
+  Mark entries replaced by a newer payload for the same record.
+  """
+  def mark_superseded([]), do: {0, nil}
+
+  def mark_superseded(ids) do
+    from(q in __MODULE__, where: q.id in ^ids)
+    |> Repo.update_all(set: [status: "superseded"])
+  end
+
+  @doc """
+  Record a failed attempt and reschedule the entry with exponential backoff
+  (`retry_base_ms * 2^attempts`, capped at `retry_max_ms`). An entry whose
+  record was written again while it was being uploaded is superseded
+  instead of retried.
+  """
+  def mark_failed(%__MODULE__{} = item, error) do
+    if newer_entry?(item),
+      do: mark_superseded([item.id]),
+      else: reschedule(item, error)
+  end
+
   def mark_failed(id, error) do
-    from(q in __MODULE__, where: q.id == ^id)
-    |> Repo.update_all(inc: [attempts: 1], set: [status: "failed", last_error: inspect(error)])
+    case Repo.get(__MODULE__, id) do
+      nil -> {0, nil}
+      item -> mark_failed(item, error)
+    end
+  end
+
+  defp reschedule(item, error) do
+    delay =
+      min(
+        config(:retry_base_ms, 1_000) * Integer.pow(2, item.attempts),
+        config(:retry_max_ms, 300_000)
+      )
+
+    retry_at = DateTime.add(DateTime.utc_now(), delay, :millisecond)
+
+    from(q in __MODULE__, where: q.id == ^item.id)
+    |> Repo.update_all(
+      inc: [attempts: 1],
+      set: [status: "failed", last_error: inspect(error), scheduled_at: retry_at]
+    )
+  end
+
+  defp config(key, default) do
+    :diwa_agent
+    |> Application.get_env(__MODULE__, [])
+    |> Keyword.get(key, default)
   end
 end
@@ -1,58 +1,143 @@
 defmodule DiwaAgent.Cloud.SyncWorker do
   @moduledoc """
   Background worker that processes the SyncQueue and calls the Cloud Client.
+
+  Each poll claims up to `:batch_size` due entries, drops the ones superseded
+  by a newer payload for the same record, and uploads the rest as
+  `Client.sync_batch/1` requests of `:chunk_size` entries, at most
+  `:max_concurrency` at a time.
+
+  Polling is adaptive: a full batch is followed immediately by the next one,
+  an idle poll doubles the interval from `:min_interval_ms` up to
+  `:max_interval_ms`, and `notify/0` (called on enqueue) wakes an idle
+  worker. Failed entries are rescheduled by `SyncQueue.mark_failed/2`.
   """
   use GenServer
   require Logger
   alias DiwaAgent.Cloud.{SyncQueue, Client}
 
-  # 5 seconds
-  @poll_interval 5_000
+  @default_batch_size 200
+  @default_chunk_size 50
+  @default_max_concurrency 4
+  @default_min_interval 500
+  @default_max_interval 30_000
+  @send_timeout 60_000
 
   def start_link(opts) do
     GenServer.start_link(__MODULE__, opts, name: __MODULE__)
   end
 
+  @doc """
+  Wake the worker if it is idling between polls.
+  """
+  def notify do
+    case Process.whereis(__MODULE__) do
+      nil -> :ok
+      pid -> send(pid, :kick)
+    end
+
+    :ok
+  end
+
   def init(_opts) do
     if System.get_env("DIWA_ENABLE_CLOUD_SYNC") == "true" do
-      schedule_poll()
-      {:ok, %{status: :active}}
+      # Entries claimed by a previous run that never finished
+      SyncQueue.release_claimed()
+      state = %{status: :active, interval: min_interval(), timer: nil}
+      {:ok, schedule_poll(state, 0)}
     else
-      {:ok, %{status: :inactive}}
+      {:ok, %{status: :inactive, interval: min_interval(), timer: nil}}
     end
   end
 
   def handle_info(:poll, state) do
-    process_batch()
-    schedule_poll()
-    {:noreply, state}
+    processed = process_batch()
+
+    interval =
+      cond do
+        processed >= config(:batch_size, @default_batch_size) -> 0
+        processed > 0 -> min_interval()
+        true -> min(max(state.interval, min_interval()) * 2, max_interval())
+      end
+
+    state = %{state | timer: nil, interval: interval}
+
+    if state.status == :active do
+      {:noreply, schedule_poll(state, interval)}
+    else
+      {:noreply, state}
+    end
   end
 
+  # New work while backing off: poll now instead of waiting out the interval
+  def handle_info(:kick, %{status: :active} = state) do
+    if state.interval > min_interval() do
+      if state.timer, do: Process.cancel_timer(state.timer)
+      {:noreply, schedule_poll(%{state | interval: min_interval()}, 0)}
+    else
+      {:noreply, state}
+    end
+  end
+
+  def handle_info(:kick, state), do: {:noreply, state}
+
   defp process_batch do
-    batches = SyncQueue.next_batch(10)
-    Enum.each(batches, &process_item/1)
-  end
-
-  defp process_item(item) do
-    case item.type do
-      "context" ->
-        # For simplicity, we assume the payload contains the necessary fields for a context-like map
-        case Client.sync_context(item.payload) do
-          :ok -> SyncQueue.mark_completed(item.id)
-          {:error, reason} -> SyncQueue.mark_failed(item.id, reason)
-        end
-
-      "memory" ->
-        # Map payload back to something Client.sync_memory(memory) can use
-        # In a real app, we might store the full struct or use a specialized mapper
-        case Client.sync_memory(item.payload) do
-          :ok -> SyncQueue.mark_completed(item.id)
-          {:error, reason} -> SyncQueue.mark_failed(item.id, reason)
-        end
+    DiwaAgent.Telemetry.execute([:diwa_agent, :sync, :queue], %{depth: SyncQueue.depth()})
+
+    case SyncQueue.claim_batch(config(:batch_size, @default_batch_size)) do
+      [] ->
+        0
+
+      batch ->
+        DiwaAgent.Telemetry.span([:diwa_agent, :sync, :batch], %{size: length(batch)}, fn ->
+          {latest, superseded} = SyncQueue.coalesce(batch)
+          SyncQueue.mark_superseded(Enum.map(superseded, & &1.id))
+          send_entries(latest)
+        end)
+
+        length(batch)
     end
   end
 
-  defp schedule_poll do
-    Process.send_after(self(), :poll, @poll_interval)
+  defp send_entries(items) do
+    chunks = Enum.chunk_every(items, config(:chunk_size, @default_chunk_size))
+
+    DiwaAgent.TaskSupervisor
+    |> Task.Supervisor.async_stream_nolink(
+      chunks,
+      fn chunk -> Client.sync_batch(Enum.map(chunk, &Map.take(&1, [:id, :type, :payload]))) end,
+      max_concurrency: config(:max_concurrency, @default_max_concurrency),
+      timeout: @send_timeout,
+      on_timeout: :kill_task
+    )
+    |> Enum.zip(chunks)
+    |> Enum.each(fn
+      {{:ok, {:ok, failed}}, chunk} ->
+        failed = Map.new(failed)
+        {rejected, sent} = Enum.split_with(chunk, &Map.has_key?(failed, &1.id))
+
+        SyncQueue.mark_completed_many(Enum.map(sent, & &1.id))
+        Enum.each(rejected, &SyncQueue.mark_failed(&1, failed[&1.id]))
+
+      {{:ok, {:error, reason}}, chunk} ->
+        Enum.each(chunk, &SyncQueue.mark_failed(&1, reason))
+
+      {{:exit, reason}, chunk} ->
+        Logger.warning("[DiwaAgent.SyncWorker] Batch upload crashed: #{inspect(reason)}")
+        Enum.each(chunk, &SyncQueue.mark_failed(&1, {:exit, reason}))
+    end)
+  end
+
+  defp schedule_poll(state, delay) do
+    %{state | timer: Process.send_after(self(), :poll, delay)}
+  end
+
+  defp min_interval, do: config(:min_interval_ms, @default_min_interval)
+  defp max_interval, do: config(:max_interval_ms, @default_max_interval)
+
+  defp config(key, default) do
+    :diwa_agent
+    |> Application.get_env(__MODULE__, [])
+    |> Keyword.get(key, default)
   end
 end
@@ -5,8 +5,12 @@ defmodule DiwaAgent.CodeBrowser do
   """
 
   require Logger
+  alias DiwaAgent.CodeBrowser.FileIndex
 
-  @default_ignored ~w(node_modules _build deps .git .elixir_ls .vscode .idea .agent .cursor .gemini)
+  @default_search_limit 50
+  @default_search_timeout_ms 10_000
+  # Files the pure-BEAM fallback search skips entirely
+  @max_search_file_bytes 10_485_760
 
   @doc """
   Lists files and directories at a given path.
@@ -16,24 +20,19 @@ defmodule DiwaAgent.CodeBrowser do
 
     # Safety check: ensure the path is within the root_path
     if String.starts_with?(full_path, Path.expand(root_path)) do
-      if File.dir?(full_path) do
+      with {:ok, entries} <- FileIndex.list_dir(full_path) do
         files =
-          File.ls!(full_path)
-          |> Enum.reject(&ignored?/1)
-          |> Enum.map(fn name ->
-            item_path = Path.join(full_path, name)
-
+          entries
+          |> Enum.map(fn {name, type} ->
             %{
               name: name,
-              type: if(File.dir?(item_path), do: :directory, else: :file),
-              path: Path.relative_to(item_path, root_path)
+              type: type,
+              path: Path.relative_to(Path.join(full_path, name), root_path)
             }
           end)
           |> Enum.sort_by(&{&1.type != :directory, &1.name})
 
         {:ok, files}
-      else
-        {:error, :not_a_directory}
       end
     else
       {:error, :access_denied}
@@ -42,29 +41,32 @@ defmodule DiwaAgent.CodeBrowser do
 
   @doc """
   Reads the content of a file.
+
+  With `:start_line`/`:end_line` only that slice is read; the total line
+  count comes from the file index.
   """
   def read_file(root_path, relative_path, opts \\ []) do
     full_path = Path.expand(Path.join(root_path, relative_path))
 
     if String.starts_with?(full_path, Path.expand(root_path)) do
-      case File.read(full_path) do
-        {:ok, content} ->
-          start_line = opts[:start_line]
-          end_line = opts[:end_line]
-
-          final_content =
-            if start_line || end_line do
-              extract_lines(content, start_line, end_line)
-            else
-              content
-            end
-
-          {:ok,
-           %{
-             path: relative_path,
-             content: final_content,
-             total_lines: line_count(content)
-           }}
+      start_line = opts[:start_line]
+      end_line = opts[:end_line]
+
+      result =
+        if start_line || end_line do
+          with {:ok, total} <- FileIndex.line_count(full_path),
+               {:ok, content} <- read_lines(full_path, start_line, end_line, total) do
+            {:ok, content, total}
+          end
+        else
+          with {:ok, content} <- File.read(full_path) do
+            {:ok, content, line_count(content)}
+          end
+        end
+
+      case result do
+        {:ok, content, total} ->
+          {:ok, %{path: relative_path, content: content, total_lines: total}}
 
         {:error, reason} ->
           {:error, reason}
@@ -75,75 +77,255 @@ defmodule DiwaAgent.CodeBrowser do
   end
 
   @doc """
-  Performs a text search using ripgrep if available.
+  Searches the code under `root_path` for `query` (a regex, case-insensitive
+  unless it contains an uppercase letter), in path order.
+
+  Uses ripgrep when it is installed, streaming its output through a Port
+  and stopping as soon as the requested page is complete; otherwise the
+  files from `DiwaAgent.CodeBrowser.FileIndex` are scanned in the BEAM.
+
+  Options: `:file_pattern` (glob), `:limit` (default 50), `:offset`,
+  `:timeout` in ms (default 10s) after which the matches found so far are
+  returned with `timed_out: true`, and `:engine` (`:ripgrep` or `:index`)
+  to force one search engine.
+
+  Returns `{:ok, %{matches: [...], next_offset: integer | nil, timed_out:
+  boolean, engine: :ripgrep | :index}}`.
   """
   def search_code(root_path, query, opts \\ []) do
-    # Check if rg is available
-    case System.find_executable("rg") do
+    limit = opts[:limit] || @default_search_limit
+    offset = opts[:offset] || 0
+    # One extra match tells whether there is a next page
+    wanted = offset + limit + 1
+    timeout = opts[:timeout] || @default_search_timeout_ms
+    deadline = System.monotonic_time(:millisecond) + timeout
+
+    rg = if opts[:engine] != :index, do: System.find_executable("rg")
+
+    result =
+      case rg do
+        nil -> search_index(root_path, query, opts[:file_pattern], wanted, deadline)
+        rg -> search_ripgrep(rg, root_path, query, opts[:file_pattern], wanted, deadline)
+      end
+
+    with {:ok, matches, engine, timed_out} <- result do
+      page = matches |> Enum.drop(offset) |> Enum.take(limit)
+
+      {:ok,
+       %{
+         matches: page,
+         next_offset: if(length(matches) == wanted, do: offset + limit),
+         timed_out: timed_out,
+         engine: engine
+       }}
+    end
+  end
+
+  # Ripgrep
+
+  defp search_ripgrep(rg, root_path, query, file_pattern, wanted, deadline) do
+    # --sort path keeps pages stable between calls
+    args = ["--json", "--sort", "path", "--smart-case"]
+    args = if file_pattern, do: args ++ ["-g", file_pattern], else: args
+    args = args ++ ["--", query, root_path]
+
+    port =
+      Port.open({:spawn_executable, rg}, [
+        :binary,
+        :exit_status,
+        :use_stdio,
+        {:line, 65_536},
+        args: args
+      ])
+
+    collect_ripgrep(port, root_path, wanted, deadline, [], 0, "")
+  end
+
+  defp collect_ripgrep(port, _root_path, wanted, _deadline, acc, wanted, _partial) do
+    stop_port(port)
+    {:ok, Enum.reverse(acc), :ripgrep, false}
+  end
+
+  defp collect_ripgrep(port, root_path, wanted, deadline, acc, count, partial) do
+    remaining = max(deadline - System.monotonic_time(:millisecond), 0)
+
+    receive do
+      {^port, {:data, {:noeol, chunk}}} ->
+        collect_ripgrep(port, root_path, wanted, deadline, acc, count, partial <> chunk)
+
+      {^port, {:data, {:eol, chunk}}} ->
+        {acc, count} =
+          case parse_rg_line(partial <> chunk, root_path) do
+            nil -> {acc, count}
+            match -> {[match | acc], count + 1}
+          end
+
+        collect_ripgrep(port, root_path, wanted, deadline, acc, count, "")
+
+      {^port, {:exit_status, status}} when status in [0, 1] or count > 0 ->
+        {:ok, Enum.reverse(acc), :ripgrep, false}
+
+      {^port, {:exit_status, status}} ->
+        {:error, {:ripgrep_failed, status}}
+    after
+      remaining ->
+        stop_port(port)
+        {:ok, Enum.reverse(acc), :ripgrep, true}
+    end
+  end
+
+  # Closing the port alone only stops rg at its next write
+  defp stop_port(port) do
+    case Port.info(port, :os_pid) do
+      {:os_pid, os_pid} ->
+        Port.close(port)
+        System.cmd("kill", ["-TERM", Integer.to_string(os_pid)], stderr_to_stdout: true)
+
       nil ->
-        {:error, :ripgrep_not_found}
+        :ok
+    end
+
+    # Drop anything the port delivered before it closed
+    flush_port(port)
+  end
+
+  defp flush_port(port) do
+    receive do
+      {^port, _} -> flush_port(port)
+    after
+      0 -> :ok
+    end
+  end
+
+  defp parse_rg_line(line, root_path) do
+    case Jason.decode(line) do
+      {:ok, %{"type" => "match", "data" => data}} ->
+        %{
+          path: Path.relative_to(data["path"]["text"], root_path),
+          line: data["line_number"],
+          column: data["submatches"] |> List.first() |> Map.get("start"),
+          content: data["lines"]["text"] |> String.trim()
+        }
+
+      _ ->
+        nil
+    end
+  end
 
-      _rg_path ->
-        args = ["--json", "--column", "--line-number", "--no-heading", "--smart-case"]
+  # Pure-BEAM fallback over the file index
 
-        args = if pattern = opts[:file_pattern], do: args ++ ["-g", pattern], else: args
-        args = args ++ [query, root_path]
+  defp search_index(root_path, query, file_pattern, wanted, deadline) do
+    caseless = if query =~ ~r/[A-Z]/, do: [], else: [:caseless]
 
-        case System.cmd("rg", args) do
-          {output, 0} ->
-            results = parse_rg_json(output, root_path)
-            {:ok, results}
+    case Regex.compile(query, caseless) do
+      {:ok, regex} ->
+        candidates = if literal?(query), do: FileIndex.candidates(root_path, query), else: :all
+        glob = file_pattern && glob_regex(file_pattern)
 
-          {_output, 1} ->
-            # No matches
-            {:ok, []}
+        root_path
+        |> FileIndex.files()
+        |> Enum.filter(fn {path, size, _mtime} ->
+          size <= @max_search_file_bytes and
+            (candidates == :all or MapSet.member?(candidates, path)) and
+            (glob == nil or glob_match?(glob, file_pattern, path))
+        end)
+        |> Enum.reduce_while({[], 0}, fn {path, _size, _mtime}, {acc, count} ->
+          cond do
+            count >= wanted ->
+              {:halt, {acc, count}}
 
-          {error, _} ->
-            {:error, error}
+            System.monotonic_time(:millisecond) > deadline ->
+              {:halt, {acc, :timed_out}}
+
+            true ->
+              found = scan_file(Path.join(root_path, path), path, regex, wanted - count)
+              {:cont, {Enum.reverse(found, acc), count + length(found)}}
+          end
+        end)
+        |> case do
+          {acc, :timed_out} -> {:ok, Enum.reverse(acc), :index, true}
+          {acc, _count} -> {:ok, Enum.reverse(acc), :index, false}
         end
+
+      {:error, {reason, _at}} ->
+        {:error, {:invalid_pattern, to_string(reason)}}
     end
   end
 
-  # Helpers
+  defp scan_file(full_path, path, regex, max) do
+    with {:ok, content} <- File.read(full_path),
+         # Binary files are skipped, as ripgrep does
+         false <- String.contains?(content, <<0>>) do
+      content
+      |> String.split(["\n", "\r\n"])
+      |> Stream.with_index(1)
+      |> Stream.flat_map(fn {line, number} ->
+        case Regex.run(regex, line, return: :index) do
+          [{column, _length} | _] ->
+            [%{path: path, line: number, column: column, content: String.trim(line)}]
+
+          nil ->
+            []
+        end
+      end)
+      |> Enum.take(max)
+    else
+      _ -> []
+    end
+  end
+
+  defp literal?(query), do: not String.match?(query, ~r/[.^$*+?()\[\]{}|\\]/)
+
+  # ripgrep -g semantics for the common cases: a pattern without "/" matches
+  # the file name, otherwise the relative path; *, **, ? and {a,b}
+  defp glob_regex(pattern) do
+    source =
+      pattern
+      |> String.trim_leading("/")
+      |> Regex.escape()
+      |> String.replace("\\*\\*/", "(.*/)?")
+      |> String.replace("\\*\\*", ".*")
+      |> String.replace("\\*", "[^/]*")
+      |> String.replace("\\?", "[^/]")
+      |> String.replace(~r/\\\{([^}]*)\\\}/, fn group ->
+        alternatives = group |> String.slice(2..-3//1) |> String.split(",")
+        "(" <> Enum.join(alternatives, "|") <> ")"
+      end)
 
-  defp ignored?(name) do
-    Enum.any?(@default_ignored, &(&1 == name))
+    Regex.compile!("^" <> source <> "$")
   end
 
+  defp glob_match?(glob, pattern, path) do
+    subject = if String.contains?(pattern, "/"), do: path, else: Path.basename(path)
+    Regex.match?(glob, subject)
+  end
+
+  # Helpers
+
   defp line_count(content) do
     content |> String.split(["\n", "\r\n"]) |> Enum.count()
   end
 
-  defp extract_lines(content, start_line, end_line) do
-    lines = String.split(content, ["\n", "\r\n"])
-    total = length(lines)
-
+  # Same slice as splitting the whole file, without holding it in memory
+  defp read_lines(full_path, start_line, end_line, total) do
     start_idx = max(0, (start_line || 1) - 1)
     end_idx = min(total - 1, (end_line || total) - 1)
 
-    lines
-    |> Enum.slice(start_idx..end_idx)
-    |> Enum.join("\n")
-  end
-
-  defp parse_rg_json(output, root_path) do
-    output
-    |> String.split("\n", trim: true)
-    |> Enum.flat_map(fn line ->
-      case Jason.decode(line) do
-        {:ok, %{"type" => "match", "data" => data}} ->
-          [
-            %{
-              path: Path.relative_to(data["path"]["text"], root_path),
-              line: data["line_number"],
-              column: data["submatches"] |> List.first() |> Map.get("start"),
-              content: data["lines"]["text"] |> String.trim()
-            }
-          ]
+    if end_idx < start_idx do
+      {:ok, ""}
+    else
+      content =
+        full_path
+        |> File.stream!()
+        |> Stream.drop(start_idx)
+        |> Stream.take(end_idx - start_idx + 1)
+        |> Enum.map_join("\n", fn line ->
+          line |> String.replace_suffix("\r\n", "") |> String.replace_suffix("\n", "")
+        end)
 
-        _ ->
-          []
-      end
-    end)
+      {:ok, content}
+    end
+  rescue
+    e in File.Error -> {:error, e.reason}
   end
 end
@@ -0,0 +1,342 @@
+defmodule DiwaAgent.CodeBrowser.FileIndex do
+  @moduledoc """
+  Cached view of a workspace tree for `DiwaAgent.CodeBrowser`.
+
+  Rows live in a public ETS table keyed by workspace root, so each context's
+  project is indexed once and read from the calling process:
+
+    * directory listings, re-read only when the directory's mtime changes
+      (entries modified within the last second are always re-read);
+    * file paths with size and mtime, refreshed by a walk that reuses the
+      cached listings and at most every `:refresh_ms` (default 5s);
+    * line counts, cached per file size and mtime;
+    * optionally (`trigrams: true`) trigram postings of small text files,
+      updated only for files whose size or mtime changed, which narrow the
+      files the pure-BEAM search fallback has to read.
+
+  Without the table (the server is not running) every call goes to the
+  filesystem directly.
+
+      config :diwa_agent, DiwaAgent.CodeBrowser.FileIndex,
+        refresh_ms: 5_000,
+        trigrams: false,
+        max_trigram_file_bytes: 262_144
+  """
+
+  use GenServer
+  require Logger
+
+  @table :diwa_file_index
+  @default_refresh_ms 5_000
+  @default_max_trigram_file_bytes 262_144
+
+  @ignored ~w(node_modules _build deps .git .elixir_ls .vscode .idea .agent .cursor .gemini)
+
+  def start_link(opts \\ []) do
+    GenServer.start_link(__MODULE__, opts, name: __MODULE__)
+  end
+
+  @doc """
+  Entries of `dir` (an absolute path) as `{name, :directory | :file}`,
+  ignored names excluded.
+  """
+  def list_dir(dir) do
+    with {:ok, %File.Stat{type: :directory, mtime: mtime}} <- File.stat(dir, time: :posix) do
+      if enabled?() do
+        case :ets.lookup(@table, {:dir, dir}) do
+          [{_, ^mtime, entries}] ->
+            {:ok, entries}
+
+          _ ->
+            with {:ok, entries} <- read_dir(dir) do
+              if settled?(mtime), do: :ets.insert(@table, {{:dir, dir}, mtime, entries})
+              {:ok, entries}
+            end
+        end
+      else
+        read_dir(dir)
+      end
+    else
+      {:ok, %File.Stat{}} -> {:error, :not_a_directory}
+      {:error, :enoent} -> {:error, :not_a_directory}
+      {:error, reason} -> {:error, reason}
+    end
+  end
+
+  @doc """
+  Files under `root` as `{relative_path, size, mtime}`, sorted by path.
+  """
+  def files(root) do
+    root = Path.expand(root)
+
+    if enabled?() do
+      GenServer.call(__MODULE__, {:refresh, root}, :infinity)
+
+      @table
+      |> :ets.match({{:file, root, :"$1"}, :"$2", :"$3"})
+      |> Enum.map(fn [path, size, mtime] -> {path, size, mtime} end)
+      |> Enum.sort()
+    else
+      root |> walk(fn dir -> read_dir(dir) end) |> Enum.sort()
+    end
+  end
+
+  @doc """
+  Number of lines in `path` (an absolute path), counted like
+  `String.split(content, ["\\n", "\\r\\n"])`.
+  """
+  def line_count(path) do
+    with {:ok, %File.Stat{size: size, mtime: mtime}} <- File.stat(path, time: :posix) do
+      if enabled?() do
+        case :ets.lookup(@table, {:lines, path}) do
+          [{_, ^size, ^mtime, count}] ->
+            {:ok, count}
+
+          _ ->
+            with {:ok, count} <- count_lines(path) do
+              if settled?(mtime), do: :ets.insert(@table, {{:lines, path}, size, mtime, count})
+              {:ok, count}
+            end
+        end
+      else
+        count_lines(path)
+      end
+    end
+  end
+
+  @doc """
+  Relative paths under `root` that may contain `literal` (case-insensitive):
+  the trigram postings plus files too large to index. `:all` when they
+  cannot narrow the search (trigrams disabled, or fewer than 3 characters).
+  """
+  def candidates(root, literal) do
+    root = Path.expand(root)
+    grams = literal |> ascii_downcase() |> trigrams()
+
+    if enabled?() and config(:trigrams, false) and grams != [] do
+      GenServer.call(__MODULE__, {:refresh, root}, :infinity)
+
+      grams
+      |> Enum.map(fn gram ->
+        case :ets.lookup(@table, {:gram, root, gram}) do
+          [{_, paths}] -> paths
+          [] -> MapSet.new()
+        end
+      end)
+      |> Enum.reduce(&MapSet.intersection/2)
+      |> MapSet.union(
+        MapSet.new(:ets.match(@table, {{:grams, root, :"$1"}, :unindexed}), &hd/1)
+      )
+    else
+      :all
+    end
+  end
+
+  @doc """
+  Forget everything indexed under `root`.
+  """
+  def invalidate(root) do
+    if enabled?(), do: GenServer.call(__MODULE__, {:invalidate, Path.expand(root)})
+    :ok
+  end
+
+  # Server
+
+  @impl true
+  def init(_opts) do
+    :ets.new(@table, [:named_table, :public, :set, read_concurrency: true])
+    {:ok, %{}}
+  end
+
+  @impl true
+  def handle_call({:refresh, root}, _from, refreshed) do
+    now = System.monotonic_time(:millisecond)
+    refresh_ms = config(:refresh_ms, @default_refresh_ms)
+
+    refreshed =
+      case Map.get(refreshed, root) do
+        at when is_integer(at) and now - at < refresh_ms ->
+          refreshed
+
+        _ ->
+          refresh(root)
+          Map.put(refreshed, root, System.monotonic_time(:millisecond))
+      end
+
+    {:reply, :ok, refreshed}
+  end
+
+  def handle_call({:invalidate, root}, _from, refreshed) do
+    for key <- [{:file, root, :_}, {:grams, root, :_}, {:gram, root, :_}] do
+      :ets.match_delete(@table, {key, :_, :_})
+      :ets.match_delete(@table, {key, :_})
+    end
+
+    # Listings under the root (and any sibling sharing its prefix) are re-read
+    :ets.select_delete(@table, [
+      {{{:dir, :"$1"}, :_, :_}, [{:==, {:binary_part, :"$1", 0, byte_size(root)}, root}],
+       [true]}
+    ])
+
+    {:reply, :ok, Map.delete(refreshed, root)}
+  end
+
+  # One walk of the tree: changed files are updated, vanished ones removed
+  defp refresh(root) do
+    started = System.monotonic_time(:millisecond)
+    trigrams? = config(:trigrams, false)
+
+    indexed =
+      @table
+      |> :ets.match({{:file, root, :"$1"}, :"$2", :"$3"})
+      |> Map.new(fn [path, size, mtime] -> {path, {size, mtime}} end)
+
+    current = walk(root, &list_dir/1)
+
+    changed =
+      Enum.filter(current, fn {path, size, mtime} ->
+        Map.get(indexed, path) != {size, mtime} or not settled?(mtime)
+      end)
+
+    present = MapSet.new(current, fn {path, _size, _mtime} -> path end)
+    removed = indexed |> Map.keys() |> Enum.reject(&MapSet.member?(present, &1))
+
+    Enum.each(removed, fn path ->
+      :ets.delete(@table, {:file, root, path})
+      if trigrams?, do: remove_postings(root, path)
+    end)
+
+    Enum.each(changed, fn {path, size, mtime} ->
+      :ets.insert(@table, {{:file, root, path}, size, mtime})
+
+      if trigrams? do
+        remove_postings(root, path)
+        add_postings(root, path, size)
+      end
+    end)
+
+    Logger.debug(
+      "[DiwaAgent.CodeBrowser.FileIndex] #{root}: #{length(current)} files, " <>
+        "#{length(changed)} changed, #{length(removed)} removed in " <>
+        "#{System.monotonic_time(:millisecond) - started}ms"
+    )
+  end
+
+  # Files too large to index are marked so searches still read them
+  defp add_postings(root, path, size) do
+    if size > config(:max_trigram_file_bytes, @default_max_trigram_file_bytes) do
+      :ets.insert(@table, {{:grams, root, path}, :unindexed})
+    else
+      with {:ok, content} <- File.read(Path.join(root, path)),
+           false <- String.contains?(content, <<0>>) do
+        grams = content |> ascii_downcase() |> trigrams()
+        :ets.insert(@table, {{:grams, root, path}, grams})
+
+        Enum.each(grams, fn gram ->
+          paths =
+            case :ets.lookup(@table, {:gram, root, gram}) do
+              [{_, paths}] -> paths
+              [] -> MapSet.new()
+            end
+
+          :ets.insert(@table, {{:gram, root, gram}, MapSet.put(paths, path)})
+        end)
+      end
+    end
+  end
+
+  defp remove_postings(root, path) do
+    case :ets.lookup(@table, {:grams, root, path}) do
+      [{_, :unindexed}] ->
+        :ets.delete(@table, {:grams, root, path})
+
+      [{_, grams}] ->
+        Enum.each(grams, fn gram ->
+          case :ets.lookup(@table, {:gram, root, gram}) do
+            [{key, paths}] -> :ets.insert(@table, {key, MapSet.delete(paths, path)})
+            [] -> :ok
+          end
+        end)
+
+        :ets.delete(@table, {:grams, root, path})
+
+      [] ->
+        :ok
+    end
+  end
+
+  # Helpers
+
+  # Symlinked directories are listed but not descended into, to avoid cycles
+  defp walk(root, list) do
+    walk(root, ".", list)
+  end
+
+  defp walk(root, rel, list) do
+    dir = if rel == ".", do: root, else: Path.join(root, rel)
+
+    case list.(dir) do
+      {:ok, entries} ->
+        Enum.flat_map(entries, fn {name, type} ->
+          path = if rel == ".", do: name, else: Path.join(rel, name)
+          full = Path.join(root, path)
+
+          case {type, File.lstat(full, time: :posix)} do
+            {:directory, {:ok, %File.Stat{type: :directory}}} -> walk(root, path, list)
+            {:file, {:ok, %File.Stat{type: :regular, size: s, mtime: m}}} -> [{path, s, m}]
+            _ -> []
+          end
+        end)
+
+      {:error, _} ->
+        []
+    end
+  end
+
+  defp read_dir(dir) do
+    with {:ok, names} <- File.ls(dir) do
+      entries =
+        names
+        |> Enum.reject(&ignored?/1)
+        |> Enum.map(fn name ->
+          type = if File.dir?(Path.join(dir, name)), do: :directory, else: :file
+          {name, type}
+        end)
+
+      {:ok, entries}
+    end
+  end
+
+  defp count_lines(path) do
+    File.open(path, [:read, :binary], fn file ->
+      file
+      |> IO.binstream(65_536)
+      |> Enum.reduce(1, fn chunk, count -> count + length(:binary.matches(chunk, "\n")) end)
+    end)
+  end
+
+  defp trigrams(text) when byte_size(text) < 3, do: []
+
+  defp trigrams(text) do
+    for i <- 0..(byte_size(text) - 3), uniq: true, do: binary_part(text, i, 3)
+  end
+
+  # Byte-wise, so non-UTF-8 files index without raising
+  defp ascii_downcase(text) do
+    for <<c <- text>>, into: "", do: <<if(c in ?A..?Z, do: c + 32, else: c)>>
+  end
+
+  defp ignored?(name), do: name in @ignored
+
+  # mtimes have one-second resolution: anything modified within the last
+  # second may change again unnoticed, so it is not trusted as a cache key
+  defp settled?(mtime), do: mtime < System.os_time(:second) - 1
+
+  defp enabled?, do: :ets.whereis(@table) != :undefined
+
+  defp config(key, default) do
+    :diwa_agent
+    |> Application.get_env(__MODULE__, [])
+    |> Keyword.get(key, default)
+  end
+end
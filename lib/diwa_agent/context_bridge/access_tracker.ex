@@ -0,0 +1,233 @@
+defmodule DiwaAgent.ContextBridge.AccessTracker do
+  @moduledoc """
+  Write-behind memory access tracking.
+
+  `record/1` only bumps a counter in a public ETS table, so reads stay
+  read-only. Every `:flush_interval_ms` (default 30s), or once
+  `:max_pending` memories (default 5_000) have pending counts, the counters
+  are taken from the table and applied in batches of `:batch_size`
+  (default 500), each in one transaction:
+
+    * `occurrence_count` is incremented and `last_accessed_at` set with one
+      `update_all` per distinct increment in the batch;
+    * ephemeral memories of the batch whose count now exceeds
+      10 are promoted to the project lifecycle with one more `update_all`.
+
+  Each flush emits `[:diwa_agent, :lifecycle, :flush]` with `rows`,
+  `promoted` and `lag_ms` (age of the oldest access applied) measurements;
+  `stats/0` returns the totals.
+
+      config :diwa_agent, DiwaAgent.ContextBridge.AccessTracker,
+        flush_interval_ms: 30_000,
+        max_pending: 5_000,
+        batch_size: 500
+  """
+
+  use GenServer
+  require Logger
+  import Ecto.Query
+  alias DiwaAgent.Repo
+  alias DiwaSchema.Core.Memory
+
+  @table :diwa_access_counts
+  @default_flush_interval_ms 30_000
+  @default_max_pending 5_000
+  @default_batch_size 500
+  # Accesses after which an ephemeral memory becomes a project memory
+  @promotion_threshold 10
+
+  def start_link(opts \\ []) do
+    GenServer.start_link(__MODULE__, opts, name: __MODULE__)
+  end
+
+  @doc """
+  Count one access to each of `memory_ids`. Never touches the database.
+  """
+  def record(memory_ids) when is_list(memory_ids) do
+    if :ets.whereis(@table) != :undefined do
+      now = System.system_time(:millisecond)
+
+      Enum.each(memory_ids, fn id ->
+        # {id, count, first access, last access}
+        :ets.update_counter(@table, id, {2, 1}, {id, 0, now, now})
+        :ets.update_element(@table, id, {4, now})
+      end)
+
+      if :ets.info(@table, :size) >= config(:max_pending, @default_max_pending) do
+        GenServer.cast(__MODULE__, :flush)
+      end
+    end
+
+    :ok
+  end
+
+  def record(memory_id), do: record([memory_id])
+
+  @doc """
+  Apply all pending counts now. Returns the number of memories updated.
+  """
+  def flush, do: GenServer.call(__MODULE__, :flush, :infinity)
+
+  @doc """
+  Totals since start: `flushes`, `rows`, `promoted` and the last `lag_ms`.
+  """
+  def stats, do: GenServer.call(__MODULE__, :stats)
+
+  @doc """
+  Threshold above which an ephemeral memory is promoted to the project
+  lifecycle.
+  """
+  def promotion_threshold, do: @promotion_threshold
+
+  # Server
+
+  @impl true
+  def init(_opts) do
+    # Flush pending counts on shutdown
+    Process.flag(:trap_exit, true)
+    :ets.new(@table, [:named_table, :public, :set, write_concurrency: true])
+    schedule_flush()
+    {:ok, %{flushes: 0, rows: 0, promoted: 0, lag_ms: 0}}
+  end
+
+  @impl true
+  def handle_call(:flush, _from, stats) do
+    {rows, stats} = do_flush(stats)
+    {:reply, {:ok, rows}, stats}
+  end
+
+  def handle_call(:stats, _from, stats), do: {:reply, stats, stats}
+
+  @impl true
+  def handle_cast(:flush, stats) do
+    {_rows, stats} = do_flush(stats)
+    {:noreply, stats}
+  end
+
+  @impl true
+  def handle_info(:flush, stats) do
+    {_rows, stats} = do_flush(stats)
+    schedule_flush()
+    {:noreply, stats}
+  end
+
+  @impl true
+  def terminate(_reason, stats) do
+    do_flush(stats)
+    :ok
+  end
+
+  defp do_flush(stats) do
+    # take/2 removes each row atomically; accesses recorded meanwhile start
+    # a new row and wait for the next flush
+    pending =
+      @table
+      |> :ets.select([{{:"$1", :_, :_, :_}, [], [:"$1"]}])
+      |> Enum.flat_map(&:ets.take(@table, &1))
+
+    if pending == [] do
+      {0, stats}
+    else
+      now = System.system_time(:millisecond)
+      lag_ms = now - (pending |> Enum.map(&elem(&1, 2)) |> Enum.min())
+
+      {rows, promoted} =
+        pending
+        |> Enum.chunk_every(config(:batch_size, @default_batch_size))
+        |> Enum.reduce({0, 0}, fn batch, {rows, promoted} ->
+          case apply_batch(batch) do
+            {:ok, {batch_rows, batch_promoted}} ->
+              {rows + batch_rows, promoted + batch_promoted}
+
+            {:error, reason} ->
+              Logger.error("[DiwaAgent.AccessTracker] Flush failed: #{inspect(reason)}")
+              {rows, promoted}
+          end
+        end)
+
+      DiwaAgent.Telemetry.execute(
+        [:diwa_agent, :lifecycle, :flush],
+        %{rows: rows, promoted: promoted, lag_ms: lag_ms}
+      )
+
+      Logger.debug(
+        "[DiwaAgent.AccessTracker] Flushed #{rows} memories " <>
+          "(#{promoted} promoted, lag #{lag_ms}ms)"
+      )
+
+      {rows,
+       %{
+         stats
+         | flushes: stats.flushes + 1,
+           rows: stats.rows + rows,
+           promoted: stats.promoted + promoted,
+           lag_ms: lag_ms
+       }}
+    end
+  end
+
+  defp apply_batch(batch) do
+    Repo.transaction(fn ->
+      rows =
+        batch
+        |> Enum.group_by(fn {_id, count, _first, _last} -> count end)
+        |> Enum.map(fn {count, entries} ->
+          ids = Enum.map(entries, &elem(&1, 0))
+          last = entries |> Enum.map(&elem(&1, 3)) |> Enum.max() |> timestamp()
+
+          {updated, _} =
+            Repo.update_all(
+              from(m in Memory,
+                where: m.id in ^ids,
+                update: [
+                  set: [
+                    occurrence_count: fragment("COALESCE(?, 0) + ?", m.occurrence_count, ^count),
+                    last_accessed_at: ^last
+                  ]
+                ]
+              ),
+              []
+            )
+
+          updated
+        end)
+        |> Enum.sum()
+
+      ids = Enum.map(batch, &elem(&1, 0))
+
+      {promoted, _} =
+        Repo.update_all(
+          from(m in Memory,
+            where: m.id in ^ids,
+            where: m.lifecycle == "ephemeral",
+            where: m.occurrence_count > @promotion_threshold
+          ),
+          set: [lifecycle: "project"]
+        )
+
+      {rows, promoted}
+    end)
+  end
+
+  # In the type of the schema field, as update_all does not cast
+  defp timestamp(ms) do
+    at = DateTime.from_unix!(ms, :millisecond)
+
+    case Memory.__schema__(:type, :last_accessed_at) do
+      :utc_datetime -> DateTime.truncate(at, :second)
+      :naive_datetime -> at |> DateTime.to_naive() |> NaiveDateTime.truncate(:second)
+      :naive_datetime_usec -> DateTime.to_naive(at)
+      _ -> at
+    end
+  end
+
+  defp schedule_flush do
+    Process.send_after(self(), :flush, config(:flush_interval_ms, @default_flush_interval_ms))
+  end
+
+  defp config(key, default) do
+    :diwa_agent
+    |> Application.get_env(__MODULE__, [])
+    |> Keyword.get(key, default)
+  end
+end
@@ -4,7 +4,7 @@ defmodule DiwaAgent.ContextBridge.Hydration do
   Handles intelligent context retrieval within token budgets and focus areas.
   """
 
-  alias DiwaAgent.Storage.Memory
+  alias DiwaAgent.Storage.{HotCache, Memory}
   require Logger
 
   @doc """
@@ -41,25 +41,16 @@ defmodule DiwaAgent.ContextBridge.Hydration do
      }}
   end
 
-  defp get_latest_handoff(context_id) do
-    case Memory.list_by_type(context_id, "handoff") do
-      {:ok, [latest | _]} -> latest
-      _ -> nil
-    end
-  end
+  defp get_latest_handoff(context_id), do: HotCache.latest_handoff(context_id)
 
   defp get_active_blockers(context_id) do
     # Filter for active blockers in metadata
-    case Memory.list_by_type(context_id, "blocker") do
-      {:ok, blockers} ->
-        Enum.filter(blockers, fn b ->
-          meta = if is_binary(b.metadata), do: Jason.decode!(b.metadata), else: b.metadata
-          meta["status"] == "active"
-        end)
-
-      _ ->
-        []
-    end
+    context_id
+    |> HotCache.blockers()
+    |> Enum.filter(fn b ->
+      meta = if is_binary(b.metadata), do: Jason.decode!(b.metadata), else: b.metadata
+      meta["status"] == "active"
+    end)
   end
 
   defp get_relevant_context(context_id, focus, depth) do
@@ -0,0 +1,30 @@
+defmodule DiwaAgent.ContextBridge.IngestFileState do
+  @moduledoc """
+  Last-seen mtime, size and content hash of an ingested file, and the memory
+  it was stored as. Maintained by `DiwaAgent.ContextBridge.Ingestor`.
+  """
+
+  use Ecto.Schema
+  import Ecto.Changeset
+
+  @primary_key {:id, :binary_id, autogenerate: true}
+  @foreign_key_type :binary_id
+
+  schema "ingest_file_states" do
+    field(:context_id, :binary_id)
+    field(:memory_id, :binary_id)
+    field(:job_id, :binary_id)
+    field(:path, :string)
+    field(:mtime, :integer)
+    field(:size, :integer)
+    field(:content_hash, :string)
+
+    timestamps()
+  end
+
+  def changeset(state, attrs) do
+    state
+    |> cast(attrs, [:context_id, :memory_id, :job_id, :path, :mtime, :size, :content_hash])
+    |> validate_required([:context_id, :path, :mtime, :size, :content_hash])
+  end
+end
@@ -1,33 +1,87 @@
 defmodule DiwaAgent.ContextBridge.Ingestor do
   @moduledoc """
   Advanced Project Context Ingestor.
-  Scans project directories (.agent, .cursor, etc.), classifies files, 
-  and persists them as memories. Tracks progress via IngestJobs.
+  Scans project directories (.agent, .cursor, etc.) recursively, classifies
+  files, and persists them as memories. Tracks progress via IngestJobs.
+
+  Ingestion is incremental. The mtime, size and content hash of every
+  ingested file are kept in `ingest_file_states`, so later runs:
+
+    * skip files whose mtime and size are unchanged, without reading them;
+    * update the memory of a file whose content changed (recording a version);
+    * soft-delete the memory of a file that disappeared.
+
+  A root or subdirectory that cannot be listed (missing, unreadable) is
+  reported in the job stats as `unlisted_dirs`, and nothing previously
+  ingested under it is deleted.
+
+  Only memories the ingestor created are updated or deleted. A file whose
+  content already exists in the context is recorded without a memory, so it
+  is re-checked on the next run and never takes over the existing memory,
+  which may have been written by a user or ingested from another file.
+
+  New and changed files are read and classified concurrently.
   """
 
   alias DiwaAgent.Repo
   alias DiwaSchema.Team.IngestJob
-  alias DiwaSchema.Core.Memory
-  alias DiwaAgent.ContextBridge.MemoryClassification
+  alias DiwaAgent.Storage.{ContentHash, Memory}
+  alias DiwaAgent.ContextBridge.{IngestFileState, MemoryClassification}
+  import Ecto.Query
   require Logger
 
   @default_dirs [".agent", ".cursor"]
+  @default_extensions [".md"]
+  @default_ignore ~w(node_modules _build deps .git .elixir_ls .vscode .idea)
+  @actor "Ingestor/v2"
+  @read_timeout 30_000
 
   @doc """
   Runs an ingestion job for a context.
+
+  Options:
+    * `:dirs` - roots to scan (default `[".agent", ".cursor"]`)
+    * `:extensions` - file extensions to ingest (default `[".md"]`)
+    * `:ignore` - extra file or directory names to skip while scanning, on
+      top of the defaults and the configured `:ignore` list
+    * `:max_concurrency` - parallel reads (default `System.schedulers_online/0`)
   """
   def run(context_id, opts \\ []) do
     dirs = opts[:dirs] || @default_dirs
 
     {:ok, job} = create_job(context_id, opts)
+    started = System.monotonic_time(:millisecond)
 
     try do
+      entries = Enum.flat_map(dirs, &scan_directory(&1, opts))
+      files = for {:file, file} <- entries, do: file
+      unlisted = for {:unlisted, dir} <- entries, do: dir
+      known = load_states(context_id)
+
+      {unchanged, candidates} = Enum.split_with(files, &unchanged?(&1, known))
+      mark_seen(context_id, unchanged, job)
+
+      {read, unreadable} = read_files(candidates, opts)
+
       results =
-        dirs
-        |> Enum.flat_map(fn dir -> scan_directory(dir) end)
-        |> Enum.map(fn file_path -> ingest_file(context_id, file_path) end)
+        Enum.map(unchanged, &{:ok, :skipped, &1.path}) ++
+          Enum.map(unreadable, &{:error, :failed, &1}) ++
+          ingest_files(context_id, read, known, job) ++
+          remove_missing(context_id, dirs, files, known, unlisted)
+
+      elapsed = System.monotonic_time(:millisecond) - started
+
+      stats =
+        results
+        |> summarize()
+        |> Map.merge(%{
+          files: length(files),
+          unlisted_dirs: unlisted,
+          bytes_read: Enum.reduce(read, 0, &(&1.size + &2)),
+          duration_ms: elapsed,
+          files_per_sec: Float.round(length(files) * 1000 / max(elapsed, 1), 1)
+        })
 
-      stats = summarize(results)
       update_job(job, %{status: "completed", stats: stats})
       {:ok, stats}
     rescue
@@ -58,70 +112,252 @@ defmodule DiwaAgent.ContextBridge.Ingestor do
     |> Repo.update()
   end
 
-  defp scan_directory(dir) do
-    if File.dir?(dir) do
-      File.ls!(dir)
-      |> Enum.map(fn f -> Path.join(dir, f) end)
-      |> Enum.filter(fn path -> !File.dir?(path) && String.ends_with?(path, ".md") end)
+  # Scanning
+
+  defp scan_directory(dir, opts) do
+    ignore = @default_ignore ++ config(:ignore, []) ++ (opts[:ignore] || [])
+    extensions = opts[:extensions] || @default_extensions
+    walk(dir, ignore, extensions)
+  end
+
+  # {:file, entry} per matching file and {:unlisted, dir} per directory
+  # that could not be listed
+  defp walk(dir, ignore, extensions) do
+    case File.ls(dir) do
+      {:ok, names} ->
+        names
+        |> Enum.reject(&(&1 in ignore))
+        |> Enum.sort()
+        |> Enum.flat_map(fn name ->
+          path = Path.join(dir, name)
+
+          # lstat: symlinked directories are not followed (no cycles)
+          case File.lstat(path, time: :posix) do
+            {:ok, %File.Stat{type: :directory}} ->
+              walk(path, ignore, extensions)
+
+            {:ok, %File.Stat{type: type}} when type in [:regular, :symlink] ->
+              file_entry(path, extensions)
+
+            _ ->
+              []
+          end
+        end)
+
+      {:error, reason} ->
+        unless reason == :enoent,
+          do: Logger.warning("[DiwaAgent.Ingestor] Cannot list #{dir}: #{inspect(reason)}")
+
+        [{:unlisted, dir}]
+    end
+  end
+
+  defp file_entry(path, extensions) do
+    with true <- Path.extname(path) in extensions,
+         {:ok, %File.Stat{type: :regular} = stat} <- File.stat(path, time: :posix) do
+      [{:file, %{path: path, mtime: stat.mtime, size: stat.size}}]
     else
-      []
+      _ -> []
     end
   end
 
-  defp ingest_file(context_id, path) do
-    content = File.read!(path)
-    filename = Path.basename(path)
+  # Change detection
+
+  defp load_states(context_id) do
+    from(s in IngestFileState, where: s.context_id == ^context_id)
+    |> Repo.all()
+    |> Map.new(&{&1.path, &1})
+  end
 
-    # Module 2 Integration: Automated Classification
-    {:ok, class, priority, lifecycle} = MemoryClassification.classify(content, filename: filename)
+  defp unchanged?(file, known) do
+    case Map.get(known, file.path) do
+      %IngestFileState{memory_id: memory_id, mtime: mtime, size: size} ->
+        memory_id != nil and mtime == file.mtime and size == file.size
 
-    # Simple deduplication check: skip if content already exists in this context
-    # In a real system, we'd use semantic fingerprints or hashes
-    case find_duplicate(context_id, content) do
       nil ->
-        attrs = %{
-          context_id: context_id,
-          content: content,
-          actor: "Ingestor/v2",
-          source: path,
-          memory_class: Atom.to_string(class),
-          priority: Atom.to_string(priority),
-          lifecycle: Atom.to_string(lifecycle),
-          tags: ["ingested", Path.dirname(path)],
-          metadata: %{
-            "original_path" => path,
-            "filename" => filename
-          }
+        false
+    end
+  end
+
+  # Record that this job confirmed the unchanged files
+  defp mark_seen(context_id, files, job) do
+    files
+    |> Enum.map(& &1.path)
+    |> Enum.chunk_every(500)
+    |> Enum.each(fn paths ->
+      from(s in IngestFileState, where: s.context_id == ^context_id and s.path in ^paths)
+      |> Repo.update_all(set: [job_id: job.id])
+    end)
+  end
+
+  defp read_files(files, opts) do
+    files
+    |> Task.async_stream(&read_file/1,
+      max_concurrency: opts[:max_concurrency] || System.schedulers_online(),
+      timeout: @read_timeout,
+      on_timeout: :kill_task
+    )
+    |> Enum.zip(files)
+    |> Enum.reduce({[], []}, fn
+      {{:ok, {:ok, read}}, _file}, {ok, failed} ->
+        {[read | ok], failed}
+
+      {other, file}, {ok, failed} ->
+        Logger.warning("[DiwaAgent.Ingestor] Could not read #{file.path}: #{inspect(other)}")
+        {ok, [file.path | failed]}
+    end)
+    |> then(fn {ok, failed} -> {Enum.reverse(ok), Enum.reverse(failed)} end)
+  end
+
+  defp read_file(file) do
+    with {:ok, content} <- File.read(file.path) do
+      filename = Path.basename(file.path)
+
+      # Module 2 Integration: Automated Classification
+      {:ok, class, priority, lifecycle} =
+        MemoryClassification.classify(content, filename: filename)
+
+      item = %{
+        content: content,
+        actor: @actor,
+        source: file.path,
+        memory_class: Atom.to_string(class),
+        priority: Atom.to_string(priority),
+        lifecycle: Atom.to_string(lifecycle),
+        tags: ["ingested", Path.dirname(file.path)],
+        metadata: %{
+          "original_path" => file.path,
+          "filename" => filename
         }
+      }
+
+      {:ok, Map.merge(file, %{content: content, hash: ContentHash.hash(content), item: item})}
+    end
+  end
+
+  # Persisting
 
-        case %Memory{} |> Memory.changeset(attrs) |> Repo.insert() do
-          {:ok, _} -> {:ok, :created, path}
-          {:error, _} -> {:error, :failed, path}
-        end
+  defp ingest_files(context_id, files, known, job) do
+    {existing, new} =
+      Enum.split_with(files, fn file ->
+        match?(%IngestFileState{memory_id: id} when id != nil, Map.get(known, file.path))
+      end)
 
-      _existing ->
-        {:ok, :skipped, path}
+    Enum.map(existing, &refresh_file(context_id, &1, Map.fetch!(known, &1.path), job)) ++
+      create_files(context_id, new, job)
+  end
+
+  # Touched but identical content: only the stat changed
+  defp refresh_file(context_id, %{hash: hash} = file, %{content_hash: hash} = state, job) do
+    save_state(context_id, file, state.memory_id, job)
+    {:ok, :skipped, file.path}
+  end
+
+  defp refresh_file(context_id, file, state, job) do
+    opts = %{actor: @actor, reason: "Source file changed: #{file.path}"}
+
+    case Memory.update(state.memory_id, file.content, opts) do
+      {:ok, _memory} ->
+        save_state(context_id, file, state.memory_id, job)
+        {:ok, :updated, file.path}
+
+      {:error, :not_found} ->
+        # The memory was removed out from under us: store the file afresh
+        hd(create_files(context_id, [file], job))
+
+      {:error, reason} ->
+        Logger.warning("[DiwaAgent.Ingestor] Update failed for #{file.path}: #{inspect(reason)}")
+        {:error, :failed, file.path}
     end
   end
 
-  defp find_duplicate(context_id, content) do
-    import Ecto.Query
+  defp create_files(_context_id, [], _job), do: []
+
+  # New files go through one bulk write; content already stored in the
+  # context (by fingerprint) is not duplicated, and the file's state records
+  # no memory since the ingestor does not own the existing one
+  defp create_files(context_id, files, job) do
+    case Memory.add_many(context_id, Enum.map(files, & &1.item), skip_duplicates: true) do
+      {:ok, results} ->
+        Enum.zip_with(files, results, fn
+          file, {:ok, memory} ->
+            save_state(context_id, file, memory.id, job)
+            {:ok, :created, file.path}
 
-    query =
-      from(m in Memory,
-        where: m.context_id == ^context_id and m.content == ^content,
-        limit: 1
+          file, {:skipped, _} ->
+            save_state(context_id, file, nil, job)
+            {:ok, :skipped, file.path}
+
+          file, {:error, _} ->
+            {:error, :failed, file.path}
+        end)
+
+      {:error, reason} ->
+        Logger.warning("[DiwaAgent.Ingestor] Bulk insert failed: #{inspect(reason)}")
+        Enum.map(files, &{:error, :failed, &1.path})
+    end
+  end
+
+  # Files previously ingested from the scanned roots that no longer exist,
+  # outside any directory that could not be listed
+  defp remove_missing(context_id, dirs, files, known, unlisted) do
+    present = MapSet.new(files, & &1.path)
+
+    known
+    |> Map.values()
+    |> Enum.filter(fn state ->
+      not MapSet.member?(present, state.path) and Enum.any?(dirs, &under?(state.path, &1)) and
+        not Enum.any?(unlisted, &under?(state.path, &1))
+    end)
+    |> Enum.map(fn state ->
+      if state.memory_id do
+        Memory.delete(state.memory_id, %{
+          actor: @actor,
+          reason: "Source file removed: #{state.path}"
+        })
+      end
+
+      Repo.delete_all(
+        from(s in IngestFileState, where: s.context_id == ^context_id and s.id == ^state.id)
       )
 
-    Repo.one(query)
+      {:ok, :deleted, state.path}
+    end)
+  end
+
+  defp under?(path, dir), do: String.starts_with?(path, String.trim_trailing(dir, "/") <> "/")
+
+  defp save_state(context_id, file, memory_id, job) do
+    %IngestFileState{}
+    |> IngestFileState.changeset(%{
+      context_id: context_id,
+      memory_id: memory_id,
+      job_id: job.id,
+      path: file.path,
+      mtime: file.mtime,
+      size: file.size,
+      content_hash: file.hash
+    })
+    |> Repo.insert(
+      on_conflict: {:replace, [:memory_id, :job_id, :mtime, :size, :content_hash, :updated_at]},
+      conflict_target: [:context_id, :path]
+    )
   end
 
   defp summarize(results) do
     results
-    |> Enum.reduce(%{created: 0, skipped: 0, failed: 0}, fn
+    |> Enum.reduce(%{created: 0, updated: 0, skipped: 0, deleted: 0, failed: 0}, fn
       {:ok, :created, _}, acc -> %{acc | created: acc.created + 1}
+      {:ok, :updated, _}, acc -> %{acc | updated: acc.updated + 1}
       {:ok, :skipped, _}, acc -> %{acc | skipped: acc.skipped + 1}
+      {:ok, :deleted, _}, acc -> %{acc | deleted: acc.deleted + 1}
       {:error, :failed, _}, acc -> %{acc | failed: acc.failed + 1}
     end)
   end
+
+  defp config(key, default) do
+    :diwa_agent
+    |> Application.get_env(__MODULE__, [])
+    |> Keyword.get(key, default)
+  end
 end
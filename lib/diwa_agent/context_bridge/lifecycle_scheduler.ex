@@ -0,0 +1,86 @@
+defmodule DiwaAgent.ContextBridge.LifecycleScheduler do
+  @moduledoc """
+  Periodic memory maintenance, so expiry no longer depends on a client
+  calling `prune_expired_memories`.
+
+  Every `:interval_ms` (default 15 minutes, first run after
+  `:initial_delay_ms`, default 1 minute) it prunes expired memories and
+  promotes frequently accessed ephemeral ones, both in chunks of
+  `:chunk_size` via `DiwaAgent.ContextBridge.MemoryLifecycle`. Each run
+  emits `[:diwa_agent, :lifecycle, :maintenance]` with `pruned`, `promoted`
+  and `duration_ms` measurements; `last_run/0` returns the latest.
+
+      config :diwa_agent, DiwaAgent.ContextBridge.LifecycleScheduler,
+        interval_ms: 900_000,
+        initial_delay_ms: 60_000,
+        chunk_size: 500
+  """
+
+  use GenServer
+  require Logger
+  alias DiwaAgent.ContextBridge.MemoryLifecycle
+
+  @default_interval_ms 900_000
+  @default_initial_delay_ms 60_000
+  @default_chunk_size 500
+
+  def start_link(opts \\ []) do
+    GenServer.start_link(__MODULE__, opts, name: __MODULE__)
+  end
+
+  @doc """
+  Run maintenance now and return its result.
+  """
+  def run_now, do: GenServer.call(__MODULE__, :run, :infinity)
+
+  @doc """
+  Result of the latest run, or nil before the first one.
+  """
+  def last_run, do: GenServer.call(__MODULE__, :last_run)
+
+  @impl true
+  def init(_opts) do
+    Process.send_after(self(), :run, config(:initial_delay_ms, @default_initial_delay_ms))
+    {:ok, %{last_run: nil}}
+  end
+
+  @impl true
+  def handle_call(:run, _from, state) do
+    result = run()
+    {:reply, result, %{state | last_run: result}}
+  end
+
+  def handle_call(:last_run, _from, state), do: {:reply, state.last_run, state}
+
+  @impl true
+  def handle_info(:run, state) do
+    result = run()
+    Process.send_after(self(), :run, config(:interval_ms, @default_interval_ms))
+    {:noreply, %{state | last_run: result}}
+  end
+
+  defp run do
+    started = System.monotonic_time(:millisecond)
+    opts = [chunk_size: config(:chunk_size, @default_chunk_size)]
+
+    {:ok, pruned} = MemoryLifecycle.prune_expired(opts)
+    {:ok, promoted} = MemoryLifecycle.promote_frequent(opts)
+
+    duration_ms = System.monotonic_time(:millisecond) - started
+    result = %{pruned: pruned, promoted: promoted, duration_ms: duration_ms}
+
+    DiwaAgent.Telemetry.execute([:diwa_agent, :lifecycle, :maintenance], result)
+    Logger.debug("[DiwaAgent.LifecycleScheduler] #{inspect(result)}")
+    result
+  rescue
+    e ->
+      Logger.error("[DiwaAgent.LifecycleScheduler] Maintenance failed: #{Exception.message(e)}")
+      {:error, e}
+  end
+
+  defp config(key, default) do
+    :diwa_agent
+    |> Application.get_env(__MODULE__, [])
+    |> Keyword.get(key, default)
+  end
+end
@@ -6,7 +6,7 @@ defmodule DiwaAgent.ContextBridge.LiveSync do
 
   alias DiwaAgent.Repo
   alias DiwaSchema.Team.Session
-  alias DiwaSchema.Core.Memory
+  alias DiwaAgent.Storage.{AfterCommit, Memory}
   alias DiwaAgent.Delegation.Handoff
   require Logger
 
@@ -65,6 +65,10 @@ defmodule DiwaAgent.ContextBridge.LiveSync do
 
   @doc """
   Ends a session and generates a handoff note.
+
+  The note is written through `DiwaAgent.Storage.Memory.add/3`, so it is
+  versioned and embedded like any memory, and cached session-start reads
+  of the context are invalidated once the session is closed.
   """
   def end_session(session_id, summary, next_steps \\ []) do
     case Repo.get(Session, session_id) do
@@ -73,7 +77,7 @@ defmodule DiwaAgent.ContextBridge.LiveSync do
 
       session ->
         # Finalize session
-        Repo.transaction(fn ->
+        AfterCommit.transaction(fn ->
           updated_session =
             session
             |> Session.changeset(%{ended_at: DateTime.utc_now(), summary: summary})
@@ -89,9 +93,7 @@ defmodule DiwaAgent.ContextBridge.LiveSync do
               active_files: session.metadata["active_files"] || []
             })
 
-          memory_attrs = %{
-            context_id: session.context_id,
-            content: summary,
+          memory_opts = %{
             actor: session.actor,
             memory_class: "handoff",
             priority: "high",
@@ -99,11 +101,10 @@ defmodule DiwaAgent.ContextBridge.LiveSync do
             metadata: Handoff.to_metadata(handoff_data)
           }
 
-          %Memory{}
-          |> Memory.changeset(memory_attrs)
-          |> Repo.insert!()
-
-          updated_session
+          case Memory.add(session.context_id, summary, memory_opts) do
+            {:ok, _memory} -> updated_session
+            {:error, reason} -> Repo.rollback(reason)
+          end
         end)
     end
   end
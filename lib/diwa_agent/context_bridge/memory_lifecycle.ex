@@ -2,52 +2,98 @@ defmodule DiwaAgent.ContextBridge.MemoryLifecycle do
   @moduledoc """
   Module 7: MemoryLifecycle
   Handles memory expiration, archival, and importance promotion.
+
+  Maintenance runs in bounded chunks so it never holds the (single SQLite)
+  writer for long; `DiwaAgent.ContextBridge.LifecycleScheduler` runs it
+  periodically. Access counting is write-behind, see
+  `DiwaAgent.ContextBridge.AccessTracker`.
   """
 
+  alias DiwaAgent.ContextBridge.AccessTracker
   alias DiwaAgent.Repo
+  alias DiwaAgent.Storage.HotCache
   alias DiwaSchema.Core.Memory
   import Ecto.Query
   require Logger
 
+  @default_chunk_size 500
+
   @doc """
-  Prunes expired memories across all contexts.
+  Prunes expired memories across all contexts, `:chunk_size` (default
+  #{@default_chunk_size}) per statement.
   """
-  def prune_expired do
+  def prune_expired(opts \\ []) do
     now = DateTime.utc_now()
-    query = from(m in Memory, where: m.expires_at < ^now and is_nil(m.deleted_at))
 
-    {count, _} = Repo.update_all(query, set: [deleted_at: now])
+    select = fn chunk_size ->
+      from(m in Memory,
+        where: m.expires_at < ^now and is_nil(m.deleted_at),
+        select: {m.id, m.context_id},
+        limit: ^chunk_size
+      )
+    end
+
+    update = fn ids ->
+      Repo.update_all(from(m in Memory, where: m.id in ^ids), set: [deleted_at: now])
+    end
+
+    count = in_chunks(select, update, opts)
+
     Logger.info("Pruned #{count} expired memories.")
     {:ok, count}
   end
 
   @doc """
-  Promotes memories based on access frequency.
+  Promotes ephemeral memories accessed more than
+  `AccessTracker.promotion_threshold/0` times to the project lifecycle,
+  `:chunk_size` per statement. The access tracker promotes the memories of
+  each flush itself; this catches counts written by other means.
   """
-  def increment_access(memory_id) do
-    case Repo.get(Memory, memory_id) do
-      nil ->
-        :ok
-
-      memory ->
-        count = (memory.occurrence_count || 0) + 1
-
-        # Simple promotion logic: if accessed > 10 times, upgrade priority or lifecycle
-        updates = %{
-          occurrence_count: count,
-          last_accessed_at: DateTime.utc_now()
-        }
-
-        updates =
-          if count > 10 && memory.lifecycle == "ephemeral" do
-            Map.put(updates, :lifecycle, "project")
-          else
-            updates
-          end
-
-        memory
-        |> Memory.changeset(updates)
-        |> Repo.update()
+  def promote_frequent(opts \\ []) do
+    threshold = AccessTracker.promotion_threshold()
+
+    select = fn chunk_size ->
+      from(m in Memory,
+        where: m.lifecycle == "ephemeral" and m.occurrence_count > ^threshold,
+        where: is_nil(m.deleted_at),
+        select: {m.id, m.context_id},
+        limit: ^chunk_size
+      )
+    end
+
+    update = fn ids ->
+      Repo.update_all(from(m in Memory, where: m.id in ^ids), set: [lifecycle: "project"])
     end
+
+    {:ok, in_chunks(select, update, opts)}
+  end
+
+  @doc """
+  Records an access to a memory (or a list of memories). The count and the
+  promotion are applied by the next `AccessTracker` flush.
+  """
+  def increment_access(memory_id), do: AccessTracker.record(memory_id)
+
+  # Select `{id, context_id}` rows, update them by id, repeat until a chunk
+  # comes back short (or changes nothing). Each chunk is its own transaction.
+  defp in_chunks(select, update, opts) do
+    chunk_size = Keyword.get(opts, :chunk_size, @default_chunk_size)
+
+    Stream.repeatedly(fn ->
+      {:ok, {rows, updated}} =
+        Repo.transaction(fn ->
+          rows = Repo.all(select.(chunk_size))
+          {updated, _} = if rows == [], do: {0, nil}, else: update.(Enum.map(rows, &elem(&1, 0)))
+          {rows, updated}
+        end)
+
+      rows |> Enum.map(&elem(&1, 1)) |> Enum.uniq() |> Enum.each(&HotCache.invalidate/1)
+      {length(rows), updated}
+    end)
+    |> Enum.reduce_while(0, fn {selected, updated}, total ->
+      if selected < chunk_size or updated == 0,
+        do: {:halt, total + updated},
+        else: {:cont, total + updated}
+    end)
   end
 end
@@ -4,9 +4,11 @@ defmodule DiwaAgent.ContextBridge.RuleEnforcement do
   Validates actions and content against recorded system rules and project standards.
   """
 
-  # alias DiwaAgent.Storage.Memory
+  alias DiwaAgent.Storage.Memory
   require Logger
 
+  @rule_classes ["user_rule", "system_instruction"]
+
   @doc """
   Validates a proposed action or content piece against project rules.
   """
@@ -27,23 +29,16 @@ defmodule DiwaAgent.ContextBridge.RuleEnforcement do
     end
   end
 
+  # Memories classified as 'user_rule' or 'system_instruction', or typed
+  # 'rule' in metadata. Two indexed lookups merged here rather than one OR,
+  # which neither index can serve.
   defp get_active_rules(context_id) do
-    # Memories classified as 'user_rule' or 'system_instruction'
-    # For now, we search for 'rule' or use memory_class if implemented
-    # We check both the new memory_class column and metadata
-    import Ecto.Query
-    alias DiwaSchema.Core.Memory, as: MemorySchema
-    alias DiwaAgent.Repo
-
-    query =
-      from(m in MemorySchema,
-        where: m.context_id == ^context_id and is_nil(m.deleted_at),
-        where:
-          m.memory_class in ["user_rule", "system_instruction"] or
-            fragment("json_extract(?, '$.type') = ?", m.metadata, "rule")
-      )
-
-    Repo.all(query)
+    with {:ok, by_class} <- Memory.list_by_class(context_id, @rule_classes),
+         {:ok, by_type} <- Memory.list_by_type(context_id, "rule") do
+      Enum.uniq_by(by_class ++ by_type, & &1.id)
+    else
+      _ -> []
+    end
   end
 
   defp check_rule(rule, content) do
@@ -2,6 +2,11 @@ defmodule DiwaAgent.Delegation.Broker do
   @moduledoc """
   Broker GenServer for Phase 1.3 Polling-Based Delegation.
   Manage task queues per agent and handles polling.
+
+  A poll may wait for work: with `timeout: ms` and nothing queued, the
+  caller is parked and answered as soon as a task is delegated to its agent,
+  or with `{:ok, []}` once the timeout elapses. One long poll per agent
+  replaces a stream of empty polls.
   """
   use GenServer
   require Logger
@@ -13,26 +18,36 @@ defmodule DiwaAgent.Delegation.Broker do
     GenServer.start_link(__MODULE__, %{}, name: __MODULE__)
   end
 
+  # Started on first use in fast-start mode (see DiwaAgent.Lazy)
+  defp server, do: DiwaAgent.Lazy.server(__MODULE__)
+
   @doc """
   Delegate a task (Handoff) to an agent.
   """
   def delegate(%Handoff{} = handoff) do
-    GenServer.call(__MODULE__, {:delegate, handoff})
+    GenServer.call(server(), {:delegate, handoff})
   end
 
+  # Margin for the reply of a poll that timed out on the server
+  @call_margin_ms 5_000
+
   @doc """
   Poll for pending tasks for a specific agent.
   Returns {:ok, list_of_handoffs} or {:ok, []}.
+
+  With `timeout: ms` (default 0) an empty queue is waited on for up to `ms`.
+  A newer poll for the same agent answers the parked one with `{:ok, []}`.
   """
-  def poll(agent_id) do
-    GenServer.call(__MODULE__, {:poll, agent_id})
+  def poll(agent_id, opts \\ []) do
+    timeout = max(Keyword.get(opts, :timeout, 0), 0)
+    GenServer.call(server(), {:poll, agent_id, timeout}, timeout + @call_margin_ms)
   end
 
   @doc """
   Mark a delegation as completed (or failed).
   """
   def complete(handoff_id, result_summary, status \\ :completed) do
-    GenServer.call(__MODULE__, {:complete, handoff_id, result_summary, status})
+    GenServer.call(server(), {:complete, handoff_id, result_summary, status})
   end
 
   # Server Callbacks
@@ -43,8 +58,9 @@ defmodule DiwaAgent.Delegation.Broker do
     # State: %{ 
     #   queues: %{ "agent_id" => [handoff1, handoff2] },
     #   pending: %{ "handoff_id" => handoff }  <-- For lookup/timeout tracking
+    #   waiters: %{ "agent_id" => %{from, timer, monitor} }  <-- Parked polls
     # }
-    {:ok, %{queues: %{}, pending: %{}}}
+    {:ok, %{queues: %{}, pending: %{}, waiters: %{}}}
   end
 
   @impl true
@@ -64,45 +80,49 @@ defmodule DiwaAgent.Delegation.Broker do
 
       updated_queues = Map.update(state.queues, target_id, [ref], fn list -> list ++ [ref] end)
       updated_pending = Map.put(state.pending, ref, handoff)
+      state = %{state | queues: updated_queues, pending: updated_pending}
 
       Logger.info("[Broker] Delegated task to #{target_id} (Ref: #{ref})")
-      {:reply, {:ok, ref, target_id}, %{state | queues: updated_queues, pending: updated_pending}}
+
+      # 3. Hand it straight to a parked poll, if any
+      state =
+        case Map.pop(state.waiters, target_id) do
+          {nil, _} ->
+            state
+
+          {waiter, waiters} ->
+            cancel(waiter)
+            {reply, state} = take(%{state | waiters: waiters}, target_id)
+            GenServer.reply(waiter.from, reply)
+            state
+        end
+
+      {:reply, {:ok, ref, target_id}, state}
     end
   end
 
   @impl true
-  def handle_call({:poll, agent_id}, _from, state) do
-    case Map.get(state.queues, agent_id) do
-      nil ->
-        {:reply, {:ok, []}, state}
+  def handle_call({:poll, agent_id, timeout}, {pid, _} = from, state) do
+    # A newer poll supersedes a parked one
+    state =
+      case Map.pop(state.waiters, agent_id) do
+        {nil, _} ->
+          state
+
+        {waiter, waiters} ->
+          cancel(waiter)
+          GenServer.reply(waiter.from, {:ok, []})
+          %{state | waiters: waiters}
+      end
 
-      [] ->
-        {:reply, {:ok, []}, state}
+    case take(state, agent_id) do
+      {{:ok, []}, state} when timeout > 0 ->
+        timer = Process.send_after(self(), {:poll_timeout, agent_id, from}, timeout)
+        waiter = %{from: from, timer: timer, monitor: Process.monitor(pid)}
+        {:noreply, %{state | waiters: Map.put(state.waiters, agent_id, waiter)}}
 
-      [ref | rest] ->
-        # FIFO basics. 
-        # Pop the first task.
-        task = Map.get(state.pending, ref)
-
-        # We assume the agent *takes* it. 
-        # Should we remove from queue? Yes.
-        # Should we keep in 'pending' until complete? Yes, mark as in-progress?
-        # For simple polling, let's just return it and keep tracking.
-
-        updated_queues = Map.put(state.queues, agent_id, rest)
-
-        # Update status in pending? (Not strictly necessary for MVP polling, but good for tracking)
-        # We return the task + its ref so agent can complete it later.
-
-        {:reply, {:ok, [%{task | active_files: [ref]}]}, %{state | queues: updated_queues}}
-        # Hack: Storing ref in active_files for now since we lack ID field? 
-        # Better: Return tuple or wrapper. But client expects simple list.
-        # Let's return the task object. The agent needs to know the ID to complete it.
-        # Phase 1.2 schema didn't have 'id'. Check Handoff.ex.
-        # It has `timestamp` but no unique ID.
-        # Correct fix: Use Memory ID.
-        # But here we are in memory.
-        # Let's wrap the return: `{:ok, [{ref, task}]}`
+      {reply, state} ->
+        {:reply, reply, state}
     end
   end
 
@@ -113,6 +133,50 @@ defmodule DiwaAgent.Delegation.Broker do
     {:reply, :ok, %{state | pending: updated_pending}}
   end
 
+  @impl true
+  def handle_info({:poll_timeout, agent_id, from}, state) do
+    case Map.get(state.waiters, agent_id) do
+      %{from: ^from} = waiter ->
+        Process.demonitor(waiter.monitor, [:flush])
+        GenServer.reply(from, {:ok, []})
+        {:noreply, %{state | waiters: Map.delete(state.waiters, agent_id)}}
+
+      _ ->
+        {:noreply, state}
+    end
+  end
+
+  # The parked caller died: keep its tasks queued for the next poll
+  def handle_info({:DOWN, monitor, :process, _pid, _reason}, state) do
+    waiters =
+      state.waiters
+      |> Enum.reject(fn {_agent_id, waiter} -> waiter.monitor == monitor end)
+      |> Map.new()
+
+    {:noreply, %{state | waiters: waiters}}
+  end
+
+  # --- Queue Helpers ---
+
+  # Pop the agent's oldest task (FIFO). It stays in `pending` until completed;
+  # its ref travels in `active_files` so the agent can complete it later.
+  defp take(state, agent_id) do
+    case Map.get(state.queues, agent_id) do
+      [ref | rest] ->
+        task = Map.get(state.pending, ref)
+        queues = Map.put(state.queues, agent_id, rest)
+        {{:ok, [%{task | active_files: [ref]}]}, %{state | queues: queues}}
+
+      _ ->
+        {{:ok, []}, state}
+    end
+  end
+
+  defp cancel(waiter) do
+    Process.cancel_timer(waiter.timer)
+    Process.demonitor(waiter.monitor, [:flush])
+  end
+
   # --- Internal Routing Helpers ---
 
   defp resolve_target_by_requirements(handoff) do
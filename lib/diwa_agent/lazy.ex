@@ -0,0 +1,69 @@
+defmodule DiwaAgent.Lazy do
+  @moduledoc """
+  Supervisor for workers that are not needed to answer the first request.
+
+  In fast-start mode (`config :diwa_agent, fast_start: true`) these workers
+  are left out of the boot sequence and started here on first use: their
+  client functions call `server/1` instead of the registered name directly.
+  Background workers with no callers to wake them are started by
+  `start_deferred/2` shortly after boot.
+
+  Without fast-start the application starts the same workers eagerly and
+  `server/1` returns the registered name unchanged.
+  """
+
+  use DynamicSupervisor
+  require Logger
+
+  def start_link(opts \\ []) do
+    DynamicSupervisor.start_link(__MODULE__, opts, name: __MODULE__)
+  end
+
+  @impl true
+  def init(_opts), do: DynamicSupervisor.init(strategy: :one_for_one)
+
+  @doc """
+  The server to call for the worker registered as `module`. In fast-start
+  mode it is started under this supervisor (with `module.child_spec([])`)
+  if it is not running yet.
+  """
+  def server(module) do
+    if fast_start?() do
+      case Process.whereis(module) do
+        nil -> start(module)
+        pid -> pid
+      end
+    else
+      module
+    end
+  end
+
+  @doc """
+  Whether non-essential workers are started lazily.
+  """
+  def fast_start?, do: Application.get_env(:diwa_agent, :fast_start, false)
+
+  @doc """
+  Start `modules` in the background after `delay_ms`.
+  """
+  def start_deferred(modules, delay_ms) do
+    Task.Supervisor.start_child(DiwaAgent.TaskSupervisor, fn ->
+      Process.sleep(delay_ms)
+      Enum.each(modules, &server/1)
+    end)
+  end
+
+  defp start(module) do
+    case DynamicSupervisor.start_child(__MODULE__, module) do
+      {:ok, pid} ->
+        Logger.debug("[DiwaAgent.Lazy] Started #{inspect(module)} on first use")
+        pid
+
+      {:error, {:already_started, pid}} ->
+        pid
+
+      {:error, reason} ->
+        exit({reason, {__MODULE__, :server, [module]}})
+    end
+  end
+end
@@ -2,156 +2,186 @@ defmodule DiwaAgent.Registry.Server do
   @moduledoc """
   GenServer that acts as the Source of Truth for all active agents.
   Handles registration, heartbeats, and status updates.
+
+  Agents live in the `:diwa_agents` ETS table (`read_concurrency: true`),
+  next to a `:diwa_agent_index` bag with one `{{:cap, capability}, id}` row
+  per capability and one `{{:role_status, role, status}, id}` row per
+  agent. Writes go through the server, which keeps the index in step;
+  lookups read the tables from the caller's process, so matching is a few
+  ETS lookups instead of a scan serialized behind `GenServer.call`.
   """
   use GenServer
   require Logger
   alias DiwaAgent.Registry.Agent
 
+  @agents :diwa_agents
+  @index :diwa_agent_index
+
   # Client API
 
   def start_link(_) do
     GenServer.start_link(__MODULE__, %{}, name: __MODULE__)
   end
 
+  # Started on first use in fast-start mode (see DiwaAgent.Lazy)
+  defp server, do: DiwaAgent.Lazy.server(__MODULE__)
+
   @doc """
   Registers a new agent or updates an existing one if ID is provided.
   """
   def register(attrs) do
-    GenServer.call(__MODULE__, {:register, attrs})
+    GenServer.call(server(), {:register, attrs})
   end
 
   @doc """
   Updates the heartbeat timestamp for an agent.
   """
   def heartbeat(agent_id) do
-    GenServer.cast(__MODULE__, {:heartbeat, agent_id})
+    GenServer.cast(server(), {:heartbeat, agent_id})
   end
 
   @doc """
   Updates an agent's status (e.g., :busy, :idle) and current context context.
   """
   def update_status(agent_id, status, context_id \\ nil) do
-    GenServer.call(__MODULE__, {:update_status, agent_id, status, context_id})
+    GenServer.call(server(), {:update_status, agent_id, status, context_id})
   end
 
   @doc """
   List all registered agents.
   """
   def list_agents do
-    GenServer.call(__MODULE__, :list_agents)
+    if tables?() do
+      @agents |> :ets.tab2list() |> Enum.map(&elem(&1, 1)) |> Enum.sort_by(& &1.id)
+    else
+      []
+    end
   end
 
   @doc """
   Find an idle agent with a specific role.
   """
   def find_idle_agent(role) do
-    GenServer.call(__MODULE__, {:find_idle, role})
+    with true <- tables?(),
+         [_ | _] = ids <- index_ids({:role_status, role, :idle}) do
+      ids |> Enum.min() |> lookup()
+    else
+      _ -> nil
+    end
   end
 
   @doc """
   Get an agent by ID.
   """
   def get_agent(agent_id) do
-    GenServer.call(__MODULE__, {:get_agent, agent_id})
+    if tables?(), do: lookup(agent_id)
   end
 
   @doc """
   Find agents that possess all required capabilities.
   """
   def find_by_capabilities(required_caps) do
-    GenServer.call(__MODULE__, {:find_by_caps, List.wrap(required_caps)})
+    case required_caps |> List.wrap() |> Enum.map(&to_string/1) |> Enum.uniq() do
+      [] ->
+        list_agents()
+
+      caps ->
+        if tables?() do
+          # Intersect the posting sets, smallest first
+          caps
+          |> Enum.map(&MapSet.new(index_ids({:cap, &1})))
+          |> Enum.sort_by(&MapSet.size/1)
+          |> Enum.reduce(&MapSet.intersection(&2, &1))
+          |> Enum.sort()
+          |> Enum.flat_map(&List.wrap(lookup(&1)))
+        else
+          []
+        end
+    end
+  end
+
+  # In fast-start mode the first lookup starts the server (and its tables)
+  defp tables? do
+    server()
+    :ets.whereis(@agents) != :undefined
   end
 
+  defp lookup(agent_id) do
+    case :ets.lookup(@agents, agent_id) do
+      [{_, agent}] -> agent
+      [] -> nil
+    end
+  end
+
+  defp index_ids(key), do: @index |> :ets.lookup(key) |> Enum.map(&elem(&1, 1))
+
   # Server Callbacks
 
   @impl true
   def init(_) do
+    :ets.new(@agents, [:named_table, :protected, :set, read_concurrency: true])
+    :ets.new(@index, [:named_table, :protected, :bag, read_concurrency: true])
     Logger.info("[DiwaAgent.Registry] Agent Registry started.")
-    # State is a map of agent_id => Agent struct
     {:ok, %{}}
   end
 
   @impl true
   def handle_call({:register, attrs}, _from, state) do
     agent = Agent.new(attrs)
-    new_state = Map.put(state, agent.id, agent)
+    put(agent)
     Logger.info("[DiwaAgent.Registry] Agent registered: #{agent.name} (#{agent.role})")
-    {:reply, {:ok, agent}, new_state}
+    {:reply, {:ok, agent}, state}
   end
 
   @impl true
   def handle_call({:update_status, agent_id, status, context_id}, _from, state) do
-    case Map.get(state, agent_id) do
+    case lookup(agent_id) do
       nil ->
         {:reply, {:error, :not_found}, state}
 
       agent ->
-        updated_agent = %{
+        put(%{
           agent
           | status: status,
             current_context_id: context_id,
             last_heartbeat: DateTime.utc_now()
-        }
+        })
 
-        new_state = Map.put(state, agent_id, updated_agent)
-        {:reply, :ok, new_state}
+        {:reply, :ok, state}
     end
   end
 
   @impl true
-  def handle_call(:list_agents, _from, state) do
-    agents = Map.values(state)
-    {:reply, agents, state}
-  end
-
-  @impl true
-  def handle_call({:find_idle, role}, _from, state) do
-    match =
-      state
-      |> Map.values()
-      |> Enum.find(fn agent ->
-        agent.role == role and agent.status == :idle
-      end)
+  def handle_cast({:heartbeat, agent_id}, state) do
+    case lookup(agent_id) do
+      nil ->
+        Logger.warning(
+          "[DiwaAgent.Registry] Received heartbeat from unknown agent: #{agent_id}"
+        )
 
-    {:reply, match, state}
-  end
+      agent ->
+        # Role, status and capabilities are unchanged: the index stays as is
+        :ets.insert(@agents, {agent_id, %{agent | last_heartbeat: DateTime.utc_now()}})
+    end
 
-  @impl true
-  def handle_call({:get_agent, agent_id}, _from, state) do
-    {:reply, Map.get(state, agent_id), state}
+    {:noreply, state}
   end
 
-  @impl true
-  def handle_call({:find_by_caps, required}, _from, state) do
-    required_set = MapSet.new(required)
+  # Replace the agent's row and its index entries
+  defp put(agent) do
+    case lookup(agent.id) do
+      nil ->
+        :ok
 
-    matches =
-      state
-      |> Map.values()
-      |> Enum.filter(fn agent ->
-        agent_caps = MapSet.new(agent.capabilities || [])
-        MapSet.subset?(required_set, agent_caps)
-      end)
+      previous ->
+        Enum.each(index_keys(previous), &:ets.delete_object(@index, {&1, previous.id}))
+    end
 
-    {:reply, matches, state}
+    :ets.insert(@agents, {agent.id, agent})
+    :ets.insert(@index, Enum.map(index_keys(agent), &{&1, agent.id}))
   end
 
-  @impl true
-  def handle_cast({:heartbeat, agent_id}, state) do
-    new_state =
-      case Map.get(state, agent_id) do
-        nil ->
-          Logger.warning(
-            "[DiwaAgent.Registry] Received heartbeat from unknown agent: #{agent_id}"
-          )
-
-          state
-
-        agent ->
-          updated = %{agent | last_heartbeat: DateTime.utc_now()}
-          Map.put(state, agent_id, updated)
-      end
-
-    {:noreply, new_state}
+  defp index_keys(agent) do
+    [{:role_status, agent.role, agent.status} | Enum.map(agent.capabilities || [], &{:cap, &1})]
   end
 end
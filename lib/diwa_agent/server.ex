@@ -4,65 +4,327 @@ defmodule DiwaAgent.Server do
 
   This module handles JSON-RPC 2.0 communication over stdio and manages
   the server lifecycle (initialize, tool calls, etc.).
+
+  `tools/call` requests are pipelined: each call runs in its own task under
+  `DiwaAgent.TaskSupervisor` and its response is delivered as soon as it
+  completes, so responses may arrive out of order. At most `:max_in_flight`
+  calls run at once; further calls wait in a FIFO queue of at most
+  `:max_pending` entries, beyond which calls are rejected with a JSON-RPC
+  "server busy" error. A `notifications/cancelled` message for an in-flight
+  or queued request terminates it and suppresses its response.
+
+  Long polls (`poll_delegated_tasks` with a positive `wait_ms`) mostly wait
+  rather than work, so up to `:max_parked_polls` of them run outside the
+  `:max_in_flight` slots. Further long polls are run as ordinary calls with
+  `wait_ms` 0, i.e. they return at once instead of holding a slot.
+
+      config :diwa_agent, DiwaAgent.Server,
+        max_in_flight: 8,
+        max_pending: 64,
+        max_parked_polls: 2
   """
 
   use GenServer
   require Logger
+  alias DiwaAgent.Prompts.Workflow
+  alias DiwaAgent.Tools.Definitions
 
   defmodule State do
     @moduledoc false
-    defstruct [:initialized, :capabilities]
+    defstruct [
+      :initialized,
+      :capabilities,
+      max_in_flight: 8,
+      max_pending: 64,
+      max_parked_polls: 2,
+      # task ref => %{id: request_id, reply_to: reply_target, parked: boolean}
+      in_flight: %{},
+      # in-flight long polls, not counted against max_in_flight
+      parked: 0,
+      # request id => task ref, used to resolve cancellations
+      by_id: %{},
+      # queued {request, reply_to} pairs waiting for a free slot
+      pending: :queue.new(),
+      # callers blocked in await_idle/2
+      idle_waiters: []
+    ]
   end
 
+  @default_max_in_flight 8
+  @default_max_pending 64
+  @default_max_parked_polls 2
+
+  # JSON-RPC implementation-defined server error
+  @server_busy -32000
+
+  # The tool and prompt catalogues are static: encode them once at compile
+  # time (with the transport's escaping) and splice them into responses
+  @tools_list_result Jason.encode!(%{"tools" => Definitions.all_tools()}, escape: :unicode_safe)
+  @prompts_list_result Jason.encode!(%{"prompts" => Workflow.all_prompts()},
+                         escape: :unicode_safe
+                       )
+
   # Client API
 
   def start_link(opts \\ []) do
-    GenServer.start_link(__MODULE__, opts, name: __MODULE__)
+    GenServer.start_link(__MODULE__, opts, name: Keyword.get(opts, :name, __MODULE__))
+  end
+
+  @doc """
+  Handle an incoming JSON-RPC message and wait for its response.
+
+  Returns `{:ok, response}`, where `response` is `nil` for notifications and
+  for requests that were cancelled before they completed.
+  """
+  def handle_message(server \\ __MODULE__, message) do
+    GenServer.call(server, {:handle_message, message}, :infinity)
+  end
+
+  @doc """
+  Submit an incoming JSON-RPC message without waiting for its response.
+
+  The response is sent to `reply_to` as `{:diwa_response, response}` once it
+  is ready. Notifications and cancelled requests produce no message.
+  """
+  def submit(server \\ __MODULE__, message, reply_to) when is_pid(reply_to) do
+    GenServer.cast(server, {:submit, message, reply_to})
   end
 
   @doc """
-  Handle an incoming JSON-RPC message.
+  Block until every in-flight and queued tool call has completed.
+
+  Used by transports on shutdown so pending responses are not lost.
   """
-  def handle_message(message) do
-    GenServer.call(__MODULE__, {:handle_message, message}, :infinity)
+  def await_idle(server \\ __MODULE__, timeout \\ :infinity) do
+    GenServer.call(server, :await_idle, timeout)
   end
 
   # Server Callbacks
 
   @impl true
-  def init(_opts) do
+  def init(opts) do
     Logger.info("[DiwaAgent.Server] MCP server started")
 
+    config = Application.get_env(:diwa_agent, __MODULE__, [])
+
+    max_in_flight =
+      Keyword.get(opts, :max_in_flight) ||
+        Keyword.get(config, :max_in_flight, @default_max_in_flight)
+
+    max_pending =
+      Keyword.get(opts, :max_pending) ||
+        Keyword.get(config, :max_pending, @default_max_pending)
+
+    max_parked_polls =
+      Keyword.get(opts, :max_parked_polls) ||
+        Keyword.get(config, :max_parked_polls, @default_max_parked_polls)
+
     state = %State{
       initialized: false,
       capabilities: %{
         tools: %{}
-      }
+      },
+      max_in_flight: max(max_in_flight, 1),
+      max_pending: max(max_pending, 0),
+      max_parked_polls: max(max_parked_polls, 0)
     }
 
     {:ok, state}
   end
 
   @impl true
-  def handle_call({:handle_message, message}, _from, state) do
+  def handle_call({:handle_message, message}, from, state) do
+    {:noreply, dispatch(message, {:call, from}, state)}
+  end
+
+  def handle_call(:await_idle, from, state) do
+    if idle?(state) do
+      {:reply, :ok, state}
+    else
+      {:noreply, %{state | idle_waiters: [from | state.idle_waiters]}}
+    end
+  end
+
+  @impl true
+  def handle_cast({:submit, message, reply_to}, state) do
+    {:noreply, dispatch(message, {:send, reply_to}, state)}
+  end
+
+  # Pipelined tool calls
+
+  defp dispatch(message, reply_to, state) do
     case decode_message(message) do
+      {:ok, %{"method" => "tools/call"} = request} ->
+        enqueue_tool_call(request, reply_to, state)
+
+      {:ok, %{"method" => "notifications/cancelled"} = request} ->
+        {response, new_state} = process_request(request, state)
+        reply(reply_to, response)
+        cancel_request(get_in(request, ["params", "requestId"]), new_state)
+
       {:ok, request} ->
         {response, new_state} = process_request(request, state)
-        {:reply, {:ok, response}, new_state}
+        reply(reply_to, response)
+        new_state
 
       {:error, reason} ->
-        error_response = build_error_response(nil, -32700, "Parse error: #{inspect(reason)}")
-        {:reply, {:ok, error_response}, state}
+        reply(reply_to, build_error_response(nil, -32700, "Parse error: #{inspect(reason)}"))
+        state
     end
   end
 
+  defp enqueue_tool_call(request, reply_to, state) do
+    long_poll? = long_poll?(request)
+
+    cond do
+      long_poll? and state.parked < state.max_parked_polls ->
+        start_tool_call(request, reply_to, state, true)
+
+      long_poll? ->
+        request
+        |> put_in(["params", "arguments", "wait_ms"], 0)
+        |> enqueue_tool_call(reply_to, state)
+
+      slot_free?(state) ->
+        start_tool_call(request, reply_to, state)
+
+      :queue.len(state.pending) < state.max_pending ->
+        %{state | pending: :queue.in({request, reply_to}, state.pending)}
+
+      true ->
+        Logger.warning(
+          "[DiwaAgent.Server] Rejected request #{inspect(request["id"])}: queue full"
+        )
+
+        reply(reply_to, build_error_response(request["id"], @server_busy, "Server busy"))
+        state
+    end
+  end
+
+  defp long_poll?(%{"params" => %{"name" => "poll_delegated_tasks"} = params}) do
+    match?(%{"wait_ms" => ms} when is_integer(ms) and ms > 0, params["arguments"])
+  end
+
+  defp long_poll?(_request), do: false
+
+  defp slot_free?(state), do: map_size(state.in_flight) - state.parked < state.max_in_flight
+
+  defp start_tool_call(request, reply_to, state, parked \\ false) do
+    case Process.whereis(DiwaAgent.TaskSupervisor) do
+      nil ->
+        # No supervisor (e.g. during isolated tests); run inline.
+        reply(reply_to, execute_tool_call(request))
+        state
+
+      _pid ->
+        task =
+          Task.Supervisor.async_nolink(DiwaAgent.TaskSupervisor, fn ->
+            execute_tool_call(request)
+          end)
+
+        id = request["id"]
+        entry = %{id: id, pid: task.pid, reply_to: reply_to, parked: parked}
+        in_flight = Map.put(state.in_flight, task.ref, entry)
+        by_id = if is_nil(id), do: state.by_id, else: Map.put(state.by_id, id, task.ref)
+        parked = if parked, do: state.parked + 1, else: state.parked
+
+        %{state | in_flight: in_flight, by_id: by_id, parked: parked}
+    end
+  end
+
+  defp finish_tool_call(ref, response, state) do
+    case Map.fetch(state.in_flight, ref) do
+      :error ->
+        state
+
+      {:ok, %{reply_to: reply_to}} ->
+        reply(reply_to, response)
+
+        state
+        |> drop_in_flight(ref)
+        |> start_pending()
+    end
+  end
+
+  defp drop_in_flight(state, ref) do
+    {%{id: id} = entry, in_flight} = Map.pop(state.in_flight, ref)
+    parked = if entry.parked, do: state.parked - 1, else: state.parked
+
+    %{state | in_flight: in_flight, by_id: Map.delete(state.by_id, id), parked: parked}
+  end
+
+  defp start_pending(state) do
+    if slot_free?(state) do
+      case :queue.out(state.pending) do
+        {{:value, {request, reply_to}}, pending} ->
+          request
+          |> start_tool_call(reply_to, %{state | pending: pending})
+          |> start_pending()
+
+        {:empty, _} ->
+          notify_idle(state)
+      end
+    else
+      state
+    end
+  end
+
+  defp idle?(state), do: map_size(state.in_flight) == 0 and :queue.is_empty(state.pending)
+
+  defp notify_idle(%State{idle_waiters: []} = state), do: state
+
+  defp notify_idle(state) do
+    if idle?(state) do
+      Enum.each(state.idle_waiters, &GenServer.reply(&1, :ok))
+      %{state | idle_waiters: []}
+    else
+      state
+    end
+  end
+
+  defp cancel_request(nil, state), do: state
+
+  defp cancel_request(id, state) do
+    case Map.fetch(state.by_id, id) do
+      {:ok, ref} ->
+        %{pid: pid, reply_to: reply_to} = Map.fetch!(state.in_flight, ref)
+        Process.demonitor(ref, [:flush])
+        Task.Supervisor.terminate_child(DiwaAgent.TaskSupervisor, pid)
+        Logger.info("[DiwaAgent.Server] Cancelled in-flight request #{inspect(id)}")
+
+        # Synchronous callers are still waiting; release them without a response.
+        reply(reply_to, nil)
+
+        state
+        |> drop_in_flight(ref)
+        |> start_pending()
+
+      :error ->
+        {cancelled, pending} =
+          state.pending
+          |> :queue.to_list()
+          |> Enum.split_with(fn {request, _reply_to} -> request["id"] == id end)
+
+        Enum.each(cancelled, fn {_request, reply_to} -> reply(reply_to, nil) end)
+        notify_idle(%{state | pending: :queue.from_list(pending)})
+    end
+  end
+
+  defp reply({:call, from}, response), do: GenServer.reply(from, {:ok, response})
+  defp reply({:send, _pid}, nil), do: :ok
+  defp reply({:send, pid}, response), do: send(pid, {:diwa_response, response})
+
   # Private Functions
 
   defp decode_message(message) do
-    case Jason.decode(message) do
-      {:ok, decoded} -> {:ok, decoded}
-      {:error, reason} -> {:error, reason}
-    end
+    meta = %{bytes: byte_size(message)}
+
+    DiwaAgent.Telemetry.span([:diwa_agent, :server, :decode], meta, fn ->
+      case Jason.decode(message) do
+        {:ok, decoded} -> {:ok, decoded}
+        {:error, reason} -> {:error, reason}
+      end
+    end)
   end
 
   defp process_request(%{"method" => "initialize"} = request, state) do
@@ -93,6 +355,12 @@ defmodule DiwaAgent.Server do
       }
     }
 
+    # First handshake of this process: time-to-initialize for the startup report
+    unless state.initialized do
+      DiwaAgent.Startup.mark(:initialize_response)
+      DiwaAgent.Startup.log_report()
+    end
+
     new_state = %{state | initialized: true}
     {response, new_state}
   end
@@ -103,35 +371,28 @@ defmodule DiwaAgent.Server do
     {nil, state}
   end
 
-  # Handle the cancelled notification (no response allowed)
+  # Handle the cancelled notification (no response allowed).
+  # The in-flight task itself is terminated by cancel_request/2.
   defp process_request(%{"method" => "notifications/cancelled"}, state) do
     IO.puts(:stderr, "[DiwaAgent.Server] Request cancelled by client")
     {nil, state}
   end
 
   defp process_request(%{"method" => "tools/list"} = request, state) do
-    tools = DiwaAgent.Tools.Definitions.all_tools()
-
     response = %{
       "jsonrpc" => "2.0",
       "id" => request["id"],
-      "result" => %{
-        "tools" => tools
-      }
+      "result" => Jason.Fragment.new(@tools_list_result)
     }
 
     {response, state}
   end
 
   defp process_request(%{"method" => "prompts/list"} = request, state) do
-    prompts = DiwaAgent.Prompts.Workflow.all_prompts()
-
     response = %{
       "jsonrpc" => "2.0",
       "id" => request["id"],
-      "result" => %{
-        "prompts" => prompts
-      }
+      "result" => Jason.Fragment.new(@prompts_list_result)
     }
 
     {response, state}
@@ -163,16 +424,37 @@ defmodule DiwaAgent.Server do
     {response, state}
   end
 
-  defp process_request(%{"method" => "tools/call"} = request, state) do
+  # Catch-all for other methods
+  defp process_request(%{"method" => method} = request, state) do
+    IO.puts(:stderr, "[DiwaAgent.Server] Unknown method: #{method}")
+
+    # Only send error if it was a request (has an id)
+    if Map.has_key?(request, "id") do
+      response = build_error_response(request["id"], -32601, "Method not found: #{method}")
+      {response, state}
+    else
+      {nil, state}
+    end
+  end
+
+  defp process_request(request, state) do
+    IO.puts(:stderr, "[DiwaAgent.Server] Invalid request structure")
+
+    if Map.has_key?(request, "id") do
+      {build_error_response(request["id"], -32600, "Invalid Request"), state}
+    else
+      {nil, state}
+    end
+  end
+
+  defp execute_tool_call(request) do
     tool_name = get_in(request, ["params", "name"])
     arguments = get_in(request, ["params", "arguments"]) || %{}
 
     result =
       try do
-        DiwaAgent.Telemetry.span([:diwa_agent, :tool, :execute], %{tool_name: tool_name}, fn ->
-          DiwaAgent.Edition.require_tool!(tool_name)
-          DiwaAgent.Tools.Executor.execute(tool_name, arguments)
-        end)
+        DiwaAgent.Edition.require_tool!(tool_name)
+        DiwaAgent.Tools.Executor.execute(tool_name, arguments)
       rescue
         e in DiwaAgent.EditionError ->
           Logger.warning("[DiwaAgent.Server] Edition Restriction: #{e.message}")
@@ -210,36 +492,11 @@ defmodule DiwaAgent.Server do
           }
       end
 
-    response = %{
+    %{
       "jsonrpc" => "2.0",
       "id" => request["id"],
       "result" => result
     }
-
-    {response, state}
-  end
-
-  # Catch-all for other methods
-  defp process_request(%{"method" => method} = request, state) do
-    IO.puts(:stderr, "[DiwaAgent.Server] Unknown method: #{method}")
-
-    # Only send error if it was a request (has an id)
-    if Map.has_key?(request, "id") do
-      response = build_error_response(request["id"], -32601, "Method not found: #{method}")
-      {response, state}
-    else
-      {nil, state}
-    end
-  end
-
-  defp process_request(request, state) do
-    IO.puts(:stderr, "[DiwaAgent.Server] Invalid request structure")
-
-    if Map.has_key?(request, "id") do
-      {build_error_response(request["id"], -32600, "Invalid Request"), state}
-    else
-      {nil, state}
-    end
   end
 
   defp build_error_response(id, code, message) do
@@ -254,6 +511,32 @@ defmodule DiwaAgent.Server do
   end
 
   @impl true
+  def handle_info({ref, response}, state) when is_reference(ref) do
+    Process.demonitor(ref, [:flush])
+    {:noreply, finish_tool_call(ref, response, state)}
+  end
+
+  def handle_info({:DOWN, ref, :process, _pid, reason}, state) do
+    case Map.fetch(state.in_flight, ref) do
+      {:ok, %{id: id}} ->
+        Logger.error("[DiwaAgent.Server] Tool task crashed: #{inspect(reason)}")
+
+        response = %{
+          "jsonrpc" => "2.0",
+          "id" => id,
+          "result" => %{
+            "content" => [%{"type" => "text", "text" => "Error: #{inspect(reason)}"}],
+            "isError" => true
+          }
+        }
+
+        {:noreply, finish_tool_call(ref, response, state)}
+
+      :error ->
+        {:noreply, state}
+    end
+  end
+
   def handle_info(msg, state) do
     Logger.warning("[DiwaAgent.Server] Unexpected info message: #{inspect(msg)}")
     {:noreply, state}
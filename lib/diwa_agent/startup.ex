@@ -0,0 +1,149 @@
+defmodule DiwaAgent.Startup do
+  @moduledoc """
+  Boot-time helpers for the MCP server process, which clients spawn once per
+  session, so every millisecond before the `initialize` response counts.
+
+    * `measure/2` and `mark/1` record startup phases; `report/0` returns
+      them and `log_report/0` prints them to stderr when the `:report`
+      option (or `DIWA_STARTUP_REPORT=1`) is set. Each phase also emits
+      `[:diwa_agent, :startup, :phase]` with a `duration_ms` measurement.
+    * `DiwaAgent.Startup.Migrator` is a supervision-tree step that runs
+      pending migrations only when the migrations shipped with the release
+      differ from the versions recorded in `schema_migrations`.
+
+      config :diwa_agent, DiwaAgent.Startup, report: false, deferred_start_ms: 2_000
+  """
+
+  @key {__MODULE__, :phases}
+  @default_deferred_start_ms 2_000
+
+  @doc """
+  Run `fun`, recording its wall time as startup `phase`. Returns its result.
+  """
+  def measure(phase, fun) do
+    started = System.monotonic_time()
+    result = fun.()
+    ms = System.convert_time_unit(System.monotonic_time() - started, :native, :microsecond)
+    record(phase, ms / 1000)
+    result
+  end
+
+  @doc """
+  Record `phase` as reached, timed from VM start. Only the first mark of a
+  phase is kept, so it can be called on a hot path (e.g. every `initialize`).
+  """
+  def mark(phase) do
+    unless List.keymember?(report(), phase, 0) do
+      {since_boot_ms, _} = :erlang.statistics(:wall_clock)
+      record(phase, since_boot_ms)
+    end
+
+    :ok
+  end
+
+  @doc """
+  Recorded phases as `{phase, milliseconds}`, in the order they completed.
+  """
+  def report, do: :persistent_term.get(@key, [])
+
+  @doc """
+  Print the phase timings to stderr if reporting is enabled.
+  """
+  def log_report do
+    if config(:report, false) or System.get_env("DIWA_STARTUP_REPORT") == "1" do
+      line = Enum.map_join(report(), " ", fn {phase, ms} -> "#{phase}=#{format_ms(ms)}ms" end)
+      IO.puts(:standard_error, "[DiwaAgent.Startup] #{line}")
+    end
+
+    :ok
+  end
+
+  @doc """
+  Delay before fast-start mode starts the deferred background workers.
+  """
+  def deferred_start_ms, do: config(:deferred_start_ms, @default_deferred_start_ms)
+
+  defp record(phase, ms) do
+    :persistent_term.put(@key, report() ++ [{phase, ms}])
+    DiwaAgent.Telemetry.execute([:diwa_agent, :startup, :phase], %{duration_ms: ms}, %{
+      phase: phase
+    })
+  end
+
+  defp format_ms(ms) when is_float(ms), do: :erlang.float_to_binary(ms, decimals: 1)
+  defp format_ms(ms), do: Integer.to_string(ms)
+
+  defp config(key, default) do
+    :diwa_agent
+    |> Application.get_env(__MODULE__, [])
+    |> Keyword.get(key, default)
+  end
+
+  defmodule Migrator do
+    @moduledoc """
+    Runs pending migrations as a step of the supervision tree, after the Repo
+    has started, then returns `:ignore`.
+
+    The shipped migration versions (read from the migration file names, no
+    compilation) are compared with those in `schema_migrations`; when they
+    match, which is every boot but the first after an upgrade, nothing else
+    is done.
+    """
+
+    require Logger
+    alias DiwaAgent.Startup
+
+    def child_spec(opts) do
+      %{id: __MODULE__, start: {__MODULE__, :start_link, [opts]}, restart: :temporary}
+    end
+
+    def start_link(opts) do
+      repo = Keyword.get(opts, :repo, DiwaAgent.Repo)
+
+      Startup.measure(:migrations, fn ->
+        unless current?(repo), do: migrate(repo)
+      end)
+
+      :ignore
+    end
+
+    @doc """
+    Whether every shipped migration has been applied to `repo`.
+    """
+    def current?(repo) do
+      shipped =
+        repo
+        |> Ecto.Migrator.migrations_path()
+        |> Path.join("*.exs")
+        |> Path.wildcard()
+        |> Enum.flat_map(fn path ->
+          case Integer.parse(Path.basename(path)) do
+            {version, "_" <> _} -> [version]
+            _ -> []
+          end
+        end)
+
+      applied = MapSet.new(Ecto.Migrator.migrated_versions(repo))
+      Enum.all?(shipped, &MapSet.member?(applied, &1))
+    rescue
+      # No schema_migrations table yet
+      _ -> false
+    end
+
+    defp migrate(repo) do
+      # Suppress all output to prevent stdout pollution in MCP protocol
+      # and ensure any residual logs go to stderr
+      Logger.configure(level: :warning)
+      Logger.configure_backend(:console, device: :standard_error)
+
+      try do
+        Ecto.Migrator.run(repo, :up, all: true, log: :debug)
+      rescue
+        e ->
+          # Log to stderr only
+          Logger.error("[DiwaAgent] Migration failed: #{Exception.message(e)}")
+          :ok
+      end
+    end
+  end
+end
@@ -0,0 +1,58 @@
+defmodule DiwaAgent.Storage.AfterCommit do
+  @moduledoc """
+  Side effects of a write that must only happen once the write is
+  committed: cache invalidation, embedding jobs and cloud sync.
+
+  `run/1` calls its function right away, unless the caller is inside
+  `transaction/2`; then the function is collected and called after that
+  transaction commits, or dropped if it rolls back. Storage functions that
+  open their own (nested) transaction therefore stay correct when a caller
+  such as `DiwaAgent.Tala.Commit` wraps several of them in one transaction.
+  """
+
+  alias DiwaAgent.Repo
+
+  @key {__MODULE__, :pending}
+
+  @doc """
+  Call `fun` now, or after the enclosing `transaction/2` commits.
+  """
+  def run(fun) when is_function(fun, 0) do
+    case Process.get(@key) do
+      nil -> fun.()
+      pending -> Process.put(@key, [fun | pending])
+    end
+
+    :ok
+  end
+
+  @doc """
+  `Repo.transaction/2`, calling the functions passed to `run/1` inside
+  `fun` (in order) once it returns `{:ok, _}`. Nested calls join the
+  outermost one.
+  """
+  def transaction(fun, opts \\ []) do
+    case Process.get(@key) do
+      nil -> collect(fun, opts)
+      _collecting -> Repo.transaction(fun, opts)
+    end
+  end
+
+  defp collect(fun, opts) do
+    Process.put(@key, [])
+
+    {result, pending} =
+      try do
+        result = Repo.transaction(fun, opts)
+        {result, Process.get(@key)}
+      after
+        Process.delete(@key)
+      end
+
+    if match?({:ok, _}, result) do
+      pending |> Enum.reverse() |> Enum.each(& &1.())
+    end
+
+    result
+  end
+end
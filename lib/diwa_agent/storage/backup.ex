@@ -2,18 +2,30 @@ defmodule DiwaAgent.Storage.Backup do
   @moduledoc """
   Enterprise Backup & Data Portability logic.
 
-  Handles automated JSON exports of contexts to ensure data safety.
+  Handles automated exports of contexts to ensure data safety. Each context
+  is streamed to its own gzip-compressed NDJSON file (see
+  `DiwaAgent.Storage.Export`), several contexts at a time.
+
+  Backups are incremental: only rows changed since the context's previous
+  backup (its watermark, kept under `.watermarks/`) are written, and a
+  context with no changes gets no new file. Pass `full: true` for a complete
+  snapshot.
   """
 
-  alias DiwaAgent.Storage.{Context, Memory}
+  alias DiwaAgent.Storage.{Context, Export}
   require Logger
 
   @backup_dir Path.expand("~/.diwa/backups")
 
   @doc """
-  Performs a full backup of all contexts.
+  Performs a backup of all contexts.
+
+  Options: `:full` (ignore watermarks), `:max_concurrency` (default
+  `System.schedulers_online/0`). Each context export holds a database
+  connection for its whole transaction, so concurrency is capped at the
+  Repo pool size minus one, leaving a connection for the rest of the app.
   """
-  def perform_full_backup do
+  def perform_full_backup(opts \\ []) do
     try do
       File.mkdir_p!(@backup_dir)
       Logger.info("[Backup] Starting full system backup to #{@backup_dir}")
@@ -21,9 +33,12 @@ defmodule DiwaAgent.Storage.Backup do
       {:ok, contexts} = Context.list()
 
       results =
-        Enum.map(contexts, fn ctx ->
-          backup_context(ctx.id)
-        end)
+        contexts
+        |> Task.async_stream(&backup_context(&1.id, opts),
+          max_concurrency: max_concurrency(opts),
+          timeout: :infinity
+        )
+        |> Enum.map(fn {:ok, result} -> result end)
 
       success_count =
         Enum.count(results, fn
@@ -46,6 +61,12 @@ defmodule DiwaAgent.Storage.Backup do
     end
   end
 
+  defp max_concurrency(opts) do
+    pool_size = Keyword.get(Application.get_env(:diwa_agent, DiwaAgent.Repo, []), :pool_size, 10)
+    requested = opts[:max_concurrency] || System.schedulers_online()
+    requested |> min(pool_size - 1) |> max(1)
+  end
+
   defp run_sql_backup do
     # Check root directory first, then fallback to local scripts (legacy)
     root_script = Path.expand("../backup_db.sh")
@@ -68,30 +89,61 @@ defmodule DiwaAgent.Storage.Backup do
   end
 
   @doc """
-  Backs up a specific context to a JSON file.
+  Backs up a specific context to a gzip-compressed NDJSON file.
+
+  Returns `{:ok, path}`, or `{:ok, :unchanged}` when an incremental backup
+  found nothing new.
   """
-  def backup_context(context_id) do
+  def backup_context(context_id, opts \\ []) do
     with {:ok, context} <- Context.get(context_id),
-         {:ok, memories} <- Memory.list(context_id, limit: 10000) do
-      filename =
-        "#{context.name |> String.downcase() |> String.replace(" ", "_")}_#{DateTime.utc_now() |> DateTime.to_unix()}.json"
-
-      path = Path.join(@backup_dir, filename)
-
-      export_data = %{
-        version: "2.0",
-        exported_at: DateTime.utc_now(),
-        context: context,
-        memories: memories
-      }
-
-      File.write!(path, Jason.encode!(export_data, pretty: true))
-      Logger.info("[Backup] Context '#{context.name}' backed up to #{path}")
-      {:ok, path}
+         {:ok, result} <- export_context(context, opts) do
+      {:ok, result}
     else
       error ->
         Logger.error("[Backup] Failed to backup context #{context_id}: #{inspect(error)}")
         error
     end
   end
+
+  defp export_context(context, opts) do
+    since = if opts[:full], do: nil, else: read_watermark(context.id)
+    slug = context.name |> String.downcase() |> String.replace(" ", "_")
+    kind = if since, do: "incr", else: "full"
+    filename = "#{slug}_#{DateTime.to_unix(DateTime.utc_now())}_#{kind}.ndjson.gz"
+    path = Path.join(@backup_dir, filename)
+
+    case Export.export(path, context_ids: [context.id], since: since) do
+      {:ok, %{counts: counts, watermark: watermark}} ->
+        write_watermark(context.id, watermark)
+
+        if since && Enum.all?(counts, fn {_table, n} -> n == 0 end) do
+          File.rm(path)
+          {:ok, :unchanged}
+        else
+          Logger.info("[Backup] Context '#{context.name}' backed up to #{path}")
+          {:ok, path}
+        end
+
+      error ->
+        File.rm(path)
+        error
+    end
+  end
+
+  defp watermark_path(context_id), do: Path.join([@backup_dir, ".watermarks", context_id])
+
+  defp read_watermark(context_id) do
+    with {:ok, iso} <- File.read(watermark_path(context_id)),
+         {:ok, watermark, _offset} <- DateTime.from_iso8601(String.trim(iso)) do
+      watermark
+    else
+      _ -> nil
+    end
+  end
+
+  defp write_watermark(context_id, watermark) do
+    path = watermark_path(context_id)
+    File.mkdir_p!(Path.dirname(path))
+    File.write!(path, DateTime.to_iso8601(watermark))
+  end
 end
@@ -0,0 +1,55 @@
+defmodule DiwaAgent.Storage.BulkInsert do
+  @moduledoc """
+  Helpers for writing schema structs with `Repo.insert_all/3`.
+
+  `insert_all` skips changeset autogeneration, so primary keys and
+  timestamps are filled in here, using the type each schema declares.
+  """
+
+  @doc """
+  Fill in a UUID primary key and `inserted_at`/`updated_at` on a struct
+  built from a changeset, leaving values that are already set.
+  """
+  def stamp(%schema{} = struct) do
+    struct = stamp_primary_key(struct, schema)
+
+    Enum.reduce([:inserted_at, :updated_at], struct, fn field, acc ->
+      case schema.__schema__(:type, field) do
+        nil -> acc
+        type -> Map.put(acc, field, Map.get(acc, field) || now(type))
+      end
+    end)
+  end
+
+  @doc """
+  The persisted fields of a struct, as a row for `Repo.insert_all/3`.
+  """
+  def to_row(%schema{} = struct), do: Map.take(struct, schema.__schema__(:fields))
+
+  @doc """
+  The current time in the representation `type` expects.
+  """
+  def now(type) do
+    now = DateTime.utc_now()
+
+    case type do
+      :utc_datetime -> DateTime.truncate(now, :second)
+      :naive_datetime -> now |> DateTime.to_naive() |> NaiveDateTime.truncate(:second)
+      :naive_datetime_usec -> DateTime.to_naive(now)
+      _ -> now
+    end
+  end
+
+  defp stamp_primary_key(struct, schema) do
+    case schema.__schema__(:primary_key) do
+      [field] ->
+        if Map.get(struct, field) == nil and
+             schema.__schema__(:type, field) in [:binary_id, Ecto.UUID],
+           do: Map.put(struct, field, Ecto.UUID.generate()),
+           else: struct
+
+      _ ->
+        struct
+    end
+  end
+end
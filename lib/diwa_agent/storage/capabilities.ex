@@ -2,7 +2,7 @@ defmodule DiwaAgent.Storage.Capabilities do
   @moduledoc """
   Detects available storage capabilities for graceful feature degradation.
 
-  Community Edition: Always uses binary embeddings with ILIKE text search
+  Community Edition: Always uses binary embeddings with FTS5 full-text search
   Enterprise Edition: Can use pgvector if extension is available
   """
 
@@ -68,7 +68,7 @@ defmodule DiwaAgent.Storage.Capabilities do
       {:ok, false} ->
         adapter = Application.get_env(:diwa_agent, DiwaAgent.Repo)[:adapter]
 
-        if adapter == Ecto.Adapters.Postgres do
+        if adapter == Ecto.Adapters.Postgres or DiwaAgent.Storage.FullTextIndex.available?() do
           :fulltext
         else
           :ilike
@@ -91,6 +91,6 @@ defmodule DiwaAgent.Storage.Capabilities do
   end
 
   defp describe_mode(:vector), do: "Vector similarity search (pgvector)"
-  defp describe_mode(:fulltext), do: "Full-text search (PostgreSQL)"
+  defp describe_mode(:fulltext), do: "Full-text search (PostgreSQL tsvector / SQLite FTS5)"
   defp describe_mode(:ilike), do: "Basic text search (ILIKE)"
 end
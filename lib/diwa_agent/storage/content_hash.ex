@@ -0,0 +1,27 @@
+defmodule DiwaAgent.Storage.ContentHash do
+  @moduledoc """
+  Normalised content hashes used as memory fingerprints.
+
+  Text is trimmed and every whitespace run collapsed to a single space before
+  hashing, so re-saving a file with different line endings or indentation
+  does not produce a new fingerprint.
+  """
+
+  @doc """
+  Collapse whitespace runs and trim.
+  """
+  def normalize(text) when is_binary(text) do
+    text
+    |> String.split()
+    |> Enum.join(" ")
+  end
+
+  @doc """
+  Lower-case hex SHA-256 of the normalised text (64 characters).
+  """
+  def hash(text) when is_binary(text) do
+    Base.encode16(:crypto.hash(:sha256, normalize(text)), case: :lower)
+  end
+
+  def hash(nil), do: hash("")
+end
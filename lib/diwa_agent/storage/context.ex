@@ -6,6 +6,8 @@ defmodule DiwaAgent.Storage.Context do
   alias DiwaAgent.Repo
   alias DiwaSchema.Core.Context
   alias DiwaSchema.Enterprise.Organization
+  alias DiwaAgent.Storage.{AfterCommit, TrigramIndex}
+  alias DiwaAgent.Utils.Fuzzy
   import Ecto.Query
   require Logger
 
@@ -181,6 +183,30 @@ defmodule DiwaAgent.Storage.Context do
     end
   end
 
+  @doc """
+  Typo-tolerant lookup: the context whose name best matches `name`
+  (Jaro-Winkler, see `DiwaAgent.Utils.Fuzzy.best_match/4`). Candidates come
+  from the trigram index, or all contexts of the organization without it.
+  """
+  def fuzzy_find(name, organization_id \\ nil) do
+    organization_id = organization_id || get_default_organization_id()
+
+    candidates =
+      case TrigramIndex.context_candidates(name, organization_id: organization_id, limit: 50) do
+        {:ok, contexts} ->
+          contexts
+
+        {:error, _} ->
+          {:ok, contexts} = list(organization_id)
+          contexts
+      end
+
+    case Fuzzy.best_match(name, candidates, :name, 0.85) do
+      {:ok, ctx} -> {:ok, ctx}
+      {:error, :no_match} -> {:error, :not_found}
+    end
+  end
+
   defp is_uuid?(str) do
     case Ecto.UUID.cast(str) do
       {:ok, _} -> true
@@ -216,7 +242,7 @@ defmodule DiwaAgent.Storage.Context do
         organization_id: context.organization_id
       }
 
-      DiwaAgent.Cloud.SyncQueue.enqueue("context", payload)
+      AfterCommit.run(fn -> DiwaAgent.Cloud.SyncQueue.enqueue("context", payload) end)
     else
       :ok
     end
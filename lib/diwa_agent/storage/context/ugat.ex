@@ -7,8 +7,12 @@ defmodule DiwaAgent.Storage.Context.Ugat do
   alias DiwaAgent.Repo
   alias DiwaSchema.Core.ContextBinding
   alias DiwaSchema.Core.ContextRelationship
+  alias DiwaAgent.Storage.TrigramIndex
   import Ecto.Query
 
+  @name_candidates 50
+  @recent_candidates 50
+
   # --- Context Bindings (Auto-Detection) ---
 
   def add_binding(context_id, type, value, metadata \\ %{}) do
@@ -53,14 +57,14 @@ defmodule DiwaAgent.Storage.Context.Ugat do
     path = opts[:path]
     git_remote = opts[:git_remote]
 
-    # 1. Gather all contexts for matching
-    contexts = Repo.all(DiwaSchema.Core.Context)
-
-    # 2. Extract keywords for matching
+    # 1. Extract keywords for matching
     repo_name = extract_repo_name(git_remote)
     folder_name = if path, do: Path.basename(path), else: nil
     keywords = [repo_name, folder_name] |> Enum.reject(&is_nil/1) |> Enum.uniq()
 
+    # 2. Gather candidate contexts for matching
+    contexts = candidate_contexts(keywords, git_remote)
+
     # 3. Score each context
     scored =
       contexts
@@ -85,6 +89,47 @@ defmodule DiwaAgent.Storage.Context.Ugat do
     {:ok, scored}
   end
 
+  # Contexts that can score above the cut-off: name or org similar to the
+  # keywords (trigram index) plus the recently updated ones. Without the
+  # index every context is scored.
+  defp candidate_contexts(keywords, git_remote) do
+    terms = keywords ++ List.wrap(extract_org_name(git_remote))
+
+    by_name =
+      Enum.reduce_while(terms, [], fn term, acc ->
+        case TrigramIndex.context_candidates(term, limit: @name_candidates) do
+          {:ok, contexts} -> {:cont, acc ++ contexts}
+          {:error, :query_too_short} -> {:cont, acc}
+          {:error, _} -> {:halt, :unavailable}
+        end
+      end)
+
+    case by_name do
+      :unavailable ->
+        Repo.all(DiwaSchema.Core.Context)
+
+      contexts ->
+        recent =
+          from(c in DiwaSchema.Core.Context,
+            order_by: [desc: c.updated_at],
+            limit: @recent_candidates
+          )
+          |> Repo.all()
+
+        Enum.uniq_by(contexts ++ recent, & &1.id)
+    end
+  end
+
+  defp extract_org_name(nil), do: nil
+
+  # Simple org extraction
+  defp extract_org_name(git_remote) do
+    case Regex.run(~r/[:\/]([^\/]+)\/[^\/]+$/, git_remote) do
+      [_, org | _] -> org
+      _ -> nil
+    end
+  end
+
   defp extract_repo_name(nil), do: nil
 
   defp extract_repo_name(url) do
@@ -111,14 +156,13 @@ defmodule DiwaAgent.Storage.Context.Ugat do
   defp check_org_match(_ctx, nil), do: 0.0
 
   defp check_org_match(ctx, git_remote) do
-    # Simple org extraction
-    case Regex.run(~r/[:\/]([^\/]+)\/[^\/]+$/, git_remote) do
-      [_, org | _] ->
+    case extract_org_name(git_remote) do
+      nil ->
+        0.0
+
+      org ->
         # If context name starts with org name or slug, or if description mentions it
         if String.contains?(String.downcase(ctx.name), String.downcase(org)), do: 1.0, else: 0.0
-
-      _ ->
-        0.0
     end
   end
 
@@ -204,7 +248,20 @@ defmodule DiwaAgent.Storage.Context.Ugat do
   def get_dependency_chain(context_id) do
     case DiwaAgent.Storage.Context.get(context_id) do
       {:ok, _ctx} ->
-        {sorted_ids, _} = topo_visit(context_id, MapSet.new(), [])
+        # Every depends_on edge reachable from the root, in one query
+        deps =
+          from(r in ContextRelationship,
+            join: t in "dependency_closure",
+            on: r.source_context_id == t.id,
+            where: r.relationship_type == "depends_on",
+            select: {r.source_context_id, r.target_context_id}
+          )
+          |> recursive_ctes(true)
+          |> with_cte("dependency_closure", as: ^dependency_closure(context_id, :downstream))
+          |> Repo.all()
+          |> Enum.group_by(&elem(&1, 0), &elem(&1, 1))
+
+        {sorted_ids, _} = topo_visit(context_id, deps, MapSet.new(), [])
 
         # Hydrate contexts
         contexts_map =
@@ -227,29 +284,49 @@ defmodule DiwaAgent.Storage.Context.Ugat do
     end
   end
 
-  defp topo_visit(id, visited, acc) do
+  defp topo_visit(id, deps, visited, acc) do
     if MapSet.member?(visited, id) do
       {acc, visited}
     else
       new_visited = MapSet.put(visited, id)
 
-      deps =
-        Repo.all(
-          from(r in ContextRelationship,
-            where: r.source_context_id == ^id and r.relationship_type == "depends_on",
-            select: r.target_context_id
-          )
-        )
-
       {final_acc, final_visited} =
-        Enum.reduce(deps, {acc, new_visited}, fn dep_id, {a, v} ->
-          topo_visit(dep_id, v, a)
+        Enum.reduce(Map.get(deps, id, []), {acc, new_visited}, fn dep_id, {a, v} ->
+          topo_visit(dep_id, deps, v, a)
         end)
 
       {[id | final_acc], final_visited}
     end
   end
 
+  # Recursive CTE of the ids reachable from `root_id` along depends_on edges:
+  # what it depends on (:downstream) or what depends on it (:upstream), root
+  # included. UNION discards ids already produced, so cycles terminate.
+  defp dependency_closure(root_id, direction) do
+    initial = from(c in DiwaSchema.Core.Context, where: c.id == ^root_id, select: %{id: c.id})
+
+    recursion =
+      case direction do
+        :downstream ->
+          from(r in ContextRelationship,
+            join: t in "dependency_closure",
+            on: r.source_context_id == t.id,
+            where: r.relationship_type == "depends_on",
+            select: %{id: r.target_context_id}
+          )
+
+        :upstream ->
+          from(r in ContextRelationship,
+            join: t in "dependency_closure",
+            on: r.target_context_id == t.id,
+            where: r.relationship_type == "depends_on",
+            select: %{id: r.source_context_id}
+          )
+      end
+
+    union(initial, ^recursion)
+  end
+
   # --- Graph Visualization ---
 
   def get_context_graph(root_id, opts \\ []) do
@@ -261,13 +338,19 @@ defmodule DiwaAgent.Storage.Context.Ugat do
         {:error, :not_found}
 
       {:ok, root_context} ->
-        initial_state = %{
-          nodes: %{root_context.id => %{id: root_context.id, name: root_context.name}},
-          edges: MapSet.new(),
-          visited: MapSet.new([root_id])
-        }
+        edges = graph_edges(root_id, max_depth)
+        neighbor_ids = edges |> Enum.flat_map(&[&1.source, &1.target]) |> Enum.uniq()
+
+        nodes =
+          from(c in DiwaSchema.Core.Context,
+            where: c.id in ^neighbor_ids,
+            select: %{id: c.id, name: c.name}
+          )
+          |> Repo.all()
+          |> Map.new(&{&1.id, &1})
+          |> Map.put(root_context.id, %{id: root_context.id, name: root_context.name})
 
-        final_state = traverse([root_id], max_depth, initial_state)
+        final_state = %{nodes: nodes, edges: MapSet.new(edges)}
 
         case to_string(format) do
           "mermaid" -> format_mermaid(final_state)
@@ -278,48 +361,50 @@ defmodule DiwaAgent.Storage.Context.Ugat do
     end
   end
 
-  defp traverse(_ids, 0, state), do: state
-  defp traverse([], _depth, state), do: state
-
-  defp traverse(current_ids, depth, state) do
-    {next_ids, new_state} =
-      Enum.reduce(current_ids, {[], state}, fn id, {acc_next, acc_state} ->
-        relationships = get_relationships(id, :both)
-
-        Enum.reduce(relationships, {acc_next, acc_state}, fn rel, {curr_next_ids, curr_state} ->
-          # Determine neighbor
-          {neighbor_id, neighbor_context} =
-            if rel.source_context_id == id do
-              {rel.target_context_id, rel.target_context}
-            else
-              {rel.source_context_id, rel.source_context}
-            end
-
-          # Update Edge
-          edge = %{
-            source: rel.source_context_id,
-            target: rel.target_context_id,
-            type: rel.relationship_type
-          }
-
-          updated_edges = MapSet.put(curr_state.edges, edge)
-
-          # Update Node
-          updated_nodes =
-            Map.put(curr_state.nodes, neighbor_id, %{id: neighbor_id, name: neighbor_context.name})
-
-          if MapSet.member?(curr_state.visited, neighbor_id) do
-            {curr_next_ids, %{curr_state | edges: updated_edges, nodes: updated_nodes}}
-          else
-            updated_visited = MapSet.put(curr_state.visited, neighbor_id)
+  # Relationships touching any context less than `max_depth` hops from the
+  # root (either direction), i.e. the edges a breadth-first walk of
+  # `max_depth` levels would visit. The depth column bounds the recursion,
+  # so cycles terminate.
+  defp graph_edges(_root_id, max_depth) when max_depth <= 0, do: []
+
+  defp graph_edges(root_id, max_depth) do
+    initial =
+      from(c in DiwaSchema.Core.Context,
+        where: c.id == ^root_id,
+        select: %{id: c.id, depth: fragment("0")}
+      )
 
-            {[neighbor_id | curr_next_ids],
-             %{curr_state | edges: updated_edges, nodes: updated_nodes, visited: updated_visited}}
-          end
-        end)
-      end)
+    recursion =
+      from(r in ContextRelationship,
+        join: t in "context_graph",
+        on: r.source_context_id == t.id or r.target_context_id == t.id,
+        where: t.depth < ^(max_depth - 1),
+        select: %{
+          id:
+            fragment(
+              "CASE WHEN ? = ? THEN ? ELSE ? END",
+              r.source_context_id,
+              t.id,
+              r.target_context_id,
+              r.source_context_id
+            ),
+          depth: fragment("? + 1", t.depth)
+        }
+      )
 
-    traverse(next_ids, depth - 1, new_state)
+    from(r in ContextRelationship,
+      join: t in "context_graph",
+      on: r.source_context_id == t.id or r.target_context_id == t.id,
+      distinct: true,
+      select: %{
+        source: r.source_context_id,
+        target: r.target_context_id,
+        type: r.relationship_type
+      }
+    )
+    |> recursive_ctes(true)
+    |> with_cte("context_graph", as: ^union(initial, ^recursion))
+    |> Repo.all()
   end
 
   defp format_mermaid(%{nodes: nodes, edges: edges}) do
@@ -530,32 +615,15 @@ defmodule DiwaAgent.Storage.Context.Ugat do
   If Context A depends on Context B, and we analyze B, A will be in the impact set.
   """
   def analyze_impact(context_id) do
-    do_analyze_impact([context_id], MapSet.new())
-    # Don't include self
-    |> MapSet.delete(context_id)
-    |> MapSet.to_list()
-    |> Enum.map(fn id -> Repo.get(DiwaSchema.Core.Context, id) end)
-  end
-
-  defp do_analyze_impact([], visited), do: visited
-
-  defp do_analyze_impact([id | rest], visited) do
-    if MapSet.member?(visited, id) do
-      do_analyze_impact(rest, visited)
-    else
-      new_visited = MapSet.put(visited, id)
-
-      # Find what depends ON this (incoming depends_on)
-      upstream_dependents =
-        Repo.all(
-          from(r in ContextRelationship,
-            where: r.target_context_id == ^id and r.relationship_type == "depends_on",
-            select: r.source_context_id
-          )
-        )
-
-      do_analyze_impact(upstream_dependents ++ rest, new_visited)
-    end
+    from(c in DiwaSchema.Core.Context,
+      join: t in "dependency_closure",
+      on: c.id == t.id,
+      # Don't include self
+      where: c.id != ^context_id
+    )
+    |> recursive_ctes(true)
+    |> with_cte("dependency_closure", as: ^dependency_closure(context_id, :upstream))
+    |> Repo.all()
   end
 
   @doc """
@@ -606,27 +674,11 @@ defmodule DiwaAgent.Storage.Context.Ugat do
 
   # --- Safety Checks ---
 
+  # Linking source -> target closes a cycle when target already reaches source
   defp circular_dependency?(source_id, target_id) do
-    has_path?(target_id, source_id, MapSet.new())
-  end
-
-  defp has_path?(current_id, target_id, visited) do
-    if current_id == target_id do
-      true
-    else
-      if MapSet.member?(visited, current_id) do
-        false
-      else
-        new_visited = MapSet.put(visited, current_id)
-
-        Repo.all(
-          from(r in ContextRelationship,
-            where: r.source_context_id == ^current_id and r.relationship_type == "depends_on",
-            select: r.target_context_id
-          )
-        )
-        |> Enum.any?(fn next_id -> has_path?(next_id, target_id, new_visited) end)
-      end
-    end
+    from(t in "dependency_closure", where: t.id == type(^source_id, :binary_id))
+    |> recursive_ctes(true)
+    |> with_cte("dependency_closure", as: ^dependency_closure(target_id, :downstream))
+    |> Repo.exists?()
   end
 end
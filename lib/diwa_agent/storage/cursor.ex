@@ -0,0 +1,98 @@
+defmodule DiwaAgent.Storage.Cursor do
+  @moduledoc """
+  Opaque keyset cursors for paged listings.
+
+  A cursor is the sort key of the last entry of a page, JSON-encoded and
+  Base64url-wrapped, so the next page is a range condition on an index
+  instead of an `OFFSET` that reads and discards every earlier row:
+
+    * listings newest first carry `[inserted_at, id]` (see `page/2`);
+    * ranked results carry `[score, id, seen, pool, now]`, `seen` being the
+      number of entries already returned and `pool` and `now` pinning the
+      ranking of the first page (see `HybridSearch`).
+
+  Callers treat cursors as strings; a cursor that does not decode is
+  `{:error, :invalid_cursor}`.
+  """
+
+  import Ecto.Query
+
+  @type t :: String.t()
+  @type page(entry) :: %{entries: [entry], next_cursor: t() | nil}
+
+  @doc """
+  Wrap a list of sort-key values into a cursor.
+  """
+  @spec encode(list()) :: t()
+  def encode(values) when is_list(values) do
+    values |> Jason.encode!() |> Base.url_encode64(padding: false)
+  end
+
+  @doc """
+  The sort-key values of a cursor, or nil for no cursor.
+  """
+  @spec decode(t() | nil) :: {:ok, list() | nil} | {:error, :invalid_cursor}
+  def decode(nil), do: {:ok, nil}
+  def decode(""), do: {:ok, nil}
+
+  def decode(cursor) when is_binary(cursor) do
+    with {:ok, json} <- Base.url_decode64(cursor, padding: false),
+         {:ok, values} when is_list(values) <- Jason.decode(json) do
+      {:ok, values}
+    else
+      _ -> {:error, :invalid_cursor}
+    end
+  end
+
+  def decode(_cursor), do: {:error, :invalid_cursor}
+
+  @doc """
+  One page of `query`, newest first by `(inserted_at, id)` of its root
+  schema. Any ordering already on the query is replaced.
+
+  Options: `:limit` (default 100) and `:cursor` (the `next_cursor` of the
+  previous page). `next_cursor` is nil on the last page.
+  """
+  @spec page(Ecto.Queryable.t(), keyword()) :: {:ok, page(struct())} | {:error, :invalid_cursor}
+  def page(queryable, opts) do
+    query = Ecto.Queryable.to_query(queryable)
+    %{from: %{source: {_table, schema}}} = query
+    limit = Keyword.get(opts, :limit, 100)
+
+    with {:ok, values} <- decode(Keyword.get(opts, :cursor)),
+         {:ok, query} <- after_key(query, schema, values) do
+      rows =
+        query
+        |> exclude(:order_by)
+        |> order_by([r], desc: r.inserted_at, desc: r.id)
+        |> limit(^(limit + 1))
+        |> DiwaAgent.Repo.all()
+
+      {entries, rest} = Enum.split(rows, limit)
+
+      next_cursor =
+        case {rest, List.last(entries)} do
+          {[], _} -> nil
+          {_, last} -> encode([timestamp(last.inserted_at), last.id])
+        end
+
+      {:ok, %{entries: entries, next_cursor: next_cursor}}
+    end
+  end
+
+  defp after_key(query, _schema, nil), do: {:ok, query}
+
+  defp after_key(query, schema, [at, id]) when is_binary(at) and is_binary(id) do
+    with {:ok, at} <- Ecto.Type.cast(schema.__schema__(:type, :inserted_at), at),
+         {:ok, id} <- Ecto.UUID.cast(id) do
+      {:ok, where(query, [r], r.inserted_at < ^at or (r.inserted_at == ^at and r.id < ^id))}
+    else
+      _ -> {:error, :invalid_cursor}
+    end
+  end
+
+  defp after_key(_query, _schema, _values), do: {:error, :invalid_cursor}
+
+  defp timestamp(%DateTime{} = at), do: DateTime.to_iso8601(at)
+  defp timestamp(%NaiveDateTime{} = at), do: NaiveDateTime.to_iso8601(at)
+end
@@ -0,0 +1,218 @@
+defmodule DiwaAgent.Storage.Export do
+  @moduledoc """
+  Streaming export and import of Diwa data.
+
+  Exports are gzip-compressed NDJSON: a header line, one line per row
+  (`{"table": "memories", "row": {...}}`) and a footer line with the row
+  counts and the watermark to pass as `:since` to the next incremental
+  export. Rows are read with `Repo.stream/2` inside a single transaction and
+  written one by one, and imports decode and upsert fixed-size chunks, so
+  memory use does not grow with the size of the database.
+
+  Tables are written parents first (organizations, contexts, memories,
+  bindings, relationships), which is also the order imports need.
+
+  Embeddings are not exported. Imported memories are queued for embedding,
+  and the cached reads and vector index partitions of their contexts are
+  invalidated after each chunk, so they are found by every search path.
+  """
+
+  alias DiwaAgent.Repo
+  alias DiwaAgent.Storage.{BulkInsert, HotCache, MemoryFingerprint, VectorIndex}
+  alias DiwaSchema.Core.{Context, ContextBinding, ContextRelationship, Memory}
+  alias DiwaSchema.Enterprise.Organization
+  import Ecto.Query
+
+  @version "2.0"
+  @stream_rows 500
+  @import_chunk 500
+
+  # {name, schema, field scoping rows to a set of contexts}
+  @tables [
+    {"organizations", Organization, nil},
+    {"contexts", Context, :id},
+    {"memories", Memory, :context_id},
+    {"bindings", ContextBinding, :context_id},
+    {"relationships", ContextRelationship, :source_context_id}
+  ]
+
+  # Not portable between databases; recomputed after import
+  @skip_fields [:embedding]
+
+  @doc """
+  Export to a gzip-compressed NDJSON file at `path`.
+
+  Options:
+    * `:since` - only rows updated at or after this `DateTime`
+    * `:context_ids` - only these contexts and their memories, bindings and
+      outgoing relationships (organizations are left out)
+
+  Returns `{:ok, %{counts: %{table => rows}, watermark: DateTime.t()}}`.
+  """
+  def export(path, opts \\ []) do
+    File.mkdir_p!(Path.dirname(path))
+
+    case File.open(path, [:write, :binary, :compressed]) do
+      {:ok, device} ->
+        try do
+          write(device, opts)
+        after
+          File.close(device)
+        end
+
+      {:error, reason} ->
+        {:error, reason}
+    end
+  end
+
+  @doc """
+  Stream an export to an open IO device. See `export/2`.
+  """
+  def write(device, opts \\ []) do
+    # Rows changed while the export runs are picked up by the next one
+    watermark = DateTime.utc_now()
+    since = Keyword.get(opts, :since)
+    context_ids = Keyword.get(opts, :context_ids)
+
+    write_line(device, %{
+      type: "header",
+      version: @version,
+      source: "diwa-agent",
+      exported_at: watermark,
+      since: since
+    })
+
+    result =
+      Repo.transaction(
+        fn ->
+          Map.new(tables(context_ids), fn {name, schema, scope} ->
+            count =
+              schema
+              |> table_query(scope, context_ids, since)
+              |> Repo.stream(max_rows: @stream_rows)
+              |> Enum.reduce(0, fn struct, n ->
+                write_line(device, %{table: name, row: to_record(struct)})
+                n + 1
+              end)
+
+            {name, count}
+          end)
+        end,
+        timeout: :infinity
+      )
+
+    with {:ok, counts} <- result do
+      write_line(device, %{type: "footer", counts: counts, watermark: watermark})
+      {:ok, %{counts: counts, watermark: watermark}}
+    end
+  end
+
+  @doc """
+  Import an export file produced by `export/2`, upserting rows by primary
+  key in chunks of #{@import_chunk}. Returns `{:ok, %{table => rows}}`.
+  """
+  def import_file(path) do
+    counts =
+      path
+      |> File.stream!([:read, :compressed])
+      |> Stream.map(&Jason.decode!/1)
+      |> Stream.filter(&Map.has_key?(&1, "table"))
+      |> Stream.chunk_by(& &1["table"])
+      |> Stream.flat_map(&Enum.chunk_every(&1, @import_chunk))
+      |> Enum.reduce(%{}, fn [%{"table" => name} | _] = lines, counts ->
+        n = import_chunk(name, Enum.map(lines, & &1["row"]))
+        Map.update(counts, name, n, &(&1 + n))
+      end)
+
+    {:ok, counts}
+  rescue
+    e in [File.Error, Jason.DecodeError, ErlangError] -> {:error, e}
+  end
+
+  defp import_chunk(name, records) do
+    case List.keyfind(@tables, name, 0) do
+      {^name, schema, _scope} ->
+        structs = Enum.map(records, &from_record(schema, &1))
+        fields = schema.__schema__(:fields) -- @skip_fields
+        rows = Enum.map(structs, &Map.take(&1, fields))
+
+        {n, _} =
+          Repo.insert_all(schema, rows,
+            on_conflict: {:replace, fields -- schema.__schema__(:primary_key)},
+            conflict_target: schema.__schema__(:primary_key)
+          )
+
+        if schema == Memory, do: imported_memories(structs)
+        n
+
+      nil ->
+        0
+    end
+  end
+
+  defp imported_memories(memories) do
+    MemoryFingerprint.record_many(memories)
+
+    memories
+    |> Enum.map(& &1.context_id)
+    |> Enum.uniq()
+    |> Enum.each(fn context_id ->
+      HotCache.invalidate(context_id)
+      VectorIndex.invalidate(context_id)
+    end)
+
+    DiwaAgent.Storage.Memory.reembed(memories)
+  end
+
+  # Rows
+
+  defp tables(nil), do: @tables
+  defp tables(_context_ids), do: Enum.reject(@tables, fn {_, _, scope} -> is_nil(scope) end)
+
+  defp table_query(schema, scope, context_ids, since) do
+    # Oldest first, so parent memories precede their children
+    query =
+      if schema.__schema__(:type, :inserted_at),
+        do: from(r in schema, order_by: r.inserted_at),
+        else: from(r in schema)
+
+    query =
+      if context_ids && scope,
+        do: where(query, [r], field(r, ^scope) in ^context_ids),
+        else: query
+
+    case {since, changed_field(schema)} do
+      {nil, _} -> query
+      {_, nil} -> query
+      {since, column} -> where(query, [r], field(r, ^column) >= ^as_type(since, schema, column))
+    end
+  end
+
+  defp changed_field(schema) do
+    Enum.find([:updated_at, :inserted_at], &schema.__schema__(:type, &1))
+  end
+
+  defp as_type(%DateTime{} = since, schema, column) do
+    if schema.__schema__(:type, column) in [:naive_datetime, :naive_datetime_usec],
+      do: DateTime.to_naive(since),
+      else: since
+  end
+
+  defp to_record(%schema{} = struct) do
+    Map.take(struct, schema.__schema__(:fields) -- @skip_fields)
+  end
+
+  defp from_record(schema, record) do
+    fields = schema.__schema__(:fields) -- (@skip_fields ++ schema.__schema__(:embeds))
+
+    schema
+    |> struct()
+    |> Ecto.Changeset.cast(record, fields)
+    |> Ecto.Changeset.apply_changes()
+    |> BulkInsert.stamp()
+  end
+
+  defp write_line(device, map) do
+    IO.binwrite(device, [Jason.encode_to_iodata!(map), ?\n])
+  end
+end
@@ -0,0 +1,169 @@
+defmodule DiwaAgent.Storage.FullTextIndex do
+  @moduledoc """
+  Ranked full-text search over memory content.
+
+  SQLite uses the external-content FTS5 table `memories_fts` (BM25 ranking,
+  `snippet/6`); Postgres uses the generated `content_tsv` column and its GIN
+  index (`ts_rank`, `ts_headline`). The index is maintained by the database
+  (triggers / generated column), so add, update, delete, restore and rollback
+  are all covered without application code. Soft-deleted memories are
+  filtered at query time.
+  """
+
+  alias DiwaAgent.Repo
+  alias DiwaSchema.Core.Memory
+  import Ecto.Query
+  require Logger
+
+  @default_limit 50
+  @snippet_words 16
+
+  @type hit :: %{memory: struct(), rank: float(), snippet: String.t()}
+
+  @doc """
+  Search active memories, best match first.
+
+  Multi-term queries match memories containing every term (stemmed); the last
+  term is also matched as a prefix on SQLite.
+
+  Options: `:context_id`, `:limit` (default #{@default_limit}), `:offset`.
+
+  Returns `{:ok, [hit]}` or `{:error, reason}` when the index is unavailable.
+  """
+  @spec search(String.t(), keyword()) :: {:ok, [hit()]} | {:error, term()}
+  def search(query_str, opts \\ []) do
+    limit = Keyword.get(opts, :limit, @default_limit)
+    offset = Keyword.get(opts, :offset, 0)
+    context_id = Keyword.get(opts, :context_id)
+
+    if postgres?() do
+      run_postgres(query_str, context_id, limit, offset)
+    else
+      case match_expression(query_str) do
+        nil -> {:ok, []}
+        match -> run_sqlite(match, context_id, limit, offset)
+      end
+    end
+  end
+
+  @doc """
+  Rebuild the index from the memories table.
+
+  Only needed after restoring a raw database file or running `VACUUM` on
+  SQLite (which may renumber rowids).
+  """
+  def rebuild do
+    sql =
+      if postgres?(),
+        do: "REINDEX INDEX memories_content_tsv_idx",
+        else: "INSERT INTO memories_fts(memories_fts) VALUES ('rebuild')"
+
+    case Repo.query(sql, []) do
+      {:ok, _} -> :ok
+      {:error, reason} -> {:error, reason}
+    end
+  end
+
+  @doc """
+  Returns true when the full-text index exists in the current database.
+  """
+  def available? do
+    sql =
+      if postgres?(),
+        do:
+          "SELECT 1 FROM information_schema.columns WHERE table_name = 'memories' AND column_name = 'content_tsv'",
+        else: "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'memories_fts'"
+
+    match?({:ok, %{num_rows: 1}}, Repo.query(sql, []))
+  rescue
+    _ -> false
+  end
+
+  @doc """
+  Build an FTS5 MATCH expression from free text.
+
+  Every word is quoted (so FTS5 operators in user input are inert) and the
+  terms are implicitly ANDed. Returns nil when the query has no searchable
+  terms.
+  """
+  def match_expression(query_str) do
+    case Regex.scan(~r/[\p{L}\p{N}_]+/u, query_str || "") do
+      [] ->
+        nil
+
+      terms ->
+        quoted = Enum.map(terms, fn [term] -> ~s("#{term}") end)
+        Enum.join(quoted, " ") <> "*"
+    end
+  end
+
+  # SQLite / FTS5
+
+  defp run_sqlite(match, context_id, limit, offset) do
+    {context_clause, context_params} =
+      if context_id, do: {"AND m.context_id = ?", [context_id]}, else: {"", []}
+
+    sql = """
+    SELECT m.id, bm25(memories_fts) AS score,
+           snippet(memories_fts, 0, '[', ']', '…', #{@snippet_words})
+    FROM memories_fts
+    JOIN memories m ON m.rowid = memories_fts.rowid
+    WHERE memories_fts MATCH ? AND m.deleted_at IS NULL #{context_clause}
+    ORDER BY score, m.id
+    LIMIT ? OFFSET ?
+    """
+
+    with {:ok, %{rows: rows}} <- Repo.query(sql, [match] ++ context_params ++ [limit, offset]) do
+      # bm25() is lower-is-better; expose a higher-is-better rank
+      {:ok, load_hits(Enum.map(rows, fn [id, score, snippet] -> {id, -score, snippet} end))}
+    else
+      {:error, reason} ->
+        Logger.debug("[DiwaAgent.FullTextIndex] FTS5 query failed: #{inspect(reason)}")
+        {:error, reason}
+    end
+  end
+
+  # Postgres / tsvector
+
+  defp run_postgres(query_str, context_id, limit, offset) do
+    {context_clause, context_params} =
+      if context_id,
+        do: {"AND m.context_id = $4", [Ecto.UUID.dump!(context_id)]},
+        else: {"", []}
+
+    sql = """
+    SELECT m.id, ts_rank(m.content_tsv, q) AS rank,
+           ts_headline('english', m.content, q,
+             'StartSel=[, StopSel=], MaxFragments=1, MaxWords=#{@snippet_words}, MinWords=4')
+    FROM memories m, websearch_to_tsquery('english', $1) q
+    WHERE m.content_tsv @@ q AND m.deleted_at IS NULL #{context_clause}
+    ORDER BY rank DESC, m.inserted_at DESC, m.id
+    LIMIT $2 OFFSET $3
+    """
+
+    with {:ok, %{rows: rows}} <- Repo.query(sql, [query_str, limit, offset] ++ context_params) do
+      {:ok, load_hits(Enum.map(rows, fn [id, rank, snippet] -> {id, rank, snippet} end))}
+    else
+      {:error, reason} ->
+        Logger.debug("[DiwaAgent.FullTextIndex] tsvector query failed: #{inspect(reason)}")
+        {:error, reason}
+    end
+  end
+
+  # Load memory structs for ranked ids, preserving rank order
+  defp load_hits([]), do: []
+
+  defp load_hits(rows) do
+    rows = Enum.map(rows, fn {id, rank, snippet} -> {Ecto.UUID.cast!(id), rank, snippet} end)
+    ids = Enum.map(rows, &elem(&1, 0))
+    memories = Map.new(Repo.all(from(m in Memory, where: m.id in ^ids)), &{&1.id, &1})
+
+    for {id, rank, snippet} <- rows, memory = memories[id], memory != nil do
+      %{memory: memory, rank: rank * 1.0, snippet: snippet}
+    end
+  end
+
+  defp postgres? do
+    Application.get_env(:diwa_agent, DiwaAgent.Repo)[:adapter] == Ecto.Adapters.Postgres
+  end
+end
@@ -0,0 +1,216 @@
+defmodule DiwaAgent.Storage.HotCache do
+  @moduledoc """
+  Read-through cache for the per-context data agents fetch at every session
+  start: latest handoff, blockers, pending tasks, plan and health.
+
+  Entries live in a public ETS table and are read from the calling process.
+  Each context has a generation counter; `invalidate/1` bumps it, so an
+  entry computed from data that changed meanwhile is never served. The
+  `Memory`, `Task` and `Plan` write paths call `invalidate/1` after they
+  commit.
+
+  Entries also expire after `:ttl_ms` (default 60s). Beyond `:max_entries`
+  (default 5_000) the oldest are evicted. Hits and misses are counted
+  (`stats/0`) and emitted as `[:diwa_agent, :hot_cache, :lookup]` events.
+  """
+
+  use GenServer
+
+  alias DiwaAgent.Storage.{HealthEngine, Memory, Plan, Task}
+
+  @table :diwa_hot_cache
+  @order :diwa_hot_cache_order
+  @default_ttl_ms 60_000
+  @default_max_entries 5_000
+
+  def start_link(opts \\ []) do
+    GenServer.start_link(__MODULE__, opts, name: __MODULE__)
+  end
+
+  # Cached reads
+
+  @doc """
+  Newest handoff memory of a context, or nil.
+  """
+  def latest_handoff(context_id) do
+    fetch(context_id, :latest_handoff, fn ->
+      case Memory.list_by_type(context_id, "handoff") do
+        {:ok, [latest | _]} -> latest
+        _ -> nil
+      end
+    end)
+  end
+
+  @doc """
+  Blocker memories of a context (resolved ones included), newest first.
+  """
+  def blockers(context_id) do
+    fetch(context_id, :blockers, fn ->
+      case Memory.list_by_type(context_id, "blocker") do
+        {:ok, blockers} -> blockers
+        _ -> []
+      end
+    end)
+  end
+
+  @doc """
+  Same result as `DiwaAgent.Storage.Task.get_pending/2`.
+  """
+  def pending_tasks(context_id, limit \\ 10) do
+    fetch(context_id, {:pending_tasks, limit}, fn -> Task.get_pending(context_id, limit) end)
+  end
+
+  @doc """
+  Same result as `DiwaAgent.Storage.Plan.get/1`.
+  """
+  def plan(context_id), do: fetch(context_id, :plan, fn -> Plan.get(context_id) end)
+
+  @doc """
+  Same result as `DiwaAgent.Storage.HealthEngine.compute_health/1`.
+  """
+  def health(context_id) do
+    fetch(context_id, :health, fn -> HealthEngine.compute_health(context_id) end)
+  end
+
+  # Generic API
+
+  @doc """
+  Return the cached value of `key` for `context_id`, computing and storing
+  it with `fun` on a miss.
+  """
+  def fetch(context_id, key, fun) do
+    if :ets.whereis(@table) == :undefined do
+      fun.()
+    else
+      gen = generation(context_id)
+      now = System.monotonic_time(:millisecond)
+
+      case :ets.lookup(@table, {context_id, key}) do
+        [{_, value, ^gen, expires_at, _tick}] when expires_at > now ->
+          count(:hits)
+          value
+
+        _ ->
+          count(:misses)
+          value = fun.()
+          store(context_id, key, value, gen, now)
+          value
+      end
+    end
+  end
+
+  @doc """
+  Drop everything cached for a context. Call after a write commits.
+  """
+  def invalidate(nil), do: :ok
+
+  def invalidate(context_id) do
+    if :ets.whereis(@table) != :undefined do
+      :ets.update_counter(@table, {:gen, context_id}, 1, {{:gen, context_id}, 0})
+
+      @table
+      |> :ets.match({{context_id, :_}, :_, :_, :_, :"$1"})
+      |> Enum.each(fn [tick] -> :ets.delete(@order, tick) end)
+
+      :ets.match_delete(@table, {{context_id, :_}, :_, :_, :_, :_})
+    end
+
+    :ok
+  end
+
+  @doc """
+  Hit/miss counters and current number of cached values.
+  """
+  def stats do
+    if :ets.whereis(@table) == :undefined do
+      %{hits: 0, misses: 0, size: 0}
+    else
+      %{
+        hits: counter(:hits),
+        misses: counter(:misses),
+        size: :ets.info(@order, :size)
+      }
+    end
+  end
+
+  @doc """
+  Drop every entry and reset the counters.
+  """
+  def clear do
+    if :ets.whereis(@table) != :undefined do
+      :ets.delete_all_objects(@table)
+      :ets.delete_all_objects(@order)
+    end
+
+    :ok
+  end
+
+  # Server Callbacks
+
+  @impl true
+  def init(_opts) do
+    :ets.new(@table, [:named_table, :set, :public, read_concurrency: true])
+    :ets.new(@order, [:named_table, :ordered_set, :public])
+    {:ok, %{}}
+  end
+
+  # Private Functions
+
+  defp store(context_id, key, value, gen, now) do
+    tick = :erlang.unique_integer([:monotonic])
+    entry_key = {context_id, key}
+
+    case :ets.lookup(@table, entry_key) do
+      [{_, _value, _gen, _expires_at, old_tick}] -> :ets.delete(@order, old_tick)
+      [] -> :ok
+    end
+
+    :ets.insert(@table, {entry_key, value, gen, now + config(:ttl_ms, @default_ttl_ms), tick})
+    :ets.insert(@order, {tick, entry_key})
+    evict(config(:max_entries, @default_max_entries))
+  end
+
+  # Oldest first
+  defp evict(max) do
+    if :ets.info(@order, :size) > max do
+      case :ets.first(@order) do
+        :"$end_of_table" ->
+          :ok
+
+        tick ->
+          with [{^tick, entry_key}] <- :ets.take(@order, tick) do
+            :ets.select_delete(@table, [{{entry_key, :_, :_, :_, tick}, [], [true]}])
+          end
+
+          evict(max)
+      end
+    else
+      :ok
+    end
+  end
+
+  defp generation(context_id) do
+    case :ets.lookup(@table, {:gen, context_id}) do
+      [{_, gen}] -> gen
+      [] -> 0
+    end
+  end
+
+  defp count(kind) do
+    :ets.update_counter(@table, {:stat, kind}, 1, {{:stat, kind}, 0})
+    DiwaAgent.Telemetry.execute([:diwa_agent, :hot_cache, :lookup], %{count: 1}, %{result: kind})
+  end
+
+  defp counter(kind) do
+    case :ets.lookup(@table, {:stat, kind}) do
+      [{_, n}] -> n
+      [] -> 0
+    end
+  end
+
+  defp config(key, default) do
+    :diwa_agent
+    |> Application.get_env(__MODULE__, [])
+    |> Keyword.get(key, default)
+  end
+end
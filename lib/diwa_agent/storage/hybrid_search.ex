@@ -0,0 +1,352 @@
+defmodule DiwaAgent.Storage.HybridSearch do
+  @moduledoc """
+  Hybrid memory retrieval in one pass.
+
+  The lexical (full-text, with the substring fallback of
+  `Memory.search_text/3`), vector and fuzzy retrievers run concurrently,
+  each under its own timeout, and their rankings are merged with reciprocal
+  rank fusion:
+
+      score(memory) = Σ weight(retriever) / (k + rank in retriever)
+
+  Optional boosts then multiply the fused score by a factor for the memory's
+  `priority` and `memory_class` and a recency factor. A retriever that fails
+  or times out only loses its contribution (it is listed in `degraded`), so
+  a search takes as long as its slowest retriever, not the sum of all three.
+
+      config :diwa_agent, DiwaAgent.Storage.HybridSearch,
+        rrf_k: 60,
+        weights: %{lexical: 1.0, vector: 1.0, fuzzy: 0.5},
+        timeouts_ms: %{lexical: 2_000, vector: 3_000, fuzzy: 1_500},
+        min_similarity: 0.25,
+        boosts: [
+          priority: %{"critical" => 1.3, "high" => 1.15},
+          memory_class: %{"user_rule" => 1.2},
+          recency_half_life_days: 30,
+          recency_weight: 0.2
+        ]
+
+  Every retriever run emits `[:diwa_agent, :search, :retriever]` with
+  `duration_ms` and `hits` measurements and `retriever` and `status`
+  (`:ok`, `:error` or `:timeout`) metadata.
+  """
+
+  alias DiwaAgent.Repo
+  alias DiwaAgent.Storage.{Cursor, FullTextIndex, Memory}
+  import Ecto.Query
+  require Logger
+
+  @embedding_module Application.compile_env(
+                      :diwa_agent,
+                      :embedding_module,
+                      DiwaAgent.AI.Embeddings
+                    )
+  @vector_repo_module Application.compile_env(
+                        :diwa_agent,
+                        :vector_repo_module,
+                        DiwaAgent.Storage.PgVectorRepo
+                      )
+
+  @retrievers [:lexical, :vector, :fuzzy]
+  @default_limit 20
+  # Each retriever ranks at least this many candidates for the fusion
+  @min_pool 50
+  @default_rrf_k 60
+  @default_weights %{lexical: 1.0, vector: 1.0, fuzzy: 0.5}
+  @default_timeouts_ms %{lexical: 2_000, vector: 3_000, fuzzy: 1_500}
+  @default_min_similarity 0.25
+  @default_recency_weight 0.2
+
+  @type source :: %{rank: pos_integer(), score: number() | nil}
+  @type hit :: %{memory: struct(), score: float(), sources: %{atom() => source()}}
+  @type page :: %{
+          hits: [hit()],
+          next_offset: non_neg_integer() | nil,
+          next_cursor: Cursor.t() | nil,
+          degraded: [atom()]
+        }
+
+  @doc """
+  Search active memories, best fused score first.
+
+  Options: `:context_id`, `:limit` (default #{@default_limit}), `:cursor`
+  (the `next_cursor` of the previous page) or `:offset`, `:retrievers`
+  (default `#{inspect(@retrievers)}`) and `:boosts` (overrides the
+  configured boosts).
+
+  Each hit carries its fused `score` and, per retriever that found it, its
+  `rank` and raw `score` (BM25/ts_rank, cosine similarity, fuzzy score).
+
+  The cursor holds the fused score and id of the last hit returned together
+  with the candidate pool size and the clock used for the recency boost of
+  the first page. Later pages rank the same number of candidates per
+  retriever at the same instant, so fused scores do not shift between pages
+  and each page costs the same; the walk ends once the pool of the first
+  page is exhausted.
+  """
+  @spec search(String.t(), keyword()) ::
+          {:ok, page()} | {:error, :invalid_context_id | :invalid_cursor}
+  def search(query_str, opts \\ []) do
+    with {:ok, context_id} <- cast_context_id(Keyword.get(opts, :context_id)),
+         {:ok, cursor} <- decode_cursor(Keyword.get(opts, :cursor)) do
+      run_search(query_str, context_id, cursor, opts)
+    end
+  end
+
+  defp cast_context_id(nil), do: {:ok, nil}
+
+  defp cast_context_id(context_id) do
+    case Ecto.UUID.cast(context_id) do
+      {:ok, context_id} -> {:ok, context_id}
+      :error -> {:error, :invalid_context_id}
+    end
+  end
+
+  # [score, id, hits already returned, pool size, recency anchor (unix ms)]
+  defp decode_cursor(cursor) do
+    case Cursor.decode(cursor) do
+      {:ok, nil} ->
+        {:ok, nil}
+
+      {:ok, [score, id, seen, pool, now_ms]}
+      when is_number(score) and is_binary(id) and is_integer(seen) and is_integer(pool) and
+             is_integer(now_ms) ->
+        case DateTime.from_unix(now_ms, :millisecond) do
+          {:ok, now} -> {:ok, %{score: score, id: id, seen: max(seen, 0), pool: pool, now: now}}
+          {:error, _} -> {:error, :invalid_cursor}
+        end
+
+      _ ->
+        {:error, :invalid_cursor}
+    end
+  end
+
+  defp run_search(query_str, context_id, cursor, opts) do
+    limit = Keyword.get(opts, :limit, @default_limit)
+
+    # A cursor pins the ranking of its first page
+    {seen, pool, now} =
+      case cursor do
+        nil ->
+          seen = Keyword.get(opts, :offset, 0)
+          {seen, max(seen + limit + 1, @min_pool), DateTime.utc_now()}
+
+        %{seen: seen, pool: pool, now: now} ->
+          {seen, pool, now}
+      end
+
+    boosts = Keyword.get(opts, :boosts, config(:boosts, []))
+
+    results =
+      opts
+      |> Keyword.get(:retrievers, @retrievers)
+      |> run(query_str, context_id, pool)
+
+    ranked =
+      results
+      |> Enum.flat_map(fn
+        {retriever, {:ok, ranked}} -> [{retriever, ranked}]
+        _ -> []
+      end)
+      |> fuse()
+      |> Enum.map(&boost(&1, boosts, now))
+      |> Enum.sort(fn a, b ->
+        a.score > b.score or (a.score == b.score and a.memory.id <= b.memory.id)
+      end)
+
+    degraded = for {retriever, status} <- results, status in [:error, :timeout], do: retriever
+
+    rest =
+      case cursor do
+        nil ->
+          Enum.drop(ranked, seen)
+
+        %{score: score, id: id} ->
+          Enum.drop_while(ranked, fn hit ->
+            hit.score > score or (hit.score == score and hit.memory.id <= id)
+          end)
+      end
+
+    {hits, more} = Enum.split(rest, limit)
+    last = List.last(hits)
+
+    {:ok,
+     %{
+       hits: hits,
+       next_offset: if(more != [], do: seen + limit),
+       next_cursor: if(more != [], do: encode_cursor(last, seen + limit, pool, now)),
+       degraded: degraded
+     }}
+  end
+
+  defp encode_cursor(last, seen, pool, now) do
+    Cursor.encode([last.score, last.memory.id, seen, pool, DateTime.to_unix(now, :millisecond)])
+  end
+
+  # Retrievers
+
+  # All retrievers start at once; each is awaited until its own deadline
+  defp run(retrievers, query_str, context_id, pool) do
+    started = System.monotonic_time(:millisecond)
+    timeouts = Map.merge(@default_timeouts_ms, config(:timeouts_ms, %{}))
+
+    retrievers
+    |> Enum.map(fn retriever ->
+      fun = fn -> retrieve(retriever, query_str, context_id, pool) end
+      task = start_task(fn -> :timer.tc(fun) end)
+      {retriever, task, started + Map.fetch!(timeouts, retriever)}
+    end)
+    |> Enum.map(fn {retriever, task, deadline} ->
+      wait = max(deadline - System.monotonic_time(:millisecond), 0)
+      elapsed_ms = fn -> System.monotonic_time(:millisecond) - started end
+
+      {result, duration_ms} =
+        case Task.yield(task, wait) || Task.shutdown(task, :brutal_kill) do
+          {:ok, {us, {:ok, ranked}}} ->
+            {{:ok, ranked}, us / 1000}
+
+          {:ok, {us, other}} ->
+            Logger.debug("[DiwaAgent.HybridSearch] #{retriever} failed: #{inspect(other)}")
+            {:error, us / 1000}
+
+          {:exit, reason} ->
+            Logger.warning("[DiwaAgent.HybridSearch] #{retriever} crashed: #{inspect(reason)}")
+            {:error, elapsed_ms.()}
+
+          nil ->
+            Logger.warning("[DiwaAgent.HybridSearch] #{retriever} timed out")
+            {:timeout, elapsed_ms.()}
+        end
+
+      emit(retriever, result, duration_ms)
+      {retriever, result}
+    end)
+  end
+
+  defp start_task(fun) do
+    case Process.whereis(DiwaAgent.TaskSupervisor) do
+      nil -> Task.async(fun)
+      _ -> Task.Supervisor.async_nolink(DiwaAgent.TaskSupervisor, fun)
+    end
+  end
+
+  defp retrieve(:lexical, query_str, context_id, pool) do
+    case FullTextIndex.search(query_str, context_id: context_id, limit: pool) do
+      {:ok, [_ | _] = hits} ->
+        {:ok, Enum.map(hits, &{&1.memory, &1.rank})}
+
+      _ ->
+        # Partial words: substring scan, newest first
+        with {:ok, memories} <- Memory.search_text(query_str, context_id, limit: pool) do
+          {:ok, Enum.map(memories, &{&1, nil})}
+        end
+    end
+  end
+
+  defp retrieve(:vector, query_str, context_id, pool) do
+    min_similarity = config(:min_similarity, @default_min_similarity)
+
+    with {:ok, query_vec} <- @embedding_module.generate_embedding(query_str),
+         {:ok, results} <- @vector_repo_module.search(query_vec, pool, context_id: context_id) do
+      similarity =
+        for r <- results, r.similarity >= min_similarity, into: %{}, do: {r.id, r.similarity}
+
+      ids = Map.keys(similarity)
+      query = from(m in DiwaSchema.Core.Memory, where: m.id in ^ids, where: is_nil(m.deleted_at))
+      query = if context_id, do: where(query, [m], m.context_id == ^context_id), else: query
+
+      ranked =
+        query
+        |> Repo.all()
+        |> Enum.map(&{&1, similarity[&1.id]})
+        |> Enum.sort_by(&elem(&1, 1), :desc)
+
+      {:ok, ranked}
+    end
+  end
+
+  defp retrieve(:fuzzy, query_str, context_id, pool) do
+    with {:ok, scored} <- Memory.fuzzy_hits(query_str, context_id, candidates: pool) do
+      {:ok, Enum.take(scored, pool)}
+    end
+  end
+
+  defp emit(retriever, result, duration_ms) do
+    {status, hits} =
+      case result do
+        {:ok, ranked} -> {:ok, length(ranked)}
+        status -> {status, 0}
+      end
+
+    DiwaAgent.Telemetry.execute(
+      [:diwa_agent, :search, :retriever],
+      %{duration_ms: duration_ms, hits: hits},
+      %{retriever: retriever, status: status}
+    )
+  end
+
+  # Fusion
+
+  defp fuse(rankings) do
+    k = config(:rrf_k, @default_rrf_k)
+    weights = Map.merge(@default_weights, config(:weights, %{}))
+
+    rankings
+    |> Enum.reduce(%{}, fn {retriever, ranked}, acc ->
+      weight = Map.fetch!(weights, retriever)
+
+      ranked
+      |> Enum.with_index(1)
+      |> Enum.reduce(acc, fn {{memory, raw}, rank}, acc ->
+        contribution = weight / (k + rank)
+        source = %{rank: rank, score: raw}
+
+        Map.update(
+          acc,
+          memory.id,
+          %{memory: memory, score: contribution, sources: %{retriever => source}},
+          fn hit ->
+            %{
+              hit
+              | score: hit.score + contribution,
+                sources: Map.put(hit.sources, retriever, source)
+            }
+          end
+        )
+      end)
+    end)
+    |> Map.values()
+  end
+
+  defp boost(hit, [], _now), do: hit
+
+  defp boost(%{memory: memory} = hit, boosts, now) do
+    priority = boosts |> Keyword.get(:priority, %{}) |> Map.get(memory.priority, 1.0)
+    class = boosts |> Keyword.get(:memory_class, %{}) |> Map.get(memory.memory_class, 1.0)
+
+    recency =
+      case Keyword.get(boosts, :recency_half_life_days) do
+        nil ->
+          1.0
+
+        half_life ->
+          weight = Keyword.get(boosts, :recency_weight, @default_recency_weight)
+          1.0 + weight * :math.pow(0.5, age_days(memory.inserted_at, now) / half_life)
+      end
+
+    %{hit | score: hit.score * priority * class * recency}
+  end
+
+  defp age_days(%DateTime{} = at, now), do: max(DateTime.diff(now, at), 0) / 86_400
+
+  defp age_days(%NaiveDateTime{} = at, now),
+    do: max(NaiveDateTime.diff(DateTime.to_naive(now), at), 0) / 86_400
+
+  defp age_days(_, _now), do: 0
+
+  defp config(key, default) do
+    :diwa_agent
+    |> Application.get_env(__MODULE__, [])
+    |> Keyword.get(key, default)
+  end
+end
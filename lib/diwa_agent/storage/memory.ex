@@ -4,10 +4,23 @@ defmodule DiwaAgent.Storage.Memory do
   Includes versioning and soft-delete support.
   """
 
+  alias DiwaAgent.AI.EmbeddingPipeline
   alias DiwaAgent.Repo
   alias DiwaSchema.Core.Memory
   alias DiwaSchema.Core.Context
-  alias DiwaAgent.Storage.MemoryVersion
+  alias DiwaAgent.Storage.{
+    AfterCommit,
+    BulkInsert,
+    ContentHash,
+    Cursor,
+    FullTextIndex,
+    HotCache,
+    HybridSearch,
+    MemoryFingerprint,
+    MemoryVersion,
+    TrigramIndex
+  }
+  alias DiwaAgent.Utils.Fuzzy
   import Ecto.Query
   require Logger
 
@@ -22,6 +35,11 @@ defmodule DiwaAgent.Storage.Memory do
                         DiwaAgent.Storage.PgVectorRepo
                       )
 
+  @fuzzy_candidates 200
+  @max_tree_depth 50
+  # Minimum Fuzzy.partial_score for a fuzzy hit
+  @fuzzy_threshold 0.8
+
   @type memory :: %{
           id: String.t(),
           context_id: String.t(),
@@ -46,34 +64,8 @@ defmodule DiwaAgent.Storage.Memory do
 
   def add(context_id, content, opts) do
     opts = normalize_opts(opts)
-    raw_metadata = Map.get(opts, :metadata) || %{}
-
-    with {:ok, metadata} <- decode_safe(raw_metadata) do
-      metadata = metadata || %{}
-      tags = normalize_tags(Map.get(opts, :tags))
-
-      # Automated Classification (Module 2)
-      {:ok, class, priority, lifecycle} =
-        DiwaAgent.ContextBridge.MemoryClassification.classify(content)
-
-      attrs = %{
-        context_id: context_id,
-        content: content,
-        metadata: metadata,
-        actor: Map.get(opts, :actor),
-        project: Map.get(opts, :project),
-        tags: tags,
-        parent_id: Map.get(opts, :parent_id),
-        external_ref: Map.get(opts, :external_ref),
-        severity: Map.get(opts, :severity),
-        # Context Bridge Fields
-        memory_class: Map.get(opts, :memory_class) || Atom.to_string(class),
-        priority: Map.get(opts, :priority) || Atom.to_string(priority),
-        lifecycle: Map.get(opts, :lifecycle) || Atom.to_string(lifecycle),
-        confidence: Map.get(opts, :confidence, 1.0),
-        source: Map.get(opts, :source)
-      }
 
+    with {:ok, attrs} <- memory_attrs(context_id, content, opts) do
       # attrs = add_embedding(attrs, content)
 
       case Repo.get(Context, context_id) do
@@ -89,6 +81,8 @@ defmodule DiwaAgent.Storage.Memory do
                   reason: Map.get(opts, :reason)
                 })
 
+                MemoryFingerprint.record(memory)
+
                 update_context_timestamp(context_id)
                 memory
 
@@ -98,8 +92,7 @@ defmodule DiwaAgent.Storage.Memory do
           end)
           |> case do
             {:ok, memory} ->
-              spawn_embedding_task(memory, content)
-              spawn_cloud_sync_task(memory)
+              after_write(memory, content)
               {:ok, memory}
 
             {:error, %Ecto.Changeset{} = cs} ->
@@ -109,34 +102,125 @@ defmodule DiwaAgent.Storage.Memory do
               other
           end
       end
+    end
+  end
+
+  @doc """
+  Add many memories to a context in bulk.
+
+  Each item is a map with `:content` plus any option accepted by `add/3`.
+  The context is checked once, items are validated and classified
+  in-process, and memories plus their "create" versions are written with
+  `Repo.insert_all` in chunked transactions. The context timestamp is
+  touched once.
+
+  Options:
+    * `:chunk_size` - rows per transaction (default 500)
+    * `:skip_duplicates` - skip items whose content (compared by normalised
+      hash, see `DiwaAgent.Storage.ContentHash`) already exists in the
+      context or earlier in the batch (default false)
+
+  Returns `{:ok, results}` with one entry per item, in input order:
+  `{:ok, memory}`, `{:skipped, :duplicate}` or `{:error, reason}`. Called
+  inside an enclosing transaction, a failing chunk raises instead of being
+  retried row by row, failing that transaction.
+  """
+  def add_many(context_id, items, opts \\ %{})
+  def add_many(nil, _items, _opts), do: {:error, :context_not_found}
+
+  def add_many(context_id, items, opts) when is_list(items) do
+    opts = Map.new(opts)
+
+    with {:ok, context_id} <- validate_context_id(context_id),
+         %Context{} <- Repo.get(Context, context_id) do
+      chunk_size = Map.get(opts, :chunk_size, 500)
+
+      prepared =
+        items
+        |> Enum.map(&build_memory(context_id, &1))
+        |> mark_duplicates(context_id, Map.get(opts, :skip_duplicates, false))
+
+      results =
+        prepared
+        |> Enum.chunk_every(chunk_size)
+        |> Enum.flat_map(&insert_chunk/1)
+
+      inserted = for {:ok, memory} <- results, do: memory
+
+      if inserted != [] do
+        update_context_timestamp(context_id)
+        Enum.each(inserted, &after_write(&1, &1.content))
+      end
+
+      {:ok, results}
     else
-      {:error, _} -> {:error, :invalid_metadata}
+      nil -> {:error, :context_not_found}
+      {:error, reason} -> {:error, reason}
+    end
+  end
+
+  @doc """
+  Queue embeddings for `memories` written without `add/3` or `update/3`,
+  e.g. rows restored by an import. Deleted memories are skipped.
+  """
+  def reembed(memories) do
+    for %{deleted_at: nil} = memory <- memories do
+      AfterCommit.run(fn -> spawn_embedding_task(memory, memory.content) end)
     end
+
+    :ok
   end
 
   @doc """
   List all memories in a context (active only).
+
+  Pages with `:limit`/`:offset`; prefer `list_page/2`, whose cost does not
+  grow with the page number.
   """
   def list(context_id, opts \\ []) do
-    # Validate context_id is a valid UUID before building the query
-    case Ecto.UUID.cast(context_id) do
-      {:ok, valid_uuid} ->
+    case list_query(context_id, opts) do
+      {:ok, query} ->
         limit = Keyword.get(opts, :limit, 100)
         offset = Keyword.get(opts, :offset, 0)
-        include_deleted = Keyword.get(opts, :include_deleted, false)
 
         query =
-          from(m in Memory,
-            where: m.context_id == ^valid_uuid,
-            order_by: [desc: m.inserted_at],
+          from(m in query,
+            order_by: [desc: m.inserted_at, desc: m.id],
             limit: ^limit,
             offset: ^offset
           )
 
-        query = if include_deleted, do: query, else: where(query, [m], is_nil(m.deleted_at))
-
         {:ok, Repo.all(query)}
 
+      error ->
+        error
+    end
+  end
+
+  @doc """
+  One page of the memories in a context, newest first.
+
+  Options: `:limit` (default 100), `:cursor` (the `next_cursor` of the
+  previous page) and `:include_deleted`. Returns
+  `{:ok, %{entries: memories, next_cursor: cursor | nil}}`; see
+  `DiwaAgent.Storage.Cursor`.
+  """
+  def list_page(context_id, opts \\ []) do
+    with {:ok, query} <- list_query(context_id, opts) do
+      Cursor.page(query, opts)
+    end
+  end
+
+  defp list_query(context_id, opts) do
+    # Validate context_id is a valid UUID before building the query
+    case Ecto.UUID.cast(context_id) do
+      {:ok, valid_uuid} ->
+        query = from(m in Memory, where: m.context_id == ^valid_uuid)
+
+        if Keyword.get(opts, :include_deleted, false),
+          do: {:ok, query},
+          else: {:ok, where(query, [m], is_nil(m.deleted_at))}
+
       :error ->
         Logger.warning("Invalid context_id provided to Memory.list/2: #{inspect(context_id)}")
         {:error, :invalid_context_id}
@@ -195,21 +279,27 @@ defmodule DiwaAgent.Storage.Memory do
         Repo.transaction(fn ->
           case memory |> Memory.changeset(changes) |> Repo.update() do
             {:ok, updated} ->
-              spawn_embedding_task(updated, content)
-
               MemoryVersion.record(updated, "update", %{
                 actor: opts[:actor],
                 reason: opts[:reason]
               })
 
+              MemoryFingerprint.record(updated)
               update_context_timestamp(updated.context_id)
-              spawn_cloud_sync_task(updated)
               updated
 
             {:error, cs} ->
               Repo.rollback(cs)
           end
         end)
+        |> case do
+          {:ok, updated} = result ->
+            after_write(updated, content)
+            result
+
+          error ->
+            error
+        end
     end
   end
 
@@ -238,6 +328,7 @@ defmodule DiwaAgent.Storage.Memory do
                   Repo.rollback(cs)
               end
             end)
+            |> invalidate_cache(memory.context_id)
         end
       else
         {:error, :invalid_metadata}
@@ -271,6 +362,7 @@ defmodule DiwaAgent.Storage.Memory do
               Repo.rollback(cs)
           end
         end)
+        |> invalidate_cache(memory.context_id)
     end
   end
 
@@ -297,110 +389,158 @@ defmodule DiwaAgent.Storage.Memory do
               Repo.rollback(cs)
           end
         end)
+        |> invalidate_cache(memory.context_id)
     end
   end
 
   @doc """
-  Search memories (active only).
-  """
-  def search(query_str, context_id \\ nil) do
-    # Try vector search first via configured modules
-    with {:ok, query_vec} <- @embedding_module.generate_embedding(query_str),
-         {:ok, results} <- @vector_repo_module.search(query_vec, 20, context_id: context_id) do
-      # Extract IDs and similarity scores
-      # results is list of %{id: id, similarity: score, ...}
-      results = Enum.filter(results, fn r -> r.similarity >= 0.25 end)
-      id_map = Map.new(results, fn r -> {r.id, r.similarity} end)
-      ids = Map.keys(id_map)
-
-      base_query = from(m in Memory, where: m.id in ^ids)
-
-      final_query =
-        if context_id do
-          from(m in base_query, where: m.context_id == ^context_id)
-        else
-          base_query
-        end
+  Search memories (active only), best match first.
 
-      final_query
-      |> Repo.all()
-      |> Enum.sort_by(fn m -> id_map[m.id] end, :desc)
-      |> then(fn
-        [] -> search_text(query_str, context_id)
-        results -> {:ok, results}
-      end)
-    else
-      _ ->
-        # Fallback to Postgres FTS
-        search_text(query_str, context_id)
+  Runs the lexical, vector and fuzzy retrievers of
+  `DiwaAgent.Storage.HybridSearch` concurrently and returns the memories in
+  fused rank order.
+
+  Options: `:limit` (default 50) and `:offset`.
+  """
+  def search(query_str, context_id \\ nil, opts \\ []) do
+    with {:ok, valid_context_id} <- validate_context_id(context_id),
+         {:ok, %{hits: hits}} <-
+           HybridSearch.search(query_str,
+             context_id: valid_context_id,
+             limit: Keyword.get(opts, :limit, 50),
+             offset: Keyword.get(opts, :offset, 0)
+           ) do
+      {:ok, Enum.map(hits, & &1.memory)}
     end
   end
 
-  def search_text(query_str, context_id \\ nil) do
+  @doc """
+  Text search over active memories, best match first.
+
+  Uses the full-text index (FTS5 on SQLite, tsvector on Postgres) and falls
+  back to a substring scan when the index is missing or has no hit at all
+  for the query, so partial-word queries keep working. A query answered by
+  the index is paged by the index alone: an empty page past its last hit
+  stays empty instead of switching to the substring scan's ordering.
+
+  Options: `:limit` (default 50) and `:offset`.
+  """
+  def search_text(query_str, context_id \\ nil, opts \\ []) do
     with {:ok, valid_context_id} <- validate_context_id(context_id) do
-      adapter = Application.get_env(:diwa_agent, DiwaAgent.Repo)[:adapter]
+      limit = Keyword.get(opts, :limit, 50)
+      offset = Keyword.get(opts, :offset, 0)
+
+      case FullTextIndex.search(query_str,
+             context_id: valid_context_id,
+             limit: limit,
+             offset: offset
+           ) do
+        {:ok, [_ | _] = hits} ->
+          {:ok, Enum.map(hits, & &1.memory)}
+
+        {:ok, []} when offset > 0 ->
+          if full_text_hit?(query_str, valid_context_id),
+            do: {:ok, []},
+            else: substring_search(query_str, valid_context_id, limit, offset)
+
+        _ ->
+          substring_search(query_str, valid_context_id, limit, offset)
+      end
+    end
+  end
 
-      base_query =
-        from(m in Memory,
-          where: is_nil(m.deleted_at),
-          limit: 50
-        )
+  defp full_text_hit?(query_str, context_id) do
+    match?(
+      {:ok, [_ | _]},
+      FullTextIndex.search(query_str, context_id: context_id, limit: 1, offset: 0)
+    )
+  end
 
-      base_query =
-        if adapter == Ecto.Adapters.Postgres do
-          from(m in base_query, where: ilike(m.content, ^"%#{query_str}%"))
-        else
-          from(m in base_query,
-            where: fragment("lower(?) LIKE ?", m.content, ^"%#{String.downcase(query_str)}%")
-          )
-        end
+  defp substring_search(query_str, valid_context_id, limit, offset) do
+    adapter = Application.get_env(:diwa_agent, DiwaAgent.Repo)[:adapter]
 
-      query =
-        if valid_context_id,
-          do: where(base_query, [m], m.context_id == ^valid_context_id),
-          else: base_query
+    base_query =
+      from(m in Memory,
+        where: is_nil(m.deleted_at),
+        order_by: [desc: m.inserted_at, desc: m.id],
+        limit: ^limit,
+        offset: ^offset
+      )
 
-      {:ok, Repo.all(query)}
-    end
+    base_query =
+      if adapter == Ecto.Adapters.Postgres do
+        from(m in base_query, where: ilike(m.content, ^"%#{query_str}%"))
+      else
+        from(m in base_query,
+          where: fragment("lower(?) LIKE ?", m.content, ^"%#{String.downcase(query_str)}%")
+        )
+      end
+
+    query =
+      if valid_context_id,
+        do: where(base_query, [m], m.context_id == ^valid_context_id),
+        else: base_query
+
+    {:ok, Repo.all(query)}
   end
 
   @doc """
   Fuzzy search fallback using Jaro-Winkler on memory content.
+
+  Candidates come from the trigram index (`TrigramIndex.memory_candidates/2`),
+  so older memories are reachable too; without it the most recent
+  #{@fuzzy_candidates} memories are scored.
   """
   def fuzzy_search(query_str, context_id \\ nil) do
-    with {:ok, valid_context_id} <- validate_context_id(context_id) do
-      # Only search recent or limited set to avoid performance issues
-      limit = 200
-
-      base_query =
-        from(m in Memory,
-          where: is_nil(m.deleted_at),
-          order_by: [desc: m.inserted_at],
-          limit: ^limit
-        )
-
-      query =
-        if valid_context_id,
-          do: where(base_query, [m], m.context_id == ^valid_context_id),
-          else: base_query
+    with {:ok, scored} <- fuzzy_hits(query_str, context_id) do
+      {:ok, Enum.map(scored, &elem(&1, 0))}
+    end
+  end
 
-      memories = Repo.all(query)
+  @doc """
+  Same as `fuzzy_search/2`, with each memory's `Fuzzy.partial_score/2` as
+  `{memory, score}`. `:candidates` raises the number of memories scored
+  (at least #{@fuzzy_candidates}), for callers paging deep into the hits.
+  """
+  def fuzzy_hits(query_str, context_id \\ nil, opts \\ []) do
+    with {:ok, valid_context_id} <- validate_context_id(context_id) do
+      limit = max(Keyword.get(opts, :candidates, 0), @fuzzy_candidates)
+
+      candidates =
+        case TrigramIndex.memory_candidates(query_str,
+               context_id: valid_context_id,
+               limit: limit
+             ) do
+          {:ok, memories} -> memories
+          {:error, _} -> recent_memories(valid_context_id, limit)
+        end
 
       scored =
-        memories
-        |> Enum.map(fn m ->
-          # Check both content and optional metadata (like tags/title if any)
-          score = DiwaAgent.Utils.Fuzzy.jaro_winkler(query_str, String.slice(m.content, 0, 100))
-          {m, score}
-        end)
-        |> Enum.filter(fn {_, score} -> score >= 0.65 end)
+        candidates
+        |> Enum.map(fn m -> {m, Fuzzy.partial_score(query_str, m.content)} end)
+        |> Enum.filter(fn {_, score} -> score >= @fuzzy_threshold end)
         |> Enum.sort_by(fn {_, score} -> score end, :desc)
-        |> Enum.map(&elem(&1, 0))
 
       {:ok, scored}
     end
   end
 
+  defp recent_memories(context_id, limit) do
+    base_query =
+      from(m in Memory,
+        where: is_nil(m.deleted_at),
+        order_by: [desc: m.inserted_at],
+        limit: ^limit
+      )
+
+    query =
+      if context_id,
+        do: where(base_query, [m], m.context_id == ^context_id),
+        else: base_query
+
+    Repo.all(query)
+  end
+
   @doc """
   Count total memories in a context.
   """
@@ -415,23 +555,20 @@ defmodule DiwaAgent.Storage.Memory do
 
   @doc """
   List memories by type (e.g., 'handoff', 'decision').
+
+  The `metadata` type expression below must stay identical to the one in the
+  `(context_id, type, deleted_at, inserted_at)` expression index, or the
+  database falls back to scanning the context.
   """
   def list_by_type(context_id, type) do
     with {:ok, valid_context_id} <- validate_context_id(context_id) do
-      # Check configured adapter (defaulting to SQLite path if not Postgres)
-      adapter = Application.get_env(:diwa_agent, DiwaAgent.Repo)[:adapter]
-
       query =
-        from(m in Memory,
-          where: m.context_id == ^valid_context_id,
-          where: is_nil(m.deleted_at),
-          order_by: [desc: m.inserted_at]
-        )
+        from(m in active_in(valid_context_id), order_by: [desc: m.inserted_at])
 
       query =
-        if adapter == Ecto.Adapters.Postgres do
+        if postgres?() do
           # Postgres JSONB syntax
-          from(m in query, where: fragment("?->>'type' = ?", m.metadata, ^type))
+          from(m in query, where: fragment("(?->>'type') = ?", m.metadata, ^type))
         else
           # SQLite syntax
           from(m in query, where: fragment("json_extract(?, '$.type') = ?", m.metadata, ^type))
@@ -442,15 +579,13 @@ defmodule DiwaAgent.Storage.Memory do
   end
 
   @doc """
-  List memories containing a specific tag.
+  List memories whose `memory_class` is one of `classes`.
   """
-  def list_by_tag(context_id, tag) do
+  def list_by_class(context_id, classes) when is_list(classes) do
     with {:ok, valid_context_id} <- validate_context_id(context_id) do
       query =
-        from(m in Memory,
-          where: m.context_id == ^valid_context_id,
-          where: is_nil(m.deleted_at),
-          where: ^tag in m.tags,
+        from(m in active_in(valid_context_id),
+          where: m.memory_class in ^classes,
           order_by: [desc: m.inserted_at]
         )
 
@@ -458,6 +593,51 @@ defmodule DiwaAgent.Storage.Memory do
     end
   end
 
+  @doc """
+  List memories containing a specific tag.
+
+  Postgres answers this from the GIN index on `tags` (`@>`); SQLite from the
+  trigger-maintained `memory_tags` table.
+  """
+  def list_by_tag(context_id, tag) do
+    with {:ok, valid_context_id} <- validate_context_id(context_id) do
+      query = from(m in tag_query(valid_context_id, tag), order_by: [desc: m.inserted_at])
+      {:ok, Repo.all(query)}
+    end
+  end
+
+  @doc """
+  One page of `list_by_tag/2`, newest first. Options and result as in
+  `list_page/2`.
+  """
+  def list_by_tag_page(context_id, tag, opts \\ []) do
+    with {:ok, valid_context_id} <- validate_context_id(context_id) do
+      valid_context_id |> tag_query(tag) |> Cursor.page(opts)
+    end
+  end
+
+  defp tag_query(context_id, tag) do
+    if postgres?() do
+      from(m in active_in(context_id),
+        where: fragment("? @> ?", m.tags, type(^[tag], {:array, :string}))
+      )
+    else
+      from(m in active_in(context_id),
+        where:
+          fragment(
+            "? IN (SELECT memory_id FROM memory_tags WHERE context_id = ? AND tag = ?)",
+            m.id,
+            ^context_id,
+            ^tag
+          )
+      )
+    end
+  end
+
+  defp active_in(context_id) do
+    from(m in Memory, where: m.context_id == ^context_id, where: is_nil(m.deleted_at))
+  end
+
   @doc """
   Find similar memories using vector similarity.
   """
@@ -488,6 +668,75 @@ defmodule DiwaAgent.Storage.Memory do
     {:ok, Repo.all(query)}
   end
 
+  @doc """
+  Load the tree of active memories below `root_id` with one recursive query.
+
+  Returns `{:ok, %{memory: memory, children: [node]}}`, children oldest
+  first. Descendants deeper than `:max_depth` (default #{@max_tree_depth})
+  are left out; a `parent_id` cycle is cut where it meets a memory already
+  in the tree.
+  """
+  def get_tree(root_id, opts \\ []) do
+    max_depth = Keyword.get(opts, :max_depth, @max_tree_depth)
+
+    with {:ok, valid_id} <- cast_id(root_id) do
+      initial =
+        from(m in Memory, where: m.id == ^valid_id and is_nil(m.deleted_at), select: %{id: m.id})
+
+      # UNION discards ids already produced, so cycles terminate
+      recursion =
+        from(m in Memory,
+          join: t in "memory_tree",
+          on: m.parent_id == t.id,
+          where: is_nil(m.deleted_at),
+          select: %{id: m.id}
+        )
+
+      memories =
+        from(m in Memory, join: t in "memory_tree", on: m.id == t.id, order_by: m.inserted_at)
+        |> recursive_ctes(true)
+        |> with_cte("memory_tree", as: ^union(initial, ^recursion))
+        |> Repo.all()
+
+      case Enum.find(memories, &(&1.id == valid_id)) do
+        nil ->
+          {:error, :not_found}
+
+        root ->
+          children = Enum.group_by(memories, & &1.parent_id)
+          {node, _seen} = tree_node(root, children, max_depth, MapSet.new([root.id]))
+          {:ok, node}
+      end
+    end
+  end
+
+  defp cast_id(id) do
+    case Ecto.UUID.cast(id) do
+      {:ok, valid_id} -> {:ok, valid_id}
+      :error -> {:error, :not_found}
+    end
+  end
+
+  defp tree_node(memory, children, depth, seen) do
+    {nodes, seen} =
+      if depth > 0 do
+        children
+        |> Map.get(memory.id, [])
+        |> Enum.flat_map_reduce(seen, fn child, seen ->
+          if MapSet.member?(seen, child.id) do
+            {[], seen}
+          else
+            {node, seen} = tree_node(child, children, depth - 1, MapSet.put(seen, child.id))
+            {[node], seen}
+          end
+        end)
+      else
+        {[], seen}
+      end
+
+    {%{memory: memory, children: nodes}, seen}
+  end
+
   @doc """
   Roll back a memory to a specific version.
   """
@@ -508,14 +757,13 @@ defmodule DiwaAgent.Storage.Memory do
 
         case memory |> Memory.changeset(changes) |> Repo.update() do
           {:ok, updated} ->
-            spawn_embedding_task(updated, version.content)
-
             MemoryVersion.record(updated, "rollback", %{
               actor: opts[:actor],
               reason: opts[:reason] || "Rollback to version #{version_id}",
               parent_version_id: version_id
             })
 
+            MemoryFingerprint.record(updated)
             updated
 
           {:error, cs} ->
@@ -525,6 +773,34 @@ defmodule DiwaAgent.Storage.Memory do
         {:error, reason} -> Repo.rollback(reason)
       end
     end)
+    |> case do
+      {:ok, updated} = result ->
+        AfterCommit.run(fn -> spawn_embedding_task(updated, updated.content) end)
+        invalidate_cache(result, updated.context_id)
+
+      error ->
+        error
+    end
+  end
+
+  # Cached session-start reads (DiwaAgent.Storage.HotCache) are dropped once
+  # a write has committed, which inside a caller's transaction
+  # (DiwaAgent.Storage.AfterCommit) is when that transaction commits
+  defp invalidate_cache({:ok, _} = result, context_id) do
+    AfterCommit.run(fn -> HotCache.invalidate(context_id) end)
+    result
+  end
+
+  defp invalidate_cache(result, _context_id), do: result
+
+  # The cache, the embedding and the cloud copy follow the memory only once
+  # it is committed, so none of them can see a write that is rolled back
+  defp after_write(memory, content) do
+    AfterCommit.run(fn ->
+      HotCache.invalidate(memory.context_id)
+      spawn_embedding_task(memory, content)
+      spawn_cloud_sync_task(memory)
+    end)
   end
 
   defp spawn_cloud_sync_task(memory) do
@@ -550,19 +826,29 @@ defmodule DiwaAgent.Storage.Memory do
   end
 
   defp spawn_embedding_task(memory, content) do
-    # Check if TaskSupervisor is started (e.g. in test env it might not be)
-    if Process.whereis(DiwaAgent.TaskSupervisor) do
-      Task.Supervisor.start_child(DiwaAgent.TaskSupervisor, fn ->
-        case @embedding_module.generate_embedding(content) do
-          {:ok, vec} ->
-            @vector_repo_module.upsert_embedding(memory.id, vec, %{})
-
-          _ ->
-            :ok
+    store = fn
+      {:ok, vec} ->
+        @vector_repo_module.upsert_embedding(memory.id, vec, %{context_id: memory.context_id})
+
+      _ ->
+        :ok
+    end
+
+    cond do
+      # Batched, cached and bounded; waits for room when the queue is full
+      @embedding_module == EmbeddingPipeline ->
+        with {:error, reason} <- EmbeddingPipeline.enqueue(content, store) do
+          Logger.warning("[DiwaAgent.Memory] Embedding delayed: #{inspect(reason)}")
         end
-      end)
-    else
-      :ok
+
+      # Check if TaskSupervisor is started (e.g. in test env it might not be)
+      Process.whereis(DiwaAgent.TaskSupervisor) ->
+        Task.Supervisor.start_child(DiwaAgent.TaskSupervisor, fn ->
+          store.(@embedding_module.generate_embedding(content))
+        end)
+
+      true ->
+        :ok
     end
   end
 
@@ -593,6 +879,154 @@ defmodule DiwaAgent.Storage.Memory do
   defp decode_safe(val) when is_binary(val), do: Jason.decode(val)
   defp decode_safe(val), do: {:ok, val}
 
+  defp memory_attrs(context_id, content, opts) do
+    raw_metadata = Map.get(opts, :metadata) || %{}
+
+    case decode_safe(raw_metadata) do
+      {:ok, metadata} ->
+        # Automated Classification (Module 2)
+        {:ok, class, priority, lifecycle} =
+          DiwaAgent.ContextBridge.MemoryClassification.classify(content)
+
+        {:ok,
+         %{
+           context_id: context_id,
+           content: content,
+           metadata: metadata || %{},
+           actor: Map.get(opts, :actor),
+           project: Map.get(opts, :project),
+           tags: normalize_tags(Map.get(opts, :tags)),
+           parent_id: Map.get(opts, :parent_id),
+           external_ref: Map.get(opts, :external_ref),
+           severity: Map.get(opts, :severity),
+           # Context Bridge Fields
+           memory_class: Map.get(opts, :memory_class) || Atom.to_string(class),
+           priority: Map.get(opts, :priority) || Atom.to_string(priority),
+           lifecycle: Map.get(opts, :lifecycle) || Atom.to_string(lifecycle),
+           confidence: Map.get(opts, :confidence, 1.0),
+           source: Map.get(opts, :source)
+         }}
+
+      {:error, _} ->
+        {:error, :invalid_metadata}
+    end
+  end
+
+  # Bulk insert (add_many/3)
+
+  @item_keys ~w(content metadata actor project tags parent_id external_ref severity
+                memory_class priority lifecycle confidence source reason)a
+
+  # Items may use atom or string keys (raw tool arguments)
+  defp normalize_item(item) when is_map(item) do
+    for key <- @item_keys,
+        value = Map.get(item, key, Map.get(item, Atom.to_string(key))),
+        value != nil,
+        into: %{},
+        do: {key, value}
+  end
+
+  defp normalize_item(_item), do: %{}
+
+  defp build_memory(context_id, item) do
+    item = normalize_item(item)
+
+    with {:ok, attrs} <- memory_attrs(context_id, Map.get(item, :content), item),
+         %Ecto.Changeset{valid?: true} = changeset <- Memory.changeset(%Memory{}, attrs) do
+      memory = changeset |> Ecto.Changeset.apply_changes() |> BulkInsert.stamp()
+      {:ok, memory, Map.get(item, :reason)}
+    else
+      %Ecto.Changeset{} = changeset -> {:error, changeset}
+      {:error, reason} -> {:error, reason}
+    end
+  end
+
+  defp mark_duplicates(prepared, _context_id, false), do: prepared
+
+  # Keyed on the normalised content hash (indexed), not the content column
+  defp mark_duplicates(prepared, context_id, true) do
+    hashed =
+      Enum.map(prepared, fn
+        {:ok, memory, _reason} = entry -> {entry, ContentHash.hash(memory.content)}
+        other -> {other, nil}
+      end)
+
+    existing =
+      MemoryFingerprint.existing_hashes(context_id, for({_, h} <- hashed, h != nil, do: h))
+
+    hashed
+    |> Enum.map_reduce(existing, fn
+      {entry, nil}, seen ->
+        {entry, seen}
+
+      {entry, hash}, seen ->
+        if MapSet.member?(seen, hash),
+          do: {{:skipped, :duplicate}, seen},
+          else: {entry, MapSet.put(seen, hash)}
+    end)
+    |> elem(0)
+  end
+
+  defp insert_chunk(entries) do
+    pending = for {:ok, memory, reason} <- entries, do: {memory, reason}
+
+    case insert_pending(pending) do
+      :ok ->
+        Enum.map(entries, fn
+          {:ok, memory, _reason} -> {:ok, memory}
+          other -> other
+        end)
+
+      {:error, _reason} when length(pending) > 1 ->
+        # Retry row by row so one bad item does not fail its whole chunk
+        Enum.flat_map(entries, &insert_chunk([&1]))
+
+      {:error, reason} ->
+        Enum.map(entries, fn
+          {:ok, _memory, _reason} -> {:error, reason}
+          other -> other
+        end)
+    end
+  end
+
+  defp insert_pending([]), do: :ok
+
+  # Inside a caller's transaction a failed statement has already aborted it
+  # (on Postgres), so neither rescuing nor retrying row by row can work: the
+  # error propagates and fails the caller's transaction as a whole
+  defp insert_pending(pending) do
+    if Repo.in_transaction?() do
+      write_pending(pending)
+      :ok
+    else
+      insert_pending_chunk(pending)
+    end
+  end
+
+  defp insert_pending_chunk(pending) do
+    case Repo.transaction(fn -> write_pending(pending) end) do
+      {:ok, _} -> :ok
+      {:error, reason} -> {:error, reason}
+    end
+  rescue
+    e ->
+      Logger.warning("[DiwaAgent.Memory] Bulk insert failed: #{Exception.message(e)}")
+      {:error, e}
+  end
+
+  defp write_pending(pending) do
+    rows = Enum.map(pending, fn {memory, _reason} -> BulkInsert.to_row(memory) end)
+    Repo.insert_all(Memory, rows)
+
+    pending
+    |> Enum.map(fn {memory, reason} -> {memory, %{actor: memory.actor, reason: reason}} end)
+    |> MemoryVersion.record_many("create")
+
+    pending
+    |> Enum.map(fn {memory, _reason} -> memory end)
+    |> MemoryFingerprint.record_many()
+  end
+
   defp update_context_timestamp(context_id) do
     case Repo.get(Context, context_id) do
       nil ->
@@ -604,4 +1038,8 @@ defmodule DiwaAgent.Storage.Memory do
         |> Repo.update()
     end
   end
+
+  defp postgres? do
+    Application.get_env(:diwa_agent, DiwaAgent.Repo)[:adapter] == Ecto.Adapters.Postgres
+  end
 end
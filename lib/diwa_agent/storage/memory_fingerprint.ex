@@ -0,0 +1,121 @@
+defmodule DiwaAgent.Storage.MemoryFingerprint do
+  @moduledoc """
+  Indexed content hash per memory, used for duplicate detection.
+
+  Comparing `memories.content` directly needs a scan of an unindexed TEXT
+  column; lookups here hit the `(context_id, content_hash)` index instead.
+  Rows are written alongside every memory insert or content change and
+  removed with the memory (`ON DELETE CASCADE`). Memories created before the
+  table existed are filled in by `mix diwa.backfill_fingerprints`.
+  """
+
+  use Ecto.Schema
+  import Ecto.Query
+
+  alias DiwaAgent.Repo
+  alias DiwaAgent.Storage.{BulkInsert, ContentHash}
+
+  @primary_key {:memory_id, :binary_id, autogenerate: false}
+  @foreign_key_type :binary_id
+
+  schema "memory_fingerprints" do
+    field(:context_id, :binary_id)
+    field(:content_hash, :string)
+
+    timestamps(updated_at: false)
+  end
+
+  @doc """
+  Store (or refresh) the fingerprint of one memory.
+  """
+  def record(memory), do: record_many([memory])
+
+  @doc """
+  Store (or refresh) fingerprints for many memories in one statement.
+  """
+  def record_many([]), do: {0, nil}
+
+  def record_many(memories) do
+    rows =
+      Enum.map(memories, fn memory ->
+        %__MODULE__{
+          memory_id: memory.id,
+          context_id: memory.context_id,
+          content_hash: ContentHash.hash(memory.content)
+        }
+        |> BulkInsert.stamp()
+        |> BulkInsert.to_row()
+      end)
+
+    Repo.insert_all(__MODULE__, rows,
+      on_conflict: {:replace, [:content_hash, :context_id]},
+      conflict_target: :memory_id
+    )
+  end
+
+  @doc """
+  The subset of `hashes` already present in `context_id`.
+  """
+  def existing_hashes(_context_id, []), do: MapSet.new()
+
+  def existing_hashes(context_id, hashes) do
+    hashes
+    |> Enum.uniq()
+    |> Enum.chunk_every(500)
+    |> Enum.flat_map(fn chunk ->
+      Repo.all(
+        from(f in __MODULE__,
+          where: f.context_id == ^context_id and f.content_hash in ^chunk,
+          select: f.content_hash
+        )
+      )
+    end)
+    |> MapSet.new()
+  end
+
+  @doc """
+  Id of a memory in `context_id` whose content matches `content`, or nil.
+  """
+  def find_duplicate(context_id, content) do
+    hash = ContentHash.hash(content)
+
+    Repo.one(
+      from(f in __MODULE__,
+        where: f.context_id == ^context_id and f.content_hash == ^hash,
+        select: f.memory_id,
+        limit: 1
+      )
+    )
+  end
+
+  @doc """
+  Fingerprint memories that have none yet, `batch_size` at a time.
+  Returns the number of rows written.
+  """
+  def backfill(opts \\ []) do
+    batch_size = Keyword.get(opts, :batch_size, 1_000)
+    do_backfill(batch_size, 0)
+  end
+
+  defp do_backfill(batch_size, total) do
+    memories =
+      Repo.all(
+        from(m in DiwaSchema.Core.Memory,
+          left_join: f in __MODULE__,
+          on: f.memory_id == m.id,
+          where: is_nil(f.memory_id),
+          select: %{id: m.id, context_id: m.context_id, content: m.content},
+          limit: ^batch_size
+        )
+      )
+
+    case memories do
+      [] ->
+        total
+
+      memories ->
+        record_many(memories)
+        do_backfill(batch_size, total + length(memories))
+    end
+  end
+end
@@ -1,16 +1,74 @@
 defmodule DiwaAgent.Storage.MemoryVersion do
   @moduledoc """
   CRUD operations for memory versions.
+
+  Version rows keep the operation, actor, reason and lineage; the versioned
+  `content`, `tags` and `metadata` are stored in
+  `DiwaAgent.Storage.VersionPayload` as periodic snapshots with line deltas
+  in between, and filled back in by every read function here. Rows
+  written before payloads existed still carry their full copy until
+  `compact/1` (`mix diwa.compact_versions`) converts them.
+
+      config :diwa_agent, DiwaAgent.Storage.MemoryVersion, snapshot_every: 16
   """
   alias DiwaAgent.Repo
+  alias DiwaAgent.Storage.{BulkInsert, Cursor, VersionPayload}
   alias DiwaSchema.Core.MemoryVersion
   import Ecto.Query
 
+  @default_snapshot_every 16
+
   @doc """
-  Record a new version of a memory.
+  Record a new version of a memory. Returns `{:ok, version}` or
+  `{:error, reason}`.
   """
   def record(memory, operation, opts \\ %{}) do
-    attrs = %{
+    changeset = MemoryVersion.changeset(%MemoryVersion{}, version_attrs(memory, operation, opts))
+
+    with {:ok, version} <- Ecto.Changeset.apply_action(changeset, :insert) do
+      Repo.transaction(fn ->
+        # The changeset keeps the schema's constraints, so violations are
+        # returned as errors instead of raised
+        case changeset |> Ecto.Changeset.change(stripped()) |> Repo.insert() do
+          {:ok, stored} ->
+            VersionPayload.append(stored.id, memory.id, state(version), snapshot_every())
+            fill(stored, state(version))
+
+          {:error, reason} ->
+            Repo.rollback(reason)
+        end
+      end)
+    end
+  end
+
+  @doc """
+  Record one version per `{memory, opts}` pair with a single `insert_all`.
+  Call inside the transaction that wrote the memories; each memory must be
+  new (its version starts a payload chain).
+  """
+  def record_many(entries, operation) do
+    versions =
+      Enum.map(entries, fn {memory, opts} ->
+        %MemoryVersion{}
+        |> MemoryVersion.changeset(version_attrs(memory, operation, opts))
+        |> Ecto.Changeset.apply_changes()
+        |> BulkInsert.stamp()
+      end)
+
+    result =
+      Repo.insert_all(MemoryVersion, Enum.map(versions, &(&1 |> strip() |> BulkInsert.to_row())))
+
+    versions
+    |> Enum.flat_map(fn version ->
+      VersionPayload.build(version.memory_id, [{version.id, state(version)}], nil, 1)
+    end)
+    |> VersionPayload.insert()
+
+    result
+  end
+
+  defp version_attrs(memory, operation, opts) do
+    %{
       memory_id: memory.id,
       content: memory.content,
       tags: memory.tags || [],
@@ -20,10 +78,6 @@ defmodule DiwaAgent.Storage.MemoryVersion do
       reason: opts[:reason],
       parent_version_id: opts[:parent_version_id]
     }
-
-    %MemoryVersion{}
-    |> MemoryVersion.changeset(attrs)
-    |> Repo.insert()
   end
 
   @doc """
@@ -36,7 +90,19 @@ defmodule DiwaAgent.Storage.MemoryVersion do
         order_by: [desc: v.inserted_at]
       )
 
-    {:ok, Repo.all(query)}
+    {:ok, query |> Repo.all() |> hydrate()}
+  end
+
+  @doc """
+  One page of the history of a memory, newest first. Options `:limit`
+  (default 100) and `:cursor`; returns
+  `{:ok, %{entries: versions, next_cursor: cursor | nil}}` (see
+  `DiwaAgent.Storage.Cursor`).
+  """
+  def history_page(memory_id, opts \\ []) do
+    from(v in MemoryVersion, where: v.memory_id == ^memory_id)
+    |> Cursor.page(opts)
+    |> hydrate_page()
   end
 
   @doc """
@@ -45,7 +111,7 @@ defmodule DiwaAgent.Storage.MemoryVersion do
   def get(id) do
     case Repo.get(MemoryVersion, id) do
       nil -> {:error, :not_found}
-      version -> {:ok, version}
+      version -> {:ok, hd(hydrate([version]))}
     end
   end
 
@@ -62,7 +128,7 @@ defmodule DiwaAgent.Storage.MemoryVersion do
 
     case Repo.one(query) do
       nil -> {:error, :not_found}
-      version -> {:ok, version}
+      version -> {:ok, hd(hydrate([version]))}
     end
   end
 
@@ -79,6 +145,145 @@ defmodule DiwaAgent.Storage.MemoryVersion do
         preload: [:memory]
       )
 
-    {:ok, Repo.all(query)}
+    {:ok, query |> Repo.all() |> hydrate()}
+  end
+
+  @doc """
+  One page of `list_recent_changes/2`. Options and result as in
+  `history_page/2`.
+  """
+  def recent_changes_page(context_id, opts \\ []) do
+    from(v in MemoryVersion,
+      join: m in assoc(v, :memory),
+      where: m.context_id == ^context_id,
+      preload: [:memory]
+    )
+    |> Cursor.page(opts)
+    |> hydrate_page()
+  end
+
+  @doc """
+  Move the full copies of versions written before payloads existed into
+  payload chains, `:batch_size` memories (default 100) at a time, each
+  memory in its own transaction. Safe to re-run: only memories with
+  versions lacking a payload are processed.
+
+  Legacy versions are ordered by `inserted_at` and come before any version
+  that already has a payload. Returns `memories`, `versions`,
+  `bytes_before` (full copies) and `bytes_after` (payloads).
+  """
+  def compact(opts \\ []) do
+    batch_size = Keyword.get(opts, :batch_size, 100)
+    do_compact(batch_size, %{memories: 0, versions: 0, bytes_before: 0, bytes_after: 0})
+  end
+
+  defp do_compact(batch_size, totals) do
+    memory_ids =
+      Repo.all(
+        from(v in MemoryVersion,
+          left_join: p in VersionPayload,
+          on: p.version_id == v.id,
+          where: is_nil(p.version_id),
+          distinct: true,
+          select: v.memory_id,
+          limit: ^batch_size
+        )
+      )
+
+    case memory_ids do
+      [] ->
+        totals
+
+      memory_ids ->
+        totals =
+          Enum.reduce(memory_ids, totals, fn memory_id, totals ->
+            {:ok, stats} = Repo.transaction(fn -> compact_memory(memory_id) end)
+            Map.merge(totals, stats, fn _key, a, b -> a + b end)
+          end)
+
+        do_compact(batch_size, totals)
+    end
+  end
+
+  defp compact_memory(memory_id) do
+    versions =
+      Repo.all(
+        from(v in MemoryVersion,
+          where: v.memory_id == ^memory_id,
+          order_by: [asc: v.inserted_at, asc: v.id]
+        )
+      )
+
+    states = VersionPayload.states(Enum.map(versions, & &1.id))
+    {chained, legacy} = Enum.split_with(versions, &Map.has_key?(states, &1.id))
+
+    seqs =
+      Repo.all(
+        from(p in VersionPayload, where: p.memory_id == ^memory_id, select: {p.version_id, p.seq})
+      )
+      |> Map.new()
+
+    entries =
+      Enum.map(legacy, &{&1.id, state(&1)}) ++
+        (chained |> Enum.sort_by(&seqs[&1.id]) |> Enum.map(&{&1.id, states[&1.id]}))
+
+    Repo.delete_all(from(p in VersionPayload, where: p.memory_id == ^memory_id))
+    rows = VersionPayload.build(memory_id, entries, nil, snapshot_every())
+    VersionPayload.insert(rows)
+
+    legacy_ids = Enum.map(legacy, & &1.id)
+
+    legacy_ids
+    |> Enum.chunk_every(500)
+    |> Enum.each(fn ids ->
+      Repo.update_all(from(v in MemoryVersion, where: v.id in ^ids),
+        set: [content: "", tags: [], metadata: %{}]
+      )
+    end)
+
+    %{
+      memories: 1,
+      versions: length(entries),
+      bytes_before: entries |> Enum.map(fn {_id, state} -> full_bytes(state) end) |> Enum.sum(),
+      bytes_after: rows |> Enum.map(&byte_size(&1.data)) |> Enum.sum()
+    }
+  end
+
+  @doc """
+  Size in bytes of a version stored as a full copy.
+  """
+  def full_bytes({content, tags, metadata}) do
+    byte_size(content) + byte_size(Jason.encode!(tags)) + byte_size(Jason.encode!(metadata))
+  end
+
+  # Fill in content, tags and metadata from the payloads; legacy rows keep
+  # their own copy
+  defp hydrate(versions) do
+    states = VersionPayload.states(Enum.map(versions, & &1.id))
+
+    Enum.map(versions, fn version ->
+      case Map.fetch(states, version.id) do
+        {:ok, state} -> fill(version, state)
+        :error -> version
+      end
+    end)
+  end
+
+  defp hydrate_page({:ok, page}), do: {:ok, %{page | entries: hydrate(page.entries)}}
+  defp hydrate_page(error), do: error
+
+  defp state(version), do: {version.content, version.tags || [], version.metadata || %{}}
+
+  defp fill(version, {content, tags, metadata}),
+    do: %{version | content: content, tags: tags, metadata: metadata}
+
+  defp strip(version), do: Map.merge(version, stripped())
+
+  defp stripped, do: %{content: "", tags: [], metadata: %{}}
+
+  defp snapshot_every do
+    :diwa_agent
+    |> Application.get_env(__MODULE__, [])
+    |> Keyword.get(:snapshot_every, @default_snapshot_every)
   end
 end
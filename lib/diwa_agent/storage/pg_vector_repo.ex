@@ -1,14 +1,19 @@
 defmodule DiwaAgent.Storage.PgVectorRepo do
   @moduledoc """
   PostgreSQL implementation of VectorRepo using Ecto and pgvector.
+
+  Without pgvector (SQLite, or `vector_type: :binary`) embeddings are still
+  persisted on the memory row, and search is served by the in-process
+  `DiwaAgent.Storage.VectorIndex`.
   """
   @behaviour DiwaAgent.Storage.VectorRepoBehaviour
 
   import Ecto.Query
   alias DiwaAgent.Repo
+  alias DiwaAgent.Storage.VectorIndex
   alias DiwaSchema.Core.Memory
   @impl true
-  def upsert_embedding(id, vector, _metadata) do
+  def upsert_embedding(id, vector, metadata) do
     # Check configured type
     type = Application.get_env(:diwa_agent, :vector_type, :binary)
 
@@ -24,10 +29,16 @@ defmodule DiwaAgent.Storage.PgVectorRepo do
       # use update_all to avoid fetching struct first
       {count, _} = Repo.update_all(query, set: [embedding: value])
 
-      if count == 0 do
-        {:error, :not_found}
-      else
-        :ok
+      cond do
+        count == 0 ->
+          {:error, :not_found}
+
+        local_index?() ->
+          VectorIndex.upsert_embedding(id, vector, metadata || %{})
+          :ok
+
+        true ->
+          :ok
       end
     rescue
       e -> {:error, e}
@@ -36,11 +47,9 @@ defmodule DiwaAgent.Storage.PgVectorRepo do
 
   @impl true
   def search(query_vector, limit, opts) do
-    type = Application.get_env(:diwa_agent, :vector_type, :binary)
-
-    if type == :binary do
-      # Vector search is not available in Community/Binary mode
-      {:error, :vector_search_disabled}
+    if local_index?() do
+      # Community/Binary mode: in-process ANN index
+      VectorIndex.search(query_vector, limit, opts)
     else
       # Enterprise/Local-Enterprise mode with pgvector
       perform_vector_search(query_vector, limit, opts)
@@ -78,6 +87,13 @@ defmodule DiwaAgent.Storage.PgVectorRepo do
   def delete_embedding(id) do
     query = from(m in Memory, where: m.id == ^id)
     Repo.update_all(query, set: [embedding: nil])
+    if local_index?(), do: VectorIndex.delete_embedding(id)
     :ok
   end
+
+  # pgvector is only usable with Postgres and a real vector column type
+  defp local_index? do
+    Application.get_env(:diwa_agent, :vector_type, :binary) == :binary or
+      Application.get_env(:diwa_agent, DiwaAgent.Repo)[:adapter] != Ecto.Adapters.Postgres
+  end
 end
@@ -4,9 +4,16 @@ defmodule DiwaAgent.Storage.Plan do
   """
 
   alias DiwaAgent.Repo
+  alias DiwaAgent.Storage.{AfterCommit, HotCache}
   alias DiwaSchema.Team.Plan
 
   def set(context_id, status, completion_pct, notes) do
+    result = upsert(context_id, status, completion_pct, notes)
+    if match?({:ok, _}, result), do: AfterCommit.run(fn -> HotCache.invalidate(context_id) end)
+    result
+  end
+
+  defp upsert(context_id, status, completion_pct, notes) do
     case Repo.get_by(Plan, context_id: context_id) do
       nil ->
         %Plan{}
@@ -4,6 +4,7 @@ defmodule DiwaAgent.Storage.Task do
   """
   import Ecto.Query
   alias DiwaAgent.Repo
+  alias DiwaAgent.Storage.{AfterCommit, HotCache}
   alias DiwaSchema.Team.Task
 
   def add(context_id, title, description, priority) do
@@ -16,6 +17,7 @@ defmodule DiwaAgent.Storage.Task do
       status: "pending"
     })
     |> Repo.insert()
+    |> invalidate_cache()
   end
 
   def complete(task_id) do
@@ -27,6 +29,7 @@ defmodule DiwaAgent.Storage.Task do
         task
         |> Task.changeset(%{status: "completed"})
         |> Repo.update()
+        |> invalidate_cache()
     end
   end
 
@@ -39,6 +42,7 @@ defmodule DiwaAgent.Storage.Task do
         task
         |> Task.changeset(%{priority: priority})
         |> Repo.update()
+        |> invalidate_cache()
     end
   end
 
@@ -84,6 +88,14 @@ defmodule DiwaAgent.Storage.Task do
         task
         |> Task.changeset(%{status: status})
         |> Repo.update()
+        |> invalidate_cache()
     end
   end
+
+  defp invalidate_cache({:ok, task} = result) do
+    AfterCommit.run(fn -> HotCache.invalidate(task.context_id) end)
+    result
+  end
+
+  defp invalidate_cache(result), do: result
 end
@@ -0,0 +1,196 @@
+defmodule DiwaAgent.Storage.TrigramIndex do
+  @moduledoc """
+  Character-trigram candidate selection for typo-tolerant search.
+
+  Fuzzy matching (`DiwaAgent.Utils.Fuzzy`) is too expensive to run against
+  every row, so the candidates are first taken from a trigram index: the
+  rows sharing the most trigrams with the query, whatever their age.
+
+  SQLite uses the external-content FTS5 tables `memories_trigram` and
+  `contexts_trigram` (`trigram` tokenizer, kept in sync by triggers) and
+  ranks by BM25 over the ORed query trigrams. Postgres uses `pg_trgm` GIN
+  indexes and ranks by `word_similarity/2`.
+
+  The candidate functions return `{:error, reason}` when the index is
+  unavailable or the query has no trigram, so callers can fall back to a
+  bounded scan.
+  """
+
+  alias DiwaAgent.Repo
+  alias DiwaSchema.Core.{Context, Memory}
+  import Ecto.Query
+  require Logger
+
+  @default_limit 200
+  @max_query_trigrams 32
+  @pg_threshold 0.3
+
+  @doc """
+  Active memories most likely to fuzzy-match `query_str`, best first.
+
+  Options: `:context_id`, `:limit` (default #{@default_limit}).
+  """
+  def memory_candidates(query_str, opts \\ []) do
+    limit = Keyword.get(opts, :limit, @default_limit)
+    context_id = Keyword.get(opts, :context_id)
+
+    with {:ok, ids} <- candidate_ids(:memories, query_str, context_id, limit) do
+      {:ok, load(Memory, ids)}
+    end
+  end
+
+  @doc """
+  Contexts whose name is most likely to fuzzy-match `query_str`, best first.
+
+  Options: `:organization_id`, `:limit` (default #{@default_limit}).
+  """
+  def context_candidates(query_str, opts \\ []) do
+    limit = Keyword.get(opts, :limit, @default_limit)
+
+    with {:ok, ids} <- candidate_ids(:contexts, query_str, nil, limit) do
+      contexts = load(Context, ids)
+
+      case Keyword.get(opts, :organization_id) do
+        nil -> {:ok, contexts}
+        org_id -> {:ok, Enum.filter(contexts, &(&1.organization_id == org_id))}
+      end
+    end
+  end
+
+  @doc """
+  Distinct lowercase trigrams of the words in `text`, at most
+  #{@max_query_trigrams}. Words shorter than three characters contribute none.
+  """
+  def trigrams(text) do
+    text
+    |> String.downcase()
+    |> String.split(~r/[^\p{L}\p{N}_]+/u, trim: true)
+    |> Enum.flat_map(fn word ->
+      chars = String.graphemes(word)
+      chars |> Enum.chunk_every(3, 1, :discard) |> Enum.map(&Enum.join/1)
+    end)
+    |> Enum.uniq()
+    |> Enum.take(@max_query_trigrams)
+  end
+
+  @doc """
+  Rebuild the SQLite trigram tables from their source tables (not needed
+  on Postgres, where the GIN indexes are maintained by the database).
+  """
+  def rebuild do
+    if postgres?() do
+      :ok
+    else
+      Enum.reduce_while(["memories_trigram", "contexts_trigram"], :ok, fn table, :ok ->
+        case Repo.query("INSERT INTO #{table}(#{table}) VALUES ('rebuild')") do
+          {:ok, _} -> {:cont, :ok}
+          {:error, reason} -> {:halt, {:error, reason}}
+        end
+      end)
+    end
+  end
+
+  # Candidate ids
+
+  defp candidate_ids(table, query_str, context_id, limit) do
+    case trigrams(query_str || "") do
+      [] ->
+        {:error, :query_too_short}
+
+      grams ->
+        if postgres?(),
+          do: run_postgres(table, query_str, context_id, limit),
+          else: run_sqlite(table, grams, context_id, limit)
+    end
+  end
+
+  defp run_sqlite(table, grams, context_id, limit) do
+    match = Enum.map_join(grams, " OR ", &~s("#{String.replace(&1, "\"", "\"\"")}"))
+
+    sql =
+      case table do
+        :memories ->
+          {context_clause, params} =
+            if context_id, do: {"AND m.context_id = ?", [context_id]}, else: {"", []}
+
+          {"""
+           SELECT m.id FROM memories_trigram t
+           JOIN memories m ON m.rowid = t.rowid
+           WHERE memories_trigram MATCH ? AND m.deleted_at IS NULL #{context_clause}
+           ORDER BY bm25(memories_trigram)
+           LIMIT ?
+           """, [match] ++ params ++ [limit]}
+
+        :contexts ->
+          {"""
+           SELECT c.id FROM contexts_trigram t
+           JOIN contexts c ON c.rowid = t.rowid
+           WHERE contexts_trigram MATCH ?
+           ORDER BY bm25(contexts_trigram)
+           LIMIT ?
+           """, [match, limit]}
+      end
+
+    query(sql)
+  end
+
+  # word_similarity threshold is lowered for the transaction so that
+  # misspelt words still hit the index (`<%` operator)
+  defp run_postgres(table, query_str, context_id, limit) do
+    sql =
+      case table do
+        :memories ->
+          {context_clause, params} =
+            if context_id,
+              do: {"AND m.context_id = $3", [Ecto.UUID.dump!(context_id)]},
+              else: {"", []}
+
+          {"""
+           SELECT m.id FROM memories m
+           WHERE $1 <% m.content AND m.deleted_at IS NULL #{context_clause}
+           ORDER BY word_similarity($1, m.content) DESC
+           LIMIT $2
+           """, [query_str, limit] ++ params}
+
+        :contexts ->
+          {"""
+           SELECT c.id FROM contexts c
+           WHERE $1 <% c.name
+           ORDER BY word_similarity($1, c.name) DESC
+           LIMIT $2
+           """, [query_str, limit]}
+      end
+
+    Repo.transaction(fn ->
+      Repo.query!("SET LOCAL pg_trgm.word_similarity_threshold = #{@pg_threshold}")
+
+      case query(sql) do
+        {:ok, ids} -> ids
+        {:error, reason} -> Repo.rollback(reason)
+      end
+    end)
+  end
+
+  defp query({sql, params}) do
+    case Repo.query(sql, params) do
+      {:ok, %{rows: rows}} ->
+        {:ok, Enum.map(rows, fn [id] -> Ecto.UUID.cast!(id) end)}
+
+      {:error, reason} ->
+        Logger.debug("[DiwaAgent.TrigramIndex] Query failed: #{inspect(reason)}")
+        {:error, reason}
+    end
+  end
+
+  # Load structs for ranked ids, preserving rank order
+  defp load(_schema, []), do: []
+
+  defp load(schema, ids) do
+    rows = Map.new(Repo.all(from(r in schema, where: r.id in ^ids)), &{&1.id, &1})
+    for id <- ids, row = rows[id], row != nil, do: row
+  end
+
+  defp postgres? do
+    Application.get_env(:diwa_agent, DiwaAgent.Repo)[:adapter] == Ecto.Adapters.Postgres
+  end
+end
@@ -0,0 +1,477 @@
+defmodule DiwaAgent.Storage.VectorIndex do
+  @moduledoc """
+  In-process approximate nearest-neighbour index used for semantic search
+  when pgvector is not available (SQLite, or `vector_type: :binary`).
+
+  Holds one `DiwaAgent.Storage.VectorIndex.HNSW` graph per context. A
+  partition is loaded lazily on first use, either from its snapshot under
+  `:vector_index_dir` (default `~/.diwa/vector_index`) or, when the snapshot
+  is missing or stale, rebuilt from the embedding blobs on the memories table.
+  Upserts and deletes are applied incrementally; changed partitions are
+  snapshotted every 30 seconds and on shutdown.
+
+  Loading runs in a task, so a large rebuild blocks neither the server nor
+  searches of other partitions. Until a partition is ready, searches that
+  need it are answered by an exact scan of the stored embeddings in the
+  caller, and upserts and deletes for it are queued and applied once it is
+  loaded.
+
+  A snapshot records the number and the latest `updated_at` of the context's
+  embedded memories; it is only used while both still match the database,
+  so updates and deletes followed by inserts are detected too.
+  """
+
+  @behaviour DiwaAgent.Storage.VectorRepoBehaviour
+
+  use GenServer
+  require Logger
+  import Ecto.Query
+
+  alias DiwaAgent.Repo
+  alias DiwaAgent.Storage.VectorIndex.HNSW
+  alias DiwaSchema.Core.Memory
+
+  @flush_interval 30_000
+  @compact_ratio 0.25
+  @snapshot_version 2
+  @call_timeout 60_000
+
+  # Client API
+
+  def start_link(opts \\ []) do
+    GenServer.start_link(__MODULE__, opts, name: __MODULE__)
+  end
+
+  @impl DiwaAgent.Storage.VectorRepoBehaviour
+  def upsert_embedding(id, vector, metadata \\ %{}) do
+    context_id = Map.get(metadata, :context_id) || Map.get(metadata, "context_id")
+    call({:upsert, id, vector, context_id})
+  end
+
+  @doc """
+  Top-k cosine search. Pass `context_id:` to search a single partition;
+  otherwise every partition is searched and the results merged.
+  """
+  @impl DiwaAgent.Storage.VectorRepoBehaviour
+  def search(query_vector, limit, opts \\ []) do
+    context_id = Keyword.get(opts, :context_id)
+
+    case call({:search, query_vector, limit, context_id}) do
+      :loading -> scan(query_vector, limit, context_id)
+      result -> result
+    end
+  end
+
+  @impl DiwaAgent.Storage.VectorRepoBehaviour
+  def delete_embedding(id), do: call({:delete, id})
+
+  @doc """
+  Write snapshots for every partition changed since the last flush.
+  """
+  def flush, do: call(:flush)
+
+  @doc """
+  Drop the partition of `context_id` and its snapshot so it is rebuilt from
+  the database on next use, e.g. after rows were written in bulk.
+  """
+  def invalidate(context_id), do: call({:invalidate, context_id})
+
+  defp call(msg) do
+    if Process.whereis(__MODULE__) do
+      GenServer.call(__MODULE__, msg, @call_timeout)
+    else
+      {:error, :vector_index_not_started}
+    end
+  end
+
+  # Server Callbacks
+
+  @impl true
+  def init(opts) do
+    Process.flag(:trap_exit, true)
+
+    dir =
+      Keyword.get(opts, :dir) ||
+        Application.get_env(:diwa_agent, :vector_index_dir, Path.expand("~/.diwa/vector_index"))
+
+    schedule_flush()
+
+    # loading: context id => {task ref, queued ops (newest first)}
+    {:ok, %{dir: dir, partitions: %{}, dirty: MapSet.new(), loading: %{}}}
+  end
+
+  @impl true
+  def handle_call({:upsert, id, vector, context_id}, _from, state) do
+    case context_id || lookup_context(id) do
+      nil ->
+        {:reply, {:error, :not_found}, state}
+
+      context_id ->
+        case state.partitions do
+          %{^context_id => index} ->
+            case HNSW.insert(index, id, vector) do
+              {:ok, index} -> {:reply, :ok, put_partition(state, context_id, index)}
+              {:error, reason} -> {:reply, {:error, reason}, state}
+            end
+
+          _ ->
+            {:reply, :ok, queue_op(state, context_id, {:upsert, id, vector})}
+        end
+    end
+  end
+
+  def handle_call({:search, vector, limit, nil}, _from, state) do
+    state = Enum.reduce(known_contexts(state), state, &ensure_loading(&2, &1))
+
+    if map_size(state.loading) > 0 do
+      {:reply, :loading, state}
+    else
+      results =
+        state.partitions
+        |> Enum.flat_map(fn {_cid, index} -> HNSW.search(index, vector, limit) end)
+        |> Enum.sort_by(&elem(&1, 1), :desc)
+        |> Enum.take(limit)
+
+      {:reply, {:ok, format_results(results)}, state}
+    end
+  end
+
+  def handle_call({:search, vector, limit, context_id}, _from, state) do
+    case state.partitions do
+      %{^context_id => index} ->
+        {:reply, {:ok, format_results(HNSW.search(index, vector, limit))}, state}
+
+      _ ->
+        {:reply, :loading, ensure_loading(state, context_id)}
+    end
+  end
+
+  def handle_call({:delete, id}, _from, state) do
+    state =
+      case lookup_context(id) do
+        nil -> state
+        context_id -> queue_if_loading(state, context_id, {:delete, id})
+      end
+
+    state =
+      Enum.reduce(state.partitions, state, fn {cid, index}, acc ->
+        if Map.has_key?(index.nodes, id),
+          do: put_partition(acc, cid, HNSW.delete(index, id)),
+          else: acc
+      end)
+
+    {:reply, :ok, state}
+  end
+
+  def handle_call(:flush, _from, state) do
+    {:reply, :ok, flush_dirty(state)}
+  end
+
+  def handle_call({:invalidate, context_id}, _from, state) do
+    File.rm(snapshot_path(state.dir, context_id))
+
+    # A load in progress may have read the old snapshot; its result is ignored
+    {:reply, :ok,
+     %{
+       state
+       | partitions: Map.delete(state.partitions, context_id),
+         dirty: MapSet.delete(state.dirty, context_id),
+         loading: Map.delete(state.loading, context_id)
+     }}
+  end
+
+  @impl true
+  def handle_info(:flush, state) do
+    schedule_flush()
+    {:noreply, flush_dirty(state)}
+  end
+
+  def handle_info({ref, {:loaded, context_id, index, dirty?}}, state) when is_reference(ref) do
+    Process.demonitor(ref, [:flush])
+
+    case Map.get(state.loading, context_id) do
+      {^ref, ops} ->
+        state = %{state | loading: Map.delete(state.loading, context_id)}
+        index = ops |> Enum.reverse() |> Enum.reduce(index, &apply_op/2)
+        state = %{state | partitions: Map.put(state.partitions, context_id, index)}
+
+        if dirty? or ops != [],
+          do: {:noreply, %{state | dirty: MapSet.put(state.dirty, context_id)}},
+          else: {:noreply, state}
+
+      _ ->
+        {:noreply, state}
+    end
+  end
+
+  # A failed load is retried on next use; queued ops are already in the
+  # database, which the retry reads
+  def handle_info({:DOWN, ref, :process, _pid, reason}, state) do
+    case Enum.find(state.loading, fn {_cid, {r, _ops}} -> r == ref end) do
+      {context_id, _} ->
+        Logger.error(
+          "[DiwaAgent.VectorIndex] Loading partition #{context_id} failed: #{inspect(reason)}"
+        )
+
+        {:noreply, %{state | loading: Map.delete(state.loading, context_id)}}
+
+      nil ->
+        {:noreply, state}
+    end
+  end
+
+  def handle_info(_msg, state), do: {:noreply, state}
+
+  @impl true
+  def terminate(_reason, state) do
+    flush_dirty(state)
+    :ok
+  end
+
+  # Partitions
+
+  defp put_partition(state, context_id, index) do
+    %{
+      state
+      | partitions: Map.put(state.partitions, context_id, index),
+        dirty: MapSet.put(state.dirty, context_id)
+    }
+  end
+
+  defp ensure_loading(state, context_id) do
+    if Map.has_key?(state.partitions, context_id) or Map.has_key?(state.loading, context_id) do
+      state
+    else
+      dir = state.dir
+      task = start_task(fn -> load_partition(dir, context_id) end)
+      %{state | loading: Map.put(state.loading, context_id, {task.ref, []})}
+    end
+  end
+
+  defp queue_op(state, context_id, op) do
+    state
+    |> ensure_loading(context_id)
+    |> queue_if_loading(context_id, op)
+  end
+
+  defp queue_if_loading(state, context_id, op) do
+    case state.loading do
+      %{^context_id => {ref, ops}} ->
+        %{state | loading: Map.put(state.loading, context_id, {ref, [op | ops]})}
+
+      _ ->
+        state
+    end
+  end
+
+  defp apply_op({:upsert, id, vector}, index) do
+    case HNSW.insert(index, id, vector) do
+      {:ok, index} -> index
+      {:error, _} -> index
+    end
+  end
+
+  defp apply_op({:delete, id}, index), do: HNSW.delete(index, id)
+
+  defp start_task(fun) do
+    case Process.whereis(DiwaAgent.TaskSupervisor) do
+      nil -> Task.async(fun)
+      _ -> Task.Supervisor.async_nolink(DiwaAgent.TaskSupervisor, fun)
+    end
+  end
+
+  # Runs in a task. Prefer the snapshot; rebuild from the database when it
+  # is missing or its stamp disagrees with the stored embeddings.
+  defp load_partition(dir, context_id) do
+    stamp = embeddings_stamp(context_id)
+
+    case read_snapshot(dir, context_id) do
+      {:ok, index, _stamp} when stamp == nil ->
+        {:loaded, context_id, index, false}
+
+      {:ok, index, ^stamp} ->
+        {:loaded, context_id, index, false}
+
+      _ ->
+        {:loaded, context_id, build_from_db(context_id), true}
+    end
+  end
+
+  defp build_from_db(context_id) do
+    started = System.monotonic_time(:millisecond)
+
+    index =
+      context_id
+      |> stored_embeddings()
+      |> Enum.reduce(HNSW.new(), fn {id, vector}, acc ->
+        case HNSW.insert(acc, id, vector) do
+          {:ok, acc} -> acc
+          {:error, _} -> acc
+        end
+      end)
+
+    Logger.debug(
+      "[DiwaAgent.VectorIndex] Built partition #{context_id} (#{HNSW.size(index)} vectors) in #{System.monotonic_time(:millisecond) - started}ms"
+    )
+
+    index
+  end
+
+  defp flush_dirty(state) do
+    Enum.reduce(state.dirty, state, fn context_id, acc ->
+      index = acc.partitions[context_id]
+
+      index =
+        if HNSW.tombstone_ratio(index) > @compact_ratio, do: HNSW.compact(index), else: index
+
+      write_snapshot(acc.dir, context_id, index, embeddings_stamp(context_id))
+      %{acc | partitions: Map.put(acc.partitions, context_id, index)}
+    end)
+    |> Map.put(:dirty, MapSet.new())
+  end
+
+  defp schedule_flush, do: Process.send_after(self(), :flush, @flush_interval)
+
+  # Exact search in the caller while partitions it needs are loading
+  defp scan(query_vector, limit, context_id) do
+    case HNSW.pack(query_vector) do
+      {:ok, q} ->
+        results =
+          context_id
+          |> stored_embeddings()
+          |> Enum.flat_map(fn {id, vector} ->
+            case HNSW.pack(vector) do
+              {:ok, v} when byte_size(v) == byte_size(q) -> [{id, HNSW.dot(q, v)}]
+              _ -> []
+            end
+          end)
+          |> Enum.sort_by(&elem(&1, 1), :desc)
+          |> Enum.take(limit)
+
+        {:ok, format_results(results)}
+
+      {:error, _} ->
+        {:ok, []}
+    end
+  end
+
+  # Snapshots
+
+  defp snapshot_path(dir, context_id), do: Path.join(dir, "#{context_id}.hnsw")
+
+  defp read_snapshot(dir, context_id) do
+    with {:ok, binary} <- File.read(snapshot_path(dir, context_id)),
+         {:diwa_hnsw, @snapshot_version, %HNSW{} = index, stamp} <-
+           :erlang.binary_to_term(binary) do
+      {:ok, index, stamp}
+    else
+      _ -> :error
+    end
+  rescue
+    _ -> :error
+  end
+
+  defp write_snapshot(dir, context_id, index, stamp) do
+    path = snapshot_path(dir, context_id)
+    tmp = path <> ".tmp"
+    binary = :erlang.term_to_binary({:diwa_hnsw, @snapshot_version, index, stamp})
+
+    with :ok <- File.mkdir_p(dir),
+         :ok <- File.write(tmp, binary),
+         :ok <- File.rename(tmp, path) do
+      :ok
+    else
+      {:error, reason} ->
+        Logger.warning("[DiwaAgent.VectorIndex] Snapshot write failed: #{inspect(reason)}")
+        {:error, reason}
+    end
+  end
+
+  # Database access
+
+  defp known_contexts(state) do
+    from_db =
+      try do
+        Repo.all(
+          from(m in Memory,
+            where: not is_nil(m.embedding) and is_nil(m.deleted_at),
+            distinct: true,
+            select: m.context_id
+          )
+        )
+      rescue
+        _ -> []
+      end
+
+    Enum.uniq(Map.keys(state.partitions) ++ from_db)
+  end
+
+  defp lookup_context(id) do
+    with {:ok, uuid} <- Ecto.UUID.cast(id) do
+      Repo.one(from(m in Memory, where: m.id == ^uuid, select: m.context_id))
+    else
+      _ -> nil
+    end
+  rescue
+    _ -> nil
+  end
+
+  # {count, latest updated_at} of the context's embedded memories: any
+  # insert, update or delete changes it
+  defp embeddings_stamp(context_id) do
+    Repo.one(
+      from(m in Memory,
+        where: m.context_id == ^context_id,
+        where: not is_nil(m.embedding) and is_nil(m.deleted_at),
+        select: {count(m.id), max(m.updated_at)}
+      )
+    )
+  rescue
+    _ -> nil
+  end
+
+  # Raw query so blobs are read as stored, whatever the schema's vector type
+  defp stored_embeddings(context_id) do
+    sql = "SELECT id, embedding FROM memories WHERE embedding IS NOT NULL AND deleted_at IS NULL"
+
+    {sql, params} =
+      case context_id do
+        nil -> {sql, []}
+        context_id -> {sql <> " AND context_id = $1", [dump(context_id)]}
+      end
+
+    case Repo.query(sql, params) do
+      {:ok, %{rows: rows}} ->
+        for [id, blob] <- rows, vector = decode_embedding(blob), vector != nil do
+          {Ecto.UUID.cast!(id), vector}
+        end
+
+      {:error, reason} ->
+        Logger.warning("[DiwaAgent.VectorIndex] Could not load embeddings: #{inspect(reason)}")
+        []
+    end
+  end
+
+  defp dump(context_id), do: if(postgres?(), do: Ecto.UUID.dump!(context_id), else: context_id)
+
+  defp decode_embedding(list) when is_list(list), do: list
+
+  defp decode_embedding(blob) when is_binary(blob) do
+    case :erlang.binary_to_term(blob, [:safe]) do
+      list when is_list(list) -> list
+      _ -> nil
+    end
+  rescue
+    _ -> nil
+  end
+
+  defp decode_embedding(_), do: nil
+
+  defp format_results(results) do
+    Enum.map(results, fn {id, similarity} -> %{id: id, similarity: similarity} end)
+  end
+
+  defp postgres? do
+    Application.get_env(:diwa_agent, DiwaAgent.Repo)[:adapter] == Ecto.Adapters.Postgres
+  end
+end
@@ -0,0 +1,307 @@
+defmodule DiwaAgent.Storage.VectorIndex.HNSW do
+  @moduledoc """
+  Pure-Elixir Hierarchical Navigable Small World graph for approximate
+  nearest-neighbour search by cosine similarity.
+
+  Vectors are L2-normalised and packed as native float32 binaries, so cosine
+  similarity is a plain dot product. Deletions are tombstones: the node keeps
+  routing searches but is never returned. `compact/1` rebuilds the graph from
+  live nodes once tombstones pile up.
+
+  The structure is an immutable value; `DiwaAgent.Storage.VectorIndex` owns
+  the instances and persists them.
+  """
+
+  defstruct m: 16,
+            m0: 32,
+            ef_construction: 100,
+            ef_search: 64,
+            level_mult: 1 / :math.log(16),
+            dim: nil,
+            next: 0,
+            entry: nil,
+            max_level: -1,
+            # node index => packed vector
+            vectors: %{},
+            # node index => external id
+            ids: %{},
+            # external id => node index (live nodes only)
+            nodes: %{},
+            # {node index, layer} => [neighbour node index]
+            links: %{},
+            deleted: MapSet.new()
+
+  @type t :: %__MODULE__{}
+
+  # Graphs this small are searched exhaustively: exact and cheaper.
+  @exact_threshold 256
+
+  @doc """
+  Create an empty graph.
+
+  Options: `:m` (links per node, default 16), `:ef_construction` (default 100),
+  `:ef_search` (default 64).
+  """
+  def new(opts \\ []) do
+    m = Keyword.get(opts, :m, 16)
+
+    %__MODULE__{
+      m: m,
+      m0: 2 * m,
+      ef_construction: Keyword.get(opts, :ef_construction, 100),
+      ef_search: Keyword.get(opts, :ef_search, 64),
+      level_mult: 1 / :math.log(m)
+    }
+  end
+
+  @doc """
+  Number of live (non-deleted) vectors.
+  """
+  def size(%__MODULE__{nodes: nodes}), do: map_size(nodes)
+
+  @doc """
+  Fraction of graph nodes that are tombstones.
+  """
+  def tombstone_ratio(%__MODULE__{vectors: vectors}) when map_size(vectors) == 0, do: 0.0
+
+  def tombstone_ratio(%__MODULE__{} = index) do
+    MapSet.size(index.deleted) / map_size(index.vectors)
+  end
+
+  @doc """
+  Normalise a list of floats into a packed float32 binary.
+  """
+  def pack(vector) when is_list(vector) and vector != [] do
+    norm = :math.sqrt(Enum.reduce(vector, 0.0, fn x, acc -> acc + x * x end))
+
+    if norm == 0.0 do
+      {:error, :zero_vector}
+    else
+      {:ok, for(x <- vector, into: <<>>, do: <<x / norm::float-32-native>>)}
+    end
+  end
+
+  def pack(_), do: {:error, :invalid_vector}
+
+  @doc """
+  Insert or replace the vector stored under `id`.
+  """
+  def insert(%__MODULE__{} = index, id, vector) do
+    with {:ok, packed} <- pack(vector),
+         :ok <- check_dim(index, packed) do
+      index = if Map.has_key?(index.nodes, id), do: delete(index, id), else: index
+      {:ok, insert_packed(%{index | dim: byte_size(packed)}, id, packed)}
+    end
+  end
+
+  @doc """
+  Tombstone the vector stored under `id`. Unknown ids are ignored.
+  """
+  def delete(%__MODULE__{} = index, id) do
+    case Map.pop(index.nodes, id) do
+      {nil, _} -> index
+      {idx, nodes} -> %{index | nodes: nodes, deleted: MapSet.put(index.deleted, idx)}
+    end
+  end
+
+  @doc """
+  Return up to `k` `{id, similarity}` pairs, most similar first.
+  """
+  def search(%__MODULE__{} = index, vector, k, ef \\ nil) do
+    with {:ok, q} <- pack(vector),
+         :ok <- check_dim(index, q) do
+      cond do
+        index.entry == nil ->
+          []
+
+        map_size(index.nodes) <= @exact_threshold ->
+          exact_search(index, q, k)
+
+        true ->
+          ef = max(ef || index.ef_search, k)
+          ep = descend(index, q, index.entry, index.max_level, 1)
+
+          index
+          |> search_layer(q, [ep], ef, 0)
+          |> Enum.reject(fn {_d, n} -> MapSet.member?(index.deleted, n) end)
+          |> Enum.take(k)
+          |> Enum.map(fn {d, n} -> {Map.fetch!(index.ids, n), 1.0 - d} end)
+      end
+    else
+      _ -> []
+    end
+  end
+
+  @doc """
+  Rebuild the graph from its live vectors, dropping tombstones.
+  """
+  def compact(%__MODULE__{} = index) do
+    opts = [m: index.m, ef_construction: index.ef_construction, ef_search: index.ef_search]
+    fresh = %{new(opts) | dim: index.dim}
+
+    index.nodes
+    |> Enum.sort_by(fn {_id, idx} -> idx end)
+    |> Enum.reduce(fresh, fn {id, idx}, acc ->
+      insert_packed(acc, id, Map.fetch!(index.vectors, idx))
+    end)
+  end
+
+  @doc """
+  Dot product of two packed vectors (cosine similarity when normalised).
+  """
+  def dot(a, b), do: dot(a, b, 0.0)
+
+  defp dot(<<x::float-32-native, ra::binary>>, <<y::float-32-native, rb::binary>>, acc),
+    do: dot(ra, rb, acc + x * y)
+
+  defp dot(_, _, acc), do: acc
+
+  # Insertion
+
+  defp insert_packed(index, id, q) do
+    idx = index.next
+    level = random_level(index)
+
+    index = %{
+      index
+      | next: idx + 1,
+        vectors: Map.put(index.vectors, idx, q),
+        ids: Map.put(index.ids, idx, id),
+        nodes: Map.put(index.nodes, id, idx)
+    }
+
+    case index.entry do
+      nil ->
+        %{index | entry: idx, max_level: level}
+
+      entry ->
+        ep = descend(index, q, entry, index.max_level, level + 1)
+        index = connect(index, idx, q, ep, min(level, index.max_level))
+
+        if level > index.max_level,
+          do: %{index | entry: idx, max_level: level},
+          else: index
+    end
+  end
+
+  defp random_level(index) do
+    trunc(-:math.log(1.0 - :rand.uniform()) * index.level_mult)
+  end
+
+  # Link the new node on every layer from `layer` down to 0
+  defp connect(index, _idx, _q, _ep, layer) when layer < 0, do: index
+
+  defp connect(index, idx, q, ep, layer) do
+    candidates = search_layer(index, q, [ep], index.ef_construction, layer)
+    max_links = if layer == 0, do: index.m0, else: index.m
+    selected = candidates |> Enum.take(index.m) |> Enum.map(&elem(&1, 1))
+
+    index = %{index | links: Map.put(index.links, {idx, layer}, selected)}
+    index = Enum.reduce(selected, index, &add_link(&2, &1, idx, layer, max_links))
+
+    {_d, next_ep} = hd(candidates)
+    connect(index, idx, q, next_ep, layer - 1)
+  end
+
+  # Add a back-link, keeping only the closest `max_links` neighbours
+  defp add_link(index, node, new, layer, max_links) do
+    links = [new | neighbours(index, node, layer)]
+
+    links =
+      if length(links) > max_links do
+        v = Map.fetch!(index.vectors, node)
+
+        links
+        |> Enum.map(&{1.0 - dot(v, Map.fetch!(index.vectors, &1)), &1})
+        |> Enum.sort()
+        |> Enum.take(max_links)
+        |> Enum.map(&elem(&1, 1))
+      else
+        links
+      end
+
+    %{index | links: Map.put(index.links, {node, layer}, links)}
+  end
+
+  # Search
+
+  defp exact_search(index, q, k) do
+    index.nodes
+    |> Enum.map(fn {id, idx} -> {id, dot(q, Map.fetch!(index.vectors, idx))} end)
+    |> Enum.sort_by(&elem(&1, 1), :desc)
+    |> Enum.take(k)
+  end
+
+  # Greedy descent from `layer` down to (and including) `stop`
+  defp descend(_index, _q, ep, layer, stop) when layer < stop, do: ep
+
+  defp descend(index, q, ep, layer, stop) do
+    next = greedy(index, q, ep, distance(index, q, ep), layer)
+    descend(index, q, next, layer - 1, stop)
+  end
+
+  defp greedy(index, q, current, current_d, layer) do
+    {best, best_d} =
+      index
+      |> neighbours(current, layer)
+      |> Enum.reduce({current, current_d}, fn n, {b, bd} ->
+        d = distance(index, q, n)
+        if d < bd, do: {n, d}, else: {b, bd}
+      end)
+
+    if best == current, do: current, else: greedy(index, q, best, best_d, layer)
+  end
+
+  # Beam search on one layer; returns [{distance, node}] closest first
+  defp search_layer(index, q, entry_points, ef, layer) do
+    initial = Enum.map(entry_points, &{distance(index, q, &1), &1})
+    candidates = :gb_sets.from_list(initial)
+
+    index
+    |> expand(q, candidates, candidates, MapSet.new(entry_points), ef, layer)
+    |> :gb_sets.to_list()
+  end
+
+  defp expand(index, q, candidates, results, visited, ef, layer) do
+    if :gb_sets.is_empty(candidates) do
+      results
+    else
+      {{d, c}, candidates} = :gb_sets.take_smallest(candidates)
+      {worst, _} = :gb_sets.largest(results)
+
+      if d > worst do
+        results
+      else
+        {candidates, results, visited} =
+          index
+          |> neighbours(c, layer)
+          |> Enum.reduce({candidates, results, visited}, fn n, {cs, rs, vis} ->
+            if MapSet.member?(vis, n) do
+              {cs, rs, vis}
+            else
+              vis = MapSet.put(vis, n)
+              dn = distance(index, q, n)
+
+              if :gb_sets.size(rs) < ef or dn < elem(:gb_sets.largest(rs), 0) do
+                rs = :gb_sets.add({dn, n}, rs)
+                rs = if :gb_sets.size(rs) > ef, do: elem(:gb_sets.take_largest(rs), 1), else: rs
+                {:gb_sets.add({dn, n}, cs), rs, vis}
+              else
+                {cs, rs, vis}
+              end
+            end
+          end)
+
+        expand(index, q, candidates, results, visited, ef, layer)
+      end
+    end
+  end
+
+  defp neighbours(index, node, layer), do: Map.get(index.links, {node, layer}, [])
+
+  defp distance(index, q, node), do: 1.0 - dot(q, Map.fetch!(index.vectors, node))
+
+  defp check_dim(%__MODULE__{dim: nil}, _packed), do: :ok
+  defp check_dim(%__MODULE__{dim: dim}, packed) when byte_size(packed) == dim, do: :ok
+  defp check_dim(_index, _packed), do: {:error, :dimension_mismatch}
+end
@@ -0,0 +1,50 @@
+defmodule DiwaAgent.Storage.VersionDelta do
+  @moduledoc """
+  Line deltas between two texts.
+
+  A delta is a list of operations on the lines of the old text: a positive
+  integer copies that many lines, a negative one skips that many and a list
+  of binaries inserts those lines. Texts are split on `"\\n"` and joined
+  back, which is lossless, so `patch(old, diff(old, new)) == new`.
+  """
+
+  @type t :: [pos_integer() | neg_integer() | [String.t()]]
+
+  @doc """
+  The delta turning `old` into `new`.
+  """
+  @spec diff(String.t(), String.t()) :: t()
+  def diff(old, new) do
+    old
+    |> lines()
+    |> List.myers_difference(lines(new))
+    |> Enum.map(fn
+      {:eq, lines} -> length(lines)
+      {:del, lines} -> -length(lines)
+      {:ins, lines} -> lines
+    end)
+  end
+
+  @doc """
+  Apply a delta from `diff/2` to `old`.
+  """
+  @spec patch(String.t(), t()) :: String.t()
+  def patch(old, delta) do
+    {out, _rest} =
+      Enum.reduce(delta, {[], lines(old)}, fn
+        n, {out, rest} when is_integer(n) and n > 0 ->
+          {copied, rest} = Enum.split(rest, n)
+          {Enum.reverse(copied, out), rest}
+
+        n, {out, rest} when is_integer(n) ->
+          {out, Enum.drop(rest, -n)}
+
+        inserted, {out, rest} ->
+          {Enum.reverse(inserted, out), rest}
+      end)
+
+    out |> Enum.reverse() |> Enum.join("\n")
+  end
+
+  defp lines(text), do: String.split(text, "\n")
+end
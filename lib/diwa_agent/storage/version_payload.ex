@@ -0,0 +1,233 @@
+defmodule DiwaAgent.Storage.VersionPayload do
+  @moduledoc """
+  Stored content of memory versions: periodic full snapshots with line
+  deltas in between.
+
+  Every version of a memory gets one row with a per-memory `seq`. A row is
+  either a `"snapshot"` (the compressed `{content, tags, metadata}`) or a
+  `"delta"` against the version before it (the compressed
+  `DiwaAgent.Storage.VersionDelta` of the content, plus tags and metadata
+  only when they changed). `depth` counts the deltas since the last
+  snapshot, so any version is rebuilt from the contiguous rows
+  `seq - depth .. seq` with one query. A delta is stored only while it is
+  smaller than a snapshot and the chain is shorter than `snapshot_every`.
+
+  Rows are removed with their version (`ON DELETE CASCADE`).
+  """
+
+  use Ecto.Schema
+  import Ecto.Query
+
+  alias DiwaAgent.Repo
+  alias DiwaAgent.Storage.{BulkInsert, VersionDelta}
+
+  @primary_key {:version_id, :binary_id, autogenerate: false}
+  @foreign_key_type :binary_id
+
+  schema "memory_version_payloads" do
+    field(:memory_id, :binary_id)
+    field(:seq, :integer)
+    field(:depth, :integer)
+    field(:encoding, :string)
+    field(:data, :binary)
+
+    timestamps(updated_at: false)
+  end
+
+  @type state :: {String.t(), [String.t()], map()}
+  # {seq, depth, state} of the latest version of a memory
+  @type previous :: {non_neg_integer(), non_neg_integer(), state()} | nil
+
+  @doc """
+  Store the payload of a new version of `memory_id`, as a delta against its
+  latest version when that pays off. Call inside a transaction: the memory
+  row is locked first, so concurrent versions of one memory get consecutive
+  `seq`s instead of colliding on the same one.
+  """
+  def append(version_id, memory_id, state, snapshot_every) do
+    lock_memory(memory_id)
+
+    memory_id
+    |> build([{version_id, state}], latest(memory_id), snapshot_every)
+    |> insert()
+  end
+
+  @doc """
+  Payload rows for consecutive versions `[{version_id, state}]` of one
+  memory, following `previous` (nil to start a new chain).
+  """
+  @spec build(String.t(), [{String.t(), state()}], previous(), pos_integer()) :: [struct()]
+  def build(memory_id, entries, previous, snapshot_every) do
+    {rows, _} =
+      Enum.map_reduce(entries, previous, fn {version_id, state}, previous ->
+        {encoding, data} = encode(previous, state, snapshot_every)
+
+        {seq, depth} =
+          case {previous, encoding} do
+            {nil, _} -> {0, 0}
+            {{seq, _, _}, "snapshot"} -> {seq + 1, 0}
+            {{seq, depth, _}, "delta"} -> {seq + 1, depth + 1}
+          end
+
+        row = %__MODULE__{
+          version_id: version_id,
+          memory_id: memory_id,
+          seq: seq,
+          depth: depth,
+          encoding: encoding,
+          data: data
+        }
+
+        {row, {seq, depth, state}}
+      end)
+
+    rows
+  end
+
+  @doc """
+  Insert payload rows built by `build/4`.
+  """
+  def insert(rows) do
+    rows
+    |> Enum.map(&(&1 |> BulkInsert.stamp() |> BulkInsert.to_row()))
+    |> Enum.chunk_every(500)
+    |> Enum.reduce({0, nil}, fn chunk, {count, _} ->
+      {inserted, _} = Repo.insert_all(__MODULE__, chunk)
+      {count + inserted, nil}
+    end)
+  end
+
+  @doc """
+  The `{content, tags, metadata}` of each of `version_ids` that has a
+  payload, as a map. Each memory's chain is read with one query.
+  """
+  @spec states([String.t()]) :: %{String.t() => state()}
+  def states([]), do: %{}
+
+  def states(version_ids) do
+    from(p in __MODULE__,
+      where: p.version_id in ^version_ids,
+      select: {p.memory_id, p.seq, p.depth}
+    )
+    |> Repo.all()
+    |> Enum.group_by(&elem(&1, 0))
+    |> Enum.flat_map(fn {memory_id, targets} ->
+      first = targets |> Enum.map(fn {_, seq, depth} -> seq - depth end) |> Enum.min()
+      last = targets |> Enum.map(&elem(&1, 1)) |> Enum.max()
+      memory_id |> chain(first, last) |> replay()
+    end)
+    |> Map.new()
+    |> Map.take(version_ids)
+  end
+
+  @doc """
+  Stored size in bytes of the payloads of `memory_id`.
+  """
+  def stored_bytes(memory_id) do
+    Repo.one(
+      from(p in __MODULE__,
+        where: p.memory_id == ^memory_id,
+        select: coalesce(sum(fragment("length(?)", p.data)), 0)
+      )
+    )
+  end
+
+  @doc """
+  `{seq, depth, state}` of the latest version of `memory_id` with a
+  payload, or nil.
+  """
+  @spec latest(String.t()) :: previous()
+  def latest(memory_id) do
+    query =
+      from(p in __MODULE__,
+        where: p.memory_id == ^memory_id,
+        order_by: [desc: p.seq],
+        limit: 1,
+        select: {p.version_id, p.seq, p.depth}
+      )
+
+    case Repo.one(query) do
+      nil ->
+        nil
+
+      {version_id, seq, depth} ->
+        states = memory_id |> chain(seq - depth, seq) |> replay() |> Map.new()
+        {seq, depth, Map.fetch!(states, version_id)}
+    end
+  end
+
+  # SQLite serialises writers, so only Postgres needs the row lock
+  defp lock_memory(memory_id) do
+    if postgres?() do
+      Repo.one(
+        from(m in DiwaSchema.Core.Memory,
+          where: m.id == ^memory_id,
+          lock: "FOR UPDATE",
+          select: m.id
+        )
+      )
+    end
+
+    :ok
+  end
+
+  defp chain(memory_id, first, last) do
+    Repo.all(
+      from(p in __MODULE__,
+        where: p.memory_id == ^memory_id and p.seq >= ^first and p.seq <= ^last,
+        order_by: [asc: p.seq]
+      )
+    )
+  end
+
+  # Rows are contiguous and start at a snapshot
+  defp replay(rows) do
+    {states, _} =
+      Enum.map_reduce(rows, nil, fn row, previous ->
+        state = decode(row, previous)
+        {{row.version_id, state}, state}
+      end)
+
+    states
+  end
+
+  defp encode(nil, state, _snapshot_every), do: snapshot(state)
+
+  defp encode({_seq, depth, _state}, state, snapshot_every) when depth + 1 >= snapshot_every,
+    do: snapshot(state)
+
+  defp encode({_seq, _depth, {old_content, old_tags, old_metadata}}, state, _snapshot_every) do
+    {content, tags, metadata} = state
+
+    delta =
+      :erlang.term_to_binary(
+        {VersionDelta.diff(old_content, content), changed(old_tags, tags),
+         changed(old_metadata, metadata)},
+        [:compressed]
+      )
+
+    {"snapshot", full} = snapshot(state)
+    if byte_size(delta) < byte_size(full), do: {"delta", delta}, else: {"snapshot", full}
+  end
+
+  defp snapshot(state), do: {"snapshot", :erlang.term_to_binary(state, [:compressed])}
+
+  defp decode(%{encoding: "snapshot", data: data}, _previous),
+    do: :erlang.binary_to_term(data, [:safe])
+
+  defp decode(%{encoding: "delta", data: data}, {content, tags, metadata}) do
+    {delta, new_tags, new_metadata} = :erlang.binary_to_term(data, [:safe])
+    {VersionDelta.patch(content, delta), unchanged(new_tags, tags),
+     unchanged(new_metadata, metadata)}
+  end
+
+  defp changed(same, same), do: :same
+  defp changed(_old, new), do: new
+
+  defp unchanged(:same, old), do: old
+  defp unchanged(new, _old), do: new
+
+  defp postgres? do
+    Application.get_env(:diwa_agent, DiwaAgent.Repo)[:adapter] == Ecto.Adapters.Postgres
+  end
+end
@@ -2,10 +2,21 @@ defmodule DiwaAgent.Tala.Buffer do
   @moduledoc """
   Transactional Accumulation & Lazy Apply (TALA) Buffer.
   Manages deferred operation commits for AI agents.
+
+  Operations are persisted to `tala_operations` for crash resilience and
+  held in a public ETS table keyed by `{session_id, seq}`, so sessions push,
+  list and commit from their own processes instead of queueing behind one
+  server. The server owns the table and, the first time a session is
+  touched, loads its pending operations from the database (e.g. after a
+  restart).
   """
   use GenServer
   require Logger
+  import Ecto.Query
   alias DiwaAgent.Repo
+  alias DiwaAgent.Tala.Operation
+
+  @table __MODULE__
 
   # Client API
 
@@ -17,125 +28,194 @@ defmodule DiwaAgent.Tala.Buffer do
   Add an operation to the buffer for a specific session.
   """
   def push(session_id, context_id, tool_name, params, actor \\ "assistant") do
-    GenServer.call(__MODULE__, {:push, session_id, context_id, tool_name, params, actor})
+    ensure_loaded(session_id)
+
+    op = %{
+      session_id: session_id,
+      context_id: context_id,
+      tool_name: tool_name,
+      params: params,
+      actor: actor
+    }
+
+    # Persist first so the operation survives a crash
+    case persist_operation(op) do
+      {:ok, db_op} ->
+        :ets.insert(@table, {{session_id, next_seq()}, db_op})
+        {:ok, db_op.id}
+
+      {:error, reason} ->
+        Logger.error("[TALA] Failed to persist operation: #{inspect(reason)}")
+        {:error, reason}
+    end
   end
 
   @doc """
-  Retrieve all pending operations for a session.
+  Retrieve all pending operations for a session, in push order.
   """
   def list(session_id) do
-    GenServer.call(__MODULE__, {:list, session_id})
+    ensure_loaded(session_id)
+    Enum.map(entries(session_id), fn {_key, op} -> op end)
   end
 
   @doc """
   Discard all pending operations for a session.
   """
   def discard(session_id) do
-    GenServer.call(__MODULE__, {:discard, session_id})
+    ensure_loaded(session_id)
+    delete_from_db(session_id)
+    :ets.select_delete(@table, [{{{session_id, :"$1"}, :_}, [{:is_integer, :"$1"}], [true]}])
+    :ok
   end
 
   @doc """
-  Flush the buffer and execute all operations.
-  Note: Execution logic will be handled by the Tool Executor.
+  Take the session's pending operations out of the buffer and pass them, in
+  push order, to `fun`, which applies them (see `DiwaAgent.Tala.Commit`).
+
+  Returns `{:ok, 0}` when the buffer is empty, otherwise the result of
+  `fun`. Unless `fun` returns `{:ok, _}` the operations are put back, so a
+  failed commit can be retried or discarded; that includes `fun` raising or
+  exiting, and the caller being killed (e.g. a cancelled tool call), in which
+  case the server puts back the operations still pending in the database.
+  A concurrent commit of the same session only sees operations pushed after
+  this one took its share.
   """
-  def flush(session_id) do
-    GenServer.call(__MODULE__, {:flush, session_id})
+  def commit(session_id, fun) do
+    ensure_loaded(session_id)
+
+    case take(session_id) do
+      [] ->
+        {:ok, 0}
+
+      taken ->
+        guard = GenServer.call(__MODULE__, {:guard, self(), taken})
+
+        try do
+          case fun.(Enum.map(taken, fn {_key, op} -> op end)) do
+            {:ok, _} = ok ->
+              ok
+
+            error ->
+              :ets.insert(@table, taken)
+              error
+          end
+        catch
+          kind, reason ->
+            :ets.insert(@table, taken)
+            :erlang.raise(kind, reason, __STACKTRACE__)
+        after
+          GenServer.cast(__MODULE__, {:release, guard})
+        end
+    end
   end
 
   # Server Callbacks
 
+  # State: monitor ref => operations taken by a commit in progress
   @impl true
   def init(_opts) do
+    :ets.new(@table, [:ordered_set, :named_table, :public, write_concurrency: true])
     Logger.info("[TALA] Server-side buffer initialized")
-    {:ok, %{buffers: %{}}}
+    {:ok, %{}}
   end
 
+  # Loading runs in the caller (which owns the DB checkout); the server only
+  # serialises installing the result, so a session is loaded exactly once and
+  # before any push that follows it.
   @impl true
-  def handle_call({:push, session_id, context_id, tool_name, params, actor}, _from, state) do
-    op = %{
-      session_id: session_id,
-      context_id: context_id,
-      tool_name: tool_name,
-      params: params,
-      actor: actor
-    }
-
-    # 1. Persist to DB for crash resilience
-    case persist_operation(op) do
-      {:ok, db_op} ->
-        # 2. Update in-memory state
-        new_buffer = Map.get(state.buffers, session_id, []) ++ [db_op]
-        new_state = put_in(state.buffers[session_id], new_buffer)
-        {:reply, {:ok, db_op.id}, new_state}
-
-      {:error, reason} ->
-        Logger.error("[TALA] Failed to persist operation: #{inspect(reason)}")
-        {:reply, {:error, reason}, state}
+  def handle_call({:hydrate, session_id, ops}, _from, state) do
+    if :ets.insert_new(@table, {{session_id, :loaded}, true}) do
+      :ets.insert(@table, Enum.map(ops, &{{session_id, next_seq()}, &1}))
     end
-  end
 
-  @impl true
-  def handle_call({:list, session_id}, _from, state) do
-    # Try to load from memory first, fallback to DB if memory empty (e.g. after restart)
-    buffer = Map.get(state.buffers, session_id)
-
-    buffer =
-      if is_nil(buffer) do
-        load_from_db(session_id)
-      else
-        buffer
-      end
+    {:reply, :ok, state}
+  end
 
-    {:reply, buffer, state}
+  def handle_call({:guard, pid, taken}, _from, state) do
+    ref = Process.monitor(pid)
+    {:reply, ref, Map.put(state, ref, taken)}
   end
 
   @impl true
-  def handle_call({:discard, session_id}, _from, state) do
-    # Clear from DB
-    delete_from_db(session_id)
-    # Clear from memory
-    new_state = put_in(state.buffers[session_id], [])
-    {:reply, :ok, new_state}
+  def handle_cast({:release, ref}, state) do
+    Process.demonitor(ref, [:flush])
+    {:noreply, Map.delete(state, ref)}
   end
 
+  # The committer died without releasing its operations. Its transaction
+  # cannot have committed after it died, so the operations still pending in
+  # the database are exactly the ones to put back.
   @impl true
-  def handle_call({:flush, session_id}, _from, state) do
-    # Get operations
-    ops = Map.get(state.buffers, session_id)
-    ops = if is_nil(ops), do: load_from_db(session_id), else: ops
-
-    if Enum.empty?(ops) do
-      {:reply, {:ok, 0}, state}
-    else
-      # In TALA v2, the actual execution of tools should be orchestrated.
-      # For now, we return the operations so the caller (Tool Executor) can process them.
-      # We mark them as 'flushed' in memory for now.
-      new_state = put_in(state.buffers[session_id], [])
-      {:reply, {:ok, ops}, new_state}
+  def handle_info({:DOWN, ref, :process, _pid, reason}, state) do
+    case Map.pop(state, ref) do
+      {nil, state} ->
+        {:noreply, state}
+
+      {taken, state} ->
+        restored = restore_pending(taken)
+
+        Logger.warning(
+          "[TALA] Commit exited (#{inspect(reason)}); restored #{restored} operations"
+        )
+
+        {:noreply, state}
     end
   end
 
   # Helper Functions
 
+  defp ensure_loaded(session_id) do
+    unless :ets.member(@table, {session_id, :loaded}) do
+      GenServer.call(__MODULE__, {:hydrate, session_id, load_from_db(session_id)})
+    end
+  end
+
+  defp entries(session_id) do
+    :ets.select(@table, [{{{session_id, :"$1"}, :_}, [{:is_integer, :"$1"}], [:"$_"]}])
+  end
+
+  # Each entry is taken by exactly one caller
+  defp take(session_id) do
+    for {key, _op} <- entries(session_id), entry <- :ets.take(@table, key), do: entry
+  end
+
+  defp next_seq, do: System.unique_integer([:monotonic, :positive])
+
+  defp restore_pending(taken) do
+    ids = Enum.map(taken, fn {_key, op} -> op.id end)
+
+    pending =
+      Operation
+      |> where([o], o.id in ^ids and o.status == "pending")
+      |> select([o], o.id)
+      |> Repo.all()
+      |> MapSet.new()
+
+    entries = Enum.filter(taken, fn {_key, op} -> MapSet.member?(pending, op.id) end)
+    :ets.insert(@table, entries)
+    length(entries)
+  rescue
+    e ->
+      # Still pending in the database, so reloaded on the next restart
+      Logger.error("[TALA] Failed to restore operations: #{Exception.message(e)}")
+      0
+  end
+
   defp persist_operation(op) do
-    %DiwaAgent.Tala.Operation{}
-    |> DiwaAgent.Tala.Operation.changeset(op)
+    %Operation{}
+    |> Operation.changeset(op)
     |> Repo.insert()
   end
 
   defp load_from_db(session_id) do
-    import Ecto.Query
-
-    DiwaAgent.Tala.Operation
+    Operation
     |> where(session_id: ^session_id, status: "pending")
     |> order_by(asc: :inserted_at)
     |> Repo.all()
   end
 
   defp delete_from_db(session_id) do
-    import Ecto.Query
-
-    DiwaAgent.Tala.Operation
+    Operation
     |> where(session_id: ^session_id, status: "pending")
     |> Repo.delete_all()
   end
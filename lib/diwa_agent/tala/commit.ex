@@ -0,0 +1,165 @@
+defmodule DiwaAgent.Tala.Commit do
+  @moduledoc """
+  Applies a flushed TALA buffer as one all-or-nothing unit.
+
+  The operations are planned before anything is written:
+
+    * redundant writes are coalesced: an `update_memory` is dropped when a
+      later `update_memory` or `delete_memory` in the buffer targets the same
+      memory;
+    * runs of consecutive `add_memory` operations are grouped per context
+      into one `Memory.add_many/3` bulk insert.
+
+  The plan runs inside a single transaction, with every other operation
+  going through the tool executor unchanged, and the operations are marked
+  committed in that same transaction. The first failure rolls the whole
+  buffer back. Side effects of the writes (cache invalidation, embeddings,
+  cloud sync) are collected by `DiwaAgent.Storage.AfterCommit` and run only
+  once the transaction has committed, so a rolled-back buffer leaves none
+  behind.
+  """
+
+  alias DiwaAgent.Repo
+  alias DiwaAgent.Storage.{AfterCommit, Memory}
+  alias DiwaAgent.Tala.Operation
+  import Ecto.Query
+
+  @id_chunk 500
+
+  @doc """
+  Apply `ops` (in push order), calling `execute.(tool_name, params)` for the
+  operations that are not bulk-written.
+
+  Returns `{:ok, %{applied: count, coalesced: count}}`, or
+  `{:error, {op, reason}}` where `op` is the failing operation (`nil` when
+  the failure cannot be attributed to one).
+  """
+  def run(ops, execute) do
+    {steps, coalesced} = plan(ops)
+
+    result =
+      AfterCommit.transaction(
+        fn ->
+          Enum.each(steps, &apply_step(&1, execute))
+          mark_committed(Enum.map(ops, & &1.id))
+          length(ops) - coalesced
+        end,
+        timeout: :infinity
+      )
+
+    case result do
+      {:ok, applied} -> {:ok, %{applied: applied, coalesced: coalesced}}
+      {:error, {%Operation{}, _reason} = failure} -> {:error, failure}
+      {:error, reason} -> {:error, {nil, reason}}
+    end
+  end
+
+  @doc """
+  Coalesce and group `ops` into steps. Returns `{steps, coalesced_count}`,
+  where each step is `{:execute, op}` or `{:add_memories, context_id, ops}`.
+  """
+  def plan(ops) do
+    kept = coalesce(ops)
+    {group(kept), length(ops) - length(kept)}
+  end
+
+  # Walk backwards, remembering the memories written later in the buffer
+  defp coalesce(ops) do
+    {kept, _written_later} =
+      ops
+      |> Enum.reverse()
+      |> Enum.reduce({[], MapSet.new()}, fn op, {kept, later} ->
+        case memory_write(op) do
+          {:update, id} ->
+            if MapSet.member?(later, id),
+              do: {kept, later},
+              else: {[op | kept], MapSet.put(later, id)}
+
+          {:delete, id} ->
+            {[op | kept], MapSet.put(later, id)}
+
+          nil ->
+            {[op | kept], later}
+        end
+      end)
+
+    kept
+  end
+
+  defp memory_write(%{tool_name: "update_memory", params: %{"memory_id" => id}}),
+    do: {:update, id}
+
+  defp memory_write(%{tool_name: "delete_memory", params: %{"memory_id" => id}}),
+    do: {:delete, id}
+
+  defp memory_write(_op), do: nil
+
+  # Memories added to different contexts are independent, so a run can be
+  # split per context without changing the outcome
+  defp group(ops) do
+    ops
+    |> Enum.chunk_by(&(&1.tool_name == "add_memory"))
+    |> Enum.flat_map(fn
+      [%{tool_name: "add_memory"}, _ | _] = run ->
+        run
+        |> Enum.chunk_by(& &1.params["context_id"])
+        |> Enum.map(fn
+          [op] -> {:execute, op}
+          [op | _] = same -> {:add_memories, op.params["context_id"], same}
+        end)
+
+      run ->
+        Enum.map(run, &{:execute, &1})
+    end)
+  end
+
+  defp apply_step({:execute, op}, execute) do
+    response = execute.(op.tool_name, op.params)
+
+    if response["isError"] do
+      Repo.rollback({op, error_text(response)})
+    end
+  end
+
+  defp apply_step({:add_memories, context_id, ops}, _execute) do
+    case Memory.add_many(context_id, Enum.map(ops, & &1.params)) do
+      {:ok, results} ->
+        failed = Enum.zip(ops, results) |> Enum.find(&(not match?({_, {:ok, _}}, &1)))
+
+        case failed do
+          nil ->
+            Enum.zip(ops, results)
+            |> Enum.each(fn {op, {:ok, memory}} ->
+              platform = op.params["actor"] || "antigravity"
+              message = "Added memory via TALA commit"
+              DiwaAgent.CVC.record_commit(context_id, platform, memory.id, message)
+            end)
+
+          {op, {:error, reason}} ->
+            Repo.rollback({op, reason})
+        end
+
+      {:error, reason} ->
+        Repo.rollback({hd(ops), reason})
+    end
+  rescue
+    # A failed bulk insert has aborted the transaction (see Memory.add_many/3),
+    # so it fails the commit instead of being retried row by row
+    e -> Repo.rollback({hd(ops), Exception.message(e)})
+  end
+
+  defp mark_committed(ids) do
+    ids
+    |> Enum.chunk_every(@id_chunk)
+    |> Enum.each(fn chunk ->
+      from(o in Operation, where: o.id in ^chunk)
+      |> Repo.update_all(set: [status: "committed"])
+    end)
+  end
+
+  defp error_text(%{"content" => content}) when is_list(content) do
+    Enum.map_join(content, "\n", &Map.get(&1, "text", ""))
+  end
+
+  defp error_text(response), do: inspect(response)
+end
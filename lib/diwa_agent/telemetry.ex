@@ -1,14 +1,39 @@
 defmodule DiwaAgent.Telemetry do
   @moduledoc """
   Telemetry and instrumentation for Diwa Agent.
+
+  Thin wrappers over `:telemetry`. Events emitted by the agent:
+
+    * `[:diwa_agent, :tool, :execute, :start | :stop | :exception]` - every
+      `DiwaAgent.Tools.Executor.execute/2` call (`tool_name` metadata)
+    * `[:diwa_agent, :server, :decode | :encode, ...]` - JSON-RPC
+      deserialisation in the server and serialisation in the transport
+    * `[:diwa_agent, :repo, :query]` - emitted by Ecto for every query
+    * `[:diwa_agent, :embedding, :batch | :queue | :cache]` - embedding pipeline
+    * `[:diwa_agent, :search, :retriever]` - each retriever of a hybrid memory
+      search (`retriever` and `status` metadata)
+    * `[:diwa_agent, :sync, :batch, ...]` and `[:diwa_agent, :sync, :queue]` -
+      cloud sync batches and queue depth
+
+  `DiwaAgent.Telemetry.Metrics` aggregates them in-process.
   """
 
-  def span(_event, _metadata, fun) do
-    # Simple wrapper for community edition
-    fun.()
+  @doc """
+  Run `fun` inside a `:telemetry` span. The stop event's metadata carries
+  `status: :error` when `fun` returns `{:error, _}` or an MCP error result.
+  """
+  def span(event, metadata, fun) do
+    :telemetry.span(event, metadata, fn ->
+      result = fun.()
+      {result, Map.put(metadata, :status, status(result))}
+    end)
   end
 
-  def execute(_event, _measurements, _metadata \\ %{}) do
-    :ok
+  def execute(event, measurements, metadata \\ %{}) do
+    :telemetry.execute(event, measurements, metadata)
   end
+
+  defp status({:error, _}), do: :error
+  defp status(%{"isError" => true}), do: :error
+  defp status(_), do: :ok
 end
@@ -0,0 +1,342 @@
+defmodule DiwaAgent.Telemetry.Metrics do
+  @moduledoc """
+  In-process aggregation of `DiwaAgent.Telemetry` events.
+
+  Durations go into log-linear (HDR-style) histograms: exact below 32µs,
+  then 16 sub-buckets per power of two, so any recorded value is within
+  about 6% of its bucket. Buckets, counts, sums and error counts are ETS
+  counters updated from the process that emitted the event, so recording
+  never goes through a GenServer.
+
+  Histograms are keyed `{group, name}`, e.g. `{:tool, "search_memories"}`,
+  `{:repo, "memories"}`, `{:server, :decode}`. Counters and gauges cover
+  embedding cache hits/misses and queue depths.
+
+  Set `config :diwa_agent, DiwaAgent.Telemetry.Metrics, prometheus_file: path`
+  to have a Prometheus text dump rewritten every `:dump_interval_ms`
+  (default 15s).
+  """
+
+  use GenServer
+  require Logger
+
+  @table :diwa_metrics
+  @handler_id "diwa-agent-metrics"
+  @sub_bits 4
+  @sub_buckets 16
+  @linear_limit 32
+  @quantiles [0.5, 0.9, 0.95, 0.99]
+
+  @events [
+    [:diwa_agent, :tool, :execute, :stop],
+    [:diwa_agent, :tool, :execute, :exception],
+    [:diwa_agent, :server, :decode, :stop],
+    [:diwa_agent, :server, :encode, :stop],
+    [:diwa_agent, :repo, :query],
+    [:diwa_agent, :embedding, :batch],
+    [:diwa_agent, :embedding, :cache],
+    [:diwa_agent, :embedding, :queue],
+    [:diwa_agent, :sync, :batch, :stop],
+    [:diwa_agent, :sync, :batch, :exception],
+    [:diwa_agent, :sync, :queue],
+    [:diwa_agent, :hot_cache, :lookup]
+  ]
+
+  # Client API
+
+  def start_link(opts \\ []) do
+    GenServer.start_link(__MODULE__, opts, name: __MODULE__)
+  end
+
+  @doc """
+  Record a duration (in native time units) for histogram `metric`.
+  """
+  def record(metric, native_duration, status \\ :ok) do
+    if :ets.whereis(@table) != :undefined do
+      us = System.convert_time_unit(native_duration, :native, :microsecond)
+      index = bucket_index(max(us, 0))
+
+      :ets.update_counter(@table, {:hist, metric, :count}, 1, {{:hist, metric, :count}, 0})
+      :ets.update_counter(@table, {:hist, metric, :sum}, us, {{:hist, metric, :sum}, 0})
+      :ets.update_counter(@table, {:bucket, metric, index}, 1, {{:bucket, metric, index}, 0})
+
+      if status == :error do
+        :ets.update_counter(@table, {:hist, metric, :errors}, 1, {{:hist, metric, :errors}, 0})
+      end
+    end
+
+    :ok
+  end
+
+  @doc """
+  Add `by` to counter `name`.
+  """
+  def increment(name, by \\ 1) do
+    if :ets.whereis(@table) != :undefined do
+      :ets.update_counter(@table, {:counter, name}, by, {{:counter, name}, 0})
+    end
+
+    :ok
+  end
+
+  @doc """
+  Set gauge `name` to `value`.
+  """
+  def gauge(name, value) do
+    if :ets.whereis(@table) != :undefined, do: :ets.insert(@table, {{:gauge, name}, value})
+    :ok
+  end
+
+  @doc """
+  Current metrics:
+
+      %{
+        histograms: %{{group, name} => %{count, errors, mean_ms, max_ms, p50_ms, ...}},
+        counters: %{name => integer},
+        gauges: %{name => number}
+      }
+  """
+  def snapshot do
+    rows = if :ets.whereis(@table) == :undefined, do: [], else: :ets.tab2list(@table)
+
+    buckets =
+      for {{:bucket, metric, index}, n} <- rows, reduce: %{} do
+        acc -> Map.update(acc, metric, [{index, n}], &[{index, n} | &1])
+      end
+
+    totals =
+      for {{:hist, metric, field}, n} <- rows, reduce: %{} do
+        acc -> Map.update(acc, metric, %{field => n}, &Map.put(&1, field, n))
+      end
+
+    histograms =
+      Map.new(totals, fn {metric, t} ->
+        {metric, summarize(t, Enum.sort(Map.get(buckets, metric, [])))}
+      end)
+
+    %{
+      histograms: histograms,
+      counters: for({{:counter, name}, n} <- rows, into: %{}, do: {name, n}),
+      gauges: for({{:gauge, name}, v} <- rows, into: %{}, do: {name, v})
+    }
+  end
+
+  @doc """
+  Drop every recorded value.
+  """
+  def reset do
+    if :ets.whereis(@table) != :undefined, do: :ets.delete_all_objects(@table)
+    :ok
+  end
+
+  @doc """
+  Metrics in the Prometheus text exposition format. Histograms are exported
+  as summaries (quantiles, `_sum` and `_count` in seconds).
+  """
+  def prometheus(snapshot \\ snapshot()) do
+    histograms =
+      snapshot.histograms
+      |> Enum.sort()
+      |> Enum.group_by(fn {{group, _name}, _} -> group end)
+      |> Enum.map(fn {group, entries} ->
+        metric = "diwa_#{group}_duration_seconds"
+
+        lines =
+          Enum.flat_map(entries, fn {{_group, name}, h} ->
+            label = ~s(name="#{escape(name)}")
+
+            Enum.map(@quantiles, fn q ->
+              ~s(#{metric}{#{label},quantile="#{q}"} #{h[quantile_key(q)] / 1000})
+            end) ++
+              [
+                "#{metric}_sum{#{label}} #{h.sum_ms / 1000}",
+                "#{metric}_count{#{label}} #{h.count}",
+                "diwa_#{group}_errors_total{#{label}} #{h.errors}"
+              ]
+          end)
+
+        ["# TYPE #{metric} summary" | lines]
+      end)
+
+    counters =
+      Enum.map(Enum.sort(snapshot.counters), fn {name, n} ->
+        "# TYPE diwa_#{name}_total counter\ndiwa_#{name}_total #{n}"
+      end)
+
+    gauges =
+      Enum.map(Enum.sort(snapshot.gauges), fn {name, v} ->
+        "# TYPE diwa_#{name} gauge\ndiwa_#{name} #{v}"
+      end)
+
+    (List.flatten(histograms) ++ counters ++ gauges)
+    |> Enum.join("\n")
+    |> Kernel.<>("\n")
+  end
+
+  @doc """
+  Write `prometheus/0` output to `path` (atomically, via a temp file).
+  """
+  def dump(path) do
+    tmp = path <> ".tmp"
+
+    with :ok <- File.mkdir_p(Path.dirname(path)),
+         :ok <- File.write(tmp, prometheus()) do
+      File.rename(tmp, path)
+    end
+  end
+
+  # Telemetry handler (runs in the emitting process)
+
+  @doc false
+  def handle_event([:diwa_agent, :tool, :execute, kind], measurements, meta, _config) do
+    status = if kind == :exception, do: :error, else: Map.get(meta, :status, :ok)
+    record({:tool, to_string(meta[:tool_name] || "unknown")}, measurements.duration, status)
+  end
+
+  def handle_event([:diwa_agent, :server, step, :stop], measurements, meta, _config) do
+    record({:server, step}, measurements.duration, Map.get(meta, :status, :ok))
+  end
+
+  def handle_event([:diwa_agent, :repo, :query], measurements, meta, _config) do
+    if total = measurements[:total_time] do
+      record({:repo, to_string(meta[:source] || "raw_sql")}, total)
+    end
+
+    :ok
+  end
+
+  def handle_event([:diwa_agent, :embedding, :batch], measurements, meta, _config) do
+    record({:embedding, :batch}, measurements.duration, Map.get(meta, :status, :ok))
+    increment(:embedding_texts, measurements[:size] || 0)
+  end
+
+  def handle_event([:diwa_agent, :embedding, :cache], measurements, _meta, _config) do
+    increment(:embedding_cache_hits, measurements[:hit] || 0)
+    increment(:embedding_cache_misses, measurements[:miss] || 0)
+  end
+
+  def handle_event([:diwa_agent, :embedding, :queue], measurements, _meta, _config) do
+    gauge(:embedding_queue_depth, measurements.depth)
+  end
+
+  def handle_event([:diwa_agent, :sync, :batch, kind], measurements, meta, _config) do
+    status = if kind == :exception, do: :error, else: Map.get(meta, :status, :ok)
+    record({:sync, :batch}, measurements.duration, status)
+  end
+
+  def handle_event([:diwa_agent, :sync, :queue], measurements, _meta, _config) do
+    gauge(:sync_queue_depth, measurements.depth)
+  end
+
+  def handle_event([:diwa_agent, :hot_cache, :lookup], measurements, meta, _config) do
+    increment(:"hot_cache_#{meta.result}", measurements.count)
+  end
+
+  def handle_event(_event, _measurements, _meta, _config), do: :ok
+
+  # Server Callbacks
+
+  @impl true
+  def init(opts) do
+    Process.flag(:trap_exit, true)
+    :ets.new(@table, [:named_table, :set, :public, write_concurrency: true])
+    :telemetry.attach_many(@handler_id, @events, &__MODULE__.handle_event/4, nil)
+
+    settings = Keyword.merge(Application.get_env(:diwa_agent, __MODULE__, []), opts)
+    state = %{file: settings[:prometheus_file], interval: settings[:dump_interval_ms] || 15_000}
+
+    if state.file, do: schedule_dump(state)
+    {:ok, state}
+  end
+
+  @impl true
+  def handle_info(:dump, state) do
+    case dump(state.file) do
+      :ok -> :ok
+      {:error, reason} -> Logger.warning("[DiwaAgent.Metrics] Dump failed: #{inspect(reason)}")
+    end
+
+    schedule_dump(state)
+    {:noreply, state}
+  end
+
+  def handle_info(_msg, state), do: {:noreply, state}
+
+  @impl true
+  def terminate(_reason, state) do
+    if state.file, do: dump(state.file)
+    :telemetry.detach(@handler_id)
+    :ok
+  end
+
+  # Histogram buckets
+
+  @doc false
+  def bucket_index(value) when value < @linear_limit, do: value
+
+  def bucket_index(value) do
+    shift = bit_length(value) - 1 - @sub_bits
+    shift * @sub_buckets + Bitwise.bsr(value, shift)
+  end
+
+  @doc false
+  def bucket_lower_bound(index) when index < @linear_limit, do: index
+
+  def bucket_lower_bound(index) do
+    shift = div(index, @sub_buckets) - 1
+    Bitwise.bsl(rem(index, @sub_buckets) + @sub_buckets, shift)
+  end
+
+  # Midpoint of a bucket, in microseconds
+  defp bucket_value(index) when index < @linear_limit, do: index
+
+  defp bucket_value(index) do
+    shift = div(index, @sub_buckets) - 1
+    bucket_lower_bound(index) + Bitwise.bsl(1, shift) / 2
+  end
+
+  defp bit_length(value), do: length(Integer.digits(value, 2))
+
+  defp summarize(totals, buckets) do
+    count = Map.get(totals, :count, 0)
+    sum = Map.get(totals, :sum, 0)
+
+    base = %{
+      count: count,
+      errors: Map.get(totals, :errors, 0),
+      sum_ms: sum / 1000,
+      mean_ms: if(count > 0, do: Float.round(sum / count / 1000, 3), else: 0.0),
+      max_ms:
+        case List.last(buckets) do
+          {index, _} -> ms(bucket_value(index))
+          nil -> 0.0
+        end
+    }
+
+    Enum.reduce(@quantiles, base, fn q, acc ->
+      Map.put(acc, quantile_key(q), ms(quantile(buckets, count, q)))
+    end)
+  end
+
+  defp quantile(_buckets, 0, _q), do: 0
+
+  defp quantile(buckets, count, q) do
+    rank = max(1, ceil(q * count))
+
+    Enum.reduce_while(buckets, 0, fn {index, n}, seen ->
+      if seen + n >= rank, do: {:halt, {:found, index}}, else: {:cont, seen + n}
+    end)
+    |> case do
+      {:found, index} -> bucket_value(index)
+      _ -> 0
+    end
+  end
+
+  defp quantile_key(q), do: String.to_atom("p#{round(q * 100)}_ms")
+
+  defp ms(us), do: Float.round(us / 1000, 3)
+
+  defp escape(name), do: name |> to_string() |> String.replace(~s("), ~s(\\"))
+
+  defp schedule_dump(state), do: Process.send_after(self(), :dump, state.interval)
+end
@@ -102,6 +102,7 @@ defmodule DiwaAgent.Tools.Definitions do
       hydrate_context(),
       validate_action(),
       prune_expired_memories(),
+      get_metrics(),
 
       # UGAT Tools (Context Intelligence Backbone)
       detect_context(),
@@ -381,6 +382,11 @@ defmodule DiwaAgent.Tools.Definitions do
               required: ["content"]
             },
             description: "List of memories to add"
+          },
+          skip_duplicates: %{
+            type: "boolean",
+            description:
+              "Skip memories whose content (ignoring whitespace) already exists in the context"
           }
         },
         required: ["context_id", "memories"]
@@ -402,6 +408,10 @@ defmodule DiwaAgent.Tools.Definitions do
           limit: %{
             type: "integer",
             description: "Maximum number of memories to return (default: 100)"
+          },
+          cursor: %{
+            type: "string",
+            description: "Optional: next_cursor from the previous page, to continue after it"
           }
         },
         required: ["context_id"]
@@ -474,11 +484,23 @@ defmodule DiwaAgent.Tools.Definitions do
         properties: %{
           query: %{
             type: "string",
-            description: "Text to search for (case-insensitive partial match)"
+            description: "Text to search for (full-text, semantic and fuzzy matches, fused by rank)"
           },
           context_id: %{
             type: "string",
             description: "Optional: Limit search to memories in this specific context only"
+          },
+          limit: %{
+            type: "integer",
+            description: "Optional: Maximum number of results (default 50)"
+          },
+          offset: %{
+            type: "integer",
+            description: "Optional: Number of ranked results to skip, for paging"
+          },
+          cursor: %{
+            type: "string",
+            description: "Optional: next_cursor from the previous page, to continue after it"
           }
         },
         required: ["query"]
@@ -890,7 +912,12 @@ defmodule DiwaAgent.Tools.Definitions do
         type: "object",
         properties: %{
           context_id: %{type: "string", description: "The UUID of the project context"},
-          tag: %{type: "string", description: "The tag to filter by"}
+          tag: %{type: "string", description: "The tag to filter by"},
+          limit: %{type: "integer", description: "Maximum number of memories (default: 100)"},
+          cursor: %{
+            type: "string",
+            description: "Optional: next_cursor from the previous page, to continue after it"
+          }
         },
         required: ["context_id", "tag"]
       }
@@ -1005,7 +1032,12 @@ defmodule DiwaAgent.Tools.Definitions do
       inputSchema: %{
         type: "object",
         properties: %{
-          memory_id: %{type: "string", description: "UUID of the memory"}
+          memory_id: %{type: "string", description: "UUID of the memory"},
+          limit: %{type: "integer", description: "Maximum number of versions (default: 50)"},
+          cursor: %{
+            type: "string",
+            description: "Optional: next_cursor from the previous page, to continue after it"
+          }
         },
         required: ["memory_id"]
       }
@@ -1051,7 +1083,11 @@ defmodule DiwaAgent.Tools.Definitions do
         type: "object",
         properties: %{
           context_id: %{type: "string", description: "UUID of the context"},
-          limit: %{type: "integer", default: 20}
+          limit: %{type: "integer", default: 20},
+          cursor: %{
+            type: "string",
+            description: "Optional: next_cursor from the previous page, to continue after it"
+          }
         },
         required: ["context_id"]
       }
@@ -1148,6 +1184,30 @@ defmodule DiwaAgent.Tools.Definitions do
     }
   end
 
+  defp get_metrics do
+    %{
+      name: "get_metrics",
+      description:
+        "Show per-tool latency percentiles, database query timings, embedding and sync queue metrics for this agent process.",
+      inputSchema: %{
+        type: "object",
+        properties: %{
+          format: %{
+            type: "string",
+            enum: ["text", "prometheus"],
+            description: "Output format (default: text)"
+          },
+          group: %{
+            type: "string",
+            enum: ["tool", "server", "repo", "embedding", "sync"],
+            description: "Only show latency histograms from this group"
+          },
+          reset: %{type: "boolean", description: "Clear all metrics after reading"}
+        }
+      }
+    }
+  end
+
   defp ingest_context do
     %{
       name: "ingest_context",
@@ -1648,7 +1708,8 @@ defmodule DiwaAgent.Tools.Definitions do
   defp search_code do
     %{
       name: "search_code",
-      description: "Search for text/patterns across the codebase using ripgrep.",
+      description:
+        "Search for text/patterns across the codebase (ripgrep, or a built-in index without it).",
       inputSchema: %{
         type: "object",
         properties: %{
@@ -1660,6 +1721,14 @@ defmodule DiwaAgent.Tools.Definitions do
             type: "string",
             description: "Optional glob pattern (e.g., '*.ex')"
           },
+          limit: %{
+            type: "integer",
+            description: "Optional: Maximum number of matches (default 50)"
+          },
+          offset: %{
+            type: "integer",
+            description: "Optional: Number of matches to skip, for paging"
+          },
           context_id: %{
             type: "string",
             description: "Optional Context ID to determine project root"
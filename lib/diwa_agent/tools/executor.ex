@@ -6,8 +6,9 @@ defmodule DiwaAgent.Tools.Executor do
   the appropriate storage layer functions.
   """
 
-  alias DiwaAgent.Storage.{Context, Memory, Plan, Task, MemoryVersion}
+  alias DiwaAgent.Storage.{Context, HotCache, HybridSearch, Memory, Plan, Task, MemoryVersion}
   alias DiwaAgent.Registry.Server, as: Registry
+  alias DiwaAgent.ContextBridge.MemoryLifecycle
   require Logger
 
   @consensus_module Application.compile_env(
@@ -16,12 +17,23 @@ defmodule DiwaAgent.Tools.Executor do
                       DiwaAgent.Consensus.ClusterManager
                     )
 
+  # Upper bound for a poll_delegated_tasks long poll; DiwaAgent.Server runs
+  # a few of these outside its in-flight slots (:max_parked_polls)
+  @max_poll_wait_ms 30_000
+
   @doc """
   Execute a tool with the given arguments.
 
-  Returns an MCP-formatted response.
+  Returns an MCP-formatted response. Each call runs inside a
+  `[:diwa_agent, :tool, :execute]` telemetry span tagged with the tool name.
   """
-  def execute(tool_name, %{"buffer" => true} = args) do
+  def execute(tool_name, args) do
+    DiwaAgent.Telemetry.span([:diwa_agent, :tool, :execute], %{tool_name: tool_name}, fn ->
+      do_execute(tool_name, args)
+    end)
+  end
+
+  defp do_execute(tool_name, %{"buffer" => true} = args) do
     session_id = Map.get(args, "session_id")
 
     if is_nil(session_id) do
@@ -43,7 +55,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute(tool_name, args) when tool_name in ~w(
+  defp do_execute(tool_name, args) when tool_name in ~w(
       detect_context bind_context unbind_context list_bindings 
       link_contexts unlink_contexts get_related_contexts get_context_graph get_dependency_chain
       start_session navigate_contexts confirm_binding
@@ -51,15 +63,15 @@ defmodule DiwaAgent.Tools.Executor do
     DiwaAgent.Tools.Ugat.execute(tool_name, args)
   end
 
-  def execute("determine_workflow", args) do
+  defp do_execute("determine_workflow", args) do
     DiwaAgent.Tools.Flow.execute("determine_workflow", args)
   end
 
-  def execute("queue_handoff_item", args) do
+  defp do_execute("queue_handoff_item", args) do
     execute_queue_handoff_item(args)
   end
 
-  def execute("get_shortcuts", %{"context_id" => _cid}) do
+  defp do_execute("get_shortcuts", %{"context_id" => _cid}) do
     shortcuts =
       DiwaAgent.Shortcuts.Registry.list_shortcuts()
       |> Enum.map(fn {name, def} ->
@@ -80,11 +92,11 @@ defmodule DiwaAgent.Tools.Executor do
     success_response(Jason.encode!(response, pretty: true))
   end
 
-  def execute("create_context", args) when not is_map_key(args, "name") do
+  defp do_execute("create_context", args) when not is_map_key(args, "name") do
     error_response("Error: 'name' parameter is required")
   end
 
-  def execute("create_context", %{"name" => name} = args) do
+  defp do_execute("create_context", %{"name" => name} = args) do
     description = Map.get(args, "description")
     organization_id = Map.get(args, "organization_id")
 
@@ -111,7 +123,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("list_contexts", args) do
+  defp do_execute("list_contexts", args) do
     organization_id = Map.get(args, "organization_id")
     query_str = Map.get(args, "query")
 
@@ -180,7 +192,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("list_organizations", _args) do
+  defp do_execute("list_organizations", _args) do
     {:ok, orgs} = DiwaAgent.Storage.Organization.list()
 
     org_list =
@@ -193,7 +205,7 @@ defmodule DiwaAgent.Tools.Executor do
     success_response("Found #{length(orgs)} organization(s):\n\n#{org_list}")
   end
 
-  def execute("get_context", %{"context_id" => context_id}) do
+  defp do_execute("get_context", %{"context_id" => context_id}) do
     case Context.get(context_id) do
       {:ok, context} ->
         desc = if context.description, do: "\nDescription: #{context.description}", else: ""
@@ -218,7 +230,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("resolve_context", %{"name" => name}) do
+  defp do_execute("resolve_context", %{"name" => name}) do
     case Context.find_by_name(name) do
       {:ok, context} ->
         success_response("""
@@ -230,14 +242,26 @@ defmodule DiwaAgent.Tools.Executor do
         """)
 
       {:error, :not_found} ->
-        error_response("Context not found with name: '#{name}'")
+        case Context.fuzzy_find(name) do
+          {:ok, context} ->
+            success_response("""
+            ✓ Context found: '#{context.name}' (closest match for '#{name}')
+
+            ID: #{context.id}
+            Organization: #{context.organization_id}
+            Description: #{context.description || "N/A"}
+            """)
+
+          {:error, :not_found} ->
+            error_response("Context not found with name: '#{name}'")
+        end
 
       {:error, reason} ->
         error_response("Error resolving context: #{inspect(reason)}")
     end
   end
 
-  def execute("update_context", %{"context_id" => context_id} = args) do
+  defp do_execute("update_context", %{"context_id" => context_id} = args) do
     updates =
       %{
         name: Map.get(args, "name"),
@@ -269,7 +293,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("delete_context", %{"context_id" => context_id}) do
+  defp do_execute("delete_context", %{"context_id" => context_id}) do
     case Context.delete(context_id) do
       :ok ->
         success_response("✓ Context deleted successfully (including all memories)")
@@ -279,7 +303,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("add_memory", %{"context_id" => context_id, "content" => content} = args) do
+  defp do_execute("add_memory", %{"context_id" => context_id, "content" => content} = args) do
     # Phase 4 Hardening: Validation
     with {:ok, _} <- DiwaAgent.Validation.validate_uuid(context_id, "context_id"),
          {:ok, _} <- DiwaAgent.Validation.validate_required(args, ~w(content)) do
@@ -321,56 +345,44 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("add_memories", %{"context_id" => context_id, "memories" => memories}) do
-    # Check if we should register the platform for CVC
-    # Inferred default as we are running in AG environment mostly?
+  defp do_execute("add_memories", %{"context_id" => context_id, "memories" => memories} = args) do
+    # Inferred default as we are running in AG environment mostly
     platform = "antigravity"
-    # Or we should try to extract it from somewhere.
-    # For now, let's just record commits if we can.
-
-    results =
-      Enum.map(memories, fn mem_args ->
-        opts = %{
-          metadata: Map.get(mem_args, "metadata"),
-          actor: Map.get(mem_args, "actor"),
-          project: Map.get(mem_args, "project"),
-          tags: Map.get(mem_args, "tags"),
-          parent_id: Map.get(mem_args, "parent_id"),
-          external_ref: Map.get(mem_args, "external_ref"),
-          severity: Map.get(mem_args, "severity")
-        }
 
-        content = Map.get(mem_args, "content")
+    skip_duplicates = Map.get(args, "skip_duplicates", false) == true
 
-        case Memory.add(context_id, content, opts) do
-          {:ok, memory} ->
-            # Record CVC commit for each memory
-            actor_platform = opts[:actor] || platform
+    case Memory.add_many(context_id, memories, skip_duplicates: skip_duplicates) do
+      {:ok, results} ->
+        memories_added = for {:ok, memory} <- results, do: memory
+        skipped = Enum.count(results, &match?({:skipped, _}, &1))
 
-            DiwaAgent.CVC.record_commit(
-              context_id,
-              actor_platform,
-              memory.id,
-              "Batch added memory"
-            )
+        # Record CVC commit for each memory
+        Enum.each(memories_added, fn memory ->
+          DiwaAgent.CVC.record_commit(
+            context_id,
+            memory.actor || platform,
+            memory.id,
+            "Batch added memory"
+          )
+        end)
 
-            {:ok, memory}
+        message =
+          "✓ Successfully added #{length(memories_added)} of #{length(memories)} memories."
 
-          error ->
-            error
-        end
-      end)
+        message =
+          if skipped > 0, do: message <> " Skipped #{skipped} duplicates.", else: message
 
-    success_count =
-      Enum.count(results, fn
-        {:ok, _} -> true
-        _ -> false
-      end)
+        success_response(message)
+
+      {:error, :context_not_found} ->
+        error_response("Context not found: #{context_id}")
 
-    success_response("✓ Successfully added #{success_count} of #{length(memories)} memories.")
+      {:error, reason} ->
+        error_response("Error adding memories: #{inspect(reason)}")
+    end
   end
 
-  def execute("classify_memory", %{"content" => content} = args) do
+  defp do_execute("classify_memory", %{"content" => content} = args) do
     filename = Map.get(args, "filename")
 
     case DiwaAgent.ContextBridge.MemoryClassification.classify(content, filename: filename) do
@@ -384,7 +396,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("hydrate_context", %{"context_id" => cid} = args) do
+  defp do_execute("hydrate_context", %{"context_id" => cid} = args) do
     depth_str = Map.get(args, "depth", "standard")
 
     depth =
@@ -403,7 +415,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("validate_action", %{"context_id" => cid, "content" => content} = args) do
+  defp do_execute("validate_action", %{"context_id" => cid, "content" => content} = args) do
     mode_str = Map.get(args, "mode", "warn")
 
     mode =
@@ -428,7 +440,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("ingest_context", %{"context_id" => context_id} = args) do
+  defp do_execute("ingest_context", %{"context_id" => context_id} = args) do
     dirs = Map.get(args, "directories", [".agent", ".cursor"])
 
     case DiwaAgent.ContextBridge.Ingestor.run(context_id, dirs: dirs) do
@@ -437,8 +449,12 @@ defmodule DiwaAgent.Tools.Executor do
         ✓ Context Ingestion Complete!
 
         Created: #{stats.created}
-        Skipped: #{stats.skipped}
+        Updated: #{stats.updated}
+        Skipped (unchanged): #{stats.skipped}
+        Deleted: #{stats.deleted}
         Failed: #{stats.failed}
+
+        Scanned #{stats.files} files, read #{stats.bytes_read} bytes in #{stats.duration_ms}ms (#{stats.files_per_sec} files/sec)
         """)
 
       {:error, reason} ->
@@ -446,7 +462,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("start_session", %{"context_id" => cid, "actor" => actor} = args) do
+  defp do_execute("start_session", %{"context_id" => cid, "actor" => actor} = args) do
     metadata = Map.get(args, "metadata", %{})
 
     case DiwaAgent.ContextBridge.LiveSync.start_session(cid, actor, metadata) do
@@ -455,13 +471,13 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("log_session_activity", %{"session_id" => sid, "message" => msg} = args) do
+  defp do_execute("log_session_activity", %{"session_id" => sid, "message" => msg} = args) do
     metadata = Map.get(args, "metadata", %{})
     DiwaAgent.ContextBridge.LiveSync.log_activity(sid, msg, metadata)
     success_response("✓ Activity logged.")
   end
 
-  def execute("end_session", %{"session_id" => sid, "summary" => sum} = args) do
+  defp do_execute("end_session", %{"session_id" => sid, "summary" => sum} = args) do
     next_steps = Map.get(args, "next_steps", [])
 
     case DiwaAgent.ContextBridge.LiveSync.end_session(sid, sum, next_steps) do
@@ -470,14 +486,41 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("prune_expired_memories", _args) do
-    case DiwaAgent.ContextBridge.MemoryLifecycle.prune_expired() do
+  defp do_execute("prune_expired_memories", _args) do
+    case MemoryLifecycle.prune_expired() do
       {:ok, count} -> success_response("✓ Pruned #{count} expired memories across all contexts.")
       error -> error_response("Pruning failed: #{inspect(error)}")
     end
   end
 
-  def execute("get_client_instructions", args) do
+  defp do_execute("get_metrics", args) do
+    alias DiwaAgent.Telemetry.Metrics
+
+    snapshot = Metrics.snapshot()
+
+    snapshot =
+      case Map.get(args, "group") do
+        nil ->
+          snapshot
+
+        group ->
+          histograms =
+            snapshot.histograms
+            |> Enum.filter(fn {{g, _name}, _} -> to_string(g) == group end)
+            |> Map.new()
+
+          %{snapshot | histograms: histograms}
+      end
+
+    if Map.get(args, "reset") == true, do: Metrics.reset()
+
+    case Map.get(args, "format", "text") do
+      "prometheus" -> success_response(Metrics.prometheus(snapshot))
+      _ -> success_response(format_metrics(snapshot))
+    end
+  end
+
+  defp do_execute("get_client_instructions", args) do
     opts =
       [
         client_type: Map.get(args, "client_type", "generic"),
@@ -490,31 +533,40 @@ defmodule DiwaAgent.Tools.Executor do
     success_response(Jason.encode!(res, pretty: true))
   end
 
-  def execute("list_memories", %{"context_id" => context_id} = args) do
+  defp do_execute("list_memories", %{"context_id" => context_id} = args) do
     limit = Map.get(args, "limit", 100)
 
-    {:ok, memories} = Memory.list(context_id, limit: limit)
+    case Memory.list_page(context_id, limit: limit, cursor: Map.get(args, "cursor")) do
+      {:ok, %{entries: []}} ->
+        success_response("No memories found for this context.")
 
-    if memories == [] do
-      success_response("No memories found for this context.")
-    else
-      memory_list =
-        memories
-        |> Enum.map(fn mem ->
-          snippet = String.slice(mem.content, 0, 100)
-          "• [#{mem.id}] #{snippet}"
-        end)
-        |> Enum.join("\n")
+      {:ok, %{entries: memories, next_cursor: next_cursor}} ->
+        memory_list =
+          memories
+          |> Enum.map(fn mem ->
+            snippet = String.slice(mem.content, 0, 100)
+            "• [#{mem.id}] #{snippet}"
+          end)
+          |> Enum.join("\n")
 
-      success_response(
-        "Found #{length(memories)} memory(ies) (Limit: #{limit}):\n\n#{memory_list}"
-      )
+        success_response(
+          "Found #{length(memories)} memory(ies) (Limit: #{limit}):\n\n#{memory_list}" <>
+            next_cursor_note(next_cursor)
+        )
+
+      {:error, :invalid_cursor} ->
+        error_response("Invalid cursor: pass the next_cursor of a previous page.")
+
+      {:error, reason} ->
+        error_response("Error listing memories: #{inspect(reason)}")
     end
   end
 
-  def execute("get_memory", %{"memory_id" => memory_id}) do
+  defp do_execute("get_memory", %{"memory_id" => memory_id}) do
     case Memory.get(memory_id) do
       {:ok, memory} ->
+        MemoryLifecycle.increment_access(memory.id)
+
         success_response("""
         Memory:
 
@@ -535,7 +587,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("update_memory", %{"memory_id" => memory_id, "content" => content}) do
+  defp do_execute("update_memory", %{"memory_id" => memory_id, "content" => content}) do
     case Memory.update(memory_id, content) do
       {:ok, memory} ->
         DiwaAgent.CVC.record_commit(
@@ -559,7 +611,7 @@ defmodule DiwaAgent.Tools.Executor do
 
 
 
-  def execute("delete_memory", %{"memory_id" => memory_id}) do
+  defp do_execute("delete_memory", %{"memory_id" => memory_id}) do
     # Fetch first to get context_id for CVC
     context_id =
       case Memory.get(memory_id) do
@@ -582,25 +634,31 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("get_memory_history", %{"memory_id" => id}) do
-    case MemoryVersion.list_history(id) do
-      {:ok, versions} ->
-        if versions == [] do
-          success_response("No history found for memory: #{id}")
-        else
-          history =
-            versions
-            |> Enum.map(fn v ->
-              "• [#{v.id}] **#{v.operation}** by #{v.actor || "unknown"} at #{v.inserted_at}\n  Reason: #{inspect(v.reason || "N/A")}"
-            end)
-            |> Enum.join("\n\n")
+  defp do_execute("get_memory_history", %{"memory_id" => id} = args) do
+    opts = [limit: Map.get(args, "limit", 50), cursor: Map.get(args, "cursor")]
 
-          success_response("Version history for memory #{id}:\n\n#{history}")
-        end
+    case MemoryVersion.history_page(id, opts) do
+      {:ok, %{entries: []}} ->
+        success_response("No history found for memory: #{id}")
+
+      {:ok, %{entries: versions, next_cursor: next_cursor}} ->
+        history =
+          versions
+          |> Enum.map(fn v ->
+            "• [#{v.id}] **#{v.operation}** by #{v.actor || "unknown"} at #{v.inserted_at}\n  Reason: #{inspect(v.reason || "N/A")}"
+          end)
+          |> Enum.join("\n\n")
+
+        success_response(
+          "Version history for memory #{id}:\n\n#{history}" <> next_cursor_note(next_cursor)
+        )
+
+      {:error, :invalid_cursor} ->
+        error_response("Invalid cursor: pass the next_cursor of a previous page.")
     end
   end
 
-  def execute("rollback_memory", %{"memory_id" => mid, "version_id" => vid} = args) do
+  defp do_execute("rollback_memory", %{"memory_id" => mid, "version_id" => vid} = args) do
     actor = Map.get(args, "actor")
     reason = Map.get(args, "reason")
 
@@ -615,7 +673,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("compare_memory_versions", %{"version_id_1" => v1, "version_id_2" => v2}) do
+  defp do_execute("compare_memory_versions", %{"version_id_1" => v1, "version_id_2" => v2}) do
     with {:ok, ver1} <- MemoryVersion.get(v1),
          {:ok, ver2} <- MemoryVersion.get(v2) do
       diff = """
@@ -638,51 +696,58 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("get_recent_changes", %{"context_id" => cid} = args) do
-    limit = Map.get(args, "limit", 20)
+  defp do_execute("get_recent_changes", %{"context_id" => cid} = args) do
+    opts = [limit: Map.get(args, "limit", 20), cursor: Map.get(args, "cursor")]
 
-    case MemoryVersion.list_recent_changes(cid, limit) do
-      {:ok, changes} ->
-        if changes == [] do
-          success_response("No recent changes found for context: #{cid}")
-        else
-          list =
-            changes
-            |> Enum.map(fn v ->
-              "• [#{v.id}] **#{v.operation}** on Memory #{v.memory_id} by #{v.actor || "unknown"} at #{v.inserted_at}"
-            end)
-            |> Enum.join("\n")
+    case MemoryVersion.recent_changes_page(cid, opts) do
+      {:ok, %{entries: []}} ->
+        success_response("No recent changes found for context: #{cid}")
 
-          success_response("Recent changes in context #{cid}:\n\n#{list}")
-        end
-    end
-  end
+      {:ok, %{entries: changes, next_cursor: next_cursor}} ->
+        list =
+          changes
+          |> Enum.map(fn v ->
+            "• [#{v.id}] **#{v.operation}** on Memory #{v.memory_id} by #{v.actor || "unknown"} at #{v.inserted_at}"
+          end)
+          |> Enum.join("\n")
 
+        success_response(
+          "Recent changes in context #{cid}:\n\n#{list}" <> next_cursor_note(next_cursor)
+        )
 
+      {:error, :invalid_cursor} ->
+        error_response("Invalid cursor: pass the next_cursor of a previous page.")
+    end
+  end
 
+  defp do_execute("search_memories", %{"query" => query} = args) do
+    context_id = Map.get(args, "context_id")
 
+    opts = [
+      context_id: context_id,
+      limit: Map.get(args, "limit", 50),
+      offset: Map.get(args, "offset", 0),
+      cursor: Map.get(args, "cursor")
+    ]
 
-  def execute("search_memories", %{"query" => query} = args) do
-    context_id = Map.get(args, "context_id")
+    case HybridSearch.search(query, opts) do
+      {:ok, %{hits: []}} ->
+        scope = if context_id, do: " in this context", else: ""
+        success_response("No memories found matching '#{query}'#{scope}.")
 
-    case Memory.search(query, context_id) do
-      {:ok, []} ->
-        # Try fuzzy fallback
-        case Memory.fuzzy_search(query, context_id) do
-          {:ok, []} ->
-            scope = if context_id, do: " in this context", else: ""
-            success_response("No memories found matching '#{query}'#{scope}.")
+      {:ok, page} ->
+        MemoryLifecycle.increment_access(Enum.map(page.hits, & &1.memory.id))
+        format_search_results(page, context_id, query)
 
-          {:ok, fuzzy_results} ->
-            format_search_results(fuzzy_results, context_id, query, true)
-        end
+      {:error, :invalid_context_id} ->
+        error_response("Invalid context_id: #{context_id}")
 
-      {:ok, memories} ->
-        format_search_results(memories, context_id, query, false)
+      {:error, :invalid_cursor} ->
+        error_response("Invalid cursor: pass the next_cursor of a previous page.")
     end
   end
 
-  def execute("ingest_agent_dir", %{"context_id" => context_id}) do
+  defp do_execute("ingest_agent_dir", %{"context_id" => context_id}) do
     # Maintain backward compatibility but use new engine
     case DiwaAgent.ContextBridge.Ingestor.run(context_id, dirs: [".agent"]) do
       {:ok, stats} ->
@@ -697,7 +762,7 @@ defmodule DiwaAgent.Tools.Executor do
 
   # --- Bridge Coordination Logic ---
 
-  def execute(
+  defp do_execute(
         "set_project_status",
         %{"context_id" => cid, "status" => status, "completion_pct" => pct} = args
       ) do
@@ -709,7 +774,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("get_project_status", %{"context_id" => cid}) do
+  defp do_execute("get_project_status", %{"context_id" => cid}) do
     case Plan.get(cid) do
       {:ok, plan} ->
         success_response("""
@@ -753,7 +818,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute(
+  defp do_execute(
         "add_requirement",
         %{"context_id" => cid, "title" => title, "description" => desc} = args
       ) do
@@ -771,7 +836,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("mark_requirement_complete", %{"requirement_id" => rid}) do
+  defp do_execute("mark_requirement_complete", %{"requirement_id" => rid}) do
     case Task.complete(rid) do
       {:ok, task} ->
         success_response("✓ Requirement '#{task.title}' marked as complete.")
@@ -784,7 +849,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute(
+  defp do_execute(
         "record_lesson",
         %{"context_id" => cid, "title" => title, "content" => content} = args
       ) do
@@ -797,7 +862,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("search_lessons", %{"query" => query}) do
+  defp do_execute("search_lessons", %{"query" => query}) do
     {:ok, memories} = Memory.search(query)
 
     lessons =
@@ -824,7 +889,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute(
+  defp do_execute(
         "flag_blocker",
         %{"context_id" => cid, "title" => title, "description" => desc} = args
       ) do
@@ -843,7 +908,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("resolve_blocker", %{"blocker_id" => bid, "resolution" => res}) do
+  defp do_execute("resolve_blocker", %{"blocker_id" => bid, "resolution" => res}) do
     case Memory.get(bid) do
       {:ok, memory} ->
         meta =
@@ -875,53 +940,36 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("commit_buffer", %{"session_id" => sid}) do
-    case DiwaAgent.Tala.Buffer.flush(sid) do
+  defp do_execute("commit_buffer", %{"session_id" => sid}) do
+    # Coalesced, bulk-grouped and applied in one transaction: all or nothing
+    apply_ops = fn ops -> DiwaAgent.Tala.Commit.run(ops, &execute/2) end
+
+    case DiwaAgent.Tala.Buffer.commit(sid, apply_ops) do
       {:ok, 0} ->
         success_response("No operations in TALA buffer to commit for session #{sid}.")
 
-      {:ok, ops} ->
-        # Execute all accumulated operations
-        # Note: We don't wrap in Ecto.transaction here because individual execute
-        # calls may have their own transactional logic or side effects (like WIKA notifications).
-        # TALA provides 'Lazy Apply', but atomicity across all tools is a future enhancement (Phase 3).
-        results =
-          Enum.reduce_while(ops, {:ok, []}, fn op, {:ok, acc} ->
-            # Call execute without 'buffer: true' to actually run it
-            res = execute(op.tool_name, op.params)
-
-            if res["isError"] do
-              {:halt,
-               {:error,
-                "Failed to execute #{op.tool_name} (Buffer ID: #{op.id}): #{inspect(res["content"]) || "No error detail"}"}}
-            else
-              {:cont, {:ok, acc ++ [res]}}
-            end
-          end)
+      {:ok, %{applied: applied, coalesced: coalesced}} ->
+        message = "✓ Successfully committed #{applied} operations from TALA buffer."
 
-        case results do
-          {:ok, list} ->
-            # Mark as committed in DB
-            import Ecto.Query
+        message =
+          if coalesced > 0,
+            do: message <> " Coalesced #{coalesced} redundant operations.",
+            else: message
 
-            DiwaAgent.Tala.Operation
-            |> where(session_id: ^sid, status: "pending")
-            |> DiwaAgent.Repo.update_all(set: [status: "committed"])
+        success_response(message)
 
-            success_response(
-              "✓ Successfully committed #{length(list)} operations from TALA buffer."
-            )
+      {:error, {nil, reason}} ->
+        error_response("Commit failed, nothing was applied: #{inspect(reason)}")
 
-          {:error, reason} ->
-            error_response("Commit failed: #{reason}")
-        end
-
-      {:error, reason} ->
-        error_response("Flush failed: #{inspect(reason)}")
+      {:error, {op, reason}} ->
+        error_response(
+          "Commit failed, nothing was applied. #{op.tool_name} (Buffer ID: #{op.id}): " <>
+            if(is_binary(reason), do: reason, else: inspect(reason))
+        )
     end
   end
 
-  def execute("list_pending", %{"session_id" => sid}) do
+  defp do_execute("list_pending", %{"session_id" => sid}) do
     ops = DiwaAgent.Tala.Buffer.list(sid)
 
     if Enum.empty?(ops) do
@@ -938,12 +986,12 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("discard_buffer", %{"session_id" => sid}) do
+  defp do_execute("discard_buffer", %{"session_id" => sid}) do
     :ok = DiwaAgent.Tala.Buffer.discard(sid)
     success_response("✓ TALA buffer discarded for session #{sid}.")
   end
 
-  def execute(
+  defp do_execute(
         "set_handoff_note",
         %{"context_id" => cid, "summary" => sum} = args
       ) do
@@ -1058,7 +1106,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("get_active_handoff", %{"context_id" => cid}) do
+  defp do_execute("get_active_handoff", %{"context_id" => cid}) do
     {:ok, list} = Memory.list_by_type(cid, "handoff")
 
     case list do
@@ -1104,7 +1152,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("get_pending_tasks", %{"context_id" => cid} = args) do
+  defp do_execute("get_pending_tasks", %{"context_id" => cid} = args) do
     limit = Map.get(args, "limit", 10)
     {:ok, tasks} = Task.get_pending(cid, limit)
 
@@ -1131,13 +1179,14 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("get_resume_context", %{"context_id" => cid}) do
-    # Get handoff note
-    {:ok, handoffs} = Memory.list_by_type(cid, "handoff")
-
+  defp do_execute("get_resume_context", %{"context_id" => cid}) do
+    # Session-start reads are served from HotCache
     handoff_summary =
-      case handoffs do
-        [latest | _] ->
+      case HotCache.latest_handoff(cid) do
+        nil ->
+          "No handoff note available."
+
+        latest ->
           meta =
             if is_binary(latest.metadata),
               do: Jason.decode!(latest.metadata),
@@ -1152,13 +1201,10 @@ defmodule DiwaAgent.Tools.Executor do
           Next Steps:
           #{steps}
           """
-
-        [] ->
-          "No handoff note available."
       end
 
     # Get pending tasks
-    {:ok, tasks} = Task.get_pending(cid, 5)
+    {:ok, tasks} = HotCache.pending_tasks(cid, 5)
 
     tasks_summary =
       if tasks == [] do
@@ -1176,10 +1222,9 @@ defmodule DiwaAgent.Tools.Executor do
       end
 
     # Get active blockers
-    {:ok, blockers} = Memory.list_by_type(cid, "blocker")
-
     active_blockers =
-      blockers
+      cid
+      |> HotCache.blockers()
       |> Enum.filter(fn b ->
         !String.starts_with?(b.content || "", "[RESOLVED]")
       end)
@@ -1207,14 +1252,14 @@ defmodule DiwaAgent.Tools.Executor do
 
     # Get health score
     health_summary =
-      case DiwaAgent.Storage.HealthEngine.compute_health(cid) do
+      case HotCache.health(cid) do
         {:ok, %{total: total}} -> "📊 Context Health: #{total}/100"
         _ -> "📊 Context Health: Unknown"
       end
 
     # Get project status
     status_summary =
-      case Plan.get(cid) do
+      case HotCache.plan(cid) do
         {:ok, plan} -> "🎯 Status: #{plan.status} (#{plan.completion_pct}%)"
         _ -> "🎯 Status: Not set"
       end
@@ -1233,7 +1278,7 @@ defmodule DiwaAgent.Tools.Executor do
     """)
   end
 
-  def execute("log_progress", %{"context_id" => cid, "message" => msg} = args) do
+  defp do_execute("log_progress", %{"context_id" => cid, "message" => msg} = args) do
     tags = Map.get(args, "tags", "progress")
     metadata = %{type: "progress", timestamp: DateTime.utc_now() |> DateTime.to_iso8601()}
 
@@ -1249,7 +1294,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute(
+  defp do_execute(
         "record_decision",
         %{"context_id" => cid, "decision" => dec, "rationale" => rat} = args
       ) do
@@ -1267,7 +1312,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute(
+  defp do_execute(
         "record_deployment",
         %{"context_id" => cid, "environment" => env, "version" => ver, "status" => status} = args
       ) do
@@ -1289,7 +1334,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute(
+  defp do_execute(
         "log_incident",
         %{"context_id" => cid, "title" => title, "description" => desc, "severity" => sev} = args
       ) do
@@ -1309,7 +1354,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute(
+  defp do_execute(
         "record_pattern",
         %{"context_id" => cid, "name" => name, "description" => desc} = args
       ) do
@@ -1327,7 +1372,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute(
+  defp do_execute(
         "record_review",
         %{"context_id" => cid, "title" => title, "summary" => sum, "status" => status} = args
       ) do
@@ -1346,7 +1391,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("prioritize_requirement", %{"requirement_id" => rid, "priority" => priority}) do
+  defp do_execute("prioritize_requirement", %{"requirement_id" => rid, "priority" => priority}) do
     case Task.update_priority(rid, priority) do
       {:ok, task} ->
         success_response("✓ Requirement '#{task.title}' priority updated to #{priority}.")
@@ -1359,27 +1404,37 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("list_by_tag", %{"context_id" => cid, "tag" => tag}) do
-    {:ok, memories} = Memory.list_by_tag(cid, tag)
+  defp do_execute("list_by_tag", %{"context_id" => cid, "tag" => tag} = args) do
+    opts = [limit: Map.get(args, "limit", 100), cursor: Map.get(args, "cursor")]
 
-    if memories == [] do
-      success_response("No memories found with tag '#{tag}'.")
-    else
-      list =
-        memories
-        |> Enum.map(fn mem ->
-          preview = String.slice(mem.content, 0, 100)
-          preview = if String.length(mem.content) > 100, do: preview <> "...", else: preview
-          tags = Enum.join(mem.tags, ", ")
-          "• #{preview}\n  ID: #{mem.id}\n  Tags: #{tags}\n  Created: #{mem.inserted_at}"
-        end)
-        |> Enum.join("\n\n")
+    case Memory.list_by_tag_page(cid, tag, opts) do
+      {:ok, %{entries: []}} ->
+        success_response("No memories found with tag '#{tag}'.")
 
-      success_response("Memories tagged with '#{tag}':\n\n#{list}")
+      {:ok, %{entries: memories, next_cursor: next_cursor}} ->
+        list =
+          memories
+          |> Enum.map(fn mem ->
+            preview = String.slice(mem.content, 0, 100)
+            preview = if String.length(mem.content) > 100, do: preview <> "...", else: preview
+            tags = Enum.join(mem.tags, ", ")
+            "• #{preview}\n  ID: #{mem.id}\n  Tags: #{tags}\n  Created: #{mem.inserted_at}"
+          end)
+          |> Enum.join("\n\n")
+
+        success_response(
+          "Memories tagged with '#{tag}':\n\n#{list}" <> next_cursor_note(next_cursor)
+        )
+
+      {:error, :invalid_cursor} ->
+        error_response("Invalid cursor: pass the next_cursor of a previous page.")
+
+      {:error, reason} ->
+        error_response("Error listing memories: #{inspect(reason)}")
     end
   end
 
-  def execute("export_context", %{"context_id" => cid, "format" => format}) do
+  defp do_execute("export_context", %{"context_id" => cid, "format" => format}) do
     case Context.get(cid) do
       {:ok, context} ->
         {:ok, memories} = Memory.list(cid, limit: 1000)
@@ -1394,7 +1449,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("perform_backup", _args) do
+  defp do_execute("perform_backup", _args) do
     case DiwaAgent.Storage.Backup.perform_full_backup() do
       {:ok, count} ->
         success_response(
@@ -1406,7 +1461,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute(
+  defp do_execute(
         "record_analysis_result",
         %{"context_id" => cid, "scanner_name" => scan, "findings" => findings, "severity" => sev} =
           args
@@ -1426,14 +1481,14 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("link_memories", %{"parent_id" => pid, "child_id" => cid}) do
+  defp do_execute("link_memories", %{"parent_id" => pid, "child_id" => cid}) do
     case Memory.set_parent(cid, pid) do
       {:ok, _} -> success_response("✓ Linked memory #{cid} to parent #{pid}.")
       {:error, reason} -> error_response("Failed to link memories: #{inspect(reason)}")
     end
   end
 
-  def execute("get_memory_tree", %{"root_id" => rid}) do
+  defp do_execute("get_memory_tree", %{"root_id" => rid}) do
     case build_tree(rid, 0) do
       {:ok, tree} -> success_response(tree)
       {:error, :not_found} -> error_response("Root memory not found: #{rid}")
@@ -1443,7 +1498,7 @@ defmodule DiwaAgent.Tools.Executor do
 
   # --- Agent Coordination Logic (Phase 1.4) ---
 
-  def execute("register_agent", %{"name" => name, "role" => role, "capabilities" => caps} = _args) do
+  defp do_execute("register_agent", %{"name" => name, "role" => role, "capabilities" => caps} = _args) do
     # Convert role string to atom if needed
     role_atom = String.to_atom(role)
 
@@ -1468,7 +1523,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("match_experts", %{"capabilities" => caps}) do
+  defp do_execute("match_experts", %{"capabilities" => caps}) do
     case DiwaAgent.Registry.Server.find_by_capabilities(caps) do
       [] ->
         success_response(
@@ -1487,11 +1542,18 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("poll_delegated_tasks", %{"agent_id" => agent_id}) do
+  defp do_execute("poll_delegated_tasks", %{"agent_id" => agent_id} = args) do
     # Update heartbeat implicitly
     DiwaAgent.Registry.Server.heartbeat(agent_id)
 
-    case DiwaAgent.Delegation.Broker.poll(agent_id) do
+    # Long poll: wait up to wait_ms for a task instead of returning empty
+    wait_ms =
+      case Map.get(args, "wait_ms", 0) do
+        ms when is_integer(ms) -> ms |> max(0) |> min(@max_poll_wait_ms)
+        _ -> 0
+      end
+
+    case DiwaAgent.Delegation.Broker.poll(agent_id, timeout: wait_ms) do
       {:ok, []} ->
         success_response("No pending tasks found.")
 
@@ -1522,7 +1584,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute(
+  defp do_execute(
         "delegate_task",
         %{"from_agent_id" => from, "context_id" => _cid, "task_definition" => task_def} = args
       ) do
@@ -1552,7 +1614,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("respond_to_delegation", %{"delegation_id" => id, "status" => status} = args) do
+  defp do_execute("respond_to_delegation", %{"delegation_id" => id, "status" => status} = args) do
     reason = Map.get(args, "reason", "No reason provided")
     Logger.info("[Executor] Agent responded to delegation #{id}: #{status} (#{inspect(reason)})")
 
@@ -1563,7 +1625,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("complete_delegation", %{"delegation_id" => id, "result_summary" => summary}) do
+  defp do_execute("complete_delegation", %{"delegation_id" => id, "result_summary" => summary}) do
     # We usually need status here too, assume completed
     case DiwaAgent.Delegation.Broker.complete(id, summary) do
       :ok ->
@@ -1574,7 +1636,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("get_agent_health", %{"agent_id" => agent_id, "context_id" => context_id}) do
+  defp do_execute("get_agent_health", %{"agent_id" => agent_id, "context_id" => context_id}) do
     # 1. Check Registry State
     registry_status =
       case Registry.get_agent(agent_id) do
@@ -1614,7 +1676,7 @@ defmodule DiwaAgent.Tools.Executor do
     """)
   end
 
-  def execute("restore_agent", %{"agent_id" => agent_id, "context_id" => context_id}) do
+  defp do_execute("restore_agent", %{"agent_id" => agent_id, "context_id" => context_id}) do
     # Find latest checkpoint
     {:ok, checkpoints} = Memory.list_by_tag(context_id, "sinag:checkpoint")
 
@@ -1642,7 +1704,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("log_failure", %{"agent_id" => agent_id, "context_id" => context_id} = args) do
+  defp do_execute("log_failure", %{"agent_id" => agent_id, "context_id" => context_id} = args) do
     category = Map.get(args, "error_category")
     severity = Map.get(args, "severity")
     stack = Map.get(args, "stack_trace", "N/A")
@@ -1666,7 +1728,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("purge_old_checkpoints", %{"context_id" => _context_id} = args) do
+  defp do_execute("purge_old_checkpoints", %{"context_id" => _context_id} = args) do
     days = Map.get(args, "retention_days", 7)
     # This would involve querying memories by tag and date, then deleting.
     success_response("✓ Purge simulation complete. 0 checkpoints found older than #{days} days.")
@@ -1674,7 +1736,7 @@ defmodule DiwaAgent.Tools.Executor do
 
   # Distributed Consensus Tools (Phase 3)
 
-  def execute("get_cluster_status", args) do
+  defp do_execute("get_cluster_status", args) do
     include_metrics = Map.get(args, "include_metrics", false)
 
     case @consensus_module.get_cluster_status(include_metrics: include_metrics) do
@@ -1713,7 +1775,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("get_byzantine_nodes", args) do
+  defp do_execute("get_byzantine_nodes", args) do
     min_level = Map.get(args, "min_suspicion_level", "medium")
 
     case @consensus_module.get_byzantine_nodes(min_suspicion_level: min_level) do
@@ -1746,7 +1808,7 @@ defmodule DiwaAgent.Tools.Executor do
 
   # --- Shortcut Interpreter Tools (Phase 4) ---
 
-  def execute("execute_shortcut", %{"command" => command, "context_id" => context_id}) do
+  defp do_execute("execute_shortcut", %{"command" => command, "context_id" => context_id}) do
     case DiwaAgent.Shortcuts.Interpreter.process(command, context_id) do
       # If it returns a map, it's a successful tool execution (already formatted)
       %{} = result -> result
@@ -1757,13 +1819,13 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("execute_shortcut", %{"command" => command} = args) do
+  defp do_execute("execute_shortcut", %{"command" => command} = args) do
     context_id = Map.get(args, "context_id")
     # Delegate to our new Interpreter
     DiwaAgent.Shortcuts.Interpreter.interpret(command, context_id)
   end
 
-  def execute("list_shortcuts", _args) do
+  defp do_execute("list_shortcuts", _args) do
     shortcuts = DiwaAgent.Shortcuts.Registry.list_shortcuts()
     sorted_shortcuts = Enum.sort_by(shortcuts, fn {cmd, _} -> cmd end)
 
@@ -1787,7 +1849,7 @@ defmodule DiwaAgent.Tools.Executor do
     )
   end
 
-  def execute("register_shortcut_alias", %{"alias_name" => name, "target_tool" => tool} = args) do
+  defp do_execute("register_shortcut_alias", %{"alias_name" => name, "target_tool" => tool} = args) do
     schema = Map.get(args, "args_schema", [])
 
     case DiwaAgent.Shortcuts.Registry.register_alias(name, tool, schema) do
@@ -1799,7 +1861,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("list_directory", args) do
+  defp do_execute("list_directory", args) do
     path = Map.get(args, "path", ".")
     context_id = Map.get(args, "context_id")
     root_path = resolve_root_path(context_id)
@@ -1830,7 +1892,7 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("read_file", %{"path" => path} = args) do
+  defp do_execute("read_file", %{"path" => path} = args) do
     context_id = Map.get(args, "context_id")
     root_path = resolve_root_path(context_id)
 
@@ -1859,16 +1921,21 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute("search_code", %{"query" => query} = args) do
+  defp do_execute("search_code", %{"query" => query} = args) do
     context_id = Map.get(args, "context_id")
     root_path = resolve_root_path(context_id)
-    opts = [file_pattern: Map.get(args, "file_pattern")]
+
+    opts = [
+      file_pattern: Map.get(args, "file_pattern"),
+      limit: Map.get(args, "limit", 50),
+      offset: Map.get(args, "offset", 0)
+    ]
 
     case DiwaAgent.CodeBrowser.search_code(root_path, query, opts) do
-      {:ok, []} ->
+      {:ok, %{matches: [], timed_out: false}} ->
         success_response("No matches found for '#{query}'.")
 
-      {:ok, matches} ->
+      {:ok, %{matches: matches} = page} ->
         formatted =
           matches
           |> Enum.map(fn m ->
@@ -1876,21 +1943,30 @@ defmodule DiwaAgent.Tools.Executor do
           end)
           |> Enum.join("\n")
 
+        footer =
+          [
+            if(page.timed_out, do: "⏱ Search timed out; results are partial."),
+            if(page.next_offset, do: "More results: call again with offset #{page.next_offset}.")
+          ]
+          |> Enum.reject(&is_nil/1)
+          |> Enum.join("\n")
+
         success_response("""
         🔍 Search Results for '#{query}':
         ----------------------------------------
         #{formatted}
+        #{footer}
         """)
 
-      {:error, :ripgrep_not_found} ->
-        error_response("ripgrep (rg) not found on system.")
+      {:error, {:invalid_pattern, reason}} ->
+        error_response("Invalid search pattern: #{reason}")
 
       {:error, reason} ->
         error_response("Search failed: #{inspect(reason)}")
     end
   end
 
-  def execute("complete_handoff", %{"context_id" => _cid, "handoff_id" => hid} = args) do
+  defp do_execute("complete_handoff", %{"context_id" => _cid, "handoff_id" => hid} = args) do
     status = Map.get(args, "status", "completed")
 
     case Memory.get(hid) do
@@ -1918,10 +1994,33 @@ defmodule DiwaAgent.Tools.Executor do
     end
   end
 
-  def execute(tool_name, _args) do
+  defp do_execute(tool_name, _args) do
     error_response("Unknown tool: #{tool_name}")
   end
 
+  defp format_metrics(%{histograms: histograms, counters: counters, gauges: gauges}) do
+    rows =
+      histograms
+      |> Enum.sort_by(fn {_metric, h} -> -h.sum_ms end)
+      |> Enum.map(fn {{group, name}, h} ->
+        "#{group}/#{name}: n=#{h.count} err=#{h.errors} mean=#{h.mean_ms}ms " <>
+          "p50=#{h.p50_ms}ms p95=#{h.p95_ms}ms p99=#{h.p99_ms}ms max=#{h.max_ms}ms"
+      end)
+
+    values =
+      Enum.map(Enum.sort(Map.to_list(counters) ++ Map.to_list(gauges)), fn {name, v} ->
+        "#{name}: #{v}"
+      end)
+
+    """
+    📈 Metrics (sorted by total time)
+
+    #{if rows == [], do: "No latency samples recorded yet.", else: Enum.join(rows, "\n")}
+
+    #{Enum.join(values, "\n")}
+    """
+  end
+
   defp get_health_summary(score) when score >= 90,
     do: "Excellent. Context is fresh, active, and well-structured."
 
@@ -1936,36 +2035,18 @@ defmodule DiwaAgent.Tools.Executor do
   defp get_health_summary(_), do: "Critical. Context is obsolete or structurally deficient."
 
   defp build_tree(id, indent) do
-    case Memory.get(id) do
-      {:ok, mem} ->
-        prefix = String.duplicate("  ", indent)
-        line = "#{prefix}• [#{mem.id}] #{String.slice(mem.content, 0, 80)}..."
-
-        case Memory.get_children(id) do
-          {:ok, children} ->
-            child_trees =
-              children
-              |> Enum.map(fn child ->
-                case build_tree(child.id, indent + 1) do
-                  {:ok, tree} -> tree
-                  _ -> ""
-                end
-              end)
-              |> Enum.join("\n")
-
-            res = if child_trees == "", do: line, else: line <> "\n" <> child_trees
-            {:ok, res}
-
-          _ ->
-            {:ok, line}
-        end
+    with {:ok, tree} <- Memory.get_tree(id) do
+      {:ok, render_tree(tree, indent)}
+    end
+  end
 
-      {:error, :not_found} ->
-        {:error, :not_found}
+  defp render_tree(%{memory: mem, children: children}, indent) do
+    prefix = String.duplicate("  ", indent)
+    line = "#{prefix}• [#{mem.id}] #{String.slice(mem.content, 0, 80)}..."
 
-      {:error, reason} ->
-        {:error, reason}
-    end
+    Enum.reduce(children, line, fn child, acc ->
+      acc <> "\n" <> render_tree(child, indent + 1)
+    end)
   end
 
   defp format_export(context, memories, "markdown") do
@@ -2108,7 +2189,7 @@ defmodule DiwaAgent.Tools.Executor do
     }
   end
 
-  defp format_search_results(memories, context_id, query, is_fuzzy) do
+  defp format_search_results(%{hits: hits} = page, context_id, query) do
     # Get context name if searching within specific context
     scope_desc =
       if context_id do
@@ -2120,12 +2201,13 @@ defmodule DiwaAgent.Tools.Executor do
         " across all contexts"
       end
 
+    is_fuzzy = Enum.all?(hits, &(Map.keys(&1.sources) == [:fuzzy]))
     match_type = if is_fuzzy, do: "fuzzy matches", else: "results"
 
     # Format results with previews
     results_list =
-      memories
-      |> Enum.map(fn mem ->
+      hits
+      |> Enum.map(fn %{memory: mem} = hit ->
         preview = String.slice(mem.content, 0, 150)
         preview = if String.length(mem.content) > 150, do: preview <> "...", else: preview
 
@@ -2136,17 +2218,43 @@ defmodule DiwaAgent.Tools.Executor do
             _ -> "Unknown"
           end
 
-        "• [#{context_name}] ID: #{mem.id}\n  #{preview}\n"
+        sources =
+          hit.sources
+          |> Enum.sort_by(fn {_retriever, source} -> source.rank end)
+          |> Enum.map_join(", ", fn {retriever, source} -> "#{retriever} ##{source.rank}" end)
+
+        score = :erlang.float_to_binary(hit.score, decimals: 4)
+        "• [#{context_name}] ID: #{mem.id} (score #{score}: #{sources})\n  #{preview}\n"
       end)
       |> Enum.join("\n")
 
+    notes =
+      [
+        if(page.next_cursor,
+          do:
+            "More results: call again with cursor \"#{page.next_cursor}\" " <>
+              "(or offset #{page.next_offset})."
+        ),
+        if(page.degraded != [],
+          do: "Partial results: #{Enum.join(page.degraded, ", ")} search unavailable."
+        )
+      ]
+      |> Enum.reject(&is_nil/1)
+      |> Enum.join("\n")
+
     success_response("""
-    Found #{length(memories)} #{match_type} for '#{query}'#{scope_desc}:
+    Found #{length(hits)} #{match_type} for '#{query}'#{scope_desc}:
 
     #{results_list}
+    #{notes}
     """)
   end
 
+  defp next_cursor_note(nil), do: ""
+
+  defp next_cursor_note(cursor),
+    do: "\n\nMore results: call again with cursor \"#{cursor}\".\nnext_cursor: #{cursor}"
+
   defp resolve_root_path(context_id) do
     case context_id do
       nil ->
@@ -2208,7 +2316,7 @@ defmodule DiwaAgent.Tools.Executor do
   end
 
   # Artifact Queue Management
-  def execute("manage_artifact_queue", %{"action" => action} = args) do
+  defp do_execute("manage_artifact_queue", %{"action" => action} = args) do
     session_id = Map.get(args, "session_id", "default")
 
     case action do
@@ -17,7 +17,7 @@ defmodule DiwaAgent.Tools.Ingestor do
         |> File.ls!()
         |> Enum.filter(&String.ends_with?(&1, ".md"))
 
-      results =
+      items =
         Enum.map(files, fn filename ->
           path = Path.join(@agent_dir, filename)
           content = File.read!(path)
@@ -32,20 +32,30 @@ defmodule DiwaAgent.Tools.Ingestor do
             "ingested_at" => DateTime.utc_now() |> DateTime.to_iso8601()
           }
 
-          msg = "Ingesting #{filename}..."
-          Logger.info(msg)
+          Logger.info("Ingesting #{filename}...")
 
-          case Memory.add(context_id, content, %{metadata: metadata, tags: tags}) do
-            {:ok, _memory} -> {:ok, filename}
-            {:error, reason} -> {:error, {filename, reason}}
-          end
+          %{content: content, metadata: metadata, tags: tags}
         end)
 
+      results =
+        case Memory.add_many(context_id, items, skip_duplicates: true) do
+          {:ok, outcomes} ->
+            Enum.zip_with(files, outcomes, fn
+              filename, {:ok, _memory} -> {:ok, filename}
+              filename, {:skipped, _} -> {:skipped, filename}
+              filename, {:error, reason} -> {:error, {filename, reason}}
+            end)
+
+          {:error, reason} ->
+            Enum.map(files, &{:error, {&1, reason}})
+        end
+
       successful = Enum.filter(results, &match?({:ok, _}, &1)) |> length()
+      skipped = Enum.count(results, &match?({:skipped, _}, &1))
       failed = Enum.filter(results, &match?({:error, _}, &1))
 
       summary = """
-      ✓ Ingested #{successful} files from .agent directory.
+      ✓ Ingested #{successful} files from .agent directory (#{skipped} already present).
       #{if length(failed) > 0, do: "❌ Failed: #{length(failed)} files.\n" <> format_errors(failed), else: ""}
       """
 
@@ -0,0 +1,32 @@
+defmodule DiwaAgent.Transport do
+  @moduledoc """
+  Helpers shared by the MCP transports (`DiwaAgent.Transport.Stdio` and
+  `DiwaAgent.Transport.Socket`).
+  """
+
+  require Logger
+
+  @doc """
+  Encode a JSON-RPC response as one line of JSON (without the newline), or
+  `nil` for notifications. If encoding fails a JSON-RPC internal error for
+  the same id is returned instead.
+  """
+  def encode_response(nil), do: nil
+
+  def encode_response(response) do
+    DiwaAgent.Telemetry.span([:diwa_agent, :server, :encode], %{}, fn ->
+      Jason.encode!(response, escape: :unicode_safe)
+    end)
+  rescue
+    e ->
+      response_id = Map.get(response, "id")
+
+      msg =
+        "[DiwaAgent.Transport] JSON encoding failed for response ID: #{inspect(response_id)}. Error: #{inspect(e)}"
+
+      IO.puts(:stderr, msg)
+      Logger.error(msg)
+
+      ~s({"jsonrpc":"2.0","id":#{inspect(response_id)},"error":{"code":-32603,"message":"Internal error: JSON encoding failed"}})
+  end
+end
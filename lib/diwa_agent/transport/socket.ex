@@ -0,0 +1,272 @@
+defmodule DiwaAgent.Transport.Socket do
+  @moduledoc """
+  Unix domain socket transport for daemon mode.
+
+  One long-lived node listens on a local socket and serves any number of
+  MCP clients, so they share one Repo pool, the warm caches and the
+  in-memory registries instead of each editor window booting its own BEAM
+  against the same database. Clients keep speaking line-delimited JSON-RPC
+  over stdio through `scripts/diwa_shim.py`, which relays to the socket.
+
+  Each connection gets its own `DiwaAgent.Server` (initialize state,
+  in-flight tool calls, cancellation), started by
+  `DiwaAgent.Transport.Socket.Connection`.
+
+  Enabled with `DIWA_TRANSPORT=socket` (`./diwa.sh daemon`). The socket path
+  is `DIWA_SOCKET`, else `:path`, else `~/.diwa/diwa.sock`:
+
+      config :diwa_agent, DiwaAgent.Transport.Socket, path: "~/.diwa/diwa.sock"
+
+  The socket is owner-only (0600). `~/.diwa`, or a directory named `diwa`,
+  is created if needed and restricted to 0700; a socket anywhere else needs
+  an existing directory owned by the current user that is not group- or
+  world-writable, otherwise the transport refuses to start.
+  """
+
+  use GenServer
+  require Logger
+  alias DiwaAgent.Transport.Socket.Connection
+
+  @default_path "~/.diwa/diwa.sock"
+
+  def start_link(opts \\ []) do
+    GenServer.start_link(__MODULE__, opts, name: Keyword.get(opts, :name, __MODULE__))
+  end
+
+  @doc """
+  The socket path this node listens on (or a shim connects to).
+  """
+  def socket_path do
+    System.get_env("DIWA_SOCKET") ||
+      :diwa_agent
+      |> Application.get_env(__MODULE__, [])
+      |> Keyword.get(:path, @default_path)
+      |> Path.expand()
+  end
+
+  @impl true
+  def init(opts) do
+    # Remove the socket file on shutdown
+    Process.flag(:trap_exit, true)
+    path = Keyword.get(opts, :path) || socket_path()
+
+    with :ok <- prepare_dir(Path.dirname(path)),
+         :ok <- clear_stale(path),
+         {:ok, listen} <- listen(path),
+         {:ok, connections} <- DynamicSupervisor.start_link(strategy: :one_for_one) do
+      File.chmod(path, 0o600)
+      acceptor = spawn_link(fn -> accept_loop(listen, connections) end)
+      Logger.info("[DiwaAgent.Transport.Socket] Listening on #{path}")
+      {:ok, %{path: path, listen: listen, connections: connections, acceptor: acceptor}}
+    else
+      {:error, reason} ->
+        Logger.error("[DiwaAgent.Transport.Socket] Cannot listen on #{path}: #{inspect(reason)}")
+        {:stop, reason}
+    end
+  end
+
+  @impl true
+  def handle_info({:EXIT, pid, reason}, %{acceptor: pid} = state) do
+    {:stop, reason, state}
+  end
+
+  def handle_info({:EXIT, pid, reason}, %{connections: pid} = state) do
+    {:stop, reason, state}
+  end
+
+  def handle_info({:EXIT, _pid, _reason}, state), do: {:noreply, state}
+
+  @impl true
+  def terminate(_reason, state) do
+    :gen_tcp.close(state.listen)
+    File.rm(state.path)
+  end
+
+  defp listen(path) do
+    # exit_on_close: false lets a connection answer in-flight calls after
+    # the client half-closes its end (stdin EOF in the shim)
+    :gen_tcp.listen(0, [
+      :binary,
+      ifaddr: {:local, String.to_charlist(path)},
+      packet: :raw,
+      active: false,
+      exit_on_close: false,
+      backlog: 128
+    ])
+  end
+
+  # The socket exposes the whole memory store, so its directory must be
+  # private before the socket exists. Directories the transport owns (the
+  # default ~/.diwa, or any directory named "diwa") are created and locked
+  # down to 0700; any other directory must already be private to this user
+  # and is never modified.
+  defp prepare_dir(dir) do
+    if owned_dir?(dir) do
+      with :ok <- File.mkdir_p(dir),
+           {:ok, _mode} <- own_dir(dir) do
+        File.chmod(dir, 0o700)
+      end
+    else
+      with {:ok, mode} <- own_dir(dir) do
+        if Bitwise.band(mode, 0o022) == 0, do: :ok, else: {:error, {:insecure_dir, dir}}
+      end
+    end
+  end
+
+  defp owned_dir?(dir) do
+    dir == Path.dirname(Path.expand(@default_path)) or Path.basename(dir) == "diwa"
+  end
+
+  # A real directory (not a symlink) owned by the current user
+  defp own_dir(dir) do
+    uid = current_uid()
+
+    case File.lstat(dir) do
+      {:ok, %File.Stat{type: :directory, uid: ^uid, mode: mode}} -> {:ok, mode}
+      {:ok, _stat} -> {:error, {:insecure_dir, dir}}
+      {:error, reason} -> {:error, {reason, dir}}
+    end
+  end
+
+  defp current_uid do
+    case System.cmd("id", ["-u"]) do
+      {uid, 0} -> String.to_integer(String.trim(uid))
+      _ -> nil
+    end
+  rescue
+    _ -> nil
+  end
+
+  # A leftover file from a crashed daemon is removed; a live one is an error
+  defp clear_stale(path) do
+    if File.exists?(path) do
+      case :gen_tcp.connect({:local, String.to_charlist(path)}, 0, [:binary], 1_000) do
+        {:ok, socket} ->
+          :gen_tcp.close(socket)
+          {:error, :already_running}
+
+        {:error, _} ->
+          File.rm(path)
+      end
+    else
+      :ok
+    end
+  end
+
+  defp accept_loop(listen, connections) do
+    case :gen_tcp.accept(listen) do
+      {:ok, socket} ->
+        case DynamicSupervisor.start_child(connections, {Connection, socket}) do
+          {:ok, pid} ->
+            :ok = :gen_tcp.controlling_process(socket, pid)
+            send(pid, :activate)
+
+          {:error, reason} ->
+            Logger.error("[DiwaAgent.Transport.Socket] Connection failed: #{inspect(reason)}")
+            :gen_tcp.close(socket)
+        end
+
+        accept_loop(listen, connections)
+
+      {:error, :closed} ->
+        exit(:normal)
+
+      {:error, reason} ->
+        Logger.error("[DiwaAgent.Transport.Socket] Accept error: #{inspect(reason)}")
+        accept_loop(listen, connections)
+    end
+  end
+
+  defmodule Connection do
+    @moduledoc """
+    One MCP client on the daemon socket, with its own `DiwaAgent.Server`.
+
+    Incoming bytes are split into lines and submitted to the server;
+    responses arrive as `{:diwa_response, _}` in completion order and are
+    written from this process only. When the client closes its end, in-flight
+    calls are allowed to finish and their responses are flushed first.
+    """
+
+    use GenServer, restart: :temporary
+    require Logger
+    alias DiwaAgent.Server
+
+    # Guard against a client that never sends a newline
+    @max_line_bytes 64 * 1024 * 1024
+
+    def start_link(socket), do: GenServer.start_link(__MODULE__, socket)
+
+    @impl true
+    def init(socket) do
+      {:ok, server} = Server.start_link(name: nil)
+      {:ok, %{socket: socket, server: server, buffer: ""}}
+    end
+
+    @impl true
+    def handle_info(:activate, state) do
+      :inet.setopts(state.socket, active: :once)
+      {:noreply, state}
+    end
+
+    def handle_info({:tcp, socket, data}, %{socket: socket} = state) do
+      [rest | lines] = (state.buffer <> data) |> String.split("\n") |> Enum.reverse()
+
+      lines
+      |> Enum.reverse()
+      |> Enum.each(fn line ->
+        case String.trim(line) do
+          "" -> :ok
+          line -> Server.submit(state.server, line, self())
+        end
+      end)
+
+      if byte_size(rest) > @max_line_bytes do
+        Logger.error("[DiwaAgent.Transport.Socket] Line too long, closing connection")
+        {:stop, :normal, state}
+      else
+        :inet.setopts(socket, active: :once)
+        {:noreply, %{state | buffer: rest}}
+      end
+    end
+
+    def handle_info({:tcp_closed, socket}, %{socket: socket} = state) do
+      # Let in-flight tool calls finish and their responses reach the client
+      Server.await_idle(state.server)
+      flush_responses(state.socket)
+      {:stop, :normal, state}
+    end
+
+    def handle_info({:tcp_error, socket, reason}, %{socket: socket} = state) do
+      Logger.warning("[DiwaAgent.Transport.Socket] Connection error: #{inspect(reason)}")
+      {:stop, :normal, state}
+    end
+
+    def handle_info({:diwa_response, response}, state) do
+      send_response(state.socket, response)
+      {:noreply, state}
+    end
+
+    @impl true
+    def terminate(_reason, state) do
+      :gen_tcp.close(state.socket)
+      if Process.alive?(state.server), do: GenServer.stop(state.server)
+    end
+
+    defp flush_responses(socket) do
+      receive do
+        {:diwa_response, response} ->
+          send_response(socket, response)
+          flush_responses(socket)
+      after
+        0 -> :ok
+      end
+    end
+
+    defp send_response(socket, response) do
+      case DiwaAgent.Transport.encode_response(response) do
+        nil -> :ok
+        json -> :gen_tcp.send(socket, [json, ?\n])
+      end
+    end
+  end
+end
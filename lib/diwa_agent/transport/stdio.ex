@@ -3,6 +3,11 @@ defmodule DiwaAgent.Transport.Stdio do
   STDIO transport layer for JSON-RPC 2.0 communication.
 
   Reads line-delimited JSON from stdin and writes responses to stdout.
+
+  The reader loop only submits lines to `DiwaAgent.Server`; it never waits
+  for a response. Responses arrive at this process as `{:diwa_response, _}`
+  messages in completion order and are written from here, so concurrent
+  tool calls never interleave their output.
   """
 
   use GenServer
@@ -16,44 +21,51 @@ defmodule DiwaAgent.Transport.Stdio do
     # Configure stdout for reliable UTF-8 transmission
     :io.setopts(:standard_io, binary: true, encoding: :utf8)
 
-    # Start reading from stdin
-    Task.start_link(fn -> read_loop() end)
+    # Start reading from stdin; responses are routed back to this process
+    transport = self()
+    Task.start_link(fn -> read_loop(transport) end)
 
     {:ok, %{}}
   end
 
-  defp read_loop do
+  def handle_info({:diwa_response, response}, state) do
+    send_response(response)
+    {:noreply, state}
+  end
+
+  def handle_call(:flush, _from, state) do
+    {:reply, :ok, state}
+  end
+
+  defp read_loop(transport) do
     # Use binread to avoid potential encoding issues during the read itself
     case IO.binread(:stdio, :line) do
       :eof ->
         Logger.info("[DiwaAgent.Transport.Stdio] EOF received, shutting down")
+        # Let in-flight tool calls finish and their responses reach stdout
+        DiwaAgent.Server.await_idle()
+        GenServer.call(transport, :flush, :infinity)
         System.halt(0)
 
       {:error, reason} ->
         Logger.error("[DiwaAgent.Transport.Stdio] Read error: #{inspect(reason)}")
         Process.sleep(100)
-        read_loop()
+        read_loop(transport)
 
       line when is_binary(line) ->
         line = String.trim(line)
 
         unless line == "" do
-          handle_input(line)
+          handle_input(line, transport)
         end
 
-        read_loop()
+        read_loop(transport)
     end
   end
 
-  defp handle_input(line) do
+  defp handle_input(line, transport) do
     try do
-      case DiwaAgent.Server.handle_message(line) do
-        {:ok, response} ->
-          send_response(response)
-
-        {:error, reason} ->
-          Logger.error("[DiwaAgent.Transport.Stdio] Error handling message: #{inspect(reason)}")
-      end
+      DiwaAgent.Server.submit(line, transport)
     rescue
       e ->
         msg = "[DiwaAgent.Transport.Stdio] Crash during message handling: #{inspect(e)}"
@@ -62,27 +74,15 @@ defmodule DiwaAgent.Transport.Stdio do
     end
   end
 
-  defp send_response(nil), do: :ok
-
   defp send_response(response) do
-    json = Jason.encode!(response, escape: :unicode_safe)
-
-    # Use IO.binwrite to standard_io which is configured for binary/utf8
-    # This proved more reliable than raw :file.write(1) in the current environment
-    IO.binwrite(:standard_io, json <> "\n")
-  rescue
-    e ->
-      response_id = Map.get(response, "id")
-
-      msg =
-        "[DiwaAgent.Transport.Stdio] JSON encoding failed for response ID: #{inspect(response_id)}. Error: #{inspect(e)}"
-
-      IO.puts(:stderr, msg)
-      Logger.error(msg)
-
-      fallback =
-        ~s({"jsonrpc":"2.0","id":#{inspect(response_id)},"error":{"code":-32603,"message":"Internal error: JSON encoding failed"}})
-
-      IO.binwrite(:standard_io, fallback <> "\n")
+    case DiwaAgent.Transport.encode_response(response) do
+      nil ->
+        :ok
+
+      # Use IO.binwrite to standard_io which is configured for binary/utf8
+      # This proved more reliable than raw :file.write(1) in the current environment
+      json ->
+        IO.binwrite(:standard_io, json <> "\n")
+    end
   end
 end
@@ -4,6 +4,8 @@ defmodule DiwaAgent.Utils.Fuzzy do
   Uses Jaro-Winkler distance for typo-tolerant matching.
   """
 
+  import Bitwise
+
   @doc """
   Returns a score between 0.0 (no match) and 1.0 (exact match).
   """
@@ -25,79 +27,62 @@ defmodule DiwaAgent.Utils.Fuzzy do
     end
   end
 
+  # Strings are compared as tuples of codepoints, so every character access
+  # is O(1); matched positions of `s2` are tracked in an integer bitmask.
   defp jaro_distance(s1, s2) do
-    l1 = String.length(s1)
-    l2 = String.length(s2)
+    t1 = s1 |> String.to_charlist() |> List.to_tuple()
+    t2 = s2 |> String.to_charlist() |> List.to_tuple()
+    l1 = tuple_size(t1)
+    l2 = tuple_size(t2)
 
     # Matching window
     window = max(0, div(max(l1, l2), 2) - 1)
 
-    {m, t} = matching_and_transpositions(s1, s2, window)
+    # For navigation, we often match short queries against long names (e.g. 'diwa' -> 'Project Diwa').
+    # Standard Jaro window is too restrictive. We'll use a more lenient window for better sub-word matching.
+    effective_window = max(window, abs(l1 - l2) + 2)
+
+    {matched1, used2, m} = find_matches(t1, t2, effective_window)
 
     if m == 0 do
       0.0
     else
+      t = count_transpositions(Enum.reverse(matched1), t2, used2)
       (m / l1 + m / l2 + (m - t / 2) / m) / 3.0
     end
   end
 
-  defp matching_and_transpositions(s1, s2, window) do
-    chars1 = String.graphemes(s1)
-    chars2 = String.graphemes(s2)
+  # First pass: for each char of t1, take the first unused equal char of t2
+  # within the window. Returns the matched chars of t1 (reversed), the bitmask
+  # of used t2 positions and the match count.
+  defp find_matches(t1, t2, window) do
+    l2 = tuple_size(t2)
 
-    # For navigation, we often match short queries against long names (e.g. 'diwa' -> 'Project Diwa').
-    # Standard Jaro window is too restrictive. We'll use a more lenient window for better sub-word matching.
-    len1 = length(chars1)
-    len2 = length(chars2)
-    effective_window = max(window, abs(len1 - len2) + 2)
+    Enum.reduce(0..(tuple_size(t1) - 1)//1, {[], 0, 0}, fn i, {matched, used, count} ->
+      c1 = elem(t1, i)
 
-    matches1 = for _ <- chars1, do: {nil, false}
-    matches2 = for _ <- chars2, do: {nil, false}
-
-    # First pass: find matches within window
-    {matches1, matches2, m_count} =
-      find_matches(chars1, chars2, effective_window, matches1, matches2)
-
-    if m_count == 0 do
-      {0, 0}
-    else
-      # Second pass: count transpositions
-      t_count = count_transpositions(matches1, matches2)
-      {m_count, t_count}
-    end
-  end
-
-  defp find_matches(chars1, chars2, window, m1, m2) do
-    l2 = length(chars2)
-
-    Enum.reduce(Enum.with_index(chars1), {m1, m2, 0}, fn {c1, i}, {acc_m1, acc_m2, count} ->
-      start_j = max(0, i - window)
-      end_j = min(l2 - 1, i + window)
-
-      # Find first unused char in chars2 that matches c1 within window
-      found_j =
-        Enum.find(start_j..end_j, fn j ->
-          {_, matched} = Enum.at(acc_m2, j)
-          !matched && Enum.at(chars2, j) == c1
-        end)
-
-      if found_j do
-        new_m1 = List.replace_at(acc_m1, i, {c1, true})
-        new_m2 = List.replace_at(acc_m2, found_j, {Enum.at(chars2, found_j), true})
-        {new_m1, new_m2, count + 1}
-      else
-        {acc_m1, acc_m2, count}
+      case find_in_window(t2, c1, used, max(0, i - window), min(l2 - 1, i + window)) do
+        nil -> {matched, used, count}
+        j -> {[c1 | matched], used ||| 1 <<< j, count + 1}
       end
     end)
   end
 
-  defp count_transpositions(matches1, matches2) do
-    # Extract matched characters in order
-    m1_chars = Enum.filter(matches1, &elem(&1, 1)) |> Enum.map(&elem(&1, 0))
-    m2_chars = Enum.filter(matches2, &elem(&1, 1)) |> Enum.map(&elem(&1, 0))
+  defp find_in_window(_t2, _c, _used, j, last) when j > last, do: nil
+
+  defp find_in_window(t2, c, used, j, last) do
+    if elem(t2, j) == c and (used &&& 1 <<< j) == 0,
+      do: j,
+      else: find_in_window(t2, c, used, j + 1, last)
+  end
 
-    # Transpositions are mismatched orders
-    Enum.zip(m1_chars, m2_chars)
+  # Second pass: matched chars of both strings in order; transpositions are
+  # half the positions where they differ
+  defp count_transpositions(matched1, t2, used2) do
+    matched2 = for j <- 0..(tuple_size(t2) - 1)//1, (used2 &&& 1 <<< j) != 0, do: elem(t2, j)
+
+    matched1
+    |> Enum.zip(matched2)
     |> Enum.count(fn {c1, c2} -> c1 != c2 end)
     |> div(2)
   end
@@ -114,6 +99,41 @@ defmodule DiwaAgent.Utils.Fuzzy do
 
   defp common_prefix_length(_, _, count), do: count
 
+  @doc """
+  Best Jaro-Winkler score of `query` against any run of consecutive words
+  in `text` with as many words as the query. Returns 1.0 when `text`
+  contains the query verbatim (case-insensitive).
+
+  Suited to scoring a short query against long content: windows whose
+  length differs too much from the query are not compared.
+  """
+  def partial_score(query, text) do
+    query = String.downcase(query)
+    text = String.downcase(text || "")
+
+    cond do
+      query == "" ->
+        0.0
+
+      String.contains?(text, query) ->
+        1.0
+
+      true ->
+        n = query |> String.split() |> length()
+        len = String.length(query)
+        slack = div(len, 3) + 2
+
+        text
+        |> String.split()
+        |> Enum.chunk_every(max(n, 1), 1)
+        |> Enum.map(&Enum.join(&1, " "))
+        |> Enum.uniq()
+        |> Enum.filter(&(abs(String.length(&1) - len) <= slack))
+        |> Enum.map(&jaro_winkler(query, &1))
+        |> Enum.max(fn -> 0.0 end)
+    end
+  end
+
   @doc """
   Finds the best match for `query` in a list of `candidates`.
   Each candidate should be a map or struct with a field (default :name).
@@ -23,12 +23,15 @@ defmodule DiwaAgent.Workflow.ArtifactQueue do
     GenServer.start_link(__MODULE__, opts, name: __MODULE__)
   end
 
+  # Started on first use in fast-start mode (see DiwaAgent.Lazy)
+  defp server, do: DiwaAgent.Lazy.server(__MODULE__)
+
   @doc """
   Initialize queue for a new session.
   Returns session ID.
   """
   def init_session(session_id) do
-    GenServer.call(__MODULE__, {:init_session, session_id})
+    GenServer.call(server(), {:init_session, session_id})
   end
 
   @doc """
@@ -41,28 +44,28 @@ defmodule DiwaAgent.Workflow.ArtifactQueue do
   - metadata: Additional info (title, actor, etc.)
   """
   def queue_artifact(session_id, artifact) do
-    GenServer.call(__MODULE__, {:queue, session_id, artifact})
+    GenServer.call(server(), {:queue, session_id, artifact})
   end
 
   @doc """
   List all queued artifacts for a session.
   """
   def list_artifacts(session_id) do
-    GenServer.call(__MODULE__, {:list, session_id})
+    GenServer.call(server(), {:list, session_id})
   end
 
   @doc """
   Get artifact count for a session.
   """
   def count(session_id) do
-    GenServer.call(__MODULE__, {:count, session_id})
+    GenServer.call(server(), {:count, session_id})
   end
 
   @doc """
   Clear all artifacts for a session.
   """
   def clear_session(session_id) do
-    GenServer.call(__MODULE__, {:clear, session_id})
+    GenServer.call(server(), {:clear, session_id})
   end
 
   @doc """
@@ -70,7 +73,7 @@ defmodule DiwaAgent.Workflow.ArtifactQueue do
   Returns markdown string with all artifact contents.
   """
   def compile_for_handoff(session_id) do
-    GenServer.call(__MODULE__, {:compile, session_id})
+    GenServer.call(server(), {:compile, session_id})
   end
 
   ## GenServer Callbacks
@@ -0,0 +1,30 @@
+defmodule Mix.Tasks.Diwa.BackfillFingerprints do
+  use Mix.Task
+  require Logger
+
+  @shortdoc "Computes content fingerprints for memories that have none."
+  @moduledoc """
+  Fills `memory_fingerprints` for memories created before the table existed,
+  so duplicate detection on ingest covers them too. Safe to re-run: only
+  memories without a fingerprint are processed.
+
+  ## Usage
+      mix diwa.backfill_fingerprints
+      mix diwa.backfill_fingerprints --batch-size 5000
+  """
+
+  def run(args) do
+    {opts, _} = OptionParser.parse!(args, strict: [batch_size: :integer])
+
+    {:ok, _} = Application.ensure_all_started(:diwa_agent)
+
+    Logger.info("Backfilling memory fingerprints...")
+
+    {us, count} =
+      :timer.tc(fn ->
+        DiwaAgent.Storage.MemoryFingerprint.backfill(batch_size: opts[:batch_size] || 1_000)
+      end)
+
+    Logger.info("Fingerprinted #{count} memories in #{div(us, 1000)}ms.")
+  end
+end
@@ -0,0 +1,40 @@
+defmodule Mix.Tasks.Diwa.CompactVersions do
+  use Mix.Task
+  require Logger
+
+  @shortdoc "Converts full-copy memory versions into snapshot/delta payloads."
+  @moduledoc """
+  Moves the content, tags and metadata of memory versions written before
+  `memory_version_payloads` existed into snapshot/delta chains, and clears
+  the full copies. Safe to re-run: only memories with versions lacking a
+  payload are processed.
+
+  ## Usage
+      mix diwa.compact_versions
+      mix diwa.compact_versions --batch-size 500
+  """
+
+  def run(args) do
+    {opts, _} = OptionParser.parse!(args, strict: [batch_size: :integer])
+
+    {:ok, _} = Application.ensure_all_started(:diwa_agent)
+
+    Logger.info("Compacting memory version history...")
+
+    {us, stats} =
+      :timer.tc(fn ->
+        DiwaAgent.Storage.MemoryVersion.compact(batch_size: opts[:batch_size] || 100)
+      end)
+
+    saved =
+      if stats.bytes_before > 0,
+        do: Float.round(100 * (1 - stats.bytes_after / stats.bytes_before), 1),
+        else: 0.0
+
+    Logger.info(
+      "Compacted #{stats.versions} versions of #{stats.memories} memories in " <>
+        "#{div(us, 1000)}ms: #{stats.bytes_before} -> #{stats.bytes_after} bytes " <>
+        "(#{saved}% saved)."
+    )
+  end
+end
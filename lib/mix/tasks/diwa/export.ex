@@ -1,78 +1,57 @@
 defmodule Mix.Tasks.Diwa.Export do
   use Mix.Task
   require Logger
-  alias DiwaAgent.Repo
-  alias DiwaSchema.Core.{Context, Memory, ContextBinding, ContextRelationship}
-  alias DiwaSchema.Enterprise.Organization
-  import Ecto.Query
+  alias DiwaAgent.Storage.Export
 
-  @shortdoc "Export all Diwa data to JSON"
+  @shortdoc "Export Diwa data to gzip-compressed NDJSON"
+  @moduledoc """
+  Streams every table to a gzip-compressed NDJSON file (one row per line),
+  so memory use stays flat however large the database is.
 
-  @fields_to_drop [
-    :__meta__,
-    :context,
-    :source_context,
-    :target_context,
-    :organization,
-    :memories,
-    :bindings,
-    :children,
-    :parent_memory,
-    :versions,
-    :embedding
-  ]
+  ## Usage
+      mix diwa.export
+      mix diwa.export --output backup.ndjson.gz
+      mix diwa.export --since 2026-10-01T00:00:00Z
+      mix diwa.export --context <context_id> --context <context_id>
+
+  `--since` limits the export to rows changed at or after the given time;
+  the footer line of every export holds the watermark for the next one.
+  Load a file with `mix diwa.import`.
+  """
 
   def run(args) do
     # Start the application to ensure Repo is available
     {:ok, _} = Application.ensure_all_started(:diwa_agent)
 
-    {opts, _} = OptionParser.parse!(args, strict: [output: :string, format: :string])
-    output_path = Keyword.get(opts, :output, "diwa_export.json")
+    {opts, _} =
+      OptionParser.parse!(args, strict: [output: :string, since: :string, context: :keep])
 
-    IO.puts("🚀 Starting Diwa Agent Export...")
-    IO.puts("   Output: #{output_path}")
+    output_path = Keyword.get(opts, :output, "diwa_export.ndjson.gz")
 
-    data = %{
-      "version" => "1.0",
-      "exported_at" => DateTime.utc_now() |> DateTime.to_iso8601(),
-      "source" => "diwa-agent",
-      "source_version" => "1.0.0",
-      "organizations" => export_table(Organization),
-      "contexts" => export_table(Context),
-      "memories" => export_table(Memory),
-      "bindings" => export_table(ContextBinding),
-      "relationships" => export_table(ContextRelationship)
-    }
+    export_opts =
+      [since: parse_since(opts[:since]), context_ids: Keyword.get_values(opts, :context)]
+      |> Enum.reject(fn {_k, v} -> v in [nil, []] end)
 
-    IO.puts("   - Contexts: #{length(data["contexts"])}")
-    IO.puts("   - Memories: #{length(data["memories"])}")
-    IO.puts("   - Bindings: #{length(data["bindings"])}")
-    IO.puts("   - Relationships: #{length(data["relationships"])}")
+    IO.puts("🚀 Starting Diwa Agent Export...")
+    IO.puts("   Output: #{output_path}")
 
-    case Jason.encode(data, pretty: true) do
-      {:ok, json} ->
-        File.write!(output_path, json)
+    case Export.export(output_path, export_opts) do
+      {:ok, %{counts: counts, watermark: watermark}} ->
+        Enum.each(counts, fn {table, n} -> IO.puts("   - #{String.capitalize(table)}: #{n}") end)
         IO.puts("\n✅ Export complete! Saved to #{output_path}")
+        IO.puts("   Watermark: #{DateTime.to_iso8601(watermark)}")
 
       {:error, reason} ->
         IO.puts("\n❌ Export failed: #{inspect(reason)}")
     end
   end
 
-  defp export_table(schema) do
-    Repo.all(schema)
-    |> Enum.map(&Map.from_struct/1)
-    |> Enum.map(&sanitize_map/1)
-  end
+  defp parse_since(nil), do: nil
 
-  defp sanitize_map(map) do
-    map
-    |> Map.drop(@fields_to_drop)
-    |> Enum.reduce(%{}, fn
-      {k, %Ecto.Association.NotLoaded{}}, acc -> acc
-      {k, v}, acc when is_struct(v, DateTime) -> Map.put(acc, k, DateTime.to_iso8601(v))
-      {k, v}, acc when is_struct(v, NaiveDateTime) -> Map.put(acc, k, NaiveDateTime.to_iso8601(v))
-      {k, v}, acc -> Map.put(acc, k, v)
-    end)
+  defp parse_since(iso) do
+    case DateTime.from_iso8601(iso) do
+      {:ok, since, _offset} -> since
+      {:error, _} -> Mix.raise("Invalid --since timestamp: #{iso}")
+    end
   end
 end
@@ -0,0 +1,38 @@
+defmodule Mix.Tasks.Diwa.Import do
+  use Mix.Task
+  alias DiwaAgent.Storage.Export
+
+  @shortdoc "Import a Diwa NDJSON export"
+  @moduledoc """
+  Streams a file written by `mix diwa.export` (or a context backup) into the
+  database, upserting rows by id in chunks. Incremental exports can be
+  applied on top of a full one in order.
+
+  ## Usage
+      mix diwa.import diwa_export.ndjson.gz
+  """
+
+  def run(args) do
+    {_opts, paths} = OptionParser.parse!(args, strict: [])
+
+    if paths == [], do: Mix.raise("Usage: mix diwa.import <file> [<file> ...]")
+
+    {:ok, _} = Application.ensure_all_started(:diwa_agent)
+
+    Enum.each(paths, fn path ->
+      IO.puts("📥 Importing #{path}...")
+
+      case Export.import_file(path) do
+        {:ok, counts} ->
+          Enum.each(counts, fn {table, n} ->
+            IO.puts("   - #{String.capitalize(table)}: #{n}")
+          end)
+
+        {:error, reason} ->
+          Mix.raise("Import of #{path} failed: #{inspect(reason)}")
+      end
+    end)
+
+    IO.puts("\n✅ Import complete!")
+  end
+end
@@ -75,6 +75,9 @@ defmodule DiwaAgent.MixProject do
       # HTTP Client
       {:req, "~> 0.5.0"},
 
+      # Instrumentation
+      {:telemetry, "~> 1.0"},
+
       # Dev/Test
       {:ex_doc, "~> 0.31", only: :dev, runtime: false},
       {:credo, "~> 1.7", only: [:dev, :test], runtime: false},
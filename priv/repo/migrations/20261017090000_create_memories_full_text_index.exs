@@ -0,0 +1,65 @@
+defmodule DiwaSchema.Repo.Migrations.CreateMemoriesFullTextIndex do
+  use Ecto.Migration
+
+  # Full-text index over memories.content.
+  #
+  # SQLite: an external-content FTS5 table keyed by memories.rowid and kept in
+  # sync by triggers, so every write path (insert, content update, hard delete)
+  # is covered. Soft-deleted rows stay indexed and are filtered at query time.
+  #
+  # Postgres: a generated tsvector column with a GIN index.
+
+  def up do
+    if repo().__adapter__() == Ecto.Adapters.SQLite3 do
+      execute """
+      CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts USING fts5(
+        content,
+        content='memories',
+        content_rowid='rowid',
+        tokenize='porter unicode61'
+      )
+      """
+
+      execute """
+      CREATE TRIGGER IF NOT EXISTS memories_fts_ai AFTER INSERT ON memories BEGIN
+        INSERT INTO memories_fts(rowid, content) VALUES (new.rowid, new.content);
+      END
+      """
+
+      execute """
+      CREATE TRIGGER IF NOT EXISTS memories_fts_ad AFTER DELETE ON memories BEGIN
+        INSERT INTO memories_fts(memories_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+      END
+      """
+
+      execute """
+      CREATE TRIGGER IF NOT EXISTS memories_fts_au AFTER UPDATE OF content ON memories BEGIN
+        INSERT INTO memories_fts(memories_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+        INSERT INTO memories_fts(rowid, content) VALUES (new.rowid, new.content);
+      END
+      """
+
+      # Backfill existing rows
+      execute "INSERT INTO memories_fts(memories_fts) VALUES ('rebuild')"
+    else
+      execute """
+      ALTER TABLE memories ADD COLUMN IF NOT EXISTS content_tsv tsvector
+        GENERATED ALWAYS AS (to_tsvector('english', coalesce(content, ''))) STORED
+      """
+
+      execute "CREATE INDEX IF NOT EXISTS memories_content_tsv_idx ON memories USING GIN (content_tsv)"
+    end
+  end
+
+  def down do
+    if repo().__adapter__() == Ecto.Adapters.SQLite3 do
+      execute "DROP TRIGGER IF EXISTS memories_fts_au"
+      execute "DROP TRIGGER IF EXISTS memories_fts_ad"
+      execute "DROP TRIGGER IF EXISTS memories_fts_ai"
+      execute "DROP TABLE IF EXISTS memories_fts"
+    else
+      execute "DROP INDEX IF EXISTS memories_content_tsv_idx"
+      execute "ALTER TABLE memories DROP COLUMN IF EXISTS content_tsv"
+    end
+  end
+end
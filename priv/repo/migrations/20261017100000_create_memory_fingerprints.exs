@@ -0,0 +1,25 @@
+defmodule DiwaSchema.Repo.Migrations.CreateMemoryFingerprints do
+  use Ecto.Migration
+
+  # Normalised SHA-256 of memories.content, indexed per context, so duplicate
+  # checks on ingest are an index lookup instead of a TEXT comparison scan.
+  # Existing memories are filled in by `mix diwa.backfill_fingerprints`.
+
+  def change do
+    is_sqlite = repo().__adapter__() == Ecto.Adapters.SQLite3
+
+    create table(:memory_fingerprints, primary_key: false) do
+      add :memory_id, references(:memories, type: :uuid, on_delete: :delete_all),
+        primary_key: true
+
+      add :context_id, references(:contexts, type: :uuid, on_delete: :delete_all), null: false
+      add :content_hash, :string, size: 64, null: false
+
+      add :inserted_at, :utc_datetime,
+        default: fragment(if is_sqlite, do: "CURRENT_TIMESTAMP", else: "NOW()"),
+        null: false
+    end
+
+    create index(:memory_fingerprints, [:context_id, :content_hash])
+  end
+end
@@ -0,0 +1,29 @@
+defmodule DiwaSchema.Repo.Migrations.CreateIngestFileStates do
+  use Ecto.Migration
+
+  # Last-seen state of every file the context ingestor has persisted, so
+  # re-runs can skip unchanged files (mtime/size), update memories whose file
+  # changed (content hash) and retire memories whose file disappeared.
+
+  def change do
+    is_sqlite = repo().__adapter__() == Ecto.Adapters.SQLite3
+    id_default = if is_sqlite, do: nil, else: fragment("uuid_generate_v4()")
+    now = fragment(if is_sqlite, do: "CURRENT_TIMESTAMP", else: "NOW()")
+
+    create table(:ingest_file_states, primary_key: false) do
+      add :id, :uuid, primary_key: true, default: id_default
+      add :context_id, references(:contexts, type: :uuid, on_delete: :delete_all), null: false
+      add :memory_id, references(:memories, type: :uuid, on_delete: :nilify_all)
+      # Last IngestJob that read or confirmed this file
+      add :job_id, :uuid
+      add :path, :text, null: false
+      add :mtime, :bigint, null: false
+      add :size, :bigint, null: false
+      add :content_hash, :string, size: 64, null: false
+      add :inserted_at, :utc_datetime, default: now, null: false
+      add :updated_at, :utc_datetime, default: now, null: false
+    end
+
+    create unique_index(:ingest_file_states, [:context_id, :path])
+  end
+end
@@ -0,0 +1,70 @@
+defmodule DiwaSchema.Repo.Migrations.CreateTrigramIndexes do
+  use Ecto.Migration
+
+  # Character-trigram indexes over memories.content and contexts.name, used
+  # to pick fuzzy-search candidates (DiwaAgent.Storage.TrigramIndex).
+  #
+  # SQLite: external-content FTS5 tables with the trigram tokenizer (SQLite
+  # 3.34+), kept in sync by triggers like memories_fts.
+  #
+  # Postgres: pg_trgm GIN indexes.
+
+  @sources [{"memories_trigram", "memories", "content"}, {"contexts_trigram", "contexts", "name"}]
+
+  def up do
+    if repo().__adapter__() == Ecto.Adapters.SQLite3 do
+      for {index, table, column} <- @sources do
+        execute """
+        CREATE VIRTUAL TABLE IF NOT EXISTS #{index} USING fts5(
+          #{column},
+          content='#{table}',
+          content_rowid='rowid',
+          tokenize='trigram'
+        )
+        """
+
+        execute """
+        CREATE TRIGGER IF NOT EXISTS #{index}_ai AFTER INSERT ON #{table} BEGIN
+          INSERT INTO #{index}(rowid, #{column}) VALUES (new.rowid, new.#{column});
+        END
+        """
+
+        execute """
+        CREATE TRIGGER IF NOT EXISTS #{index}_ad AFTER DELETE ON #{table} BEGIN
+          INSERT INTO #{index}(#{index}, rowid, #{column}) VALUES ('delete', old.rowid, old.#{column});
+        END
+        """
+
+        execute """
+        CREATE TRIGGER IF NOT EXISTS #{index}_au AFTER UPDATE OF #{column} ON #{table} BEGIN
+          INSERT INTO #{index}(#{index}, rowid, #{column}) VALUES ('delete', old.rowid, old.#{column});
+          INSERT INTO #{index}(rowid, #{column}) VALUES (new.rowid, new.#{column});
+        END
+        """
+
+        # Backfill existing rows
+        execute "INSERT INTO #{index}(#{index}) VALUES ('rebuild')"
+      end
+    else
+      execute "CREATE EXTENSION IF NOT EXISTS pg_trgm"
+
+      execute "CREATE INDEX IF NOT EXISTS memories_content_trgm_idx ON memories USING GIN (content gin_trgm_ops)"
+
+      execute "CREATE INDEX IF NOT EXISTS contexts_name_trgm_idx ON contexts USING GIN (name gin_trgm_ops)"
+    end
+  end
+
+  def down do
+    if repo().__adapter__() == Ecto.Adapters.SQLite3 do
+      for {index, _table, _column} <- @sources do
+        execute "DROP TRIGGER IF EXISTS #{index}_au"
+        execute "DROP TRIGGER IF EXISTS #{index}_ad"
+        execute "DROP TRIGGER IF EXISTS #{index}_ai"
+        execute "DROP TABLE IF EXISTS #{index}"
+      end
+    else
+      execute "DROP INDEX IF EXISTS contexts_name_trgm_idx"
+      execute "DROP INDEX IF EXISTS memories_content_trgm_idx"
+    end
+  end
+end
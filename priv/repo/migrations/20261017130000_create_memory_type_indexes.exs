@@ -0,0 +1,92 @@
+defmodule DiwaSchema.Repo.Migrations.CreateMemoryTypeIndexes do
+  use Ecto.Migration
+
+  # Indexes for the per-context type/class/tag lookups run at session start
+  # (Memory.list_by_type/2, list_by_class/2, list_by_tag/2).
+  #
+  # The metadata type is indexed as an expression rather than a generated
+  # column, so the shared Memory schema needs no new field; the expression
+  # must match the one in Memory.list_by_type/2. Creating the index covers
+  # existing rows.
+  #
+  # Tags: Postgres gets a GIN index on the array. SQLite cannot index JSON
+  # array membership, so `memory_tags` holds one row per (memory, tag), kept
+  # in sync by triggers and backfilled here.
+
+  @class_columns [:context_id, :memory_class, :deleted_at, :inserted_at]
+
+  def up do
+    create_if_not_exists index(:memories, @class_columns, name: :memories_context_class_index)
+
+    if repo().__adapter__() == Ecto.Adapters.SQLite3 do
+      execute """
+      CREATE INDEX IF NOT EXISTS memories_context_type_index
+      ON memories (context_id, json_extract(metadata, '$.type'), deleted_at, inserted_at)
+      """
+
+      execute """
+      CREATE TABLE IF NOT EXISTS memory_tags (
+        memory_id TEXT NOT NULL,
+        context_id TEXT NOT NULL,
+        tag TEXT NOT NULL
+      )
+      """
+
+      execute "CREATE INDEX IF NOT EXISTS memory_tags_context_tag_index ON memory_tags (context_id, tag)"
+
+      execute "CREATE INDEX IF NOT EXISTS memory_tags_memory_index ON memory_tags (memory_id)"
+
+      execute """
+      CREATE TRIGGER IF NOT EXISTS memory_tags_ai AFTER INSERT ON memories BEGIN
+        INSERT INTO memory_tags (memory_id, context_id, tag)
+        SELECT DISTINCT new.id, new.context_id, value FROM json_each(#{tags_json("new")});
+      END
+      """
+
+      execute """
+      CREATE TRIGGER IF NOT EXISTS memory_tags_ad AFTER DELETE ON memories BEGIN
+        DELETE FROM memory_tags WHERE memory_id = old.id;
+      END
+      """
+
+      execute """
+      CREATE TRIGGER IF NOT EXISTS memory_tags_au AFTER UPDATE OF tags, context_id ON memories BEGIN
+        DELETE FROM memory_tags WHERE memory_id = old.id;
+        INSERT INTO memory_tags (memory_id, context_id, tag)
+        SELECT DISTINCT new.id, new.context_id, value FROM json_each(#{tags_json("new")});
+      END
+      """
+
+      # Backfill existing rows
+      execute """
+      INSERT INTO memory_tags (memory_id, context_id, tag)
+      SELECT DISTINCT m.id, m.context_id, t.value
+      FROM memories m, json_each(#{tags_json("m")}) t
+      """
+    else
+      execute """
+      CREATE INDEX IF NOT EXISTS memories_context_type_index
+      ON memories (context_id, (metadata->>'type'), deleted_at, inserted_at)
+      """
+
+      execute "CREATE INDEX IF NOT EXISTS memories_tags_gin_index ON memories USING GIN (tags)"
+    end
+  end
+
+  def down do
+    if repo().__adapter__() == Ecto.Adapters.SQLite3 do
+      execute "DROP TRIGGER IF EXISTS memory_tags_au"
+      execute "DROP TRIGGER IF EXISTS memory_tags_ad"
+      execute "DROP TRIGGER IF EXISTS memory_tags_ai"
+      execute "DROP TABLE IF EXISTS memory_tags"
+    else
+      execute "DROP INDEX IF EXISTS memories_tags_gin_index"
+    end
+
+    execute "DROP INDEX IF EXISTS memories_context_type_index"
+    drop_if_exists index(:memories, @class_columns, name: :memories_context_class_index)
+  end
+
+  # json_each raises on malformed JSON; NULL or bad tags count as no tags
+  defp tags_json(row), do: "CASE WHEN json_valid(#{row}.tags) THEN #{row}.tags ELSE '[]' END"
+end
@@ -0,0 +1,28 @@
+defmodule DiwaSchema.Repo.Migrations.CreateMemoryVersionPayloads do
+  use Ecto.Migration
+
+  # Versioned content of memory_versions rows as snapshots plus line deltas
+  # (see DiwaAgent.Storage.VersionPayload). Rows written before this table
+  # existed keep their full copy until `mix diwa.compact_versions`.
+
+  def change do
+    is_sqlite = repo().__adapter__() == Ecto.Adapters.SQLite3
+
+    create table(:memory_version_payloads, primary_key: false) do
+      add :version_id, references(:memory_versions, type: :uuid, on_delete: :delete_all),
+        primary_key: true
+
+      add :memory_id, references(:memories, type: :uuid, on_delete: :delete_all), null: false
+      add :seq, :integer, null: false
+      add :depth, :integer, null: false
+      add :encoding, :string, size: 16, null: false
+      add :data, :binary, null: false
+
+      add :inserted_at, :utc_datetime,
+        default: fragment(if is_sqlite, do: "CURRENT_TIMESTAMP", else: "NOW()"),
+        null: false
+    end
+
+    create unique_index(:memory_version_payloads, [:memory_id, :seq])
+  end
+end
@@ -0,0 +1,17 @@
+defmodule DiwaSchema.Repo.Migrations.CreateKeysetIndexes do
+  use Ecto.Migration
+
+  # Indexes matching the `(inserted_at, id)` keyset order of cursor-paged
+  # listings (DiwaAgent.Storage.Cursor): memories per context and versions
+  # per memory, so each page is one index range scan.
+
+  def change do
+    create_if_not_exists index(:memories, [:context_id, :inserted_at, :id],
+                           name: :memories_context_keyset_index
+                         )
+
+    create_if_not_exists index(:memory_versions, [:memory_id, :inserted_at, :id],
+                           name: :memory_versions_memory_keyset_index
+                         )
+  end
+end
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+Async load generator and latency benchmark for the Diwa MCP stdio server.
+
+Spawns the server (``./diwa.sh start`` by default), performs the MCP
+handshake and then drives a weighted mix of tool calls at a target rate and
+concurrency. Requests are correlated with responses by a unique JSON-RPC id,
+so the server is free to answer out of order.
+
+Reports p50/p95/p99 latency per tool, throughput, error counts and server
+RSS over time as JSON, plus a per-request CSV.
+
+Examples:
+
+    python3 scripts/bench_mcp.py --duration 30 --concurrency 16 --rate 200
+    python3 scripts/bench_mcp.py --mix search_memories=8,add_memory=2 \\
+        --requests 5000 --json-out bench.json --csv-out bench.csv
+
+Uses only the Python standard library.
+"""
+
+import argparse
+import asyncio
+import csv
+import itertools
+import json
+import os
+import random
+import re
+import shlex
+import string
+import sys
+import time
+
+DEFAULT_MIX = "add_memory=3,add_memories=1,search_memories=4,hydrate_context=1,get_resume_context=1"
+
+SEARCH_TERMS = [
+    "database", "migration", "search", "latency", "deploy", "decision",
+    "blocker", "elixir", "sqlite", "postgres", "embedding", "handoff",
+]
+
+
+class MCPClient:
+    """Line-delimited JSON-RPC client with id-based response correlation."""
+
+    def __init__(self, cmd, cwd=None):
+        self.cmd = cmd
+        self.cwd = cwd
+        self.process = None
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._reader_task = None
+        self._write_lock = asyncio.Lock()
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            *self.cmd,
+            cwd=self.cwd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            limit=64 * 1024 * 1024,
+        )
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+        await self.request(
+            "initialize",
+            {
+                "protocolVersion": "2024-11-05",
+                "capabilities": {},
+                "clientInfo": {"name": "bench_mcp", "version": "1.0"},
+            },
+            timeout=120,
+        )
+        await self.notify("notifications/initialized")
+
+    async def _read_loop(self):
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                break
+            try:
+                msg = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            fut = self._pending.pop(msg.get("id"), None)
+            if fut is not None and not fut.done():
+                fut.set_result(msg)
+
+        for fut in self._pending.values():
+            if not fut.done():
+                fut.set_exception(ConnectionError("server closed stdout"))
+        self._pending.clear()
+
+    async def _send(self, payload):
+        data = (json.dumps(payload) + "\n").encode("utf-8")
+        async with self._write_lock:
+            self.process.stdin.write(data)
+            await self.process.stdin.drain()
+
+    async def notify(self, method, params=None):
+        payload = {"jsonrpc": "2.0", "method": method}
+        if params is not None:
+            payload["params"] = params
+        await self._send(payload)
+
+    async def request(self, method, params, timeout=60):
+        req_id = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[req_id] = fut
+        await self._send({"jsonrpc": "2.0", "id": req_id, "method": method, "params": params})
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            self._pending.pop(req_id, None)
+            await self.notify("notifications/cancelled", {"requestId": req_id, "reason": "timeout"})
+            raise
+
+    async def call_tool(self, name, arguments, timeout=60):
+        return await self.request("tools/call", {"name": name, "arguments": arguments}, timeout)
+
+    async def close(self):
+        if self.process and self.process.returncode is None:
+            self.process.stdin.close()
+            try:
+                await asyncio.wait_for(self.process.wait(), 10)
+            except asyncio.TimeoutError:
+                self.process.terminate()
+                await self.process.wait()
+        if self._reader_task:
+            self._reader_task.cancel()
+
+
+# ---------------------------------------------------------------------------
+# Workload
+# ---------------------------------------------------------------------------
+
+
+def parse_mix(spec):
+    mix = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, weight = part.partition("=")
+        mix.append((name.strip(), float(weight or 1)))
+    if not mix:
+        raise ValueError("empty --mix")
+    return mix
+
+
+def random_text(rng, words=24):
+    vocab = SEARCH_TERMS + ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(8)]
+    return " ".join(rng.choice(vocab) for _ in range(words))
+
+
+def build_arguments(tool, context_id, rng, batch_size):
+    if tool == "add_memory":
+        return {"context_id": context_id, "content": random_text(rng), "actor": "bench", "tags": "bench"}
+    if tool == "add_memories":
+        return {
+            "context_id": context_id,
+            "memories": [{"content": random_text(rng), "tags": "bench"} for _ in range(batch_size)],
+        }
+    if tool == "search_memories":
+        return {"query": rng.choice(SEARCH_TERMS), "context_id": context_id}
+    if tool in ("hydrate_context", "get_resume_context"):
+        return {"context_id": context_id}
+    return {"context_id": context_id}
+
+
+async def create_context(client, name):
+    resp = await client.call_tool("create_context", {"name": name, "description": "bench_mcp workload"})
+    text = resp.get("result", {}).get("content", [{}])[0].get("text", "")
+    match = re.search(r"ID: ([0-9a-fA-F-]{36})", text)
+    if not match:
+        raise RuntimeError(f"could not create benchmark context: {text or resp}")
+    return match.group(1)
+
+
+# ---------------------------------------------------------------------------
+# RSS sampling
+# ---------------------------------------------------------------------------
+
+
+def _children(pid):
+    kids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            if int(fields[1]) == pid:
+                kids.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return kids
+
+
+def tree_rss_kb(root_pid):
+    """Sum VmRSS over the process tree (diwa.sh -> mix -> beam.smp)."""
+    if not os.path.isdir("/proc"):
+        return None
+    total, stack, seen = 0, [root_pid], set()
+    while stack:
+        pid = stack.pop()
+        if pid in seen:
+            continue
+        seen.add(pid)
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+        stack.extend(_children(pid))
+    return total
+
+
+async def sample_rss(pid, interval, samples, started):
+    while True:
+        rss = tree_rss_kb(pid)
+        if rss is not None:
+            samples.append({"t": round(time.perf_counter() - started, 3), "rss_kb": rss})
+        await asyncio.sleep(interval)
+
+
+# ---------------------------------------------------------------------------
+# Driver
+# ---------------------------------------------------------------------------
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(latencies):
+    values = sorted(latencies)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values), 3),
+        "p50_ms": round(percentile(values, 50), 3),
+        "p95_ms": round(percentile(values, 95), 3),
+        "p99_ms": round(percentile(values, 99), 3),
+        "max_ms": round(values[-1], 3),
+    }
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    tools, weights = zip(*mix)
+
+    client = MCPClient(shlex.split(args.cmd), cwd=args.cwd)
+    await client.start()
+
+    context_id = args.context_id or await create_context(client, f"bench-{int(time.time())}")
+
+    records = []
+    rss_samples = []
+    started = time.perf_counter()
+    rss_task = asyncio.create_task(sample_rss(client.process.pid, args.rss_interval, rss_samples, started))
+
+    sem = asyncio.Semaphore(args.concurrency)
+    deadline = started + args.duration if args.duration else None
+    interval = 1.0 / args.rate if args.rate else 0.0
+    in_flight = set()
+
+    async def one(seq, tool):
+        try:
+            arguments = build_arguments(tool, context_id, rng, args.batch_size)
+            t0 = time.perf_counter()
+            status = "ok"
+            try:
+                resp = await client.call_tool(tool, arguments, timeout=args.timeout)
+                if "error" in resp or resp.get("result", {}).get("isError"):
+                    status = "error"
+            except asyncio.TimeoutError:
+                status = "timeout"
+            except ConnectionError:
+                status = "closed"
+            t1 = time.perf_counter()
+            records.append(
+                {
+                    "seq": seq,
+                    "tool": tool,
+                    "start_s": round(t0 - started, 6),
+                    "latency_ms": round((t1 - t0) * 1000, 3),
+                    "status": status,
+                }
+            )
+        finally:
+            sem.release()
+
+    next_send = time.perf_counter()
+    for seq in itertools.count():
+        if args.requests and seq >= args.requests:
+            break
+        if deadline and time.perf_counter() >= deadline:
+            break
+        if interval:
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_send += interval
+        await sem.acquire()
+        task = asyncio.create_task(one(seq, rng.choices(tools, weights)[0]))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+    if in_flight:
+        await asyncio.gather(*in_flight)
+    elapsed = time.perf_counter() - started
+
+    rss_task.cancel()
+    await client.close()
+
+    by_tool = {}
+    for rec in records:
+        by_tool.setdefault(rec["tool"], []).append(rec)
+
+    ok = [r["latency_ms"] for r in records if r["status"] == "ok"]
+    report = {
+        "config": {
+            "cmd": args.cmd,
+            "mix": dict(mix),
+            "rate": args.rate,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "requests": args.requests,
+            "batch_size": args.batch_size,
+            "context_id": context_id,
+        },
+        "elapsed_s": round(elapsed, 3),
+        "total": len(records),
+        "errors": sum(1 for r in records if r["status"] != "ok"),
+        "throughput_rps": round(len(records) / elapsed, 2) if elapsed else None,
+        "latency": summarize(ok),
+        "tools": {
+            tool: dict(
+                summarize([r["latency_ms"] for r in recs if r["status"] == "ok"]),
+                errors=sum(1 for r in recs if r["status"] != "ok"),
+            )
+            for tool, recs in sorted(by_tool.items())
+        },
+        "rss": {
+            "peak_kb": max((s["rss_kb"] for s in rss_samples), default=None),
+            "samples": rss_samples,
+        },
+    }
+
+    if args.csv_out:
+        with open(args.csv_out, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["seq", "tool", "start_s", "latency_ms", "status"])
+            writer.writeheader()
+            writer.writerows(sorted(records, key=lambda r: r["seq"]))
+
+    output = json.dumps(report, indent=2)
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cmd", default="./diwa.sh start", help="server command (default: %(default)s)")
+    parser.add_argument("--cwd", default=None, help="working directory for the server command")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weighted tool mix, e.g. search_memories=4,add_memory=1")
+    parser.add_argument("--rate", type=float, default=0, help="target requests/sec (0 = as fast as concurrency allows)")
+    parser.add_argument("--concurrency", type=int, default=8, help="max requests in flight")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run (0 = until --requests)")
+    parser.add_argument("--requests", type=int, default=0, help="stop after N requests (0 = until --duration)")
+    parser.add_argument("--batch-size", type=int, default=10, help="memories per add_memories call")
+    parser.add_argument("--timeout", type=float, default=60, help="per-request timeout in seconds")
+    parser.add_argument("--context-id", default=None, help="reuse an existing context instead of creating one")
+    parser.add_argument("--rss-interval", type=float, default=1.0, help="seconds between RSS samples")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the workload")
+    parser.add_argument("--json-out", default=None, help="write the JSON report to this file")
+    parser.add_argument("--csv-out", default=None, help="write per-request samples to this CSV file")
+    args = parser.parse_args()
+
+    if not args.duration and not args.requests:
+        parser.error("one of --duration or --requests must be non-zero")
+
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        sys.exit(130)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for the Diwa MCP stdio server.
+
+Spawns the server (``./diwa.sh start`` by default) several times and, for
+each run, measures the time from spawn to the ``initialize`` response and to
+the ``tools/list`` response. The server is started with
+``DIWA_STARTUP_REPORT=1`` so its own phase timings (migrations, supervision
+tree, time-to-initialize since VM start) are collected from stderr.
+
+Exits non-zero when the median time-to-initialize exceeds ``--target-ms``.
+
+Examples:
+
+    python3 scripts/bench_startup.py --runs 10
+    python3 scripts/bench_startup.py --cmd "_build/prod/rel/diwa_agent/bin/diwa_agent start" \\
+        --target-ms 300 --json-out startup.json
+
+Uses only the Python standard library.
+"""
+
+import argparse
+import json
+import os
+import queue
+import shlex
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+REPORT_PREFIX = "[DiwaAgent.Startup]"
+
+
+def read_lines(stream, sink):
+    for line in iter(stream.readline, b""):
+        sink.put(line.decode("utf-8", "replace"))
+    sink.put(None)
+
+
+def wait_for_id(lines, request_id, deadline):
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"no response for request {request_id}")
+        line = lines.get(timeout=remaining)
+        if line is None:
+            raise RuntimeError("server exited before responding")
+        try:
+            message = json.loads(line)
+        except ValueError:
+            continue
+        if message.get("id") == request_id:
+            return message
+
+
+def parse_report(stderr_lines):
+    for line in stderr_lines:
+        if REPORT_PREFIX in line:
+            phases = {}
+            for item in line.split(REPORT_PREFIX, 1)[1].split():
+                name, _, value = item.partition("=")
+                phases[name] = float(value.rstrip("ms"))
+            return phases
+    return {}
+
+
+def run_once(cmd, cwd, timeout):
+    env = dict(os.environ, DIWA_STARTUP_REPORT="1")
+    started = time.monotonic()
+    proc = subprocess.Popen(
+        cmd, cwd=cwd, env=env,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+
+    stdout, stderr = queue.Queue(), queue.Queue()
+    threading.Thread(target=read_lines, args=(proc.stdout, stdout), daemon=True).start()
+    threading.Thread(target=read_lines, args=(proc.stderr, stderr), daemon=True).start()
+
+    def send(message):
+        proc.stdin.write((json.dumps(message) + "\n").encode())
+        proc.stdin.flush()
+
+    deadline = started + timeout
+
+    try:
+        send({
+            "jsonrpc": "2.0", "id": 1, "method": "initialize",
+            "params": {
+                "protocolVersion": "2024-11-05",
+                "capabilities": {},
+                "clientInfo": {"name": "bench_startup", "version": "1.0"},
+            },
+        })
+        wait_for_id(stdout, 1, deadline)
+        initialize_ms = (time.monotonic() - started) * 1000
+
+        send({"jsonrpc": "2.0", "method": "notifications/initialized"})
+        send({"jsonrpc": "2.0", "id": 2, "method": "tools/list"})
+        tools = wait_for_id(stdout, 2, deadline)
+        tools_ms = (time.monotonic() - started) * 1000
+    finally:
+        proc.stdin.close()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+    stderr_lines = []
+    while True:
+        try:
+            line = stderr.get(timeout=1)
+        except queue.Empty:
+            break
+        if line is None:
+            break
+        stderr_lines.append(line)
+
+    return {
+        "initialize_ms": round(initialize_ms, 1),
+        "tools_list_ms": round(tools_ms, 1),
+        "tool_count": len(tools.get("result", {}).get("tools", [])),
+        "server_phases": parse_report(stderr_lines),
+    }
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round((len(ordered) - 1) * pct))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--cmd", default="./diwa.sh start", help="server command")
+    parser.add_argument("--cwd", default=None, help="working directory for the server")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs first")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds per run")
+    parser.add_argument("--target-ms", type=float, default=300.0)
+    parser.add_argument("--json-out", default=None)
+    args = parser.parse_args()
+
+    cmd = shlex.split(args.cmd)
+
+    for _ in range(args.warmup):
+        run_once(cmd, args.cwd, args.timeout)
+
+    runs = []
+    for n in range(args.runs):
+        result = run_once(cmd, args.cwd, args.timeout)
+        runs.append(result)
+        print(
+            f"run {n + 1}: initialize {result['initialize_ms']}ms, "
+            f"tools/list {result['tools_list_ms']}ms, server {result['server_phases']}",
+            file=sys.stderr,
+        )
+
+    initialize = [r["initialize_ms"] for r in runs]
+    summary = {
+        "runs": runs,
+        "initialize_ms": {
+            "min": min(initialize),
+            "median": statistics.median(initialize),
+            "p95": percentile(initialize, 0.95),
+            "max": max(initialize),
+        },
+        "tools_list_ms_median": statistics.median(r["tools_list_ms"] for r in runs),
+        "target_ms": args.target_ms,
+    }
+    summary["within_target"] = summary["initialize_ms"]["median"] <= args.target_ms
+
+    output = json.dumps(summary, indent=2)
+    if args.json_out:
+        with open(args.json_out, "w") as handle:
+            handle.write(output)
+    print(output)
+
+    sys.exit(0 if summary["within_target"] else 1)
+
+
+if __name__ == "__main__":
+    main()
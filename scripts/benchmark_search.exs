@@ -1,35 +1,113 @@
-# Run with: mix run scripts/benchmark_search.exs
-
-alias Diwa.Storage.{Context, Memory}
-alias Diwa.Repo
-
-IO.puts("Setting up benchmark data...")
-
-# Create a context
-{:ok, context} = Context.create("Benchmark Context", "For Benchee")
-IO.puts("Context created: #{context.id}")
-
-# Insert 100 memories (enough to test logic, 1000 might be slow to setup in script)
-IO.puts("Inserting 100 memories...")
-Enum.each(1..100, fn i ->
-  content = "This is memory number #{i}. Elixir is great for concurrency. Bridge tools help agents work together. #{Enum.random(["Alpha", "Beta", "Gamma"])}"
-  Memory.add(context.id, content, %{metadata: %{"index" => i}})
-end)
-
-IO.puts("Data inserted. Running benchmark...")
-
-Benchee.run(%{
-  "list_memories (baseline)" => fn -> 
-    {:ok, _} = Memory.list(context.id, limit: 10) 
-  end,
-  "search_text (FTS 'Elixir')" => fn -> 
-    {:ok, _} = Memory.search_text("Elixir", context.id) 
-  end,
-  "search_text (FTS 'Beta')" => fn -> 
-    {:ok, _} = Memory.search_text("Beta", context.id) 
+# Compare the full-text index against the legacy LIKE '%q%' scan.
+#
+# Run with: mix run scripts/benchmark_search.exs [sizes]
+#   e.g.    mix run scripts/benchmark_search.exs 1000,10000,100000
+#
+# For each size a fresh context is filled via insert_all (the FTS triggers fire
+# on bulk inserts too), then each query is timed with :timer.tc over several
+# iterations. Contexts are deleted afterwards.
+
+alias DiwaAgent.Repo
+alias DiwaAgent.Storage.{Context, FullTextIndex, Memory}
+import Ecto.Query
+
+sizes =
+  case System.argv() do
+    [arg | _] -> arg |> String.split(",") |> Enum.map(&String.to_integer/1)
+    [] -> [1_000, 10_000, 100_000]
+  end
+
+iterations = 20
+queries = ["Elixir", "concurrency agents", "Gamma", "bridge tools help", "nonexistentterm"]
+words = ~w(alpha beta gamma delta sqlite postgres elixir phoenix agent bridge tools
+  latency index search memory context handoff blocker decision deploy)
+
+timestamp = fn ->
+  now = DateTime.utc_now()
+
+  case DiwaSchema.Core.Memory.__schema__(:type, :inserted_at) do
+    :utc_datetime -> DateTime.truncate(now, :second)
+    :naive_datetime -> now |> DateTime.to_naive() |> NaiveDateTime.truncate(:second)
+    :naive_datetime_usec -> DateTime.to_naive(now)
+    _ -> now
+  end
+end
+
+like_search = fn query, context_id ->
+  pattern = "%#{String.downcase(query)}%"
+
+  from(m in DiwaSchema.Core.Memory,
+    where: m.context_id == ^context_id,
+    where: is_nil(m.deleted_at),
+    where: fragment("lower(?) LIKE ?", m.content, ^pattern),
+    limit: 50
+  )
+  |> Repo.all()
+end
+
+measure = fn fun ->
+  # warm-up
+  fun.()
+
+  times =
+    for _ <- 1..iterations do
+      {us, _} = :timer.tc(fun)
+      us
+    end
+    |> Enum.sort()
+
+  %{
+    median_ms: Enum.at(times, div(length(times), 2)) / 1000,
+    p95_ms: Enum.at(times, min(length(times) - 1, round(length(times) * 0.95))) / 1000
+  }
+end
+
+IO.puts("Full-text index available: #{FullTextIndex.available?()}\n")
+
+for size <- sizes do
+  {:ok, context} = Context.create("FTS Benchmark #{size}", "search benchmark")
+  IO.puts("== #{size} memories ==")
+
+  {insert_us, _} =
+    :timer.tc(fn ->
+      1..size
+      |> Stream.chunk_every(500)
+      |> Enum.each(fn chunk ->
+        now = timestamp.()
+
+        rows =
+          Enum.map(chunk, fn i ->
+            text = Enum.map_join(1..24, " ", fn _ -> Enum.random(words) end)
+
+            %{
+              id: Ecto.UUID.generate(),
+              context_id: context.id,
+              content: "Memory #{i}: #{text}. Elixir is great for concurrency.",
+              metadata: %{"index" => i},
+              tags: [],
+              inserted_at: now,
+              updated_at: now
+            }
+          end)
+
+        Repo.insert_all(DiwaSchema.Core.Memory, rows)
+      end)
+    end)
+
+  IO.puts("inserted in #{Float.round(insert_us / 1_000_000, 2)}s")
+
+  for query <- queries do
+    like = measure.(fn -> like_search.(query, context.id) end)
+    fts = measure.(fn -> Memory.search_text(query, context.id) end)
+    {:ok, hits} = FullTextIndex.search(query, context_id: context.id)
+
+    IO.puts(
+      String.pad_trailing("  #{inspect(query)}", 24) <>
+        "LIKE median #{like.median_ms}ms p95 #{like.p95_ms}ms | " <>
+        "FTS median #{fts.median_ms}ms p95 #{fts.p95_ms}ms (#{length(hits)} ranked hits)"
+    )
   end
-}, time: 5, memory_time: 2)
 
-IO.puts("Cleaning up...")
-Context.delete(context.id)
-IO.puts("Done.")
+  Context.delete(context.id)
+  IO.puts("")
+end
@@ -0,0 +1,180 @@
+# Compare the indexed memory type/class/tag lookups against the legacy scans.
+#
+# Run with: mix run scripts/benchmark_type_lookups.exs [sizes]
+#   e.g.    mix run scripts/benchmark_type_lookups.exs 10000,100000
+#
+# For each size a fresh context is filled via insert_all with a mix of
+# types, classes and tags, then the query plan of each lookup is printed and
+# each lookup is timed against its legacy form. The legacy forms wrap the
+# indexed expression (`|| ''`) or use the old array-membership test, so the
+# planner cannot use the new indexes. Contexts are deleted afterwards.
+
+alias DiwaAgent.Repo
+alias DiwaAgent.Storage.{Context, Memory}
+import Ecto.Query
+
+sizes =
+  case System.argv() do
+    [arg | _] -> arg |> String.split(",") |> Enum.map(&String.to_integer/1)
+    [] -> [100_000]
+  end
+
+iterations = 20
+postgres? = Repo.__adapter__() == Ecto.Adapters.Postgres
+types = ~w(note decision lesson progress blocker handoff rule)
+classes = ~w(fact decision user_rule system_instruction lesson)
+tags = ~w(backend frontend sinag:checkpoint sinag:failure progress handoff_item infra)
+
+timestamp = fn ->
+  now = DateTime.utc_now()
+
+  case DiwaSchema.Core.Memory.__schema__(:type, :inserted_at) do
+    :utc_datetime -> DateTime.truncate(now, :second)
+    :naive_datetime -> now |> DateTime.to_naive() |> NaiveDateTime.truncate(:second)
+    :naive_datetime_usec -> DateTime.to_naive(now)
+    _ -> now
+  end
+end
+
+active = fn context_id ->
+  from(m in DiwaSchema.Core.Memory,
+    where: m.context_id == ^context_id,
+    where: is_nil(m.deleted_at),
+    order_by: [desc: m.inserted_at]
+  )
+end
+
+legacy_type = fn context_id, type ->
+  if postgres?,
+    do:
+      from(m in active.(context_id),
+        where: fragment("(?->>'type') || '' = ?", m.metadata, ^type)
+      ),
+    else:
+      from(m in active.(context_id),
+        where: fragment("json_extract(?, '$.type') || '' = ?", m.metadata, ^type)
+      )
+end
+
+# RuleEnforcement's former single OR query
+legacy_rules = fn context_id ->
+  classes = ~w(user_rule system_instruction)
+
+  if postgres?,
+    do:
+      from(m in active.(context_id),
+        where: m.memory_class in ^classes or fragment("(?->>'type') = 'rule'", m.metadata)
+      ),
+    else:
+      from(m in active.(context_id),
+        where:
+          m.memory_class in ^classes or
+            fragment("json_extract(?, '$.type') = 'rule'", m.metadata)
+      )
+end
+
+legacy_tag = fn context_id, tag -> from(m in active.(context_id), where: ^tag in m.tags) end
+
+explain = fn queries ->
+  prefix = if postgres?, do: "EXPLAIN ", else: "EXPLAIN QUERY PLAN "
+
+  Enum.map_join(queries, "\n", fn {sql, params} ->
+    Repo.query!(prefix <> sql, params).rows
+    |> Enum.map_join("\n", fn row -> "      " <> to_string(List.last(row)) end)
+  end)
+end
+
+# The SQL a lookup issues, captured from the Repo's query telemetry
+issued_sql = fn fun ->
+  handler = "benchmark-type-lookups"
+  parent = self()
+  event = [:diwa_agent, :repo, :query]
+
+  :telemetry.attach(handler, event, fn _, _, meta, _ -> send(parent, {:sql, meta}) end, nil)
+  fun.()
+  :telemetry.detach(handler)
+
+  Stream.repeatedly(fn ->
+    receive do
+      {:sql, %{query: sql, params: params}} -> {sql, params}
+    after
+      0 -> nil
+    end
+  end)
+  |> Enum.take_while(& &1)
+end
+
+measure = fn fun ->
+  # warm-up
+  fun.()
+
+  times =
+    for _ <- 1..iterations do
+      {us, _} = :timer.tc(fun)
+      us
+    end
+    |> Enum.sort()
+
+  %{
+    median_ms: Enum.at(times, div(length(times), 2)) / 1000,
+    p95_ms: Enum.at(times, min(length(times) - 1, round(length(times) * 0.95))) / 1000
+  }
+end
+
+for size <- sizes do
+  {:ok, context} = Context.create("Type Lookup Benchmark #{size}", "type lookup benchmark")
+  IO.puts("== #{size} memories ==")
+
+  {insert_us, _} =
+    :timer.tc(fn ->
+      1..size
+      |> Stream.chunk_every(500)
+      |> Enum.each(fn chunk ->
+        now = timestamp.()
+
+        rows =
+          Enum.map(chunk, fn i ->
+            %{
+              id: Ecto.UUID.generate(),
+              context_id: context.id,
+              content: "Memory #{i}",
+              metadata: %{"type" => Enum.random(types), "index" => i},
+              memory_class: Enum.random(classes),
+              tags: Enum.take_random(tags, 2),
+              inserted_at: now,
+              updated_at: now
+            }
+          end)
+
+        Repo.insert_all(DiwaSchema.Core.Memory, rows)
+      end)
+    end)
+
+  IO.puts("inserted in #{Float.round(insert_us / 1_000_000, 2)}s\n")
+
+  cases = [
+    {"type = handoff", fn -> Memory.list_by_type(context.id, "handoff") end,
+     legacy_type.(context.id, "handoff")},
+    {"rules (class or type)",
+     fn ->
+       Memory.list_by_class(context.id, ~w(user_rule system_instruction))
+       Memory.list_by_type(context.id, "rule")
+     end, legacy_rules.(context.id)},
+    {"tag = sinag:checkpoint", fn -> Memory.list_by_tag(context.id, "sinag:checkpoint") end,
+     legacy_tag.(context.id, "sinag:checkpoint")}
+  ]
+
+  for {label, indexed, legacy_query} <- cases do
+    new = measure.(indexed)
+    old = measure.(fn -> Repo.all(legacy_query) end)
+
+    IO.puts("  #{label}")
+    IO.puts("    legacy  median #{old.median_ms}ms p95 #{old.p95_ms}ms")
+    IO.puts(explain.([Repo.to_sql(:all, legacy_query)]))
+    IO.puts("    indexed median #{new.median_ms}ms p95 #{new.p95_ms}ms")
+    IO.puts(explain.(issued_sql.(indexed)))
+    IO.puts("")
+  end
+
+  Context.delete(context.id)
+end
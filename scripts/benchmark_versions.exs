@@ -0,0 +1,85 @@
+# Measure version history storage and reconstruction latency.
+#
+# Run with: mix run scripts/benchmark_versions.exs [edits] [lines]
+#   e.g.    mix run scripts/benchmark_versions.exs 500 200
+#
+# A memory shaped like a living status doc (`lines` lines, default 100)
+# gets `edits` versions (default 200), each changing, adding or removing a
+# line. The bytes the payload chain stores are compared with full copies of
+# every version, then single-version reads (`MemoryVersion.get/1`, as used
+# by compare_memory_versions and rollback_memory) and whole-history reads
+# are timed. The context is deleted afterwards.
+
+alias DiwaAgent.Storage.{Context, Memory, MemoryVersion, VersionPayload}
+
+{edits, lines} =
+  case System.argv() do
+    [edits, lines | _] -> {String.to_integer(edits), String.to_integer(lines)}
+    [edits] -> {String.to_integer(edits), 100}
+    [] -> {200, 100}
+  end
+
+iterations = 50
+
+measure = fn fun ->
+  # warm-up
+  fun.()
+
+  times =
+    for _ <- 1..iterations do
+      {us, _} = :timer.tc(fun)
+      us
+    end
+    |> Enum.sort()
+
+  %{
+    median_ms: Enum.at(times, div(length(times), 2)) / 1000,
+    p95_ms: Enum.at(times, min(length(times) - 1, round(length(times) * 0.95))) / 1000
+  }
+end
+
+edit = fn doc, i ->
+  line = "- [#{i}] status item #{:rand.uniform(1_000_000)} updated by agent #{rem(i, 7)}"
+  at = :rand.uniform(length(doc)) - 1
+
+  case rem(i, 5) do
+    0 -> List.insert_at(doc, at, line)
+    1 when length(doc) > 1 -> List.delete_at(doc, at)
+    _ -> List.replace_at(doc, at, line)
+  end
+end
+
+{:ok, context} = Context.create("Version Benchmark", "version history benchmark")
+doc = for i <- 1..lines, do: "- [#{i}] initial status item #{i}"
+{:ok, memory} = Memory.add(context.id, Enum.join(doc, "\n"), %{tags: ["status"]})
+
+IO.puts("== #{edits} edits of a #{lines}-line memory ==")
+
+{record_us, {_doc, full_bytes}} =
+  :timer.tc(fn ->
+    Enum.reduce(1..edits, {doc, 0}, fn i, {doc, bytes} ->
+      doc = edit.(doc, i)
+      content = Enum.join(doc, "\n")
+      {:ok, version} = MemoryVersion.record(%{memory | content: content}, "update")
+      {doc, bytes + MemoryVersion.full_bytes({content, version.tags, version.metadata})}
+    end)
+  end)
+
+stored = VersionPayload.stored_bytes(memory.id)
+{:ok, history} = MemoryVersion.list_history(memory.id)
+
+IO.puts("recorded in #{Float.round(record_us / 1000, 1)}ms")
+IO.puts("  full copies  #{full_bytes} bytes")
+
+IO.puts(
+  "  payloads     #{stored} bytes (#{Float.round(100 * (1 - stored / full_bytes), 1)}% saved)\n"
+)
+
+ids = Enum.map(history, & &1.id)
+one = measure.(fn -> MemoryVersion.get(Enum.random(ids)) end)
+all = measure.(fn -> MemoryVersion.list_history(memory.id) end)
+
+IO.puts("  get/1 (random version)  median #{one.median_ms}ms p95 #{one.p95_ms}ms")
+IO.puts("  list_history/1         median #{all.median_ms}ms p95 #{all.p95_ms}ms")
+
+Context.delete(context.id)
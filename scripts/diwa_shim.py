@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Stdio-to-socket shim for the shared Diwa daemon.
+
+MCP clients launch this script instead of a server of their own. It
+connects to the daemon's Unix socket and relays line-delimited JSON-RPC in
+both directions, so every client shares one node, one Repo pool and the
+daemon's warm caches. Each connection gets its own server state on the
+daemon side.
+
+If nothing is listening and ``--spawn`` is given (the default is
+``./diwa.sh daemon`` from the repository root), the daemon is started
+detached, logging to ``~/.diwa/daemon.log``, and the shim waits for the
+socket to appear.
+
+Examples:
+
+    python3 scripts/diwa_shim.py
+    python3 scripts/diwa_shim.py --socket /tmp/diwa.sock --spawn ""
+
+Uses only the Python standard library.
+"""
+
+import argparse
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+DEFAULT_SOCKET = os.path.join("~", ".diwa", "diwa.sock")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def connect(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def spawn_daemon(cmd, path):
+    log_path = os.path.join(os.path.dirname(path), "daemon.log")
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    env = dict(os.environ, DIWA_SOCKET=path)
+
+    with open(log_path, "ab") as log:
+        subprocess.Popen(
+            shlex.split(cmd), cwd=ROOT, env=env,
+            stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+            start_new_session=True,
+        )
+
+
+def wait_for_socket(path, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        sock = connect(path)
+        if sock:
+            return sock
+        time.sleep(0.1)
+    return None
+
+
+def stdin_to_socket(sock):
+    stdin = sys.stdin.buffer
+    try:
+        for line in iter(stdin.readline, b""):
+            sock.sendall(line)
+    except OSError:
+        pass
+    finally:
+        # Half-close: the daemon still answers in-flight requests
+        try:
+            sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+def socket_to_stdout(sock):
+    stdout = sys.stdout.buffer
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            break
+        stdout.write(data)
+        stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--socket",
+        default=os.environ.get("DIWA_SOCKET", DEFAULT_SOCKET),
+        help="daemon socket path (default: $DIWA_SOCKET or ~/.diwa/diwa.sock)",
+    )
+    parser.add_argument(
+        "--spawn", default="./diwa.sh daemon",
+        help="command that starts the daemon if it is not running ('' to disable)",
+    )
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for it")
+    args = parser.parse_args()
+
+    path = os.path.expanduser(args.socket)
+    sock = connect(path)
+
+    if sock is None and args.spawn:
+        spawn_daemon(args.spawn, path)
+        sock = wait_for_socket(path, args.timeout)
+
+    if sock is None:
+        print(f"[diwa_shim] No daemon listening on {path}", file=sys.stderr)
+        sys.exit(1)
+
+    threading.Thread(target=stdin_to_socket, args=(sock,), daemon=True).start()
+
+    try:
+        socket_to_stdout(sock)
+    except (OSError, KeyboardInterrupt):
+        pass
+    finally:
+        sock.close()
+
+
+if __name__ == "__main__":
+    main()
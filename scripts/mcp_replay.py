@@ -0,0 +1,601 @@
+#!/usr/bin/env python3
+"""
+Record, replay and compare MCP sessions against the Diwa stdio server.
+
+record
+    Transparent stdio proxy: configure it as the MCP server command of a
+    client (Claude Desktop, an IDE, an agent) and it spawns the real server
+    (``./diwa.sh start`` by default), relays both directions unchanged and
+    writes every JSON-RPC line with its timestamp to a trace file.
+
+replay
+    Re-issues the client side of a trace against a fresh server, at the
+    original pacing or faster (``--speed``). Request ids are remapped, and
+    UUIDs the recorded server handed out (created contexts, memories, ...)
+    are substituted with the ones the new server returns; ``--context-id``
+    sends every ``context_id`` argument to one existing context instead.
+    A request that uses such a UUID waits for the response that produces it.
+    Writes per-call latency and response size as a run file.
+
+compare
+    Diffs per-tool latency distributions and response sizes between two
+    runs (trace or run files) and flags regressions.
+
+Trace files are JSON lines: a header, then one event per message with ``t``
+(seconds since start), ``dir`` (``c2s`` or ``s2c``) and ``msg``.
+
+Examples:
+
+    # in the MCP client config: command "python3", args
+    #   ["scripts/mcp_replay.py", "record", "--trace", "/tmp/session.jsonl"]
+    python3 scripts/mcp_replay.py replay /tmp/session.jsonl --speed 4 --out new.json
+    python3 scripts/mcp_replay.py compare /tmp/session.jsonl new.json --threshold 15
+
+Uses only the Python standard library.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import threading
+import time
+
+TRACE_VERSION = 1
+UUID_RE = re.compile(r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b")
+
+
+# ---------------------------------------------------------------------------
+# Trace files
+# ---------------------------------------------------------------------------
+
+
+class TraceWriter:
+    """Thread-safe JSON-lines trace writer."""
+
+    def __init__(self, path, cmd):
+        self._file = open(path, "w", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._write({"type": "header", "version": TRACE_VERSION, "cmd": cmd, "started_at": time.time()})
+
+    def _write(self, event):
+        self._file.write(json.dumps(event, separators=(",", ":")) + "\n")
+        self._file.flush()
+
+    def event(self, direction, line):
+        t = round(time.monotonic() - self._started, 6)
+        text = line.decode("utf-8", errors="replace").rstrip("\r\n")
+        if not text.strip():
+            return
+        try:
+            event = {"t": t, "dir": direction, "msg": json.loads(text)}
+        except json.JSONDecodeError:
+            event = {"t": t, "dir": direction, "raw": text}
+        with self._lock:
+            self._write(event)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_trace(path):
+    header, events = None, []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if event.get("type") == "header":
+                header = event
+            elif "msg" in event:
+                events.append(event)
+    if header is None:
+        raise ValueError(f"{path}: not a trace file (no header)")
+    return header, events
+
+
+def method_key(msg):
+    """``tools/call`` requests are keyed by tool name, others by method."""
+    if msg.get("method") == "tools/call":
+        return (msg.get("params") or {}).get("name") or "tools/call"
+    return msg.get("method")
+
+
+def response_status(msg):
+    if "error" in msg:
+        return "error"
+    if isinstance(msg.get("result"), dict) and msg["result"].get("isError"):
+        return "error"
+    return "ok"
+
+
+def size_of(msg):
+    return len(json.dumps(msg, separators=(",", ":")).encode("utf-8"))
+
+
+def trace_calls(events):
+    """Pair recorded requests with their responses."""
+    requests, calls = {}, []
+    for event in events:
+        msg = event["msg"]
+        if not isinstance(msg, dict):
+            continue
+        if event["dir"] == "c2s" and "method" in msg and "id" in msg:
+            requests[json.dumps(msg["id"])] = (event["t"], msg)
+        elif event["dir"] == "s2c" and "id" in msg and "method" not in msg:
+            sent = requests.pop(json.dumps(msg["id"]), None)
+            if sent is None:
+                continue
+            t0, request = sent
+            calls.append(
+                {
+                    "id": request["id"],
+                    "tool": method_key(request),
+                    "start_s": t0,
+                    "latency_ms": round((event["t"] - t0) * 1000, 3),
+                    "bytes": size_of(msg),
+                    "status": response_status(msg),
+                    "response": msg,
+                }
+            )
+    return calls
+
+
+# ---------------------------------------------------------------------------
+# record
+# ---------------------------------------------------------------------------
+
+
+def record(args):
+    cmd = shlex.split(args.cmd)
+    trace = TraceWriter(args.trace, args.cmd)
+    server = subprocess.Popen(cmd, cwd=args.cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=None)
+
+    def client_to_server():
+        stdin = sys.stdin.buffer
+        try:
+            for line in iter(stdin.readline, b""):
+                trace.event("c2s", line)
+                server.stdin.write(line)
+                server.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            pass
+        finally:
+            # Client went away: let the server drain and exit
+            try:
+                server.stdin.close()
+            except OSError:
+                pass
+
+    def server_to_client():
+        stdout = sys.stdout.buffer
+        for line in iter(server.stdout.readline, b""):
+            trace.event("s2c", line)
+            try:
+                stdout.write(line)
+                stdout.flush()
+            except BrokenPipeError:
+                break
+
+    threading.Thread(target=client_to_server, daemon=True).start()
+    relay = threading.Thread(target=server_to_client)
+    relay.start()
+
+    try:
+        code = server.wait()
+    except KeyboardInterrupt:
+        server.terminate()
+        code = server.wait()
+    relay.join(timeout=5)
+    trace.close()
+    return code
+
+
+# ---------------------------------------------------------------------------
+# replay
+# ---------------------------------------------------------------------------
+
+
+def substitute(value, mapping, context_id=None):
+    """Replace mapped UUIDs in every string, and ``context_id`` values."""
+    if isinstance(value, dict):
+        out = {}
+        for key, item in value.items():
+            if context_id and key == "context_id" and isinstance(item, str):
+                out[key] = context_id
+            else:
+                out[key] = substitute(item, mapping, context_id)
+        return out
+    if isinstance(value, list):
+        return [substitute(item, mapping, context_id) for item in value]
+    if isinstance(value, str) and mapping:
+        return UUID_RE.sub(lambda m: mapping.get(m.group(0).lower(), m.group(0)), value)
+    return value
+
+
+def uuids_in(value):
+    return [u.lower() for u in UUID_RE.findall(json.dumps(value))]
+
+
+class Replayer:
+    def __init__(self, args, events):
+        self.args = args
+        self.events = events
+        self.process = None
+        self.mapping = dict(parse_maps(args.map))
+        self.results = []
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._write_lock = asyncio.Lock()
+        # new id -> original id, for notifications/cancelled
+        self._id_map = {}
+        self._done = {}
+
+        # Which recorded request first returned each UUID
+        self.recorded = {json.dumps(c["id"]): c for c in trace_calls(events)}
+        self.producers = {}
+        for event in events:
+            msg = event["msg"]
+            if event["dir"] == "c2s" and isinstance(msg, dict):
+                for u in uuids_in(msg):
+                    self.producers.setdefault(u, None)
+        for key, call in sorted(self.recorded.items(), key=lambda kv: kv[1]["start_s"]):
+            for u in uuids_in(call["response"]):
+                if self.producers.get(u, "") is None:
+                    self.producers[u] = key
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            *shlex.split(self.args.cmd),
+            cwd=self.args.cwd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            limit=64 * 1024 * 1024,
+        )
+        self._reader = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self):
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                break
+            try:
+                msg = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            fut = self._pending.pop(msg.get("id"), None) if isinstance(msg, dict) else None
+            if fut is not None and not fut.done():
+                fut.set_result((time.perf_counter(), msg))
+        for fut in self._pending.values():
+            if not fut.done():
+                fut.set_exception(ConnectionError("server closed stdout"))
+        self._pending.clear()
+
+    async def _send(self, payload):
+        data = (json.dumps(payload) + "\n").encode("utf-8")
+        async with self._write_lock:
+            self.process.stdin.write(data)
+            await self.process.stdin.drain()
+
+    def _learn(self, recorded, msg):
+        """Map UUIDs of a recorded response onto those of the new one."""
+        old, new = uuids_in(recorded), uuids_in(msg)
+        if len(old) != len(new):
+            return
+        for o, n in zip(old, new):
+            if o != n and o not in self.mapping:
+                self.mapping[o] = n
+
+    async def _call(self, seq, key, msg):
+        new_id = next(self._ids)
+        self._id_map[json.dumps(msg["id"])] = new_id
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[new_id] = fut
+        payload = dict(substitute(msg, self.mapping, self.args.context_id), id=new_id)
+
+        t0 = time.perf_counter()
+        await self._send(payload)
+        status, size, response = "ok", None, None
+        try:
+            t1, response = await asyncio.wait_for(fut, self.args.timeout)
+            status, size = response_status(response), size_of(response)
+        except asyncio.TimeoutError:
+            self._pending.pop(new_id, None)
+            t1, status = time.perf_counter(), "timeout"
+        except ConnectionError:
+            t1, status = time.perf_counter(), "closed"
+
+        recorded = self.recorded.get(key)
+        if recorded and response is not None:
+            self._learn(recorded["response"], response)
+
+        self.results.append(
+            {
+                "seq": seq,
+                "id": msg["id"],
+                "tool": method_key(msg),
+                "start_s": round(t0 - self._started, 6),
+                "latency_ms": round((t1 - t0) * 1000, 3),
+                "bytes": size,
+                "status": status,
+                "recorded_latency_ms": recorded["latency_ms"] if recorded else None,
+                "recorded_bytes": recorded["bytes"] if recorded else None,
+            }
+        )
+
+    async def _dependencies(self, msg):
+        """Wait for the calls whose recorded responses produced UUIDs in msg."""
+        for u in uuids_in(msg):
+            if u in self.mapping:
+                continue
+            key = self.producers.get(u)
+            task = self._done.get(key) if key else None
+            if task is not None and not task.done():
+                await asyncio.shield(task)
+
+    async def run(self):
+        await self.start()
+        self._started = time.perf_counter()
+        client = [e for e in self.events if e["dir"] == "c2s" and isinstance(e["msg"], dict)]
+
+        if not client or client[0]["msg"].get("method") != "initialize":
+            # Trace starts mid-session: the fresh server still needs a handshake
+            await self._call(
+                -1,
+                None,
+                {
+                    "jsonrpc": "2.0",
+                    "id": "replay-init",
+                    "method": "initialize",
+                    "params": {
+                        "protocolVersion": "2024-11-05",
+                        "capabilities": {},
+                        "clientInfo": {"name": "mcp_replay", "version": "1.0"},
+                    },
+                },
+            )
+            await self._send({"jsonrpc": "2.0", "method": "notifications/initialized"})
+
+        origin = client[0]["t"] if client else 0.0
+        tasks = []
+        for seq, event in enumerate(client):
+            msg = event["msg"]
+            if self.args.speed > 0:
+                due = self._started + (event["t"] - origin) / self.args.speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            await self._dependencies(msg)
+
+            if "id" in msg and "method" in msg:
+                key = json.dumps(msg["id"])
+                task = asyncio.create_task(self._call(seq, key, msg))
+                self._done[key] = task
+                tasks.append(task)
+                # The handshake must complete before anything else is sent
+                if msg.get("method") == "initialize":
+                    await task
+            elif msg.get("method") == "notifications/cancelled":
+                params = dict(msg.get("params") or {})
+                params["requestId"] = self._id_map.get(json.dumps(params.get("requestId")), params.get("requestId"))
+                await self._send(dict(msg, params=params))
+            elif "method" in msg:
+                await self._send(substitute(msg, self.mapping, self.args.context_id))
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - self._started
+        await self.close()
+        return elapsed
+
+    async def close(self):
+        if self.process and self.process.returncode is None:
+            self.process.stdin.close()
+            try:
+                await asyncio.wait_for(self.process.wait(), 10)
+            except asyncio.TimeoutError:
+                self.process.terminate()
+                await self.process.wait()
+        self._reader.cancel()
+
+
+def parse_maps(specs):
+    for spec in specs or []:
+        old, sep, new = spec.partition("=")
+        if not sep or not UUID_RE.fullmatch(old.strip()):
+            raise SystemExit(f"--map expects OLD_UUID=NEW_VALUE, got {spec!r}")
+        yield old.strip().lower(), new.strip()
+
+
+def replay(args):
+    header, events = read_trace(args.trace)
+    replayer = Replayer(args, events)
+    elapsed = asyncio.run(replayer.run())
+
+    results = sorted(replayer.results, key=lambda r: r["seq"])
+    run = {
+        "type": "run",
+        "trace": os.path.abspath(args.trace),
+        "cmd": args.cmd,
+        "speed": args.speed,
+        "elapsed_s": round(elapsed, 3),
+        "errors": sum(1 for r in results if r["status"] != "ok"),
+        "mapping": replayer.mapping,
+        "calls": results,
+    }
+
+    output = json.dumps(run, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    summary = {tool: summarize(calls) for tool, calls in group(results).items()}
+    print(json.dumps({"elapsed_s": run["elapsed_s"], "errors": run["errors"], "tools": summary}, indent=2))
+    return 1 if run["errors"] and args.fail_on_error else 0
+
+
+# ---------------------------------------------------------------------------
+# compare
+# ---------------------------------------------------------------------------
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(calls):
+    ok = [c for c in calls if c["status"] == "ok"]
+    latencies = sorted(c["latency_ms"] for c in ok)
+    sizes = [c["bytes"] for c in ok if c["bytes"] is not None]
+    summary = {"count": len(calls), "errors": len(calls) - len(ok)}
+    if latencies:
+        summary.update(
+            {
+                "mean_ms": round(sum(latencies) / len(latencies), 3),
+                "p50_ms": round(percentile(latencies, 50), 3),
+                "p95_ms": round(percentile(latencies, 95), 3),
+                "p99_ms": round(percentile(latencies, 99), 3),
+                "max_ms": round(latencies[-1], 3),
+            }
+        )
+    if sizes:
+        summary["mean_bytes"] = round(sum(sizes) / len(sizes), 1)
+        summary["max_bytes"] = max(sizes)
+    return summary
+
+
+def group(calls):
+    grouped = {}
+    for call in calls:
+        grouped.setdefault(call["tool"], []).append(call)
+    return grouped
+
+
+def load_calls(path):
+    """Calls of a run file (replay output) or a trace file (recorded run)."""
+    with open(path, encoding="utf-8") as f:
+        first = f.readline()
+        try:
+            doc = json.loads(first + f.read())
+        except json.JSONDecodeError:
+            doc = None
+    if isinstance(doc, dict) and doc.get("type") == "run":
+        return doc["calls"]
+    _, events = read_trace(path)
+    return trace_calls(events)
+
+
+def change(base, new):
+    if base in (None, 0) or new is None:
+        return None
+    return round(100.0 * (new - base) / base, 1)
+
+
+def compare(args):
+    base, new = group(load_calls(args.baseline)), group(load_calls(args.candidate))
+    rows, regressions = [], []
+
+    for tool in sorted(set(base) | set(new)):
+        a, b = summarize(base.get(tool, [])), summarize(new.get(tool, []))
+        row = {"tool": tool, "baseline": a, "candidate": b, "change_pct": {}}
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "mean_bytes"):
+            row["change_pct"][metric] = change(a.get(metric), b.get(metric))
+        rows.append(row)
+
+        if min(a["count"], b["count"]) < args.min_count:
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            pct = row["change_pct"][metric]
+            # Ignore sub-millisecond noise
+            grew = (b.get(metric) or 0) - (a.get(metric) or 0)
+            if pct is not None and pct > args.threshold and grew >= args.min_delta_ms:
+                regressions.append(f"{tool} {metric} +{pct}% ({a[metric]} -> {b[metric]} ms)")
+        if b["errors"] > a["errors"]:
+            regressions.append(f"{tool} errors {a['errors']} -> {b['errors']}")
+
+    def fmt(value, suffix=""):
+        return "-" if value is None else f"{value}{suffix}"
+
+    header = f"{'tool':<28} {'n':>5} {'p50 ms':>17} {'p95 ms':>17} {'bytes':>17} {'Δp50':>8} {'Δp95':>8} {'Δbytes':>8}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        a, b, pct = row["baseline"], row["candidate"], row["change_pct"]
+        print(
+            f"{row['tool'][:28]:<28} {b['count']:>5} "
+            f"{fmt(a.get('p50_ms')):>8}→{fmt(b.get('p50_ms')):<8} "
+            f"{fmt(a.get('p95_ms')):>8}→{fmt(b.get('p95_ms')):<8} "
+            f"{fmt(a.get('mean_bytes')):>8}→{fmt(b.get('mean_bytes')):<8} "
+            f"{fmt(pct['p50_ms'], '%'):>8} {fmt(pct['p95_ms'], '%'):>8} {fmt(pct['mean_bytes'], '%'):>8}"
+        )
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold}%:")
+        for line in regressions:
+            print(f"  {line}")
+    else:
+        print(f"\nNo regressions over {args.threshold}%.")
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump({"tools": rows, "regressions": regressions}, f, indent=2)
+            f.write("\n")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    modes = parser.add_subparsers(dest="mode", required=True)
+
+    rec = modes.add_parser("record", help="proxy stdio to the server and write a trace")
+    rec.add_argument("--trace", required=True, help="trace file to write")
+    rec.add_argument("--cmd", default="./diwa.sh start", help="server command (default: %(default)s)")
+    rec.add_argument("--cwd", default=None, help="working directory for the server command")
+
+    rep = modes.add_parser("replay", help="re-issue a trace against a fresh server")
+    rep.add_argument("trace", help="trace file from record mode")
+    rep.add_argument("--cmd", default="./diwa.sh start", help="server command (default: %(default)s)")
+    rep.add_argument("--cwd", default=None, help="working directory for the server command")
+    rep.add_argument("--speed", type=float, default=1.0, help="pacing factor: 1 = original, 4 = 4x faster, 0 = no delays")
+    rep.add_argument("--context-id", default=None, help="send every context_id argument to this context")
+    rep.add_argument("--map", action="append", metavar="OLD=NEW", help="substitute a recorded UUID (repeatable)")
+    rep.add_argument("--timeout", type=float, default=120, help="per-request timeout in seconds")
+    rep.add_argument("--out", default=None, help="write the run (per-call latency and size) to this file")
+    rep.add_argument("--fail-on-error", action="store_true", help="exit 1 if any call failed")
+
+    cmp_ = modes.add_parser("compare", help="diff latency and response sizes of two runs")
+    cmp_.add_argument("baseline", help="trace or run file")
+    cmp_.add_argument("candidate", help="trace or run file")
+    cmp_.add_argument("--threshold", type=float, default=20.0, help="regression threshold in percent")
+    cmp_.add_argument("--min-delta-ms", type=float, default=1.0, help="ignore latency changes smaller than this")
+    cmp_.add_argument("--min-count", type=int, default=1, help="skip tools with fewer calls than this")
+    cmp_.add_argument("--json-out", default=None, help="write the comparison as JSON")
+    cmp_.add_argument("--fail-on-regression", action="store_true", help="exit 1 on any regression")
+
+    args = parser.parse_args()
+    handlers = {"record": record, "replay": replay, "compare": compare}
+    try:
+        sys.exit(handlers[args.mode](args))
+    except KeyboardInterrupt:
+        sys.exit(130)
+
+
+if __name__ == "__main__":
+    main()
@@ -40,7 +40,7 @@ def main():
     
     # Start the server
     proc = subprocess.Popen(
-        ["./koda", "start"],
+        ["./diwa.sh", "start"],
         stdin=subprocess.PIPE,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE
@@ -57,7 +57,7 @@ def main():
             "capabilities": {},
             "clientInfo": {"name": "test-client", "version": "1.0.0"}
         })
-        assert response["result"]["serverInfo"]["name"] == "koda"
+        assert response["result"]["serverInfo"]["name"] == "diwa"
         print("✓ Initialize successful\n")
         
         # Test 2: List tools
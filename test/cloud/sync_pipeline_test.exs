@@ -0,0 +1,197 @@
+defmodule DiwaAgent.Cloud.SyncPipelineTest do
+  use ExUnit.Case, async: false
+  alias DiwaAgent.Cloud.{SyncQueue, SyncWorker}
+  alias DiwaAgent.Repo
+
+  # Minimal stand-in for the cloud API: answers every request with `reply`
+  # and forwards the decoded body to the test process.
+  defmodule StandIn do
+    @moduledoc false
+
+    def start(test_pid, reply) do
+      {:ok, listen} =
+        :gen_tcp.listen(0, [:binary, packet: :http_bin, active: false, reuseaddr: true])
+
+      {:ok, port} = :inet.port(listen)
+      spawn_link(fn -> accept(listen, test_pid, reply) end)
+      "http://127.0.0.1:#{port}/api/v1"
+    end
+
+    defp accept(listen, test_pid, reply) do
+      {:ok, socket} = :gen_tcp.accept(listen)
+      {path, headers} = read_head(socket, nil, %{})
+      length = String.to_integer(Map.get(headers, "content-length", "0"))
+      :ok = :inet.setopts(socket, packet: :raw)
+      {:ok, body} = if length > 0, do: :gen_tcp.recv(socket, length), else: {:ok, ""}
+
+      body = if headers["content-encoding"] == "gzip", do: :zlib.gunzip(body), else: body
+      send(test_pid, {:request, path, headers, Jason.decode!(body)})
+
+      payload = Jason.encode!(reply)
+
+      :gen_tcp.send(socket, [
+        "HTTP/1.1 200 OK\r\ncontent-type: application/json\r\nconnection: close\r\n",
+        "content-length: #{byte_size(payload)}\r\n\r\n",
+        payload
+      ])
+
+      :gen_tcp.close(socket)
+      accept(listen, test_pid, reply)
+    end
+
+    defp read_head(socket, path, headers) do
+      case :gen_tcp.recv(socket, 0) do
+        {:ok, {:http_request, _method, {:abs_path, p}, _version}} ->
+          read_head(socket, p, headers)
+
+        {:ok, {:http_header, _, name, _, value}} ->
+          name = name |> to_string() |> String.downcase()
+          read_head(socket, path, Map.put(headers, name, value))
+
+        {:ok, :http_eoh} ->
+          {path, headers}
+      end
+    end
+  end
+
+  setup do
+    DiwaAgent.TestHelper.setup_test_db()
+    previous_url = System.get_env("DIWA_CLOUD_URL")
+
+    on_exit(fn ->
+      if previous_url,
+        do: System.put_env("DIWA_CLOUD_URL", previous_url),
+        else: System.delete_env("DIWA_CLOUD_URL")
+
+      DiwaAgent.TestHelper.cleanup_test_db(nil)
+    end)
+
+    :ok
+  end
+
+  defp start_worker do
+    {:ok, pid} = GenServer.start_link(SyncWorker, [], name: :sync_pipeline_test_worker)
+    Ecto.Adapters.SQL.Sandbox.allow(Repo, self(), pid)
+    pid
+  end
+
+  defp memory_payload(id, content) do
+    %{id: id, context_id: Ecto.UUID.generate(), content: content}
+  end
+
+  test "pending writes to one record are coalesced on enqueue" do
+    id = Ecto.UUID.generate()
+
+    {:ok, first} = SyncQueue.enqueue("memory", memory_payload(id, "v1"))
+    {:ok, second} = SyncQueue.enqueue("memory", memory_payload(id, "v2"))
+
+    assert first.id == second.id
+    assert %{payload: %{"content" => "v2"}} = Repo.get!(SyncQueue, first.id)
+    assert SyncQueue.depth() == 1
+  end
+
+  test "a write after the entry was claimed gets a row of its own" do
+    id = Ecto.UUID.generate()
+
+    {:ok, claimed} = SyncQueue.enqueue("memory", memory_payload(id, "v1"))
+    assert [%{id: claimed_id}] = SyncQueue.claim_batch(10)
+    assert claimed_id == claimed.id
+
+    {:ok, newer} = SyncQueue.enqueue("memory", memory_payload(id, "v2"))
+
+    assert newer.id != claimed.id
+    assert %{status: "sending", payload: %{"content" => "v1"}} = Repo.get!(SyncQueue, claimed.id)
+    assert %{status: "pending", payload: %{"content" => "v2"}} = Repo.get!(SyncQueue, newer.id)
+  end
+
+  test "a newer write supersedes a failed entry waiting to be retried" do
+    id = Ecto.UUID.generate()
+    {:ok, old} = SyncQueue.enqueue("memory", memory_payload(id, "v1"))
+
+    url = StandIn.start(self(), %{failed: [%{ref: old.id, error: "unavailable"}]})
+    System.put_env("DIWA_CLOUD_URL", url)
+    Application.put_env(:diwa_agent, SyncQueue, retry_base_ms: 60_000)
+    on_exit(fn -> Application.put_env(:diwa_agent, SyncQueue, retry_base_ms: 0) end)
+
+    pid = start_worker()
+    send(pid, :poll)
+    assert_receive {:request, _, _, %{"items" => [_]}}, 2_000
+    _ = :sys.get_state(pid)
+    GenServer.stop(pid)
+    assert Repo.get!(SyncQueue, old.id).status == "failed"
+
+    {:ok, newer} = SyncQueue.enqueue("memory", memory_payload(id, "v2"))
+
+    # Even once the backoff has expired, only the newer payload is due
+    Repo.update_all(SyncQueue, set: [scheduled_at: DateTime.add(DateTime.utc_now(), -1)])
+    assert Repo.get!(SyncQueue, old.id).status == "superseded"
+    assert [%{id: due_id, payload: %{"content" => "v2"}}] = SyncQueue.next_batch(10)
+    assert due_id == newer.id
+  end
+
+  test "a failed upload overtaken by a newer write is not retried" do
+    id = Ecto.UUID.generate()
+    {:ok, old} = SyncQueue.enqueue("memory", memory_payload(id, "v1"))
+    assert [claimed] = SyncQueue.claim_batch(10)
+
+    {:ok, newer} = SyncQueue.enqueue("memory", memory_payload(id, "v2"))
+    SyncQueue.mark_failed(claimed, "timeout")
+
+    assert Repo.get!(SyncQueue, old.id).status == "superseded"
+    assert [%{id: due_id}] = SyncQueue.next_batch(10)
+    assert due_id == newer.id
+  end
+
+  test "due entries are uploaded as one gzip batch" do
+    System.put_env("DIWA_CLOUD_URL", StandIn.start(self(), %{failed: []}))
+
+    ids =
+      for n <- 1..3 do
+        id = Ecto.UUID.generate()
+        {:ok, _} = SyncQueue.enqueue("memory", memory_payload(id, "m#{n}"))
+        id
+      end
+
+    context_id = Ecto.UUID.generate()
+    {:ok, _} = SyncQueue.enqueue("context", %{id: context_id, name: "ctx"})
+
+    pid = start_worker()
+    send(pid, :poll)
+
+    assert_receive {:request, "/api/v1/sync/batch", headers, %{"items" => items}}, 2_000
+    assert headers["content-encoding"] == "gzip"
+    assert length(items) == 4
+    sent = for %{"payload" => %{"id" => id}} <- items, do: id
+    assert Enum.sort(sent) == Enum.sort([context_id | ids])
+    refute_receive {:request, _, _, _}, 100
+
+    _ = :sys.get_state(pid)
+    assert SyncQueue.depth() == 0
+    GenServer.stop(pid)
+  end
+
+  test "entries rejected by the server are rescheduled with backoff" do
+    {:ok, item} = SyncQueue.enqueue("memory", memory_payload(Ecto.UUID.generate(), "bad"))
+    {:ok, good} = SyncQueue.enqueue("memory", memory_payload(Ecto.UUID.generate(), "good"))
+
+    url = StandIn.start(self(), %{failed: [%{ref: item.id, error: "invalid"}]})
+    System.put_env("DIWA_CLOUD_URL", url)
+    Application.put_env(:diwa_agent, SyncQueue, retry_base_ms: 60_000)
+    on_exit(fn -> Application.put_env(:diwa_agent, SyncQueue, retry_base_ms: 0) end)
+
+    pid = start_worker()
+    send(pid, :poll)
+    assert_receive {:request, _, _, %{"items" => [_, _]}}, 2_000
+    _ = :sys.get_state(pid)
+
+    assert Repo.get!(SyncQueue, good.id).status == "completed"
+
+    failed = Repo.get!(SyncQueue, item.id)
+    assert failed.status == "failed"
+    assert failed.attempts == 1
+    assert DateTime.diff(failed.scheduled_at, DateTime.utc_now(), :second) > 30
+    assert SyncQueue.next_batch(10) == []
+
+    GenServer.stop(pid)
+  end
+end
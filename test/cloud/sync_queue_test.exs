@@ -32,7 +32,7 @@ defmodule DiwaAgent.Cloud.SyncQueueIntegrationTest do
 
     # 2. Simulate Offline (failure)
     # We expect one call that fails
-    expect(DiwaAgent.Cloud.ClientMock, :sync_context, fn _ ->
+    expect(DiwaAgent.Cloud.ClientMock, :sync_batch, fn [%{type: "context"}] ->
       {:error, :econnrefused}
     end)
 
@@ -56,7 +56,7 @@ defmodule DiwaAgent.Cloud.SyncQueueIntegrationTest do
 
     # 3. Simulate Online (Recovery)
     # We expect another call that succeeds
-    expect(DiwaAgent.Cloud.ClientMock, :sync_context, fn _ -> :ok end)
+    expect(DiwaAgent.Cloud.ClientMock, :sync_batch, fn [_] -> {:ok, []} end)
 
     # Send poll again (retry)
     send(pid, :poll)
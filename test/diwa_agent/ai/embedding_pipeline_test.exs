@@ -0,0 +1,135 @@
+defmodule DiwaAgent.AI.EmbeddingPipelineTest do
+  use ExUnit.Case, async: false
+  alias DiwaAgent.AI.{EmbeddingCache, EmbeddingPipeline}
+  alias DiwaAgent.AI.Embeddings.Local
+
+  defmodule CountingProvider do
+    @moduledoc false
+    def generate_embeddings(texts) do
+      send(:embedding_pipeline_test, {:batch, length(texts)})
+      Local.generate_embeddings(texts)
+    end
+
+    def generate_embedding(text), do: Local.generate_embedding(text)
+  end
+
+  setup do
+    previous = Application.get_env(:diwa_agent, :embedding_provider)
+    Application.put_env(:diwa_agent, :embedding_provider, CountingProvider)
+    Process.register(self(), :embedding_pipeline_test)
+
+    on_exit(fn ->
+      if previous,
+        do: Application.put_env(:diwa_agent, :embedding_provider, previous),
+        else: Application.delete_env(:diwa_agent, :embedding_provider)
+    end)
+
+    :ok
+  end
+
+  defp unique(text), do: "#{text} #{System.unique_integer([:positive])}"
+
+  test "local provider is deterministic and lexical" do
+    {:ok, a} = Local.generate_embedding("deploy the sqlite index")
+    {:ok, b} = Local.generate_embedding("deploy the sqlite index")
+    {:ok, c} = Local.generate_embedding("quarterly revenue forecast")
+
+    assert a == b
+    assert length(a) == Local.dimensions()
+
+    dot = fn x, y -> Enum.zip_with(x, y, &(&1 * &2)) |> Enum.sum() end
+    assert dot.(a, b) > dot.(a, c)
+  end
+
+  test "concurrent requests are micro-batched" do
+    texts = for i <- 1..10, do: unique("batched text #{i}")
+
+    results =
+      texts
+      |> Enum.map(&Task.async(fn -> EmbeddingPipeline.generate_embedding(&1) end))
+      |> Enum.map(&Task.await/1)
+
+    assert Enum.all?(results, &match?({:ok, [_ | _]}, &1))
+
+    sizes = collect_batches([])
+    assert Enum.sum(sizes) == 10
+    assert Enum.any?(sizes, &(&1 > 1))
+  end
+
+  test "repeated text is served from the cache" do
+    text = unique("cached text")
+
+    {:ok, first} = EmbeddingPipeline.generate_embedding(text)
+    assert_receive {:batch, 1}
+
+    {:ok, second} = EmbeddingPipeline.generate_embedding(text)
+    refute_receive {:batch, _}, 50
+
+    assert first == second
+    assert {:ok, ^first} = EmbeddingCache.get(EmbeddingCache.key(CountingProvider, text))
+  end
+
+  test "batch API preserves input order" do
+    texts = [unique("alpha"), unique("beta"), unique("gamma")]
+    {:ok, vectors} = EmbeddingPipeline.generate_embeddings(texts)
+
+    assert vectors == Enum.map(texts, fn t -> elem(Local.generate_embedding(t), 1) end)
+  end
+
+  test "enqueue delivers the vector to the callback" do
+    parent = self()
+    assert :ok = EmbeddingPipeline.enqueue(unique("async"), &send(parent, {:embedded, &1}))
+    assert_receive {:embedded, {:ok, [_ | _]}}, 1_000
+  end
+
+  test "enqueue waits for room instead of dropping texts when the queue is full" do
+    {:ok, pid} =
+      GenServer.start_link(EmbeddingPipeline,
+        max_queue: 1,
+        batch_size: 1,
+        max_concurrency: 1,
+        max_wait_ms: 1
+      )
+
+    parent = self()
+
+    callers =
+      for i <- 1..5 do
+        text = unique("held #{i}")
+        key = EmbeddingCache.key(CountingProvider, text)
+        request = {:enqueue, key, text, &send(parent, {:embedded, &1})}
+        Task.async(fn -> GenServer.call(pid, request) end)
+      end
+
+    assert Enum.map(callers, &Task.await/1) == List.duplicate(:ok, 5)
+
+    for _ <- 1..5, do: assert_receive({:embedded, {:ok, [_ | _]}}, 1_000)
+    assert %{queue_depth: 0, blocked: 0} = GenServer.call(pid, :stats)
+  end
+
+  test "cache evicts the least recently used entry" do
+    previous = Application.get_env(:diwa_agent, EmbeddingCache)
+    Application.put_env(:diwa_agent, EmbeddingCache, max_entries: 2)
+
+    on_exit(fn -> Application.put_env(:diwa_agent, EmbeddingCache, previous || []) end)
+
+    EmbeddingCache.clear()
+    EmbeddingCache.put(:a, [1.0])
+    EmbeddingCache.put(:b, [2.0])
+    assert {:ok, [1.0]} = EmbeddingCache.get(:a)
+
+    EmbeddingCache.put(:c, [3.0])
+
+    assert {:ok, [1.0]} = EmbeddingCache.get(:a)
+    assert :miss = EmbeddingCache.get(:b)
+    assert {:ok, [3.0]} = EmbeddingCache.get(:c)
+  end
+
+  defp collect_batches(acc) do
+    receive do
+      {:batch, n} -> collect_batches([n | acc])
+    after
+      100 -> acc
+    end
+  end
+end
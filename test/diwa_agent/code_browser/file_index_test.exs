@@ -0,0 +1,60 @@
+defmodule DiwaAgent.CodeBrowser.FileIndexTest do
+  use ExUnit.Case, async: false
+  alias DiwaAgent.CodeBrowser.FileIndex
+
+  setup do
+    root = Path.join(System.tmp_dir!(), "diwa_index_#{System.unique_integer([:positive])}")
+    File.mkdir_p!(Path.join(root, "lib"))
+    File.mkdir_p!(Path.join(root, "node_modules"))
+    File.write!(Path.join(root, "lib/alpha.ex"), "defmodule Alpha do\n  def hello, do: 1\nend\n")
+    File.write!(Path.join(root, "README.md"), "# Project\r\nNotes\r\n")
+    File.write!(Path.join(root, "node_modules/skip.js"), "ignored")
+
+    previous = Application.get_env(:diwa_agent, FileIndex)
+    Application.put_env(:diwa_agent, FileIndex, refresh_ms: 0, trigrams: true)
+
+    on_exit(fn ->
+      if previous,
+        do: Application.put_env(:diwa_agent, FileIndex, previous),
+        else: Application.delete_env(:diwa_agent, FileIndex)
+
+      FileIndex.invalidate(root)
+      File.rm_rf!(root)
+    end)
+
+    %{root: root}
+  end
+
+  test "lists a directory without ignored entries", %{root: root} do
+    assert {:ok, entries} = FileIndex.list_dir(root)
+    assert Enum.sort(entries) == [{"README.md", :file}, {"lib", :directory}]
+    assert {:error, :not_a_directory} = FileIndex.list_dir(Path.join(root, "README.md"))
+  end
+
+  test "indexes files and picks up changes", %{root: root} do
+    assert [{"README.md", _, _}, {"lib/alpha.ex", _, _}] = FileIndex.files(root)
+
+    File.write!(Path.join(root, "lib/beta.ex"), "defmodule Beta do\nend\n")
+    File.rm!(Path.join(root, "README.md"))
+
+    assert ["lib/alpha.ex", "lib/beta.ex"] = Enum.map(FileIndex.files(root), &elem(&1, 0))
+  end
+
+  test "counts lines like splitting the content", %{root: root} do
+    for name <- ["lib/alpha.ex", "README.md"] do
+      path = Path.join(root, name)
+      expected = path |> File.read!() |> String.split(["\n", "\r\n"]) |> length()
+      assert FileIndex.line_count(path) == {:ok, expected}
+    end
+  end
+
+  test "trigram postings narrow candidate files", %{root: root} do
+    assert FileIndex.candidates(root, "HELLO") == MapSet.new(["lib/alpha.ex"])
+    assert FileIndex.candidates(root, "nowhere") == MapSet.new()
+    assert FileIndex.candidates(root, "ab") == :all
+
+    File.write!(Path.join(root, "README.md"), "hello again\n")
+
+    assert FileIndex.candidates(root, "hello") == MapSet.new(["README.md", "lib/alpha.ex"])
+  end
+end
@@ -31,4 +31,40 @@ defmodule DiwaAgent.CodeBrowserTest do
   test "read_file/2 rejects invalid path" do
     assert {:error, :enoent} = CodeBrowser.read_file(@root_path, "nonexistent.txt")
   end
+
+  test "search_code/3 pages through matches" do
+    # Matches CodeBrowser and CodeBrowser.FileIndex
+    opts = [file_pattern: "*.ex", limit: 1]
+    {:ok, first} = CodeBrowser.search_code(@root_path, "defmodule DiwaAgent.CodeBrowser", opts)
+    assert length(first.matches) == 1
+    assert first.next_offset == 1
+
+    {:ok, second} =
+      CodeBrowser.search_code(
+        @root_path,
+        "defmodule DiwaAgent.CodeBrowser",
+        Keyword.put(opts, :offset, first.next_offset)
+      )
+
+    assert second.matches != []
+    assert Enum.all?(first.matches ++ second.matches, &String.ends_with?(&1.path, ".ex"))
+    assert MapSet.disjoint?(MapSet.new(first.matches), MapSet.new(second.matches))
+  end
+
+  test "search_code/3 falls back to the file index" do
+    {:ok, result} =
+      CodeBrowser.search_code(@root_path, "defmodule DiwaAgent.MixProject",
+        file_pattern: "mix.exs",
+        engine: :index
+      )
+
+    assert result.engine == :index
+    assert [%{path: "mix.exs", line: 1, column: 0}] = result.matches
+    assert result.next_offset == nil
+  end
+
+  test "search_code/3 rejects an invalid pattern in the fallback" do
+    assert {:error, {:invalid_pattern, _}} =
+             CodeBrowser.search_code(@root_path, "(unclosed", engine: :index)
+  end
 end
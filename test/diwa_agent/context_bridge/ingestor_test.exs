@@ -0,0 +1,97 @@
+defmodule DiwaAgent.ContextBridge.IngestorTest do
+  use ExUnit.Case, async: false
+  alias DiwaAgent.ContextBridge.Ingestor
+  alias DiwaAgent.Storage.{Context, Memory}
+  import DiwaAgent.TestHelper
+
+  setup do
+    db_path = setup_test_db()
+    start_database()
+
+    {:ok, context} = Context.create("Ingest Context", "For ingestor tests")
+
+    root = Path.join(System.tmp_dir!(), "diwa_ingest_#{System.unique_integer([:positive])}")
+    File.mkdir_p!(Path.join(root, "guides"))
+    File.mkdir_p!(Path.join(root, "node_modules"))
+    File.write!(Path.join(root, "rules.md"), "# Rules\nAlways run the tests.")
+    File.write!(Path.join(root, "guides/deploy.md"), "# Deploy\nUse the release task.")
+    File.write!(Path.join(root, "node_modules/vendor.md"), "ignored")
+    File.write!(Path.join(root, "notes.txt"), "not markdown")
+
+    on_exit(fn ->
+      File.rm_rf!(root)
+      cleanup_test_db(db_path)
+    end)
+
+    {:ok, context: context, root: root}
+  end
+
+  test "ingests recursively and skips unchanged files", %{context: context, root: root} do
+    assert {:ok, first} = Ingestor.run(context.id, dirs: [root])
+    assert first.created == 2
+    assert first.files == 2
+
+    assert {:ok, second} = Ingestor.run(context.id, dirs: [root])
+    assert second.created == 0
+    assert second.skipped == 2
+    assert second.bytes_read == 0
+  end
+
+  test "updates changed files and retires removed ones", %{context: context, root: root} do
+    {:ok, _} = Ingestor.run(context.id, dirs: [root])
+    {:ok, memories} = Memory.list(context.id)
+    rules = Enum.find(memories, &(&1.content =~ "Rules"))
+    deploy = Enum.find(memories, &(&1.content =~ "Deploy"))
+
+    rules_path = Path.join(root, "rules.md")
+    File.write!(rules_path, "# Rules\nAlways run the tests. Twice.")
+    File.touch!(rules_path, System.os_time(:second) + 5)
+    File.rm!(Path.join(root, "guides/deploy.md"))
+
+    assert {:ok, stats} = Ingestor.run(context.id, dirs: [root])
+    assert stats.updated == 1
+    assert stats.deleted == 1
+
+    assert {:ok, updated} = Memory.get(rules.id)
+    assert updated.content =~ "Twice."
+    assert {:ok, %{deleted_at: deleted_at}} = Memory.get(deploy.id)
+    assert deleted_at != nil
+  end
+
+  test "a root that cannot be listed retires nothing", %{context: context, root: root} do
+    {:ok, first} = Ingestor.run(context.id, dirs: [root])
+    assert first.created == 2
+
+    moved = root <> "_moved"
+    File.rename!(root, moved)
+    on_exit(fn -> File.rm_rf!(moved) end)
+
+    assert {:ok, stats} = Ingestor.run(context.id, dirs: [root])
+    assert stats.deleted == 0
+    assert stats.unlisted_dirs == [root]
+
+    assert {:ok, memories} = Memory.list(context.id)
+    assert length(memories) == 2
+  end
+
+  test "never updates or deletes a memory it did not create", %{context: context, root: root} do
+    {:ok, own} = Memory.add(context.id, "# Shared\nWritten by hand.")
+    shared_path = Path.join(root, "shared.md")
+    File.write!(shared_path, "# Shared\nWritten by hand.")
+
+    assert {:ok, first} = Ingestor.run(context.id, dirs: [root])
+    assert first.created == 2
+    assert first.skipped == 1
+
+    File.write!(shared_path, "# Shared\nRewritten in the file.")
+    File.touch!(shared_path, System.os_time(:second) + 5)
+    assert {:ok, second} = Ingestor.run(context.id, dirs: [root])
+    assert second.created == 1
+    assert second.updated == 0
+
+    File.rm!(shared_path)
+    assert {:ok, _third} = Ingestor.run(context.id, dirs: [root])
+
+    assert {:ok, %{content: "# Shared\nWritten by hand.", deleted_at: nil}} = Memory.get(own.id)
+  end
+end
@@ -0,0 +1,64 @@
+defmodule DiwaAgent.ContextBridge.MemoryLifecycleTest do
+  use ExUnit.Case, async: false
+  alias DiwaAgent.ContextBridge.{AccessTracker, MemoryLifecycle}
+  alias DiwaAgent.Repo
+  alias DiwaAgent.Storage.{Context, Memory}
+  import DiwaAgent.TestHelper
+  import Ecto.Query
+
+  setup do
+    db_path = setup_test_db()
+    start_database()
+    Ecto.Adapters.SQL.Sandbox.allow(Repo, self(), Process.whereis(AccessTracker))
+
+    {:ok, context} = Context.create("Lifecycle Context", "For lifecycle tests")
+
+    on_exit(fn -> cleanup_test_db(db_path) end)
+
+    {:ok, context: context}
+  end
+
+  test "accesses are counted in memory and applied by a flush", %{context: context} do
+    {:ok, memory} = Memory.add(context.id, "Frequently read note", %{lifecycle: "ephemeral"})
+    {:ok, other} = Memory.add(context.id, "Read once", %{lifecycle: "ephemeral"})
+
+    for _ <- 1..11, do: MemoryLifecycle.increment_access(memory.id)
+    MemoryLifecycle.increment_access([other.id])
+
+    # Nothing written yet
+    assert Repo.get(DiwaSchema.Core.Memory, memory.id).last_accessed_at == nil
+
+    assert {:ok, 2} = AccessTracker.flush()
+
+    read = Repo.get(DiwaSchema.Core.Memory, memory.id)
+    assert read.occurrence_count == 11
+    assert read.lifecycle == "project"
+    assert read.last_accessed_at
+
+    once = Repo.get(DiwaSchema.Core.Memory, other.id)
+    assert once.occurrence_count == 1
+    assert once.lifecycle == "ephemeral"
+
+    assert {:ok, 0} = AccessTracker.flush()
+  end
+
+  test "prunes expired memories in chunks", %{context: context} do
+    past = DateTime.utc_now() |> DateTime.add(-3600, :second) |> DateTime.truncate(:second)
+
+    expired =
+      for n <- 1..5 do
+        {:ok, memory} = Memory.add(context.id, "Expired #{n}", nil)
+        memory
+      end
+
+    ids = Enum.map(expired, & &1.id)
+    query = from(m in DiwaSchema.Core.Memory, where: m.id in ^ids)
+    {5, _} = Repo.update_all(query, set: [expires_at: past])
+
+    {:ok, kept} = Memory.add(context.id, "Still valid", nil)
+
+    assert {:ok, 5} = MemoryLifecycle.prune_expired(chunk_size: 2)
+    assert Enum.all?(expired, &Repo.get(DiwaSchema.Core.Memory, &1.id).deleted_at)
+    refute Repo.get(DiwaSchema.Core.Memory, kept.id).deleted_at
+  end
+end
@@ -0,0 +1,51 @@
+defmodule DiwaAgent.Delegation.BrokerTest do
+  use ExUnit.Case, async: false
+  alias DiwaAgent.Delegation.{Broker, Handoff}
+
+  setup do
+    %{agent_id: "agent-#{System.unique_integer([:positive])}"}
+  end
+
+  defp handoff(agent_id, task) do
+    Handoff.new(%{delegation_type: "agent", to_agent_id: agent_id, task_definition: task})
+  end
+
+  test "a plain poll returns queued tasks in order", %{agent_id: agent_id} do
+    assert {:ok, []} = Broker.poll(agent_id)
+
+    {:ok, first, ^agent_id} = Broker.delegate(handoff(agent_id, "first"))
+    {:ok, _second, ^agent_id} = Broker.delegate(handoff(agent_id, "second"))
+
+    assert {:ok, [%{task_definition: "first", active_files: [^first]}]} = Broker.poll(agent_id)
+    assert {:ok, [%{task_definition: "second"}]} = Broker.poll(agent_id, timeout: 1_000)
+  end
+
+  test "a long poll is answered when a task arrives", %{agent_id: agent_id} do
+    poll = Task.async(fn -> Broker.poll(agent_id, timeout: 5_000) end)
+    # Let the poll park before delegating
+    Process.sleep(50)
+
+    {:ok, ref, ^agent_id} = Broker.delegate(handoff(agent_id, "pushed"))
+
+    assert {:ok, [%{task_definition: "pushed", active_files: [^ref]}]} = Task.await(poll, 1_000)
+    assert {:ok, []} = Broker.poll(agent_id)
+  end
+
+  test "a long poll returns empty after its timeout", %{agent_id: agent_id} do
+    started = System.monotonic_time(:millisecond)
+    assert {:ok, []} = Broker.poll(agent_id, timeout: 100)
+    assert System.monotonic_time(:millisecond) - started >= 100
+  end
+
+  test "a newer poll releases the parked one", %{agent_id: agent_id} do
+    parked = Task.async(fn -> Broker.poll(agent_id, timeout: 5_000) end)
+    Process.sleep(50)
+
+    newer = Task.async(fn -> Broker.poll(agent_id, timeout: 5_000) end)
+    assert {:ok, []} = Task.await(parked, 1_000)
+
+    Process.sleep(50)
+    {:ok, _ref, ^agent_id} = Broker.delegate(handoff(agent_id, "latest"))
+    assert {:ok, [%{task_definition: "latest"}]} = Task.await(newer, 1_000)
+  end
+end
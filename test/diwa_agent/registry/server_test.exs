@@ -0,0 +1,56 @@
+defmodule DiwaAgent.Registry.ServerTest do
+  use ExUnit.Case, async: false
+  alias DiwaAgent.Registry.Server
+
+  setup do
+    %{cap: "cap_#{System.unique_integer([:positive])}"}
+  end
+
+  test "matches agents holding all required capabilities", %{cap: cap} do
+    {:ok, both} = Server.register(name: "both", role: :coder, capabilities: [cap, "#{cap}_db"])
+    {:ok, one} = Server.register(name: "one", role: :coder, capabilities: [cap])
+
+    assert Enum.map(Server.find_by_capabilities([cap]), & &1.id) == Enum.sort([both.id, one.id])
+    assert [%{id: id}] = Server.find_by_capabilities([cap, "#{cap}_db"])
+    assert id == both.id
+    assert Server.find_by_capabilities(["#{cap}_missing", cap]) == []
+  end
+
+  test "re-registering replaces the capability index entries", %{cap: cap} do
+    {:ok, agent} = Server.register(name: "a", role: :qa, capabilities: [cap])
+    {:ok, _} = Server.register(id: agent.id, name: "a", role: :qa, capabilities: ["#{cap}_new"])
+
+    assert Server.find_by_capabilities([cap]) == []
+    assert [%{id: id}] = Server.find_by_capabilities(["#{cap}_new"])
+    assert id == agent.id
+  end
+
+  test "finds idle agents through the role/status index", %{cap: cap} do
+    role = String.to_atom(cap)
+    {:ok, agent} = Server.register(name: "idle", role: role, capabilities: [])
+
+    assert Server.find_idle_agent(role).id == agent.id
+
+    assert :ok = Server.update_status(agent.id, :busy, nil)
+    assert Server.find_idle_agent(role) == nil
+    assert Server.get_agent(agent.id).status == :busy
+
+    assert :ok = Server.update_status(agent.id, :idle, nil)
+    assert Server.find_idle_agent(role).id == agent.id
+    assert {:error, :not_found} = Server.update_status("unknown-#{cap}", :idle)
+  end
+
+  test "heartbeats keep the agent matchable", %{cap: cap} do
+    {:ok, agent} = Server.register(name: "hb", role: :coder, capabilities: [cap])
+
+    Server.heartbeat(agent.id)
+    # Wait for the cast to be handled
+    :sys.get_state(Server)
+
+    beat = Server.get_agent(agent.id).last_heartbeat
+    assert DateTime.compare(beat, agent.last_heartbeat) != :lt
+
+    assert [%{id: id}] = Server.find_by_capabilities([cap])
+    assert id == agent.id
+  end
+end
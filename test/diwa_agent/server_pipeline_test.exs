@@ -0,0 +1,178 @@
+defmodule DiwaAgent.Server.PipelineTest do
+  use ExUnit.Case, async: false
+  alias DiwaAgent.Server
+
+  setup do
+    server =
+      start_supervised!(
+        Supervisor.child_spec({Server, name: :pipeline_test_server, max_in_flight: 1},
+          id: :pipeline_test_server
+        )
+      )
+
+    {:ok, server: server}
+  end
+
+  defp tool_call(id, name) do
+    Jason.encode!(%{
+      "jsonrpc" => "2.0",
+      "id" => id,
+      "method" => "tools/call",
+      "params" => %{"name" => name, "arguments" => %{}}
+    })
+  end
+
+  defp cancel(id) do
+    Jason.encode!(%{
+      "jsonrpc" => "2.0",
+      "method" => "notifications/cancelled",
+      "params" => %{"requestId" => id}
+    })
+  end
+
+  test "submit delivers each response to the caller", %{server: server} do
+    for id <- 1..3, do: Server.submit(server, tool_call(id, "no_such_tool"), self())
+
+    ids =
+      for _ <- 1..3 do
+        assert_receive {:diwa_response, %{"id" => id, "result" => result}}, 1_000
+        assert result["isError"] == true
+        id
+      end
+
+    assert Enum.sort(ids) == [1, 2, 3]
+  end
+
+  test "handle_message still returns the tool response synchronously", %{server: server} do
+    {:ok, response} = Server.handle_message(server, tool_call(7, "no_such_tool"))
+
+    assert response["id"] == 7
+    assert hd(response["result"]["content"])["text"] =~ "Unknown tool"
+  end
+
+  test "cancelling a queued request suppresses its response", %{server: server} do
+    # Suspend the server so all three messages are queued before any task finishes
+    :sys.suspend(server)
+    Server.submit(server, tool_call(1, "no_such_tool"), self())
+    Server.submit(server, tool_call(2, "no_such_tool"), self())
+    Server.submit(server, cancel(2), self())
+    :sys.resume(server)
+
+    assert_receive {:diwa_response, %{"id" => 1}}, 1_000
+    assert :ok = Server.await_idle(server, 1_000)
+    refute_received {:diwa_response, %{"id" => 2}}
+  end
+
+  # Tool calls named in `names` report their task pid and then hang
+  defp block_probe_calls(names \\ ["blocking_probe"]) do
+    test_pid = self()
+    handler = "pipeline-test-#{System.unique_integer([:positive])}"
+
+    :telemetry.attach(
+      handler,
+      [:diwa_agent, :tool, :execute, :start],
+      fn _event, _measurements, %{tool_name: name}, _config ->
+        if name in names do
+          send(test_pid, {:running, self()})
+          Process.sleep(:infinity)
+        end
+      end,
+      nil
+    )
+
+    on_exit(fn -> :telemetry.detach(handler) end)
+  end
+
+  test "cancelling a running request terminates its task", %{server: server} do
+    block_probe_calls()
+    Server.submit(server, tool_call(1, "blocking_probe"), self())
+    assert_receive {:running, task}, 1_000
+    ref = Process.monitor(task)
+
+    Server.submit(server, cancel(1), self())
+
+    assert_receive {:DOWN, ^ref, :process, ^task, _reason}, 1_000
+    assert :ok = Server.await_idle(server, 1_000)
+    refute_received {:diwa_response, %{"id" => 1}}
+  end
+
+  test "calls beyond max_pending are rejected as busy" do
+    block_probe_calls()
+
+    server =
+      start_supervised!(
+        Supervisor.child_spec(
+          {Server, name: :pipeline_test_bounded, max_in_flight: 1, max_pending: 1},
+          id: :pipeline_test_bounded
+        )
+      )
+
+    Server.submit(server, tool_call(1, "blocking_probe"), self())
+    assert_receive {:running, _task}, 1_000
+    Server.submit(server, tool_call(2, "no_such_tool"), self())
+    Server.submit(server, tool_call(3, "no_such_tool"), self())
+
+    assert_receive {:diwa_response, %{"id" => 3, "error" => %{"code" => -32000}}}, 1_000
+
+    # Freeing the slot lets the queued call through
+    Server.submit(server, cancel(1), self())
+    assert_receive {:diwa_response, %{"id" => 2, "result" => _}}, 1_000
+  end
+
+  test "long polls do not take the in-flight slots" do
+    previous = Application.get_env(:diwa_agent, :edition)
+    Application.put_env(:diwa_agent, :edition, "enterprise")
+
+    on_exit(fn ->
+      if previous,
+        do: Application.put_env(:diwa_agent, :edition, previous),
+        else: Application.delete_env(:diwa_agent, :edition)
+    end)
+
+    block_probe_calls(["poll_delegated_tasks"])
+
+    server =
+      start_supervised!(
+        Supervisor.child_spec(
+          {Server,
+           name: :pipeline_test_polls, max_in_flight: 1, max_pending: 0, max_parked_polls: 1},
+          id: :pipeline_test_polls
+        )
+      )
+
+    poll = fn id ->
+      Jason.encode!(%{
+        "jsonrpc" => "2.0",
+        "id" => id,
+        "method" => "tools/call",
+        "params" => %{
+          "name" => "poll_delegated_tasks",
+          "arguments" => %{"agent_id" => "worker", "wait_ms" => 30_000}
+        }
+      })
+    end
+
+    Server.submit(server, poll.(1), self())
+    assert_receive {:running, _task}, 1_000
+
+    # The parked poll leaves the only slot to an ordinary call
+    Server.submit(server, tool_call(2, "no_such_tool"), self())
+    assert_receive {:diwa_response, %{"id" => 2, "result" => _}}, 1_000
+
+    # A second long poll is over the cap and takes the ordinary slot
+    Server.submit(server, poll.(3), self())
+    assert_receive {:running, _task}, 1_000
+    assert %{parked: 1, in_flight: in_flight} = :sys.get_state(server)
+    assert map_size(in_flight) == 2
+
+    Server.submit(server, cancel(1), self())
+    Server.submit(server, cancel(3), self())
+    assert :ok = Server.await_idle(server, 1_000)
+  end
+
+  test "parse errors are reported without a request id", %{server: server} do
+    Server.submit(server, "{not json", self())
+
+    assert_receive {:diwa_response, %{"id" => nil, "error" => %{"code" => -32700}}}, 1_000
+  end
+end
@@ -0,0 +1,44 @@
+defmodule DiwaAgent.StartupTest do
+  use ExUnit.Case, async: false
+  alias DiwaAgent.{Lazy, Server, Startup}
+  import DiwaAgent.TestHelper
+
+  test "tools/list serves the pre-encoded catalogue" do
+    server =
+      start_supervised!(
+        Supervisor.child_spec({Server, name: :startup_test_server}, id: :startup_test_server)
+      )
+
+    message = Jason.encode!(%{"jsonrpc" => "2.0", "id" => 7, "method" => "tools/list"})
+    {:ok, response} = Server.handle_message(server, message)
+
+    assert %{"id" => 7, "result" => %{"tools" => tools}} =
+             response |> Jason.encode!() |> Jason.decode!()
+
+    expected = DiwaAgent.Tools.Definitions.all_tools() |> Jason.encode!() |> Jason.decode!()
+    assert tools == expected
+  end
+
+  test "migrator reports an up-to-date schema" do
+    db_path = setup_test_db()
+    on_exit(fn -> cleanup_test_db(db_path) end)
+
+    assert Startup.Migrator.current?(DiwaAgent.Repo)
+  end
+
+  test "lazy workers start on first use" do
+    previous = Application.get_env(:diwa_agent, :fast_start)
+    Application.put_env(:diwa_agent, :fast_start, true)
+    on_exit(fn -> Application.put_env(:diwa_agent, :fast_start, previous) end)
+
+    pid = Lazy.server(DiwaAgent.Delegation.Broker)
+    assert Process.whereis(DiwaAgent.Delegation.Broker) == pid
+    assert Lazy.server(DiwaAgent.Delegation.Broker) == pid
+  end
+
+  test "measure/2 records phases in order" do
+    assert Startup.measure(:startup_test_phase, fn -> :done end) == :done
+    assert {:startup_test_phase, ms} = List.last(Startup.report())
+    assert ms >= 0
+  end
+end
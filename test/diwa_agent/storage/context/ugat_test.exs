@@ -161,5 +161,29 @@ defmodule DiwaAgent.Storage.Context.UgatTest do
       assert String.contains?(graph, "Grandchild")
       assert String.contains?(graph, "-->")
     end
+
+    test "get_context_graph/2 respects the depth limit", %{a: a} do
+      {:ok, shallow} = Ugat.get_context_graph(a.id, depth: 1, format: :list)
+      assert shallow.nodes == ["Child", "Root"]
+      assert shallow.relationships == ["Root -- depends_on --> Child"]
+
+      {:ok, deep} = Ugat.get_context_graph(a.id, depth: 3, format: :list)
+      assert deep.nodes == ["Child", "Grandchild", "Root"]
+      assert length(deep.relationships) == 2
+    end
+
+    test "circular dependencies are rejected", %{a: a, c: c} do
+      assert {:error, :circular_dependency_detected} = Ugat.link_contexts(c.id, a.id, "depends_on")
+      # Non-dependency links may close a loop
+      assert {:ok, _} = Ugat.link_contexts(c.id, a.id, "complements")
+
+      {:ok, graph} = Ugat.get_context_graph(a.id, depth: 10, format: :list)
+      assert length(graph.relationships) == 3
+    end
+
+    test "analyze_impact/1 lists transitive dependents", %{a: a, b: b, c: c} do
+      ids = c.id |> Ugat.analyze_impact() |> Enum.map(& &1.id) |> Enum.sort()
+      assert ids == Enum.sort([a.id, b.id])
+    end
   end
 end
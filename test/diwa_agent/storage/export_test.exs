@@ -0,0 +1,102 @@
+defmodule DiwaAgent.Storage.ExportTest do
+  use ExUnit.Case, async: false
+  alias DiwaAgent.Repo
+  alias DiwaAgent.Storage.{Context, Export, Memory}
+  import DiwaAgent.TestHelper
+
+  setup do
+    db_path = setup_test_db()
+    start_database()
+
+    {:ok, context} = Context.create("Export Context", "For export tests")
+    path = Path.join(System.tmp_dir!(), "diwa_export_#{System.unique_integer([:positive])}")
+
+    on_exit(fn ->
+      File.rm(path)
+      cleanup_test_db(db_path)
+    end)
+
+    {:ok, context: context, path: path}
+  end
+
+  defp read_lines(path) do
+    path
+    |> File.read!()
+    |> :zlib.gunzip()
+    |> String.split("\n", trim: true)
+    |> Enum.map(&Jason.decode!/1)
+  end
+
+  test "writes gzip NDJSON with header, rows and footer", %{context: context, path: path} do
+    {:ok, _} = Memory.add(context.id, "First")
+    {:ok, _} = Memory.add(context.id, "Second")
+
+    assert {:ok, %{counts: counts}} = Export.export(path, context_ids: [context.id])
+    assert counts["memories"] == 2
+    assert counts["contexts"] == 1
+
+    [header | rest] = read_lines(path)
+    footer = List.last(rest)
+
+    assert header["type"] == "header"
+    assert footer["type"] == "footer"
+    assert footer["counts"]["memories"] == 2
+
+    contents = for %{"table" => "memories", "row" => row} <- rest, do: row["content"]
+    assert Enum.sort(contents) == ["First", "Second"]
+  end
+
+  test "incremental export only includes rows changed since the watermark", %{
+    context: context,
+    path: path
+  } do
+    {:ok, memory} = Memory.add(context.id, "Original")
+    {:ok, %{watermark: watermark}} = Export.export(path, context_ids: [context.id])
+
+    {:ok, %{counts: counts}} = Export.export(path, context_ids: [context.id], since: watermark)
+    assert counts["memories"] == 0
+
+    Process.sleep(1_100)
+    {:ok, _} = Memory.update(memory.id, "Edited")
+
+    {:ok, %{counts: counts}} = Export.export(path, context_ids: [context.id], since: watermark)
+    assert counts["memories"] == 1
+  end
+
+  test "import_file upserts exported rows", %{context: context, path: path} do
+    {:ok, kept} = Memory.add(context.id, "Keep me")
+    {:ok, lost} = Memory.add(context.id, "Restore me")
+    {:ok, _} = Export.export(path, context_ids: [context.id])
+
+    Repo.delete!(Repo.get!(DiwaSchema.Core.Memory, lost.id))
+    {:ok, _} = Memory.update(kept.id, "Changed after export")
+
+    assert {:ok, %{"memories" => 2, "contexts" => 1}} = Export.import_file(path)
+    assert {:ok, %{content: "Restore me"}} = Memory.get(lost.id)
+    assert {:ok, %{content: "Keep me"}} = Memory.get(kept.id)
+  end
+
+  test "imported memories are queued for embedding", %{context: context, path: path} do
+    {:ok, memory} = Memory.add(context.id, "Embed me again")
+    {:ok, _} = Export.export(path, context_ids: [context.id])
+
+    Repo.delete!(Repo.get!(DiwaSchema.Core.Memory, memory.id))
+    :ets.delete(:diwa_agent_fake_vector_repo, memory.id)
+
+    assert {:ok, %{"memories" => 1}} = Export.import_file(path)
+    assert wait_for_embedding(memory.id, 50)
+  end
+
+  defp wait_for_embedding(_id, 0), do: false
+
+  defp wait_for_embedding(id, tries) do
+    case :ets.lookup(:diwa_agent_fake_vector_repo, id) do
+      [{^id, [_ | _]}] ->
+        true
+
+      [] ->
+        Process.sleep(20)
+        wait_for_embedding(id, tries - 1)
+    end
+  end
+end
@@ -0,0 +1,89 @@
+defmodule DiwaAgent.Storage.FullTextIndexTest do
+  use ExUnit.Case, async: false
+  alias DiwaAgent.Storage.{Context, FullTextIndex, Memory}
+  import DiwaAgent.TestHelper
+
+  setup do
+    db_path = setup_test_db()
+    start_database()
+
+    {:ok, context} = Context.create("FTS Context", "For full-text tests")
+
+    on_exit(fn -> cleanup_test_db(db_path) end)
+
+    {:ok, context: context}
+  end
+
+  test "ranks memories matching every term", %{context: context} do
+    {:ok, both} = Memory.add(context.id, "Phoenix uses Ecto for databases", nil)
+    {:ok, _one} = Memory.add(context.id, "Phoenix LiveView is awesome", nil)
+
+    assert {:ok, [hit]} = FullTextIndex.search("phoenix database", context_id: context.id)
+    assert hit.memory.id == both.id
+    assert hit.snippet =~ "[Phoenix]"
+    assert is_float(hit.rank)
+  end
+
+  test "follows content updates, soft deletes and restores", %{context: context} do
+    {:ok, memory} = Memory.add(context.id, "Initial draft about caching", nil)
+
+    {:ok, _} = Memory.update(memory.id, "Rewritten note about sharding")
+    assert {:ok, []} = FullTextIndex.search("caching", context_id: context.id)
+    assert {:ok, [_]} = FullTextIndex.search("sharding", context_id: context.id)
+
+    {:ok, _} = Memory.delete(memory.id)
+    assert {:ok, []} = FullTextIndex.search("sharding", context_id: context.id)
+
+    {:ok, _} = Memory.restore(memory.id)
+    assert {:ok, [_]} = FullTextIndex.search("sharding", context_id: context.id)
+  end
+
+  test "paginates ranked results", %{context: context} do
+    for i <- 1..5, do: Memory.add(context.id, "Deployment note #{i}", nil)
+
+    {:ok, page1} = Memory.search_text("deployment", context.id, limit: 3)
+    {:ok, page2} = Memory.search_text("deployment", context.id, limit: 3, offset: 3)
+
+    assert length(page1) == 3
+    assert length(page2) == 2
+    assert MapSet.disjoint?(MapSet.new(page1, & &1.id), MapSet.new(page2, & &1.id))
+  end
+
+  test "pages over tied scores neither repeat nor drop hits", %{context: context} do
+    # Same length and term frequency, so every hit gets the same score
+    ids =
+      for word <- ~w(alpha bravo charlie delta echo foxtrot) do
+        {:ok, memory} = Memory.add(context.id, "Deployment note #{word}", nil)
+        memory.id
+      end
+
+    paged =
+      for offset <- 0..5 do
+        opts = [context_id: context.id, limit: 1, offset: offset]
+        {:ok, [hit]} = FullTextIndex.search("deployment", opts)
+        hit.memory.id
+      end
+
+    assert Enum.sort(paged) == Enum.sort(ids)
+  end
+
+  test "a page past the last full-text hit stays empty", %{context: context} do
+    for i <- 1..5, do: Memory.add(context.id, "Deployment note #{i}", nil)
+    for i <- 1..3, do: Memory.add(context.id, "Predeployment checklist #{i}", nil)
+
+    assert {:ok, [_, _]} = Memory.search_text("deployment", context.id, limit: 3, offset: 3)
+    assert {:ok, []} = Memory.search_text("deployment", context.id, limit: 3, offset: 6)
+  end
+
+  test "falls back to substring matching for partial words", %{context: context} do
+    {:ok, memory} = Memory.add(context.id, "Configured the QuantumMechanics module", nil)
+
+    assert {:ok, [found]} = Memory.search_text("mechanic", context.id)
+    assert found.id == memory.id
+  end
+
+  test "ignores FTS operators in user input" do
+    assert FullTextIndex.match_expression(~s(foo" OR bar*)) == ~s("foo" "OR" "bar"*)
+    assert FullTextIndex.match_expression("  ") == nil
+  end
+end
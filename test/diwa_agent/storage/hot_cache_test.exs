@@ -0,0 +1,101 @@
+defmodule DiwaAgent.Storage.HotCacheTest do
+  use ExUnit.Case, async: false
+  alias DiwaAgent.ContextBridge.LiveSync
+  alias DiwaAgent.Storage.{Context, HotCache, Memory, Plan, Task}
+  import DiwaAgent.TestHelper
+
+  setup do
+    db_path = setup_test_db()
+    start_database()
+
+    {:ok, context} = Context.create("Hot Cache Context", "For hot cache tests")
+    previous = Application.get_env(:diwa_agent, HotCache)
+
+    on_exit(fn ->
+      if previous,
+        do: Application.put_env(:diwa_agent, HotCache, previous),
+        else: Application.delete_env(:diwa_agent, HotCache)
+
+      cleanup_test_db(db_path)
+    end)
+
+    {:ok, context: context}
+  end
+
+  defp handoff(context_id, content) do
+    Memory.add(context_id, content, %{metadata: %{"type" => "handoff", "next_steps" => []}})
+  end
+
+  test "second read is served from the cache", %{context: context} do
+    {:ok, _} = handoff(context.id, "First session")
+    before = HotCache.stats()
+
+    assert %{content: "First session"} = HotCache.latest_handoff(context.id)
+    assert %{content: "First session"} = HotCache.latest_handoff(context.id)
+
+    stats = HotCache.stats()
+    assert stats.misses - before.misses == 1
+    assert stats.hits - before.hits == 1
+  end
+
+  test "memory writes invalidate the context", %{context: context} do
+    assert HotCache.latest_handoff(context.id) == nil
+
+    {:ok, _} = handoff(context.id, "Fresh handoff")
+    assert %{content: "Fresh handoff"} = HotCache.latest_handoff(context.id)
+
+    {:ok, blocker} =
+      Memory.add(context.id, "CI is red", %{metadata: %{"type" => "blocker"}})
+
+    assert [%{id: id}] = HotCache.blockers(context.id)
+    assert id == blocker.id
+
+    {:ok, _} = Memory.delete(blocker.id)
+    assert HotCache.blockers(context.id) == []
+  end
+
+  test "task and plan writes invalidate the context", %{context: context} do
+    assert {:ok, []} = HotCache.pending_tasks(context.id, 5)
+    {:ok, task} = Task.add(context.id, "Ship it", "", "high")
+    assert {:ok, [%{title: "Ship it"}]} = HotCache.pending_tasks(context.id, 5)
+
+    {:ok, _} = Task.complete(task.id)
+    assert {:ok, []} = HotCache.pending_tasks(context.id, 5)
+
+    assert {:error, :not_found} = HotCache.plan(context.id)
+    {:ok, _} = Plan.set(context.id, "building", 40, "halfway")
+    assert {:ok, %{completion_pct: 40}} = HotCache.plan(context.id)
+  end
+
+  test "ending a session invalidates the context", %{context: context} do
+    {:ok, session} = LiveSync.start_session(context.id, "claude")
+    assert HotCache.fetch(context.id, :resume_probe, fn -> :before end) == :before
+
+    {:ok, _} = LiveSync.end_session(session.id, "Wired up the cache", ["Measure it"])
+
+    assert HotCache.fetch(context.id, :resume_probe, fn -> :after end) == :after
+    assert {:ok, [%{content: "Wired up the cache"}]} = Memory.list(context.id)
+  end
+
+  test "entries expire after ttl_ms", %{context: context} do
+    Application.put_env(:diwa_agent, HotCache, ttl_ms: 0)
+    calls = :counters.new(1, [])
+    fun = fn -> :counters.add(calls, 1, 1) end
+
+    HotCache.fetch(context.id, :ttl_probe, fun)
+    HotCache.fetch(context.id, :ttl_probe, fun)
+
+    assert :counters.get(calls, 1) == 2
+  end
+
+  test "oldest entries are evicted beyond max_entries", %{context: context} do
+    HotCache.clear()
+    Application.put_env(:diwa_agent, HotCache, max_entries: 3)
+
+    for n <- 1..5, do: HotCache.fetch(context.id, {:probe, n}, fn -> n end)
+
+    assert HotCache.stats().size == 3
+    assert HotCache.fetch(context.id, {:probe, 1}, fn -> :recomputed end) == :recomputed
+    assert HotCache.fetch(context.id, {:probe, 5}, fn -> :recomputed end) == 5
+  end
+end
@@ -0,0 +1,134 @@
+defmodule DiwaAgent.Storage.HybridSearchTest do
+  use ExUnit.Case, async: false
+  alias DiwaAgent.Storage.{Context, HybridSearch, Memory}
+  alias DiwaAgent.Test.{FakeEmbeddings, FakeVectorRepo}
+  import DiwaAgent.TestHelper
+
+  setup do
+    db_path = setup_test_db()
+    start_database()
+
+    {:ok, context} = Context.create("Hybrid Context", "For hybrid search tests")
+
+    on_exit(fn -> cleanup_test_db(db_path) end)
+
+    {:ok, context: context}
+  end
+
+  defp add_with_vector(context_id, content) do
+    {:ok, memory} = Memory.add(context_id, content, nil)
+    {:ok, vec} = FakeEmbeddings.generate_embedding(content)
+    FakeVectorRepo.upsert_embedding(memory.id, vec)
+    memory
+  end
+
+  test "memories found by several retrievers rank first", %{context: context} do
+    {:ok, lexical_only} = Memory.add(context.id, "Release checklist draft for review", nil)
+    both = add_with_vector(context.id, "Release checklist")
+
+    assert {:ok, %{hits: [first, second | _], degraded: []}} =
+             HybridSearch.search("Release checklist", context_id: context.id)
+
+    assert first.memory.id == both.id
+    assert Map.has_key?(first.sources, :lexical)
+    assert %{rank: 1, score: similarity} = first.sources.vector
+    assert similarity == 1.0
+
+    assert second.memory.id == lexical_only.id
+    assert first.score > second.score
+  end
+
+  test "pages through fused results", %{context: context} do
+    for n <- 1..5, do: Memory.add(context.id, "Deployment note #{n}", nil)
+
+    opts = [context_id: context.id, limit: 2, retrievers: [:lexical]]
+    {:ok, first} = HybridSearch.search("deployment", opts)
+    {:ok, last} = HybridSearch.search("deployment", Keyword.put(opts, :offset, 4))
+
+    assert length(first.hits) == 2
+    assert first.next_offset == 2
+    assert [_] = last.hits
+    assert last.next_offset == nil
+    refute Enum.any?(first.hits, fn hit -> hit in last.hits end)
+  end
+
+  test "walks fused results with a cursor", %{context: context} do
+    for n <- 1..5, do: Memory.add(context.id, "Deployment note #{n}", nil)
+
+    opts = [context_id: context.id, limit: 2, retrievers: [:lexical]]
+    {:ok, all} = HybridSearch.search("deployment", Keyword.put(opts, :limit, 10))
+    next = fn page ->
+      HybridSearch.search("deployment", Keyword.put(opts, :cursor, page.next_cursor))
+    end
+
+    {:ok, first} = HybridSearch.search("deployment", opts)
+    {:ok, second} = next.(first)
+    {:ok, third} = next.(second)
+
+    walked = Enum.flat_map([first, second, third], & &1.hits)
+    assert Enum.map(walked, & &1.memory.id) == Enum.map(all.hits, & &1.memory.id)
+    assert third.next_cursor == nil
+
+    assert {:error, :invalid_cursor} =
+             HybridSearch.search("deployment", Keyword.put(opts, :cursor, "bogus"))
+  end
+
+  test "cursor pages match one large page without gaps or repeats", %{context: context} do
+    # Duplicates tie on every retriever score; only the id orders them
+    for n <- 1..12 do
+      add_with_vector(context.id, "Deployment runbook #{rem(n, 4)}")
+    end
+
+    opts = [
+      context_id: context.id,
+      limit: 3,
+      boosts: [recency_half_life_days: 1, recency_weight: 0.5]
+    ]
+
+    {:ok, all} = HybridSearch.search("deployment runbook", Keyword.put(opts, :limit, 40))
+
+    walk = fn walk, page, acc ->
+      acc = acc ++ page.hits
+
+      case page.next_cursor do
+        nil ->
+          acc
+
+        cursor ->
+          {:ok, next} = HybridSearch.search("deployment runbook", [{:cursor, cursor} | opts])
+          walk.(walk, next, acc)
+      end
+    end
+
+    {:ok, first} = HybridSearch.search("deployment runbook", opts)
+    walked = Enum.map(walk.(walk, first, []), & &1.memory.id)
+
+    assert length(walked) == 12
+    assert walked == Enum.uniq(walked)
+    assert walked == Enum.map(all.hits, & &1.memory.id)
+  end
+
+  test "boosts reorder closely ranked hits", %{context: context} do
+    {:ok, low} = Memory.add(context.id, "Cache invalidation idea", %{priority: "low"})
+    {:ok, critical} = Memory.add(context.id, "Cache invalidation idea", %{priority: "critical"})
+
+    search = fn boosts ->
+      HybridSearch.search("cache invalidation",
+        context_id: context.id,
+        retrievers: [:lexical],
+        boosts: boosts
+      )
+    end
+
+    {:ok, %{hits: [first | _]}} = search.(priority: %{"low" => 2.0})
+    assert first.memory.id == low.id
+
+    {:ok, %{hits: [first | _]}} = search.(priority: %{"critical" => 2.0})
+
+    assert first.memory.id == critical.id
+  end
+
+  test "rejects an invalid context id" do
+    assert {:error, :invalid_context_id} = HybridSearch.search("anything", context_id: "nope")
+  end
+end
@@ -1,6 +1,6 @@
 defmodule DiwaAgent.Storage.MemoryTest do
   use ExUnit.Case, async: false
-  alias DiwaAgent.Storage.{Context, Memory}
+  alias DiwaAgent.Storage.{Context, Memory, MemoryFingerprint}
   import DiwaAgent.TestHelper
 
   setup do
@@ -69,6 +69,70 @@ defmodule DiwaAgent.Storage.MemoryTest do
     end
   end
 
+  describe "add_many/3" do
+    test "inserts every item with a create version", %{context: context} do
+      items = [
+        %{content: "Bulk one", tags: ["bulk"]},
+        %{"content" => "Bulk two", "metadata" => %{"n" => 2}, "actor" => "importer"}
+      ]
+
+      assert {:ok, [{:ok, one}, {:ok, two}]} = Memory.add_many(context.id, items)
+
+      assert {:ok, stored} = Memory.get(one.id)
+      assert stored.content == "Bulk one"
+      assert stored.tags == ["bulk"]
+      assert two.metadata == %{"n" => 2}
+      assert two.actor == "importer"
+
+      assert {:ok, [version]} = DiwaAgent.Storage.MemoryVersion.list_history(two.id)
+      assert version.operation == "create"
+      assert Memory.count(context.id) == {:ok, 2}
+    end
+
+    test "reports per-item errors and skips duplicates", %{context: context} do
+      {:ok, _} = Memory.add(context.id, "Already here", nil)
+
+      items = [
+        %{content: "Already here"},
+        %{content: "Fresh"},
+        %{content: "Fresh"},
+        %{content: "Bad metadata", metadata: "{not json"}
+      ]
+
+      assert {:ok, results} = Memory.add_many(context.id, items, skip_duplicates: true)
+
+      assert [
+               {:skipped, :duplicate},
+               {:ok, _},
+               {:skipped, :duplicate},
+               {:error, :invalid_metadata}
+             ] = results
+    end
+
+    test "duplicates are matched on whitespace-normalised content", %{context: context} do
+      {:ok, _} = Memory.add(context.id, "Line one\nLine two", nil)
+
+      assert {:ok, [{:skipped, :duplicate}]} =
+               Memory.add_many(context.id, [%{content: "  Line one   Line two\r\n"}],
+                 skip_duplicates: true
+               )
+    end
+
+    test "backfill fingerprints memories that have none", %{context: context} do
+      {:ok, memory} = Memory.add(context.id, "Legacy note", nil)
+      DiwaAgent.Repo.delete_all(MemoryFingerprint)
+
+      assert MemoryFingerprint.find_duplicate(context.id, "Legacy note") == nil
+      assert MemoryFingerprint.backfill() == 1
+      assert MemoryFingerprint.find_duplicate(context.id, "Legacy note") == memory.id
+    end
+
+    test "returns an error for a missing context" do
+      assert {:error, :context_not_found} =
+               Memory.add_many(Ecto.UUID.generate(), [%{content: "orphan"}])
+    end
+  end
+
   describe "list/2" do
     test "returns empty list when context has no memories", %{context: context} do
       assert {:ok, []} = Memory.list(context.id)
@@ -133,6 +197,42 @@ defmodule DiwaAgent.Storage.MemoryTest do
     end
   end
 
+  describe "list_page/2" do
+    test "walks a context with cursors", %{context: context} do
+      ids =
+        for n <- 1..5 do
+          {:ok, memory} = Memory.add(context.id, "Paged #{n}", %{tags: ["paged"]})
+          memory.id
+        end
+
+      walk = fn fun ->
+        Stream.unfold(:start, fn
+          nil ->
+            nil
+
+          cursor ->
+            {:ok, page} = fun.(if cursor == :start, do: nil, else: cursor)
+            {page.entries, page.next_cursor}
+        end)
+        |> Enum.to_list()
+      end
+
+      pages = walk.(&Memory.list_page(context.id, limit: 2, cursor: &1))
+      assert Enum.map(pages, &length/1) == [2, 2, 1]
+
+      {:ok, all} = Memory.list(context.id)
+      assert pages |> List.flatten() |> Enum.map(& &1.id) == Enum.map(all, & &1.id)
+      assert Enum.sort(Enum.map(all, & &1.id)) == Enum.sort(ids)
+
+      tagged = walk.(&Memory.list_by_tag_page(context.id, "paged", limit: 3, cursor: &1))
+      assert Enum.map(tagged, &length/1) == [3, 2]
+    end
+
+    test "rejects a malformed cursor", %{context: context} do
+      assert {:error, :invalid_cursor} = Memory.list_page(context.id, cursor: "not a cursor")
+    end
+  end
+
   describe "get/1" do
     test "retrieves existing memory by ID", %{context: context} do
       {:ok, created} = Memory.add(context.id, "Test content", nil)
@@ -350,4 +450,73 @@ defmodule DiwaAgent.Storage.MemoryTest do
       assert {:error, :not_found} = Memory.get(mem2.id)
     end
   end
+
+  describe "fuzzy_search/2" do
+    test "finds misspelt terms in memories older than the recent window", %{context: context} do
+      {:ok, old} =
+        Memory.add(context.id, "The deployment pipeline uses a blue green strategy", nil)
+
+      items = for n <- 1..250, do: %{content: "Unrelated note number #{n} about lunch"}
+      {:ok, _} = Memory.add_many(context.id, items)
+
+      assert {:ok, [first | _]} = Memory.fuzzy_search("deplyment piepline", context.id)
+      assert first.id == old.id
+    end
+  end
+
+  describe "get_tree/2" do
+    test "loads nested children, honours max_depth and cuts cycles", %{context: context} do
+      {:ok, root} = Memory.add(context.id, "root", nil)
+      {:ok, child} = Memory.add(context.id, "child", %{parent_id: root.id})
+      {:ok, grandchild} = Memory.add(context.id, "grandchild", %{parent_id: child.id})
+
+      assert {:ok, %{memory: %{id: root_id}, children: [child_node]}} = Memory.get_tree(root.id)
+      assert root_id == root.id
+      assert %{memory: %{id: child_id}, children: [%{children: []}]} = child_node
+      assert child_id == child.id
+
+      assert {:ok, %{children: [%{children: []}]}} = Memory.get_tree(root.id, max_depth: 1)
+
+      # root -> child -> grandchild -> root
+      {:ok, _} = Memory.set_parent(root.id, grandchild.id)
+      assert {:ok, %{children: [%{children: [%{children: []}]}]}} = Memory.get_tree(root.id)
+    end
+
+    test "returns not_found for unknown roots" do
+      assert {:error, :not_found} = Memory.get_tree(Ecto.UUID.generate())
+    end
+  end
+
+  describe "type, class and tag lookups" do
+    test "list_by_type/2 returns active memories of the type", %{context: context} do
+      {:ok, first} = Memory.add(context.id, "first", %{metadata: %{"type" => "handoff"}})
+      {:ok, _} = Memory.add(context.id, "other", %{metadata: %{"type" => "note"}})
+      {:ok, gone} = Memory.add(context.id, "gone", %{metadata: %{"type" => "handoff"}})
+      {:ok, _} = Memory.delete(gone.id)
+
+      assert {:ok, [%{id: id}]} = Memory.list_by_type(context.id, "handoff")
+      assert id == first.id
+    end
+
+    test "list_by_class/2 filters on memory_class", %{context: context} do
+      {:ok, rule} = Memory.add(context.id, "Always lint", %{memory_class: "user_rule"})
+      {:ok, _} = Memory.add(context.id, "Some fact", %{memory_class: "fact"})
+
+      assert {:ok, [%{id: id}]} = Memory.list_by_class(context.id, ["user_rule"])
+      assert id == rule.id
+    end
+
+    test "list_by_tag/2 follows tag changes", %{context: context} do
+      {:ok, memory} = Memory.add(context.id, "tagged", %{tags: ["alpha", "beta"]})
+      {:ok, _} = Memory.add(context.id, "untagged")
+
+      assert {:ok, [%{id: id}]} = Memory.list_by_tag(context.id, "beta")
+      assert id == memory.id
+
+      memory |> Ecto.Changeset.change(tags: ["gamma"]) |> DiwaAgent.Repo.update!()
+
+      assert {:ok, []} = Memory.list_by_tag(context.id, "beta")
+      assert {:ok, [_]} = Memory.list_by_tag(context.id, "gamma")
+    end
+  end
 end
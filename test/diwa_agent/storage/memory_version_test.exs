@@ -0,0 +1,142 @@
+defmodule DiwaAgent.Storage.MemoryVersionTest do
+  use ExUnit.Case, async: false
+  alias DiwaAgent.Repo
+  alias DiwaAgent.Storage.{Context, Memory, MemoryVersion, VersionDelta, VersionPayload}
+  import DiwaAgent.TestHelper
+
+  setup do
+    db_path = setup_test_db()
+    start_database()
+
+    {:ok, context} = Context.create("Version Context", "For version tests")
+
+    previous = Application.get_env(:diwa_agent, MemoryVersion)
+    Application.put_env(:diwa_agent, MemoryVersion, snapshot_every: 4)
+
+    on_exit(fn ->
+      if previous,
+        do: Application.put_env(:diwa_agent, MemoryVersion, previous),
+        else: Application.delete_env(:diwa_agent, MemoryVersion)
+
+      cleanup_test_db(db_path)
+    end)
+
+    {:ok, context: context}
+  end
+
+  defp doc(n), do: Enum.map_join(1..40, "\n", &"line #{&1} of a long status document, rev #{n}")
+
+  defp edit(n), do: String.replace(doc(0), "line 7 of", "line 7 (rev #{n}) of")
+
+  test "deltas round-trip any pair of texts" do
+    for {old, new} <- [{"", "a"}, {"a\nb\n", "a\nc\n"}, {"x\r\ny", ""}, {doc(1), edit(3)}] do
+      assert VersionDelta.patch(old, VersionDelta.diff(old, new)) == new
+    end
+  end
+
+  test "stores deltas between snapshots and rebuilds every version", %{context: context} do
+    {:ok, memory} = Memory.add(context.id, doc(0), %{tags: ["status"]})
+
+    for n <- 1..9 do
+      {:ok, _} = MemoryVersion.record(%{memory | content: edit(n)}, "update")
+    end
+
+    {:ok, history} = MemoryVersion.list_history(memory.id)
+    assert length(history) == 10
+
+    contents = MapSet.new(history, & &1.content)
+    assert MapSet.equal?(contents, MapSet.new([doc(0) | Enum.map(1..9, &edit/1)]))
+    assert Enum.all?(history, &(&1.tags == ["status"]))
+
+    encodings =
+      Repo.all(VersionPayload)
+      |> Enum.filter(&(&1.memory_id == memory.id))
+      |> Enum.sort_by(& &1.seq)
+      |> Enum.map(&{&1.encoding, &1.depth})
+
+    assert encodings == [
+             {"snapshot", 0},
+             {"delta", 1},
+             {"delta", 2},
+             {"delta", 3},
+             {"snapshot", 0},
+             {"delta", 1},
+             {"delta", 2},
+             {"delta", 3},
+             {"snapshot", 0},
+             {"delta", 1}
+           ]
+
+    assert VersionPayload.stored_bytes(memory.id) <
+             Enum.sum(Enum.map(history, &byte_size(&1.content)))
+
+    # The version rows themselves no longer carry a copy
+    raw = Repo.get!(DiwaSchema.Core.MemoryVersion, hd(history).id)
+    assert raw.content == ""
+  end
+
+  test "pages through history with a cursor", %{context: context} do
+    {:ok, memory} = Memory.add(context.id, doc(0), nil)
+    for n <- 1..4, do: {:ok, _} = MemoryVersion.record(%{memory | content: edit(n)}, "update")
+
+    {:ok, first} = MemoryVersion.history_page(memory.id, limit: 3)
+    {:ok, second} = MemoryVersion.history_page(memory.id, limit: 3, cursor: first.next_cursor)
+    {:ok, history} = MemoryVersion.list_history(memory.id)
+
+    assert length(first.entries) == 3
+    assert second.next_cursor == nil
+    walked = first.entries ++ second.entries
+
+    assert Enum.sort(Enum.map(walked, &{&1.id, &1.content})) ==
+             Enum.sort(Enum.map(history, &{&1.id, &1.content}))
+  end
+
+  test "rollback restores a version rebuilt from deltas", %{context: context} do
+    {:ok, memory} = Memory.add(context.id, doc(0), nil)
+    {:ok, _} = Memory.update(memory.id, edit(1))
+    {:ok, _} = Memory.update(memory.id, edit(2))
+
+    {:ok, history} = MemoryVersion.list_history(memory.id)
+    target = Enum.find(history, &(&1.content == edit(1)))
+
+    assert {:ok, rolled_back} = Memory.rollback(memory.id, target.id)
+    assert rolled_back.content == edit(1)
+    assert {:ok, %{content: content}} = MemoryVersion.get(target.id)
+    assert content == edit(1)
+  end
+
+  test "compact converts full-copy versions", %{context: context} do
+    {:ok, memory} = Memory.add(context.id, doc(0), nil)
+    Repo.delete_all(VersionPayload)
+    Repo.delete_all(DiwaSchema.Core.MemoryVersion)
+
+    # History as written before payloads existed
+    for n <- 1..5 do
+      %DiwaSchema.Core.MemoryVersion{}
+      |> DiwaSchema.Core.MemoryVersion.changeset(%{
+        memory_id: memory.id,
+        content: edit(n),
+        tags: ["legacy"],
+        metadata: %{"n" => n},
+        operation: "update"
+      })
+      |> Repo.insert!()
+    end
+
+    {:ok, before} = MemoryVersion.list_history(memory.id)
+
+    stats = MemoryVersion.compact(batch_size: 1)
+    assert %{memories: 1, versions: 5} = stats
+    assert stats.bytes_after < stats.bytes_before
+
+    {:ok, after_compact} = MemoryVersion.list_history(memory.id)
+
+    snapshot = fn versions ->
+      versions |> Enum.map(&{&1.id, &1.content, &1.tags, &1.metadata}) |> Enum.sort()
+    end
+
+    assert snapshot.(after_compact) == snapshot.(before)
+
+    assert MemoryVersion.compact() == %{memories: 0, versions: 0, bytes_before: 0, bytes_after: 0}
+  end
+end
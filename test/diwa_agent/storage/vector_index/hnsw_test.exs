@@ -0,0 +1,69 @@
+defmodule DiwaAgent.Storage.VectorIndex.HNSWTest do
+  use ExUnit.Case, async: true
+  alias DiwaAgent.Storage.VectorIndex.HNSW
+
+  defp random_vector(dim), do: for(_ <- 1..dim, do: :rand.normal())
+
+  defp build(vectors) do
+    Enum.reduce(vectors, HNSW.new(), fn {id, v}, acc ->
+      {:ok, acc} = HNSW.insert(acc, id, v)
+      acc
+    end)
+  end
+
+  defp exact_top(vectors, query, k) do
+    {:ok, q} = HNSW.pack(query)
+
+    vectors
+    |> Enum.map(fn {id, v} ->
+      {:ok, p} = HNSW.pack(v)
+      {id, HNSW.dot(q, p)}
+    end)
+    |> Enum.sort_by(&elem(&1, 1), :desc)
+    |> Enum.take(k)
+    |> Enum.map(&elem(&1, 0))
+  end
+
+  test "approximate search agrees with brute force" do
+    :rand.seed(:exsss, {1, 2, 3})
+    vectors = for i <- 1..800, do: {"m#{i}", random_vector(16)}
+    index = build(vectors)
+
+    recall =
+      for _ <- 1..20 do
+        query = random_vector(16)
+        found = index |> HNSW.search(query, 10) |> Enum.map(&elem(&1, 0))
+        expected = MapSet.new(exact_top(vectors, query, 10))
+        MapSet.size(MapSet.intersection(MapSet.new(found), expected))
+      end
+      |> Enum.sum()
+
+    assert recall / 200 >= 0.9
+  end
+
+  test "returns the identical vector first with similarity ~1.0" do
+    index = build([{"a", [1.0, 0.0, 0.0]}, {"b", [0.0, 1.0, 0.0]}, {"c", [0.7, 0.7, 0.0]}])
+
+    assert [{"a", sim} | _] = HNSW.search(index, [2.0, 0.0, 0.0], 3)
+    assert_in_delta sim, 1.0, 1.0e-6
+  end
+
+  test "deleted vectors are never returned and compaction drops them" do
+    index = build([{"a", [1.0, 0.0]}, {"b", [0.0, 1.0]}])
+    index = HNSW.delete(index, "a")
+
+    assert Enum.map(HNSW.search(index, [1.0, 0.0], 2), &elem(&1, 0)) == ["b"]
+    assert HNSW.tombstone_ratio(index) == 0.5
+
+    compacted = HNSW.compact(index)
+    assert HNSW.size(compacted) == 1
+    assert HNSW.tombstone_ratio(compacted) == 0.0
+  end
+
+  test "rejects vectors of a different dimension" do
+    index = build([{"a", [1.0, 0.0]}])
+
+    assert {:error, :dimension_mismatch} = HNSW.insert(index, "b", [1.0, 0.0, 0.0])
+    assert HNSW.search(index, [1.0, 0.0, 0.0], 1) == []
+  end
+end
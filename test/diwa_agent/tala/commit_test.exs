@@ -0,0 +1,138 @@
+defmodule DiwaAgent.Tala.CommitTest do
+  use ExUnit.Case, async: false
+  alias DiwaAgent.Repo
+  alias DiwaAgent.Storage.{AfterCommit, Context, Memory}
+  alias DiwaAgent.Tala.{Buffer, Commit}
+  alias DiwaAgent.Tools.Executor
+  import DiwaAgent.TestHelper
+
+  setup do
+    db_path = setup_test_db()
+    start_database()
+
+    {:ok, context} = Context.create("TALA Context", "For TALA commit tests")
+    on_exit(fn -> cleanup_test_db(db_path) end)
+
+    {:ok, context: context, session_id: Ecto.UUID.generate()}
+  end
+
+  defp buffer(session_id, tool, args) do
+    args = Map.merge(args, %{"buffer" => true, "session_id" => session_id})
+    refute Executor.execute(tool, args)["isError"]
+  end
+
+  defp text(%{"content" => [%{"text" => text}]}), do: text
+
+  test "consecutive add_memory operations become one bulk insert", %{
+    context: context,
+    session_id: sid
+  } do
+    for n <- 1..50 do
+      buffer(sid, "add_memory", %{"context_id" => context.id, "content" => "Note #{n}"})
+    end
+
+    assert {[{:add_memories, context_id, ops}], 0} = Commit.plan(Buffer.list(sid))
+    assert context_id == context.id
+    assert length(ops) == 50
+
+    assert text(Executor.execute("commit_buffer", %{"session_id" => sid})) =~
+             "committed 50 operations"
+
+    {:ok, memories} = Memory.list(context.id, limit: 100)
+    assert length(memories) == 50
+    assert Buffer.list(sid) == []
+  end
+
+  test "repeated updates of a memory are coalesced", %{context: context, session_id: sid} do
+    {:ok, memory} = Memory.add(context.id, "v0")
+
+    for n <- 1..3 do
+      buffer(sid, "update_memory", %{
+        "context_id" => context.id,
+        "memory_id" => memory.id,
+        "content" => "v#{n}"
+      })
+    end
+
+    assert {[{:execute, %{params: %{"content" => "v3"}}}], 2} = Commit.plan(Buffer.list(sid))
+
+    assert text(Executor.execute("commit_buffer", %{"session_id" => sid})) =~
+             "Coalesced 2 redundant operations"
+
+    assert {:ok, %{content: "v3"}} = Memory.get(memory.id)
+  end
+
+  test "a failing operation rolls back the whole buffer", %{context: context, session_id: sid} do
+    buffer(sid, "add_memory", %{"context_id" => context.id, "content" => "First"})
+    buffer(sid, "add_memory", %{"context_id" => context.id, "content" => "Second"})
+
+    buffer(sid, "update_memory", %{
+      "context_id" => context.id,
+      "memory_id" => Ecto.UUID.generate(),
+      "content" => "Nowhere"
+    })
+
+    result = Executor.execute("commit_buffer", %{"session_id" => sid})
+    assert result["isError"]
+    assert text(result) =~ "nothing was applied"
+
+    assert {:ok, []} = Memory.list(context.id)
+    assert length(Buffer.list(sid)) == 3
+  end
+
+  test "write side effects run only once the transaction commits" do
+    parent = self()
+
+    assert {:error, :rolled_back} =
+             AfterCommit.transaction(fn ->
+               AfterCommit.run(fn -> send(parent, :first) end)
+               refute_received :first
+               Repo.rollback(:rolled_back)
+             end)
+
+    refute_received :first
+
+    assert {:ok, :done} =
+             AfterCommit.transaction(fn ->
+               AfterCommit.run(fn -> send(parent, :second) end)
+               refute_received :second
+               :done
+             end)
+
+    assert_received :second
+  end
+
+  test "operations are put back when the commit exits", %{context: context, session_id: sid} do
+    buffer(sid, "add_memory", %{"context_id" => context.id, "content" => "Kept"})
+
+    assert catch_exit(Buffer.commit(sid, fn _ops -> exit(:cancelled) end)) == :cancelled
+    assert length(Buffer.list(sid)) == 1
+  end
+
+  test "operations are put back when the committer is killed", %{
+    context: context,
+    session_id: sid
+  } do
+    Ecto.Adapters.SQL.Sandbox.allow(Repo, self(), Process.whereis(Buffer))
+    buffer(sid, "add_memory", %{"context_id" => context.id, "content" => "Kept"})
+    parent = self()
+
+    {pid, ref} =
+      spawn_monitor(fn ->
+        Buffer.commit(sid, fn _ops ->
+          send(parent, :applying)
+          Process.sleep(:infinity)
+        end)
+      end)
+
+    assert_receive :applying
+    assert Buffer.list(sid) == []
+
+    Process.exit(pid, :kill)
+    assert_receive {:DOWN, ^ref, :process, ^pid, :killed}
+    # Let the buffer server handle the committer's exit
+    :sys.get_state(Buffer)
+
+    assert [%{tool_name: "add_memory"}] = Buffer.list(sid)
+  end
+end
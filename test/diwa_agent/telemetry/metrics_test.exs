@@ -0,0 +1,54 @@
+defmodule DiwaAgent.Telemetry.MetricsTest do
+  use ExUnit.Case, async: false
+  alias DiwaAgent.Telemetry.Metrics
+
+  setup do
+    Metrics.reset()
+    :ok
+  end
+
+  defp us(n), do: System.convert_time_unit(n, :microsecond, :native)
+
+  test "buckets stay within ~6% of the recorded value" do
+    for value <- [0, 1, 31, 32, 47, 100, 1_000, 12_345, 987_654, 60_000_000] do
+      index = Metrics.bucket_index(value)
+      lower = Metrics.bucket_lower_bound(index)
+      upper = Metrics.bucket_lower_bound(index + 1)
+
+      assert lower <= value and value < upper
+      assert upper - lower <= max(1, value * 0.0625)
+    end
+  end
+
+  test "records latency percentiles and errors per metric" do
+    for n <- 1..100, do: Metrics.record({:tool, "demo"}, us(n * 1_000))
+    Metrics.record({:tool, "demo"}, us(5_000), :error)
+
+    %{histograms: %{{:tool, "demo"} => h}} = Metrics.snapshot()
+
+    assert h.count == 101
+    assert h.errors == 1
+    assert_in_delta h.p50_ms, 50.0, 4.0
+    assert_in_delta h.p99_ms, 99.0, 7.0
+    assert h.max_ms >= 96.0
+  end
+
+  test "tool calls are measured through the executor" do
+    DiwaAgent.Tools.Executor.execute("no_such_tool", %{})
+
+    assert %{histograms: %{{:tool, "no_such_tool"} => %{count: 1}}} = Metrics.snapshot()
+  end
+
+  test "prometheus output exposes summaries, counters and gauges" do
+    Metrics.record({:repo, "memories"}, us(2_000))
+    Metrics.increment(:embedding_cache_hits, 3)
+    Metrics.gauge(:sync_queue_depth, 7)
+
+    text = Metrics.prometheus()
+
+    assert text =~ ~s(diwa_repo_duration_seconds_count{name="memories"} 1)
+    assert text =~ ~s(diwa_repo_duration_seconds{name="memories",quantile="0.5"})
+    assert text =~ "diwa_embedding_cache_hits_total 3"
+    assert text =~ "diwa_sync_queue_depth 7"
+  end
+end
@@ -230,6 +230,25 @@ defmodule DiwaAgent.Tools.ExecutorTest do
       assert text =~ "2"
     end
 
+    test "returns a cursor for the next page", %{context: context} do
+      Memory.add(context.id, "Memory 3", nil)
+
+      result = Executor.execute("list_memories", %{"context_id" => context.id, "limit" => 2})
+      assert %{"content" => [%{"type" => "text", "text" => text}]} = result
+      assert [_, cursor] = Regex.run(~r/next_cursor: (\S+)/, text)
+
+      result =
+        Executor.execute("list_memories", %{
+          "context_id" => context.id,
+          "limit" => 2,
+          "cursor" => cursor
+        })
+
+      assert %{"content" => [%{"type" => "text", "text" => text}]} = result
+      assert text =~ "Found 1 memory(ies)"
+      refute text =~ "next_cursor"
+    end
+
     test "shows message when context has no memories" do
       {:ok, empty_context} = Context.create("Empty", nil)
 
@@ -0,0 +1,87 @@
+defmodule DiwaAgent.Transport.SocketTest do
+  use ExUnit.Case, async: false
+  alias DiwaAgent.Transport.Socket
+
+  setup do
+    root = Path.join(System.tmp_dir!(), "diwa_#{System.unique_integer([:positive])}")
+    path = Path.join([root, "diwa", "diwa.sock"])
+
+    start_supervised!(
+      Supervisor.child_spec({Socket, path: path, name: :socket_test}, id: :socket_test)
+    )
+
+    on_exit(fn -> File.rm_rf(root) end)
+    %{path: path, root: root}
+  end
+
+  defp connect(path) do
+    opts = [:binary, packet: :line, active: false]
+    {:ok, conn} = :gen_tcp.connect({:local, String.to_charlist(path)}, 0, opts)
+
+    conn
+  end
+
+  defp request(conn, id, method) do
+    message = Jason.encode!(%{"jsonrpc" => "2.0", "id" => id, "method" => method})
+    :ok = :gen_tcp.send(conn, message <> "\n")
+    {:ok, line} = :gen_tcp.recv(conn, 0, 5_000)
+    Jason.decode!(line)
+  end
+
+  test "answers requests over the socket", %{path: path} do
+    conn = connect(path)
+
+    assert %{"id" => 1, "result" => %{"tools" => [_ | _]}} = request(conn, 1, "tools/list")
+
+    :gen_tcp.close(conn)
+  end
+
+  test "serves concurrent connections independently", %{path: path} do
+    first = connect(path)
+    second = connect(path)
+
+    assert %{"id" => 1, "result" => _} = request(first, 1, "tools/list")
+    assert %{"id" => 1, "result" => _} = request(second, 1, "tools/list")
+
+    # Closing one client leaves the other connected
+    :gen_tcp.close(first)
+    assert %{"id" => 2, "result" => _} = request(second, 2, "tools/list")
+
+    :gen_tcp.close(second)
+  end
+
+  test "refuses to start over a live socket", %{path: path} do
+    Process.flag(:trap_exit, true)
+    assert {:error, :already_running} = Socket.start_link(path: path, name: nil)
+  end
+
+  test "socket is owner-only", %{path: path} do
+    assert {:ok, %File.Stat{mode: mode}} = File.stat(path)
+    assert Bitwise.band(mode, 0o777) == 0o600
+  end
+
+  test "socket directory is created owner-only", %{path: path} do
+    assert {:ok, %File.Stat{mode: mode}} = File.stat(Path.dirname(path))
+    assert Bitwise.band(mode, 0o777) == 0o700
+  end
+
+  test "refuses a shared directory and leaves it untouched", %{root: root} do
+    Process.flag(:trap_exit, true)
+    File.chmod!(root, 0o777)
+
+    assert {:error, {:insecure_dir, ^root}} =
+             Socket.start_link(path: Path.join(root, "other.sock"), name: nil)
+
+    assert {:ok, %File.Stat{mode: mode}} = File.stat(root)
+    assert Bitwise.band(mode, 0o777) == 0o777
+  end
+
+  test "uses an existing private directory as is", %{root: root} do
+    File.chmod!(root, 0o700)
+    path = Path.join(root, "other.sock")
+
+    assert {:ok, pid} = Socket.start_link(path: path, name: nil)
+    assert File.exists?(path)
+    GenServer.stop(pid)
+  end
+end
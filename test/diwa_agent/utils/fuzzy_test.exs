@@ -0,0 +1,36 @@
+defmodule DiwaAgent.Utils.FuzzyTest do
+  use ExUnit.Case, async: true
+  alias DiwaAgent.Utils.Fuzzy
+
+  describe "jaro_winkler/2" do
+    test "matches the reference values" do
+      assert Fuzzy.jaro_winkler("MARTHA", "MARHTA") |> Float.round(3) == 0.961
+      assert Fuzzy.jaro_winkler("DWAYNE", "DUANE") |> Float.round(3) == 0.84
+      assert Fuzzy.jaro_winkler("same", "SAME") == 1.0
+    end
+
+    test "handles empty and disjoint strings" do
+      assert Fuzzy.jaro_winkler("", "abc") == 0.0
+      assert Fuzzy.jaro_winkler("abc", "xyz") == 0.0
+    end
+
+    test "stays fast on long strings" do
+      a = String.duplicate("abcdefghij", 100)
+      b = String.duplicate("abcdefghji", 100)
+
+      {micros, score} = :timer.tc(fn -> Fuzzy.jaro_winkler(a, b) end)
+      assert score > 0.9
+      assert micros < 1_000_000
+    end
+  end
+
+  describe "partial_score/2" do
+    test "scores the best matching word window" do
+      text = "We finally migrated the deployment pipeline to the new cluster"
+
+      assert Fuzzy.partial_score("deplyment", text) > 0.9
+      assert Fuzzy.partial_score("deployment pipeline", text) == 1.0
+      assert Fuzzy.partial_score("kubernetes", text) < 0.8
+    end
+  end
+end